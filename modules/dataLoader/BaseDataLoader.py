@@ -2,8 +2,11 @@ from abc import ABCMeta, abstractmethod
 
 import torch
 from mgds.MGDS import MGDS, TrainDataLoader
+from mgds.pipelineModules.AspectBatchSorting import AspectBatchSorting
 
 from modules.dataLoader.mixin.DataLoaderMgdsMixin import DataLoaderMgdsMixin
+from modules.dataLoader.pipelineModules.BudgetBatchSorting import BudgetBatchSorting
+from modules.util.config.TrainConfig import TrainConfig
 
 
 class BaseDataLoader(
@@ -21,6 +24,8 @@ class BaseDataLoader(
         self.train_device = train_device
         self.temp_device = temp_device
 
+        self.__budget_batch_sorting = None
+
     @abstractmethod
     def get_data_set(self) -> MGDS:
         pass
@@ -28,3 +33,21 @@ class BaseDataLoader(
     @abstractmethod
     def get_data_loader(self) -> TrainDataLoader:
         pass
+
+    def get_batch_ranges(self) -> list[tuple[int, int]] | None:
+        """
+        Returns the (start, end) index ranges of the batches in the current epoch, or None if all batches have the
+        batch size of the data loader.
+        """
+        if self.__budget_batch_sorting is None:
+            return None
+        return self.__budget_batch_sorting.batch_ranges()
+
+    def _create_batch_sorting(self, config: TrainConfig, names: list[str]):
+        if config.batch_pixel_budget > 0:
+            self.__budget_batch_sorting = BudgetBatchSorting(
+                resolution_in_name='crop_resolution', names=names, pixel_budget=config.batch_pixel_budget
+            )
+            return self.__budget_batch_sorting
+
+        return AspectBatchSorting(resolution_in_name='crop_resolution', names=names, batch_size=config.batch_size)
@@ -0,0 +1,58 @@
+from mgds.MGDS import TrainDataLoader
+from torch.utils.data import DataLoader
+
+from modules.util import distributed_util
+
+
+class DistributedDataLoader:
+    """
+    Splits the batches of a TrainDataLoader between the ranks of a distributed run.
+
+    Every rank builds the same deterministic epoch. The batches of that epoch are assigned to the ranks in turn, so
+    each optimizer step consumes world_size consecutive batches. Trailing batches that can't be distributed to all
+    ranks are dropped, because every rank has to run the same number of steps.
+
+    If batch_ranges is set, the batches are taken from these (start, end) index ranges instead of being split at
+    every batch_size items. This is used for batches of different sizes.
+    """
+
+    def __init__(
+            self,
+            data_loader: TrainDataLoader,
+            batch_ranges: list[tuple[int, int]] | None = None,
+    ):
+        self.data_loader = data_loader
+        self.batch_ranges = batch_ranges
+        self.rank = distributed_util.rank()
+        self.world_size = distributed_util.world_size()
+
+    def __batch_count(self) -> int:
+        if self.batch_ranges is not None:
+            return len(self.batch_ranges)
+        return len(self.data_loader.dataset) // self.data_loader.batch_size
+
+    def __len__(self) -> int:
+        if self.world_size <= 1 and self.batch_ranges is None:
+            return len(self.data_loader)
+        return self.__batch_count() // self.world_size
+
+    def __batch_indices(self):
+        batch_size = self.data_loader.batch_size
+        for step in range(len(self)):
+            batch_index = step * self.world_size + self.rank
+            if self.batch_ranges is not None:
+                start, end = self.batch_ranges[batch_index]
+            else:
+                start, end = batch_index * batch_size, (batch_index + 1) * batch_size
+            yield list(range(start, end))
+
+    def __iter__(self):
+        if self.world_size <= 1 and self.batch_ranges is None:
+            yield from self.data_loader
+            return
+
+        yield from DataLoader(
+            self.data_loader.dataset,
+            batch_sampler=list(self.__batch_indices()),
+            collate_fn=self.data_loader.collate_fn,
+        )
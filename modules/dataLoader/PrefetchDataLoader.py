@@ -0,0 +1,141 @@
+import threading
+from contextlib import contextmanager, nullcontext
+from queue import Queue, Full
+
+import torch
+from mgds.MGDS import TrainDataLoader
+from torch import Tensor
+
+
+class _PrefetchError:
+    def __init__(self, exception: BaseException):
+        self.exception = exception
+
+
+_END_OF_EPOCH = object()
+
+
+class PrefetchDataLoader:
+    """
+    Wraps a TrainDataLoader and loads the next batches on a background thread while the current step is computed.
+
+    Batches are moved to the train device on a separate cuda stream, using pinned memory and non-blocking copies for
+    tensors that are still on the cpu. The consumer only waits for the copy of the batch it actually uses.
+    """
+
+    def __init__(
+            self,
+            data_loader: TrainDataLoader,
+            train_device: torch.device,
+            prefetch_batches: int,
+    ):
+        self.data_loader = data_loader
+        self.train_device = train_device
+        self.prefetch_batches = prefetch_batches
+
+        self.__use_cuda_stream = train_device.type == 'cuda' and torch.cuda.is_available()
+        self.__fetch_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.data_loader)
+
+    @contextmanager
+    def pause(self):
+        """
+        Blocks the background thread from fetching new batches. This is needed while the model is moved between
+        devices (sampling, backups), because some pipeline modules run parts of the model.
+        """
+        with self.__fetch_lock:
+            yield
+
+    def __to_device(self, data):
+        if isinstance(data, Tensor):
+            if data.device == self.train_device:
+                return data
+            if self.__use_cuda_stream and data.device.type == 'cpu':
+                return data.pin_memory().to(self.train_device, non_blocking=True)
+            return data.to(self.train_device)
+        elif isinstance(data, dict):
+            return {key: self.__to_device(value) for key, value in data.items()}
+        elif isinstance(data, list):
+            return [self.__to_device(value) for value in data]
+        elif isinstance(data, tuple):
+            return tuple(self.__to_device(value) for value in data)
+        return data
+
+    def __record_stream(self, data, stream: torch.cuda.Stream):
+        # marks tensors created on the prefetch stream as used by the consuming stream,
+        # so the caching allocator does not reuse their memory too early
+        if isinstance(data, Tensor):
+            if data.device.type == 'cuda':
+                data.record_stream(stream)
+        elif isinstance(data, dict):
+            for value in data.values():
+                self.__record_stream(value, stream)
+        elif isinstance(data, list | tuple):
+            for value in data:
+                self.__record_stream(value, stream)
+
+    def __iter__(self):
+        if self.prefetch_batches <= 0:
+            yield from self.data_loader
+            return
+
+        queue = Queue(maxsize=self.prefetch_batches)
+        stop_event = threading.Event()
+        stream = torch.cuda.Stream(self.train_device) if self.__use_cuda_stream else None
+
+        def put(item) -> bool:
+            while not stop_event.is_set():
+                try:
+                    queue.put(item, timeout=0.1)
+                    return True
+                except Full:
+                    pass
+            return False
+
+        def prefetch():
+            try:
+                iterator = iter(self.data_loader)
+                while not stop_event.is_set():
+                    with self.__fetch_lock:
+                        with torch.cuda.stream(stream) if stream is not None else nullcontext():
+                            try:
+                                batch = next(iterator)
+                            except StopIteration:
+                                break
+                            batch = self.__to_device(batch)
+
+                            event = None
+                            if stream is not None:
+                                event = torch.cuda.Event()
+                                event.record(stream)
+
+                    if not put((batch, event)):
+                        return
+            except BaseException as e:
+                put(_PrefetchError(e))
+            finally:
+                put(_END_OF_EPOCH)
+
+        thread = threading.Thread(target=prefetch, daemon=True)
+        thread.start()
+
+        try:
+            while True:
+                item = queue.get()
+                if item is _END_OF_EPOCH:
+                    break
+                if isinstance(item, _PrefetchError):
+                    raise item.exception
+
+                batch, event = item
+                if event is not None:
+                    current_stream = torch.cuda.current_stream(self.train_device)
+                    current_stream.wait_event(event)
+                    self.__record_stream(batch, current_stream)
+
+                yield batch
+        finally:
+            stop_event.set()
+            thread.join()
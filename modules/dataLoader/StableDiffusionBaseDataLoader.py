@@ -4,13 +4,11 @@ import os
 import torch
 from mgds.MGDS import TrainDataLoader, MGDS
 from mgds.OutputPipelineModule import OutputPipelineModule
-from mgds.pipelineModules.AspectBatchSorting import AspectBatchSorting
 from mgds.pipelineModules.AspectBucketing import AspectBucketing
 from mgds.pipelineModules.CalcAspect import CalcAspect
 from mgds.pipelineModules.CollectPaths import CollectPaths
 from mgds.pipelineModules.DecodeTokens import DecodeTokens
 from mgds.pipelineModules.DecodeVAE import DecodeVAE
-from mgds.pipelineModules.DiskCache import DiskCache
 from mgds.pipelineModules.EncodeClipText import EncodeClipText
 from mgds.pipelineModules.EncodeVAE import EncodeVAE
 from mgds.pipelineModules.GenerateDepth import GenerateDepth
@@ -44,6 +42,9 @@ from mgds.pipelineModules.Tokenize import Tokenize
 from mgds.pipelineModules.VariationSorting import VariationSorting
 
 from modules.dataLoader.BaseDataLoader import BaseDataLoader
+from modules.dataLoader.pipelineModules.BatchedEncodeClipText import BatchedEncodeClipText
+from modules.dataLoader.pipelineModules.BatchedEncodeVAE import BatchedEncodeVAE
+from modules.dataLoader.pipelineModules.ParallelLoad import ParallelLoad
 from modules.model.StableDiffusionModel import StableDiffusionModel
 from modules.util import path_util
 from modules.util.TrainProgress import TrainProgress
@@ -237,6 +238,25 @@ class StablDiffusionBaseDataLoader(BaseDataLoader):
         return modules
 
 
+    def _parallel_load_modules(self, config: TrainConfig):
+        if config.dataloader_threads <= 1:
+            return []
+
+        names = ['image']
+
+        if config.masked_training or config.model_type.has_mask_input():
+            names.append('mask')
+
+        if config.model_type.has_depth_input():
+            names.append('depth')
+
+        if config.model_type.has_conditioning_image_input():
+            names.append('conditioning_image')
+
+        parallel_load = ParallelLoad(names=names, threads=config.dataloader_threads)
+
+        return [parallel_load]
+
     def _preparation_modules(self, config: TrainConfig, model: StableDiffusionModel):
         rescale_image = RescaleImageChannels(image_in_name='image', image_out_name='image', in_range_min=0, in_range_max=1, out_range_min=-1, out_range_max=1)
         rescale_conditioning_image = RescaleImageChannels(image_in_name='conditioning_image', image_out_name='conditioning_image', in_range_min=0, in_range_max=1, out_range_min=-1, out_range_max=1)
@@ -247,6 +267,11 @@ class StablDiffusionBaseDataLoader(BaseDataLoader):
         tokenize_prompt = Tokenize(in_name='prompt', tokens_out_name='tokens', mask_out_name='tokens_mask', tokenizer=model.tokenizer, max_token_length=model.tokenizer.model_max_length)
         encode_prompt = EncodeClipText(in_name='tokens', tokens_attention_mask_in_name=None, hidden_state_out_name='text_encoder_hidden_state', pooled_out_name=None, add_layer_norm=True, text_encoder=model.text_encoder, hidden_state_output_index=-(1 + config.text_encoder_layer_skip), autocast_contexts=[model.autocast_context], dtype=model.train_dtype.torch_dtype())
 
+        if config.latent_caching and config.cache_batch_size > 1:
+            encode_image = BatchedEncodeVAE(in_name='image', out_name='latent_image_distribution', vae=model.vae, batch_size=config.cache_batch_size, autocast_contexts=[model.autocast_context], dtype=model.train_dtype.torch_dtype())
+            encode_conditioning_image = BatchedEncodeVAE(in_name='conditioning_image', out_name='latent_conditioning_image_distribution', vae=model.vae, batch_size=config.cache_batch_size, autocast_contexts=[model.autocast_context], dtype=model.train_dtype.torch_dtype())
+            encode_prompt = BatchedEncodeClipText(in_name='tokens', tokens_attention_mask_in_name=None, hidden_state_out_name='text_encoder_hidden_state', pooled_out_name=None, add_layer_norm=True, text_encoder=model.text_encoder, batch_size=config.cache_batch_size, hidden_state_output_index=-(1 + config.text_encoder_layer_skip), autocast_contexts=[model.autocast_context], dtype=model.train_dtype.torch_dtype())
+
         modules = [rescale_image, encode_image, tokenize_prompt]
 
         if config.masked_training or config.model_type.has_mask_input():
@@ -300,10 +325,10 @@ class StablDiffusionBaseDataLoader(BaseDataLoader):
             model.eval()
             torch_gc()
 
-        image_disk_cache = DiskCache(cache_dir=image_cache_dir, split_names=image_split_names, aggregate_names=image_aggregate_names, variations_in_name='concept.image_variations', repeats_in_name='concept.repeats', variations_group_in_name=['concept.path', 'concept.seed', 'concept.include_subdirectories', 'concept.image'], group_enabled_in_name='concept.enabled', before_cache_fun=before_cache_image_fun)
+        image_disk_cache = self._create_disk_cache(config, cache_dir=image_cache_dir, split_names=image_split_names, aggregate_names=image_aggregate_names, variations_in_name='concept.image_variations', repeats_in_name='concept.repeats', variations_group_in_name=['concept.path', 'concept.seed', 'concept.include_subdirectories', 'concept.image'], group_enabled_in_name='concept.enabled', before_cache_fun=before_cache_image_fun, key_path_names=self._image_cache_key_path_names(config), key_data=self._image_cache_key_data(config))
         image_ram_cache = RamCache(cache_names=image_split_names + image_aggregate_names, repeats_in_name='concept.repeats', variations_group_in_name=['concept.path', 'concept.seed', 'concept.include_subdirectories', 'concept.image'], group_enabled_in_name='concept.enabled', before_cache_fun=before_cache_image_fun)
 
-        text_disk_cache = DiskCache(cache_dir=text_cache_dir, split_names=text_split_names, aggregate_names=[], variations_in_name='concept.text_variations', repeats_in_name='concept.repeats', variations_group_in_name=['concept.path', 'concept.seed', 'concept.include_subdirectories', 'concept.text'], group_enabled_in_name='concept.enabled', before_cache_fun=before_cache_text_fun)
+        text_disk_cache = self._create_disk_cache(config, cache_dir=text_cache_dir, split_names=text_split_names, aggregate_names=[], variations_in_name='concept.text_variations', repeats_in_name='concept.repeats', variations_group_in_name=['concept.path', 'concept.seed', 'concept.include_subdirectories', 'concept.text'], group_enabled_in_name='concept.enabled', before_cache_fun=before_cache_text_fun, key_path_names=self._text_cache_key_path_names(config), key_data=self._text_cache_key_data(config))
 
         modules = []
 
@@ -355,7 +380,7 @@ class StablDiffusionBaseDataLoader(BaseDataLoader):
             autocast_contexts=[model.autocast_context], dtype=model.train_dtype.torch_dtype(),
             before_cache_fun=before_cache_image_fun,
         )
-        batch_sorting = AspectBatchSorting(resolution_in_name='crop_resolution', names=sort_names, batch_size=config.batch_size)
+        batch_sorting = self._create_batch_sorting(config, sort_names)
         output = OutputPipelineModule(names=output_names)
 
         modules = [image_sample]
@@ -427,6 +452,7 @@ class StablDiffusionBaseDataLoader(BaseDataLoader):
         crop_modules = self._crop_modules(config)
         augmentation_modules = self._augmentation_modules(config)
         inpainting_modules = self._inpainting_modules(config)
+        parallel_load_modules = self._parallel_load_modules(config)
         preparation_modules = self._preparation_modules(config, model)
         cache_modules = self._cache_modules(config, model)
         output_modules = self._output_modules(config, model)
@@ -443,6 +469,7 @@ class StablDiffusionBaseDataLoader(BaseDataLoader):
                 crop_modules,
                 augmentation_modules,
                 inpainting_modules,
+                parallel_load_modules,
                 preparation_modules,
                 cache_modules,
                 output_modules,
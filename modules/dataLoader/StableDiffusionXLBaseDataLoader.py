@@ -4,13 +4,11 @@ import os
 import torch
 from mgds.MGDS import TrainDataLoader, MGDS
 from mgds.OutputPipelineModule import OutputPipelineModule
-from mgds.pipelineModules.AspectBatchSorting import AspectBatchSorting
 from mgds.pipelineModules.AspectBucketing import AspectBucketing
 from mgds.pipelineModules.CalcAspect import CalcAspect
 from mgds.pipelineModules.CollectPaths import CollectPaths
 from mgds.pipelineModules.DecodeTokens import DecodeTokens
 from mgds.pipelineModules.DecodeVAE import DecodeVAE
-from mgds.pipelineModules.DiskCache import DiskCache
 from mgds.pipelineModules.EncodeClipText import EncodeClipText
 from mgds.pipelineModules.EncodeVAE import EncodeVAE
 from mgds.pipelineModules.GenerateImageLike import GenerateImageLike
@@ -43,6 +41,9 @@ from mgds.pipelineModules.Tokenize import Tokenize
 from mgds.pipelineModules.VariationSorting import VariationSorting
 
 from modules.dataLoader.BaseDataLoader import BaseDataLoader
+from modules.dataLoader.pipelineModules.BatchedEncodeClipText import BatchedEncodeClipText
+from modules.dataLoader.pipelineModules.BatchedEncodeVAE import BatchedEncodeVAE
+from modules.dataLoader.pipelineModules.ParallelLoad import ParallelLoad
 from modules.model.StableDiffusionXLModel import StableDiffusionXLModel
 from modules.util import path_util
 from modules.util.TrainProgress import TrainProgress
@@ -220,6 +221,22 @@ class StablDiffusionXLBaseDataLoader(BaseDataLoader):
 
         return modules
 
+    def _parallel_load_modules(self, config: TrainConfig):
+        if config.dataloader_threads <= 1:
+            return []
+
+        names = ['image']
+
+        if config.masked_training or config.model_type.has_mask_input():
+            names.append('mask')
+
+        if config.model_type.has_conditioning_image_input():
+            names.append('conditioning_image')
+
+        parallel_load = ParallelLoad(names=names, threads=config.dataloader_threads)
+
+        return [parallel_load]
+
     def _preparation_modules(self, config: TrainConfig, model: StableDiffusionXLModel):
         rescale_image = RescaleImageChannels(image_in_name='image', image_out_name='image', in_range_min=0, in_range_max=1, out_range_min=-1, out_range_max=1)
         rescale_conditioning_image = RescaleImageChannels(image_in_name='conditioning_image', image_out_name='conditioning_image', in_range_min=0, in_range_max=1, out_range_min=-1, out_range_max=1)
@@ -231,6 +248,12 @@ class StablDiffusionXLBaseDataLoader(BaseDataLoader):
         encode_prompt_1 = EncodeClipText(in_name='tokens_1', tokens_attention_mask_in_name=None, hidden_state_out_name='text_encoder_1_hidden_state', pooled_out_name=None, add_layer_norm=False, text_encoder=model.text_encoder_1, hidden_state_output_index=-(2 + config.text_encoder_layer_skip), autocast_contexts=[model.autocast_context], dtype=model.train_dtype.torch_dtype())
         encode_prompt_2 = EncodeClipText(in_name='tokens_2', tokens_attention_mask_in_name=None, hidden_state_out_name='text_encoder_2_hidden_state', pooled_out_name='text_encoder_2_pooled_state', add_layer_norm=False, text_encoder=model.text_encoder_2, hidden_state_output_index=-(2 + config.text_encoder_2_layer_skip), autocast_contexts=[model.autocast_context], dtype=model.train_dtype.torch_dtype())
 
+        if config.latent_caching and config.cache_batch_size > 1:
+            encode_image = BatchedEncodeVAE(in_name='image', out_name='latent_image_distribution', vae=model.vae, batch_size=config.cache_batch_size, autocast_contexts=[model.autocast_context, model.vae_autocast_context], dtype=model.vae_train_dtype.torch_dtype())
+            encode_conditioning_image = BatchedEncodeVAE(in_name='conditioning_image', out_name='latent_conditioning_image_distribution', vae=model.vae, batch_size=config.cache_batch_size, autocast_contexts=[model.autocast_context, model.vae_autocast_context], dtype=model.vae_train_dtype.torch_dtype())
+            encode_prompt_1 = BatchedEncodeClipText(in_name='tokens_1', tokens_attention_mask_in_name=None, hidden_state_out_name='text_encoder_1_hidden_state', pooled_out_name=None, add_layer_norm=False, text_encoder=model.text_encoder_1, batch_size=config.cache_batch_size, hidden_state_output_index=-(2 + config.text_encoder_layer_skip), autocast_contexts=[model.autocast_context], dtype=model.train_dtype.torch_dtype())
+            encode_prompt_2 = BatchedEncodeClipText(in_name='tokens_2', tokens_attention_mask_in_name=None, hidden_state_out_name='text_encoder_2_hidden_state', pooled_out_name='text_encoder_2_pooled_state', add_layer_norm=False, text_encoder=model.text_encoder_2, batch_size=config.cache_batch_size, hidden_state_output_index=-(2 + config.text_encoder_2_layer_skip), autocast_contexts=[model.autocast_context], dtype=model.train_dtype.torch_dtype())
+
         modules = [
             rescale_image, encode_image,
             tokenize_prompt_1,
@@ -304,7 +327,7 @@ class StablDiffusionXLBaseDataLoader(BaseDataLoader):
             model.eval()
             torch_gc()
 
-        image_disk_cache = DiskCache(cache_dir=image_cache_dir, split_names=image_split_names, aggregate_names=image_aggregate_names, variations_in_name='concept.image_variations', repeats_in_name='concept.repeats', variations_group_in_name=['concept.path', 'concept.seed', 'concept.include_subdirectories', 'concept.image'], group_enabled_in_name='concept.enabled', before_cache_fun=before_cache_image_fun)
+        image_disk_cache = self._create_disk_cache(config, cache_dir=image_cache_dir, split_names=image_split_names, aggregate_names=image_aggregate_names, variations_in_name='concept.image_variations', repeats_in_name='concept.repeats', variations_group_in_name=['concept.path', 'concept.seed', 'concept.include_subdirectories', 'concept.image'], group_enabled_in_name='concept.enabled', before_cache_fun=before_cache_image_fun, key_path_names=self._image_cache_key_path_names(config), key_data=self._image_cache_key_data(config))
         image_ram_cache = RamCache(cache_names=image_split_names + image_aggregate_names, repeats_in_name='concept.repeats', variations_group_in_name=['concept.path', 'concept.seed', 'concept.include_subdirectories', 'concept.image'], group_enabled_in_name='concept.enabled', before_cache_fun=before_cache_image_fun)
 
         modules = []
@@ -315,7 +338,7 @@ class StablDiffusionXLBaseDataLoader(BaseDataLoader):
             modules.append(image_ram_cache)
 
         if (not config.text_encoder.train or not config.text_encoder_2.train) and config.latent_caching and config.training_method != TrainingMethod.EMBEDDING:
-            text_disk_cache = DiskCache(cache_dir=text_cache_dir, split_names=text_split_names, aggregate_names=[], variations_in_name='concept.text_variations', repeats_in_name='concept.repeats', variations_group_in_name=['concept.path', 'concept.seed', 'concept.include_subdirectories', 'concept.text'], group_enabled_in_name='concept.enabled', before_cache_fun=before_cache_text_fun)
+            text_disk_cache = self._create_disk_cache(config, cache_dir=text_cache_dir, split_names=text_split_names, aggregate_names=[], variations_in_name='concept.text_variations', repeats_in_name='concept.repeats', variations_group_in_name=['concept.path', 'concept.seed', 'concept.include_subdirectories', 'concept.text'], group_enabled_in_name='concept.enabled', before_cache_fun=before_cache_text_fun, key_path_names=self._text_cache_key_path_names(config), key_data=self._text_cache_key_data(config))
             modules.append(text_disk_cache)
             sort_names = [x for x in sort_names if x not in text_split_names]
 
@@ -362,7 +385,7 @@ class StablDiffusionXLBaseDataLoader(BaseDataLoader):
             autocast_contexts=[model.autocast_context], dtype=model.train_dtype.torch_dtype(),
             before_cache_fun=before_cache_image_fun,
         )
-        batch_sorting = AspectBatchSorting(resolution_in_name='crop_resolution', names=sort_names, batch_size=config.batch_size)
+        batch_sorting = self._create_batch_sorting(config, sort_names)
         output = OutputPipelineModule(names=output_names)
 
         modules = [image_sample]
@@ -430,6 +453,7 @@ class StablDiffusionXLBaseDataLoader(BaseDataLoader):
         crop_modules = self._crop_modules(config)
         augmentation_modules = self._augmentation_modules(config)
         inpainting_modules = self._inpainting_modules(config)
+        parallel_load_modules = self._parallel_load_modules(config)
         preparation_modules = self._preparation_modules(config, model)
         cache_modules = self._cache_modules(config, model)
         output_modules = self._output_modules(config, model)
@@ -446,6 +470,7 @@ class StablDiffusionXLBaseDataLoader(BaseDataLoader):
                 crop_modules,
                 augmentation_modules,
                 inpainting_modules,
+                parallel_load_modules,
                 preparation_modules,
                 cache_modules,
                 output_modules,
@@ -4,12 +4,10 @@ import os
 import torch
 from mgds.MGDS import TrainDataLoader, MGDS
 from mgds.OutputPipelineModule import OutputPipelineModule
-from mgds.pipelineModules.AspectBatchSorting import AspectBatchSorting
 from mgds.pipelineModules.AspectBucketing import AspectBucketing
 from mgds.pipelineModules.CalcAspect import CalcAspect
 from mgds.pipelineModules.CollectPaths import CollectPaths
 from mgds.pipelineModules.DecodeTokens import DecodeTokens
-from mgds.pipelineModules.DiskCache import DiskCache
 from mgds.pipelineModules.EncodeClipText import EncodeClipText
 from mgds.pipelineModules.GenerateImageLike import GenerateImageLike
 from mgds.pipelineModules.GetFilename import GetFilename
@@ -39,6 +37,9 @@ from mgds.pipelineModules.Tokenize import Tokenize
 from mgds.pipelineModules.VariationSorting import VariationSorting
 
 from modules.dataLoader.BaseDataLoader import BaseDataLoader
+from modules.dataLoader.pipelineModules.BatchedEncodeClipText import BatchedEncodeClipText
+from modules.dataLoader.pipelineModules.ParallelLoad import ParallelLoad
+from modules.dataLoader.wuerstchen.BatchedEncodeWuerstchenEffnet import BatchedEncodeWuerstchenEffnet
 from modules.dataLoader.wuerstchen.EncodeWuerstchenEffnet import EncodeWuerstchenEffnet
 from modules.model.WuerstchenModel import WuerstchenModel
 from modules.util import path_util
@@ -212,6 +213,19 @@ class WuerstchenBaseDataLoader(BaseDataLoader):
         return modules
 
 
+    def _parallel_load_modules(self, config: TrainConfig):
+        if config.dataloader_threads <= 1:
+            return []
+
+        names = ['image']
+
+        if config.masked_training or config.model_type.has_mask_input():
+            names.append('mask')
+
+        parallel_load = ParallelLoad(names=names, threads=config.dataloader_threads)
+
+        return [parallel_load]
+
     def _preparation_modules(self, config: TrainConfig, model: WuerstchenModel):
         downscale_image = ScaleImage(in_name='image', out_name='image', factor=0.75)
         normalize_image = NormalizeImageChannels(image_in_name='image', image_out_name='image', mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225))
@@ -223,6 +237,13 @@ class WuerstchenBaseDataLoader(BaseDataLoader):
         elif model.model_type.is_stable_cascade():
             encode_prompt = EncodeClipText(in_name='tokens', tokens_attention_mask_in_name='tokens_mask', hidden_state_out_name='text_encoder_hidden_state', pooled_out_name='pooled_text_encoder_output', add_layer_norm=False, text_encoder=model.prior_text_encoder, hidden_state_output_index=-1, autocast_contexts=[model.autocast_context], dtype=model.train_dtype.torch_dtype())
 
+        if config.latent_caching and config.cache_batch_size > 1:
+            encode_image = BatchedEncodeWuerstchenEffnet(in_name='image', out_name='latent_image', effnet_encoder=model.effnet_encoder, batch_size=config.cache_batch_size, autocast_contexts=[model.autocast_context, model.effnet_encoder_autocast_context], dtype=model.effnet_encoder_train_dtype.torch_dtype())
+            if model.model_type.is_wuerstchen_v2():
+                encode_prompt = BatchedEncodeClipText(in_name='tokens', tokens_attention_mask_in_name='tokens_mask', hidden_state_out_name='text_encoder_hidden_state', pooled_out_name=None, add_layer_norm=True, text_encoder=model.prior_text_encoder, batch_size=config.cache_batch_size, hidden_state_output_index=-1, autocast_contexts=[model.autocast_context], dtype=model.train_dtype.torch_dtype())
+            elif model.model_type.is_stable_cascade():
+                encode_prompt = BatchedEncodeClipText(in_name='tokens', tokens_attention_mask_in_name='tokens_mask', hidden_state_out_name='text_encoder_hidden_state', pooled_out_name='pooled_text_encoder_output', add_layer_norm=False, text_encoder=model.prior_text_encoder, batch_size=config.cache_batch_size, hidden_state_output_index=-1, autocast_contexts=[model.autocast_context], dtype=model.train_dtype.torch_dtype())
+
         modules = [
             downscale_image, normalize_image, encode_image,
             tokenize_prompt,
@@ -271,10 +292,10 @@ class WuerstchenBaseDataLoader(BaseDataLoader):
             model.eval()
             torch_gc()
 
-        image_disk_cache = DiskCache(cache_dir=image_cache_dir, split_names=image_split_names, aggregate_names=image_aggregate_names, variations_in_name='concept.image_variations', repeats_in_name='concept.repeats', variations_group_in_name=['concept.path', 'concept.seed', 'concept.include_subdirectories', 'concept.image'], group_enabled_in_name='concept.enabled', before_cache_fun=before_cache_image_fun)
+        image_disk_cache = self._create_disk_cache(config, cache_dir=image_cache_dir, split_names=image_split_names, aggregate_names=image_aggregate_names, variations_in_name='concept.image_variations', repeats_in_name='concept.repeats', variations_group_in_name=['concept.path', 'concept.seed', 'concept.include_subdirectories', 'concept.image'], group_enabled_in_name='concept.enabled', before_cache_fun=before_cache_image_fun, key_path_names=self._image_cache_key_path_names(config), key_data=self._image_cache_key_data(config))
         image_ram_cache = RamCache(cache_names=image_split_names + image_aggregate_names, repeats_in_name='concept.repeats', variations_group_in_name=['concept.path', 'concept.seed', 'concept.include_subdirectories', 'concept.image'], group_enabled_in_name='concept.enabled', before_cache_fun=before_cache_image_fun)
 
-        text_disk_cache = DiskCache(cache_dir=text_cache_dir, split_names=text_split_names, aggregate_names=[], variations_in_name='concept.text_variations', repeats_in_name='concept.repeats', variations_group_in_name=['concept.path', 'concept.seed', 'concept.include_subdirectories', 'concept.text'], group_enabled_in_name='concept.enabled', before_cache_fun=before_cache_text_fun)
+        text_disk_cache = self._create_disk_cache(config, cache_dir=text_cache_dir, split_names=text_split_names, aggregate_names=[], variations_in_name='concept.text_variations', repeats_in_name='concept.repeats', variations_group_in_name=['concept.path', 'concept.seed', 'concept.include_subdirectories', 'concept.text'], group_enabled_in_name='concept.enabled', before_cache_fun=before_cache_text_fun, key_path_names=self._text_cache_key_path_names(config), key_data=self._text_cache_key_data(config))
 
         modules = []
 
@@ -325,7 +346,7 @@ class WuerstchenBaseDataLoader(BaseDataLoader):
             autocast_contexts=[model.autocast_context], dtype=model.train_dtype.torch_dtype(),
             before_cache_fun=before_cache_image_fun
         )
-        batch_sorting = AspectBatchSorting(resolution_in_name='crop_resolution', names=sort_names, batch_size=config.batch_size)
+        batch_sorting = self._create_batch_sorting(config, sort_names)
         output = OutputPipelineModule(names=output_names)
 
         modules = []
@@ -377,6 +398,7 @@ class WuerstchenBaseDataLoader(BaseDataLoader):
         aspect_bucketing_in = self._aspect_bucketing_in(config)
         crop_modules = self._crop_modules(config)
         augmentation_modules = self._augmentation_modules(config)
+        parallel_load_modules = self._parallel_load_modules(config)
         preparation_modules = self._preparation_modules(config, model)
         cache_modules = self._cache_modules(config, model)
         output_modules = self._output_modules(config, model)
@@ -392,6 +414,7 @@ class WuerstchenBaseDataLoader(BaseDataLoader):
                 aspect_bucketing_in,
                 crop_modules,
                 augmentation_modules,
+                parallel_load_modules,
                 preparation_modules,
                 cache_modules,
                 output_modules,
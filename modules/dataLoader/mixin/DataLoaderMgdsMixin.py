@@ -1,16 +1,51 @@
 import json
 from abc import ABCMeta
+from typing import Callable
 
 import torch
 from mgds.MGDS import MGDS
+from mgds.pipelineModules.DiskCache import DiskCache
 
+from modules.dataLoader.pipelineModules.ParallelLoad import ParallelLoad
+from modules.dataLoader.pipelineModules.PlannedRequestsMixin import PlannedRequestsMixin
+from modules.dataLoader.pipelineModules.ShardedDiskCache import ShardedDiskCache
 from modules.util.TrainProgress import TrainProgress
 from modules.util.config.ConceptConfig import ConceptConfig
 from modules.util.config.TrainConfig import TrainConfig
+from modules.util.enum.CacheFormat import CacheFormat
 
 
 class DataLoaderMgdsMixin(metaclass=ABCMeta):
 
+    @staticmethod
+    def __flatten_definition(definition: list) -> list:
+        modules = []
+        for entry in definition:
+            if isinstance(entry, list):
+                modules.extend(DataLoaderMgdsMixin.__flatten_definition(entry))
+            elif entry is not None:
+                modules.append(entry)
+        return modules
+
+    @staticmethod
+    def __connect_planned_requests(definition: list):
+        # sharded caches only request uncached items, modules before them should not load the others ahead
+        planned_request_modules = []
+        for module in DataLoaderMgdsMixin.__flatten_definition(definition):
+            if isinstance(module, ShardedDiskCache):
+                module.planned_request_modules = list(planned_request_modules)
+            if isinstance(module, PlannedRequestsMixin):
+                planned_request_modules.append(module)
+
+    @staticmethod
+    def __serialize_parallel_loads(definition: list):
+        # modules before a ParallelLoad are called from several threads at once
+        previous_modules = []
+        for module in DataLoaderMgdsMixin.__flatten_definition(definition):
+            if isinstance(module, ParallelLoad):
+                module.serialize_modules(previous_modules)
+            previous_modules.append(module)
+
     def _create_mgds(
             self,
             config: TrainConfig,
@@ -31,6 +66,9 @@ class DataLoaderMgdsMixin(metaclass=ABCMeta):
             "target_resolution": config.resolution,
         }
 
+        self.__connect_planned_requests(definition)
+        self.__serialize_parallel_loads(definition)
+
         ds = MGDS(
             torch.device(config.train_device),
             concepts,
@@ -38,7 +76,85 @@ class DataLoaderMgdsMixin(metaclass=ABCMeta):
             definition,
             batch_size=config.batch_size,
             initial_epoch=train_progress.epoch,
-            initial_epoch_sample=train_progress.epoch_sample,
+            # with a pixel budget, batches are only known for whole epochs, so a resumed epoch is restarted
+            initial_epoch_sample=train_progress.epoch_sample if config.batch_pixel_budget <= 0 else 0,
         )
 
         return ds
+
+    def _image_cache_key_path_names(self, config: TrainConfig) -> list[str]:
+        key_path_names = ['image_path']
+
+        if config.masked_training:
+            key_path_names.append('mask_path')
+
+        return key_path_names
+
+    def _image_cache_key_data(self, config: TrainConfig) -> dict:
+        # all settings that change the cached image data
+        return {
+            'base_model_name': config.base_model_name,
+            'vae_model_name': config.vae.model_name,
+            'effnet_encoder_model_name': config.effnet_encoder.model_name,
+            'weight_dtypes': [str(dtype) for dtype in config.weight_dtypes().all_dtypes()],
+            'train_dtype': str(config.train_dtype),
+            'resolution': config.resolution,
+            'aspect_ratio_bucketing': config.aspect_ratio_bucketing,
+            'masked_training': config.masked_training,
+            'circular_mask_generation': config.circular_mask_generation,
+            'random_rotate_and_crop': config.random_rotate_and_crop,
+        }
+
+    def _text_cache_key_path_names(self, config: TrainConfig) -> list[str]:
+        return ['image_path', 'sample_prompt_path', 'concept.text.prompt_path']
+
+    def _text_cache_key_data(self, config: TrainConfig) -> dict:
+        # all settings that change the cached text data
+        return {
+            'base_model_name': config.base_model_name,
+            'weight_dtypes': [str(dtype) for dtype in config.weight_dtypes().all_dtypes()],
+            'train_dtype': str(config.train_dtype),
+            'text_encoder_layer_skip': config.text_encoder_layer_skip,
+            'text_encoder_2_layer_skip': config.text_encoder_2_layer_skip,
+        }
+
+    def _create_disk_cache(
+            self,
+            config: TrainConfig,
+            cache_dir: str,
+            split_names: list[str],
+            aggregate_names: list[str],
+            variations_in_name: str,
+            repeats_in_name: str,
+            variations_group_in_name: list[str],
+            group_enabled_in_name: str,
+            before_cache_fun: Callable[[], None],
+            key_path_names: list[str] | None = None,
+            key_data: dict | None = None,
+    ):
+        match config.cache_format:
+            case CacheFormat.SHARDED:
+                return ShardedDiskCache(
+                    cache_dir=cache_dir,
+                    split_names=split_names,
+                    aggregate_names=aggregate_names,
+                    variations_in_name=variations_in_name,
+                    repeats_in_name=repeats_in_name,
+                    variations_group_in_name=variations_group_in_name,
+                    group_enabled_in_name=group_enabled_in_name,
+                    before_cache_fun=before_cache_fun,
+                    key_path_names=key_path_names,
+                    key_data=key_data,
+                    prune_stale_groups=config.clear_cache_before_training,
+                )
+            case _:
+                return DiskCache(
+                    cache_dir=cache_dir,
+                    split_names=split_names,
+                    aggregate_names=aggregate_names,
+                    variations_in_name=variations_in_name,
+                    repeats_in_name=repeats_in_name,
+                    variations_group_in_name=variations_group_in_name,
+                    group_enabled_in_name=group_enabled_in_name,
+                    before_cache_fun=before_cache_fun,
+                )
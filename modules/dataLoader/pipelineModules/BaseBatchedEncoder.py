@@ -0,0 +1,139 @@
+from abc import ABCMeta, abstractmethod
+from collections import OrderedDict
+from contextlib import nullcontext
+
+import torch
+from mgds.MGDS import PipelineModule
+from mgds.pipelineModuleTypes.RandomAccessPipelineModule import RandomAccessPipelineModule
+from torch import Tensor
+
+from modules.dataLoader.pipelineModules.PlannedRequestsMixin import PlannedRequestsMixin
+
+
+class BaseBatchedEncoder(
+    PlannedRequestsMixin,
+    PipelineModule,
+    RandomAccessPipelineModule,
+    metaclass=ABCMeta,
+):
+    """
+    Base class for encoders that process several items in a single forward pass.
+
+    When an item is requested, the following items are loaded as well, until a full batch of items with the same input
+    shapes is available. The whole batch is then encoded at once, and the results are kept until they are requested.
+    This works best if items are requested in order, which is the case while a cache is built. If the cache only
+    requests some of the items, it sets a plan of the requested indices, and only those are loaded ahead.
+    """
+
+    def __init__(
+            self,
+            in_names: list[str],
+            out_names: list[str],
+            batch_size: int,
+            lookahead: int | None = None,
+            autocast_contexts: list[torch.autocast | None] = None,
+            dtype: torch.dtype | None = None,
+    ):
+        super(BaseBatchedEncoder, self).__init__()
+        self.in_names = in_names
+        self.out_names = out_names
+        self.batch_size = max(1, batch_size)
+        self.lookahead = self.batch_size * 4 if lookahead is None else lookahead
+
+        self.autocast_contexts = [nullcontext()] if autocast_contexts is None else autocast_contexts
+        self.dtype = dtype
+
+        self.__variation = None
+        self.__pending = {}  # batch key -> list of (index, inputs)
+        self.__pending_keys = {}  # index -> batch key
+        self.__results = OrderedDict()  # index -> outputs
+        self.__max_results = self.lookahead + 2 * self.batch_size
+
+    def length(self) -> int:
+        return self._get_previous_length(self.in_names[0])
+
+    def get_inputs(self) -> list[str]:
+        return self.in_names
+
+    def get_outputs(self) -> list[str]:
+        return self.out_names
+
+    @abstractmethod
+    def _encode_batch(self, inputs: list[dict]) -> list[dict]:
+        """
+        Encodes a list of items with identical input shapes. Returns the outputs of each item.
+        """
+        pass
+
+    @staticmethod
+    def _batch_key(inputs: dict) -> tuple:
+        return tuple(
+            (name, tuple(value.shape)) if isinstance(value, Tensor) else name
+            for name, value in inputs.items()
+        )
+
+    def __reset(self, variation: int):
+        self.__variation = variation
+        self.__pending = {}
+        self.__pending_keys = {}
+        self.__results = OrderedDict()
+
+    def __load(self, variation: int, index: int) -> tuple:
+        inputs = {name: self._get_previous_item(variation, name, index) for name in self.in_names}
+        batch_key = self._batch_key(inputs)
+
+        self.__pending.setdefault(batch_key, []).append((index, inputs))
+        self.__pending_keys[index] = batch_key
+
+        return batch_key
+
+    def __drop_pending_before(self, min_index: int):
+        # items that were loaded ahead, but were skipped by the consumer
+        for batch_key in list(self.__pending.keys()):
+            pending = [(index, inputs) for index, inputs in self.__pending[batch_key] if index >= min_index]
+            for index, _ in self.__pending[batch_key]:
+                if index < min_index:
+                    self.__pending_keys.pop(index)
+
+            if pending:
+                self.__pending[batch_key] = pending
+            else:
+                self.__pending.pop(batch_key)
+
+    def __encode_pending(self, batch_key: tuple):
+        pending = self.__pending.pop(batch_key)
+
+        outputs = self._encode_batch([inputs for _, inputs in pending])
+
+        for (index, _), output in zip(pending, outputs):
+            self.__pending_keys.pop(index)
+            self.__results[index] = output
+
+        while len(self.__results) > self.__max_results:
+            self.__results.popitem(last=False)
+
+    def get_item(self, variation: int, index: int, requested_name: str = None) -> dict:
+        if variation != self.__variation:
+            self.__reset(variation)
+
+        if index in self.__results:
+            return self.__results[index]
+
+        self.__drop_pending_before(index - self.lookahead)
+
+        batch_key = self.__pending_keys[index] if index in self.__pending_keys else self.__load(variation, index)
+
+        for next_index in self._next_indices(variation, index, self.lookahead - 1, self.length()):
+            if len(self.__pending[batch_key]) >= self.batch_size:
+                break
+
+            if next_index not in self.__results and next_index not in self.__pending_keys:
+                next_batch_key = self.__load(variation, next_index)
+
+                # full batches of other shapes are encoded right away
+                if next_batch_key != batch_key and len(self.__pending[next_batch_key]) >= self.batch_size:
+                    self.__encode_pending(next_batch_key)
+
+        self.__encode_pending(batch_key)
+
+        return self.__results[index]
@@ -0,0 +1,84 @@
+import torch
+from transformers import CLIPTextModel, CLIPTextModelWithProjection
+
+from modules.dataLoader.pipelineModules.BaseBatchedEncoder import BaseBatchedEncoder
+
+
+class BatchedEncodeClipText(BaseBatchedEncoder):
+    def __init__(
+            self,
+            in_name: str,
+            tokens_attention_mask_in_name: str | None,
+            hidden_state_out_name: str,
+            pooled_out_name: str | None,
+            add_layer_norm: bool,
+            text_encoder: CLIPTextModel | CLIPTextModelWithProjection,
+            batch_size: int,
+            hidden_state_output_index: int | None = None,
+            autocast_contexts: list[torch.autocast | None] = None,
+            dtype: torch.dtype | None = None,
+    ):
+        in_names = [in_name]
+        if tokens_attention_mask_in_name is not None:
+            in_names.append(tokens_attention_mask_in_name)
+
+        out_names = [hidden_state_out_name]
+        if pooled_out_name is not None:
+            out_names.append(pooled_out_name)
+
+        super(BatchedEncodeClipText, self).__init__(
+            in_names=in_names,
+            out_names=out_names,
+            batch_size=batch_size,
+            autocast_contexts=autocast_contexts,
+            dtype=dtype,
+        )
+        self.in_name = in_name
+        self.tokens_attention_mask_in_name = tokens_attention_mask_in_name
+        self.hidden_state_out_name = hidden_state_out_name
+        self.pooled_out_name = pooled_out_name
+        self.add_layer_norm = add_layer_norm
+        self.text_encoder = text_encoder
+        self.hidden_state_output_index = -1 if hidden_state_output_index is None else hidden_state_output_index
+
+    def _encode_batch(self, inputs: list[dict]) -> list[dict]:
+        tokens = torch.stack([item[self.in_name] for item in inputs]).to(self.text_encoder.device)
+
+        attention_mask = None
+        if self.tokens_attention_mask_in_name is not None:
+            attention_mask = torch.stack([item[self.tokens_attention_mask_in_name] for item in inputs])
+            attention_mask = attention_mask.to(self.text_encoder.device)
+
+        with self._all_contexts(self.autocast_contexts):
+            text_encoder_output = self.text_encoder(
+                tokens,
+                attention_mask=attention_mask,
+                output_hidden_states=True,
+                return_dict=True,
+            )
+
+            hidden_state = text_encoder_output.hidden_states[self.hidden_state_output_index]
+            if self.add_layer_norm:
+                final_layer_norm = self.text_encoder.text_model.final_layer_norm
+                hidden_state = final_layer_norm(hidden_state)
+
+        pooled_state = None
+        if self.pooled_out_name is not None:
+            if hasattr(text_encoder_output, 'text_embeds'):
+                pooled_state = text_encoder_output.text_embeds
+            else:
+                pooled_state = text_encoder_output.pooler_output
+
+        if self.dtype:
+            hidden_state = hidden_state.to(dtype=self.dtype)
+            if pooled_state is not None:
+                pooled_state = pooled_state.to(dtype=self.dtype)
+
+        outputs = []
+        for i in range(len(inputs)):
+            output = {self.hidden_state_out_name: hidden_state[i]}
+            if pooled_state is not None:
+                output[self.pooled_out_name] = pooled_state[i]
+            outputs.append(output)
+
+        return outputs
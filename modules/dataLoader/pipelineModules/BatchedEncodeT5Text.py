@@ -0,0 +1,64 @@
+import torch
+from transformers import T5EncoderModel
+
+from modules.dataLoader.pipelineModules.BaseBatchedEncoder import BaseBatchedEncoder
+
+
+class BatchedEncodeT5Text(BaseBatchedEncoder):
+    def __init__(
+            self,
+            tokens_in_name: str,
+            tokens_attention_mask_in_name: str | None,
+            hidden_state_out_name: str,
+            add_layer_norm: bool,
+            text_encoder: T5EncoderModel,
+            batch_size: int,
+            hidden_state_output_index: int | None = None,
+            autocast_contexts: list[torch.autocast | None] = None,
+            dtype: torch.dtype | None = None,
+    ):
+        in_names = [tokens_in_name]
+        if tokens_attention_mask_in_name is not None:
+            in_names.append(tokens_attention_mask_in_name)
+
+        super(BatchedEncodeT5Text, self).__init__(
+            in_names=in_names,
+            out_names=[hidden_state_out_name],
+            batch_size=batch_size,
+            autocast_contexts=autocast_contexts,
+            dtype=dtype,
+        )
+        self.tokens_in_name = tokens_in_name
+        self.tokens_attention_mask_in_name = tokens_attention_mask_in_name
+        self.hidden_state_out_name = hidden_state_out_name
+        self.add_layer_norm = add_layer_norm
+        self.text_encoder = text_encoder
+        self.hidden_state_output_index = -1 if hidden_state_output_index is None else hidden_state_output_index
+
+    def _encode_batch(self, inputs: list[dict]) -> list[dict]:
+        tokens = torch.stack([item[self.tokens_in_name] for item in inputs]).to(self.text_encoder.device)
+
+        attention_mask = None
+        if self.tokens_attention_mask_in_name is not None:
+            attention_mask = torch.stack([item[self.tokens_attention_mask_in_name] for item in inputs])
+            attention_mask = attention_mask.to(self.text_encoder.device)
+
+        with self._all_contexts(self.autocast_contexts):
+            text_encoder_output = self.text_encoder(
+                tokens,
+                attention_mask=attention_mask,
+                output_hidden_states=True,
+                return_dict=True,
+            )
+
+            # the last hidden state already includes the final layer norm
+            hidden_states = text_encoder_output.hidden_states[:-1]
+            hidden_state = hidden_states[self.hidden_state_output_index]
+            if self.add_layer_norm:
+                final_layer_norm = self.text_encoder.encoder.final_layer_norm
+                hidden_state = final_layer_norm(hidden_state)
+
+        if self.dtype:
+            hidden_state = hidden_state.to(dtype=self.dtype)
+
+        return [{self.hidden_state_out_name: hidden_state[i]} for i in range(len(inputs))]
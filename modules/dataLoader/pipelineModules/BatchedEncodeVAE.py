@@ -0,0 +1,42 @@
+import torch
+from diffusers import AutoencoderKL
+from diffusers.models.autoencoders.vae import DiagonalGaussianDistribution
+
+from modules.dataLoader.pipelineModules.BaseBatchedEncoder import BaseBatchedEncoder
+
+
+class BatchedEncodeVAE(BaseBatchedEncoder):
+    def __init__(
+            self,
+            in_name: str,
+            out_name: str,
+            vae: AutoencoderKL,
+            batch_size: int,
+            autocast_contexts: list[torch.autocast | None] = None,
+            dtype: torch.dtype | None = None,
+    ):
+        super(BatchedEncodeVAE, self).__init__(
+            in_names=[in_name],
+            out_names=[out_name],
+            batch_size=batch_size,
+            autocast_contexts=autocast_contexts,
+            dtype=dtype,
+        )
+        self.in_name = in_name
+        self.out_name = out_name
+        self.vae = vae
+
+    def _encode_batch(self, inputs: list[dict]) -> list[dict]:
+        image = torch.stack([item[self.in_name] for item in inputs])
+
+        if self.dtype:
+            image = image.to(device=self.vae.device, dtype=self.dtype)
+
+        with self._all_contexts(self.autocast_contexts):
+            latent_distribution = self.vae.encode(image).latent_dist
+
+        # every item gets its own distribution, with the same shape as a distribution of a single encoded image
+        return [
+            {self.out_name: DiagonalGaussianDistribution(parameters.unsqueeze(0))}
+            for parameters in latent_distribution.parameters
+        ]
@@ -0,0 +1,72 @@
+from mgds.MGDS import PipelineModule
+from mgds.pipelineModuleTypes.RandomAccessPipelineModule import RandomAccessPipelineModule
+
+
+class BudgetBatchSorting(
+    PipelineModule,
+    RandomAccessPipelineModule,
+):
+    """
+    Sorts the items into batches of a single resolution, where each batch holds up to pixel_budget pixels.
+
+    Unlike AspectBatchSorting, the number of items per batch depends on the resolution of the bucket. Buckets of small
+    images are packed into larger batches than buckets of large images, so every training step processes roughly the
+    same amount of data. Items are never dropped, the last batch of a bucket can be smaller. The batches of the
+    current epoch are returned by batch_ranges() as (start, end) index ranges.
+    """
+
+    def __init__(
+            self,
+            resolution_in_name: str,
+            names: list[str],
+            pixel_budget: int,
+    ):
+        super(BudgetBatchSorting, self).__init__()
+        self.resolution_in_name = resolution_in_name
+        self.names = names
+        self.pixel_budget = pixel_budget
+
+        self.__index_list = []
+        self.__batch_ranges = []
+
+    def length(self) -> int:
+        return len(self.__index_list)
+
+    def get_inputs(self) -> list[str]:
+        return [self.resolution_in_name] + self.names
+
+    def get_outputs(self) -> list[str]:
+        return self.names
+
+    def bucket_batch_size(self, resolution: tuple[int, int]) -> int:
+        height, width = resolution
+        return max(1, self.pixel_budget // (height * width))
+
+    def batch_ranges(self) -> list[tuple[int, int]]:
+        return self.__batch_ranges
+
+    def start(self, variation: int):
+        rand = self._get_rand(variation)
+
+        buckets = {}
+        for in_index in range(self._get_previous_length(self.resolution_in_name)):
+            resolution = tuple(self._get_previous_item(variation, self.resolution_in_name, in_index))
+            buckets.setdefault(resolution, []).append(in_index)
+
+        batches = []
+        for resolution, in_indices in buckets.items():
+            rand.shuffle(in_indices)
+            batch_size = self.bucket_batch_size(resolution)
+            for start in range(0, len(in_indices), batch_size):
+                batches.append(in_indices[start:start + batch_size])
+        rand.shuffle(batches)
+
+        self.__index_list = []
+        self.__batch_ranges = []
+        for batch in batches:
+            self.__batch_ranges.append((len(self.__index_list), len(self.__index_list) + len(batch)))
+            self.__index_list.extend(batch)
+
+    def get_item(self, variation: int, index: int, requested_name: str = None) -> dict:
+        in_index = self.__index_list[index]
+        return {name: self._get_previous_item(variation, name, in_index) for name in self.names}
@@ -0,0 +1,137 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from mgds.MGDS import PipelineModule
+from mgds.pipelineModuleTypes.RandomAccessPipelineModule import RandomAccessPipelineModule
+from mgds.pipelineModules.GenerateDepth import GenerateDepth
+
+from modules.dataLoader.pipelineModules.PlannedRequestsMixin import PlannedRequestsMixin
+
+
+class ParallelLoad(
+    PlannedRequestsMixin,
+    PipelineModule,
+    RandomAccessPipelineModule,
+):
+    """
+    Computes the named items of the previous modules on a pool of worker threads.
+
+    When an item is requested, the following items are submitted to the pool as well, so the decoding, scaling,
+    cropping and augmentation of up to "lookahead" items runs in parallel. Image decoding and tensor operations
+    release the GIL, which lets this scale with the number of cpu cores. If a following cache only requests some of
+    the items, only those are submitted.
+
+    Previous modules are called from several threads at once. Random access modules are only allowed to do this if
+    get_item() reads nothing but the state prepared in start(), and draws all random numbers from a generator seeded
+    from the variation and index of the item. This holds for the loading, cropping and augmentation modules. All other
+    modules, and modules that run a model, are serialized by serialize_modules() with a lock per module.
+
+    The thread pool is shut down once the last item of an epoch is returned, and when the next epoch starts.
+    """
+
+    # random access modules that are not safe to call from several threads at once
+    NOT_THREAD_SAFE_MODULE_TYPES = (GenerateDepth,)
+
+    def __init__(
+            self,
+            names: list[str],
+            threads: int,
+            lookahead: int | None = None,
+    ):
+        super(ParallelLoad, self).__init__()
+        self.names = names
+        self.threads = threads
+        self.lookahead = threads * 4 if lookahead is None else lookahead
+
+        self.__executor = None
+        self.__variation = None
+        self.__futures = OrderedDict()  # index -> future of all named items
+
+    def length(self) -> int:
+        return self._get_previous_length(self.names[0])
+
+    def get_inputs(self) -> list[str]:
+        return self.names
+
+    def get_outputs(self) -> list[str]:
+        return self.names
+
+    @staticmethod
+    def __serialized_get_item(get_item, lock: threading.Lock):
+        def serialized_get_item(*args, **kwargs):
+            with lock:
+                return get_item(*args, **kwargs)
+
+        return serialized_get_item
+
+    def serialize_modules(self, modules: list[PipelineModule]):
+        """
+        Wraps get_item() of every module that is not safe to call from several threads at once in a lock. Should be
+        called with all modules before this module.
+        """
+        for module in modules:
+            if not isinstance(module, RandomAccessPipelineModule) \
+                    or isinstance(module, self.NOT_THREAD_SAFE_MODULE_TYPES):
+                module.get_item = self.__serialized_get_item(module.get_item, threading.Lock())
+
+    def __load(self, variation: int, index: int) -> dict:
+        return {name: self._get_previous_item(variation, name, index) for name in self.names}
+
+    def __submit(self, variation: int, index: int) -> Future:
+        if self.__executor is None:
+            self.__executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='ParallelLoad')
+
+        future = self.__executor.submit(self.__load, variation, index)
+        self.__futures[index] = future
+        return future
+
+    def __shutdown(self):
+        if self.__executor is not None:
+            # waits for running items, so no thread accesses the pipeline after the epoch ended
+            self.__executor.shutdown(wait=True, cancel_futures=True)
+            self.__executor = None
+
+        # finished items are kept, the same item is usually requested once for every name
+        self.__futures = OrderedDict(
+            (index, future) for index, future in self.__futures.items() if not future.cancelled()
+        )
+
+    def __reset(self, variation: int):
+        for future in self.__futures.values():
+            future.cancel()
+
+        self.__variation = variation
+        self.__futures = OrderedDict()
+
+    def start(self, variation: int):
+        self.__shutdown()
+        self.__variation = None
+        self.__futures = OrderedDict()
+
+    def get_item(self, variation: int, index: int, requested_name: str = None) -> dict:
+        if variation != self.__variation:
+            self.__reset(variation)
+
+        future = self.__futures[index] if index in self.__futures else self.__submit(variation, index)
+
+        next_indices = self._next_indices(variation, index, self.lookahead, self.length())
+        for next_index in next_indices:
+            if next_index not in self.__futures:
+                self.__submit(variation, next_index)
+
+        # keeps the number of in-flight and finished items bounded
+        while len(self.__futures) > 2 * self.lookahead + 1:
+            oldest_index, oldest_future = next(iter(self.__futures.items()))
+            if oldest_index == index:
+                break
+            oldest_future.cancel()
+            self.__futures.pop(oldest_index)
+
+        item = future.result()
+
+        if not next_indices:
+            # the last item of the epoch
+            self.__shutdown()
+
+        return item
@@ -0,0 +1,38 @@
+class PlannedRequestsMixin:
+    """
+    Mixin for pipeline modules that load items ahead of the requested index.
+
+    A following module that only requests some of the items, like a cache that already holds all other items, can
+    announce the indices it is going to request, in order. While such a plan is set, only the planned indices are
+    loaded ahead. Without a plan, all following indices are loaded ahead.
+    """
+
+    def __init__(self):
+        super(PlannedRequestsMixin, self).__init__()
+        self.__planned_variation = None
+        self.__planned_indices = None
+        self.__planned_positions = None
+
+    def set_planned_requests(self, variation: int, indices: list[int] | None):
+        """
+        Announces the indices that will be requested in the given variation. Pass None to remove the plan.
+        """
+        if indices is None:
+            self.__planned_variation = None
+            self.__planned_indices = None
+            self.__planned_positions = None
+        else:
+            self.__planned_variation = variation
+            self.__planned_indices = list(indices)
+            self.__planned_positions = {index: position for position, index in enumerate(self.__planned_indices)}
+
+    def _next_indices(self, variation: int, index: int, count: int, length: int) -> list[int]:
+        """
+        Returns up to count indices that will most likely be requested after index.
+        """
+        if self.__planned_indices is not None and variation == self.__planned_variation:
+            position = self.__planned_positions.get(index)
+            if position is not None:
+                return self.__planned_indices[position + 1:position + 1 + count]
+
+        return list(range(index + 1, min(length, index + 1 + count)))
@@ -0,0 +1,395 @@
+import bisect
+import hashlib
+import json
+import os
+import shutil
+from typing import Any, Callable
+
+import torch
+from diffusers.models.autoencoders.vae import DiagonalGaussianDistribution
+from mgds.MGDS import PipelineModule
+from mgds.pipelineModuleTypes.RandomAccessPipelineModule import RandomAccessPipelineModule
+from safetensors.torch import save_file
+from torch import Tensor
+from tqdm import tqdm
+
+from modules.util.safetensors_util import MemoryMappedSafetensors
+
+
+class ShardedDiskCache(
+    PipelineModule,
+    RandomAccessPipelineModule,
+):
+    """
+    A disk cache that packs the cached tensors of each group and variation into a few large safetensors shards.
+
+    Each cached variation of a group is stored in its own directory, containing the shards and an index file. Tensors
+    are read back as zero-copy views into the memory mapped shards. Values that are not tensors are stored in the
+    index file.
+
+    Every cached item is identified by a key, calculated from the size and modification time of the files named in
+    key_path_names, and from key_data, which should describe all settings that influence the cached data (resolution,
+    encoder, dtype, ...). When a variation is loaded, only items with a changed or missing key are encoded again.
+
+    Like DiskCache, each group returns len(group) * repeats items per epoch. Consecutive epochs continue where the
+    previous epoch stopped, walking through the items of the group and then through its variations.
+
+    Before items are encoded, the indices that will be requested are announced to planned_request_modules, so modules
+    that load items ahead skip the items that are already cached.
+
+    If prune_stale_groups is set, the first call to start() removes all group and variation directories that are not
+    used by the current dataset. This replaces clearing the whole cache before training.
+    """
+
+    INDEX_FILE_NAME = "index.pt"
+
+    def __init__(
+            self,
+            cache_dir: str,
+            split_names: list[str],
+            aggregate_names: list[str],
+            variations_in_name: str,
+            repeats_in_name: str,
+            variations_group_in_name: str | list[str],
+            group_enabled_in_name: str | None = None,
+            before_cache_fun: Callable[[], None] | None = None,
+            key_path_names: list[str] | None = None,
+            key_data: Any = None,
+            shard_size: int = 1024 * 1024 * 1024,
+            prune_stale_groups: bool = False,
+    ):
+        super(ShardedDiskCache, self).__init__()
+        self.cache_dir = cache_dir
+        self.split_names = split_names
+        self.aggregate_names = aggregate_names
+        self.variations_in_name = variations_in_name
+        self.repeats_in_name = repeats_in_name
+        self.variations_group_in_name = \
+            [variations_group_in_name] if isinstance(variations_group_in_name, str) else variations_group_in_name
+        self.group_enabled_in_name = group_enabled_in_name
+        self.before_cache_fun = before_cache_fun
+        self.key_path_names = [] if key_path_names is None else key_path_names
+        self.key_data = key_data
+        self.shard_size = shard_size
+        self.prune_stale_groups = prune_stale_groups
+        self.planned_request_modules = []
+
+        self.__groups_initialized = False
+        self.__stale_groups_pruned = False
+        self.__group_in_indices = {}  # group key -> list of input indices
+        self.__group_item_keys = {}  # group key -> list of item keys
+        self.__group_variations = {}  # group key -> number of variations
+        self.__group_repeats = {}  # group key -> number of repeats
+        self.__group_output_samples = {}  # group key -> number of output items per epoch
+        self.__output_group_keys = []  # group keys in output order, groups without output items are skipped
+        self.__output_group_starts = []  # the first output index of each group in __output_group_keys
+        self.__length = 0
+
+        self.__current_indices = {}  # (group key, input variation) -> loaded index
+        self.__shards = {}  # shard path -> MemoryMappedSafetensors
+
+    def length(self) -> int:
+        self.__init_groups()
+        return self.__length
+
+    def get_inputs(self) -> list[str]:
+        inputs = self.split_names + self.aggregate_names + self.key_path_names \
+                 + [self.variations_in_name, self.repeats_in_name] + self.variations_group_in_name
+        if self.group_enabled_in_name is not None:
+            inputs.append(self.group_enabled_in_name)
+        return inputs
+
+    def get_outputs(self) -> list[str]:
+        return self.split_names + self.aggregate_names
+
+    @staticmethod
+    def __string_key(data: Any) -> str:
+        json_data = json.dumps(data, sort_keys=True, ensure_ascii=True, separators=(',', ':'), indent=None, default=str)
+        return hashlib.sha256(json_data.encode('utf-8')).hexdigest()
+
+    def __item_key(self, in_index: int) -> str:
+        file_stats = []
+        for name in self.key_path_names:
+            path = self._get_previous_item(0, name, in_index)
+            if path and os.path.isfile(path):
+                stat = os.stat(path)
+                file_stats.append([path, stat.st_size, stat.st_mtime_ns])
+            else:
+                file_stats.append([path, None, None])
+
+        return self.__string_key([file_stats, self.key_data])
+
+    def __init_groups(self):
+        if self.__groups_initialized:
+            return
+
+        for in_index in range(self._get_previous_length(self.split_names[0])):
+            if self.group_enabled_in_name is not None \
+                    and not self._get_previous_item(0, self.group_enabled_in_name, in_index):
+                continue
+
+            group_key = self.__string_key(
+                [self._get_previous_item(0, name, in_index) for name in self.variations_group_in_name]
+            )
+
+            if group_key not in self.__group_in_indices:
+                self.__group_in_indices[group_key] = []
+                self.__group_item_keys[group_key] = []
+                self.__group_variations[group_key] = \
+                    max(1, int(self._get_previous_item(0, self.variations_in_name, in_index)))
+                self.__group_repeats[group_key] = \
+                    float(self._get_previous_item(0, self.repeats_in_name, in_index))
+
+            self.__group_in_indices[group_key].append(in_index)
+            self.__group_item_keys[group_key].append(self.__item_key(in_index))
+
+        for group_key, in_indices in self.__group_in_indices.items():
+            output_samples = int(round(len(in_indices) * self.__group_repeats[group_key]))
+            self.__group_output_samples[group_key] = output_samples
+            if output_samples > 0:
+                self.__output_group_keys.append(group_key)
+                self.__output_group_starts.append(self.__length)
+                self.__length += output_samples
+
+        self.__groups_initialized = True
+
+    def __get_input_index(self, variation: int, index: int) -> tuple[str, int, int]:
+        """
+        Maps an output index to the group key, the input variation and the index inside the group.
+        """
+        position = bisect.bisect_right(self.__output_group_starts, index) - 1
+        group_key = self.__output_group_keys[position]
+        group_size = len(self.__group_in_indices[group_key])
+
+        local_index = index - self.__output_group_starts[position] \
+                      + variation * self.__group_output_samples[group_key]
+        in_variation = (local_index // group_size) % self.__group_variations[group_key]
+
+        return group_key, in_variation, local_index % group_size
+
+    def __get_in_variations(self, group_key: str, variation: int) -> list[int]:
+        """
+        Returns all input variations of a group that are used in the given output variation.
+        """
+        group_size = len(self.__group_in_indices[group_key])
+        output_samples = self.__group_output_samples[group_key]
+        variations = self.__group_variations[group_key]
+
+        if output_samples == 0:
+            return []
+
+        first_pass = (variation * output_samples) // group_size
+        last_pass = ((variation + 1) * output_samples - 1) // group_size
+        return sorted({
+            in_pass % variations for in_pass in range(first_pass, min(last_pass, first_pass + variations - 1) + 1)
+        })
+
+    def __get_variation_dir(self, group_key: str, in_variation: int) -> str:
+        return os.path.join(self.cache_dir, group_key, f"variation-{in_variation}")
+
+    def __prune_stale_groups(self):
+        if self.__stale_groups_pruned or not os.path.isdir(self.cache_dir):
+            return
+
+        for group_key in os.listdir(self.cache_dir):
+            group_dir = os.path.join(self.cache_dir, group_key)
+            if not os.path.isdir(group_dir):
+                continue
+
+            if group_key not in self.__group_in_indices:
+                print(f"Removing stale cache group {group_dir}")
+                shutil.rmtree(group_dir)
+                continue
+
+            used_variation_dirs = [f"variation-{i}" for i in range(self.__group_variations[group_key])]
+            for variation_dir in os.listdir(group_dir):
+                if variation_dir not in used_variation_dirs:
+                    shutil.rmtree(os.path.join(group_dir, variation_dir))
+
+        self.__stale_groups_pruned = True
+
+    def __close_shards(self):
+        for shard in self.__shards.values():
+            shard.close()
+
+        self.__current_indices = {}
+        self.__shards = {}
+
+    def __encode_value(self, value: Any, key: str, shard: dict[str, Tensor]) -> tuple:
+        if isinstance(value, Tensor):
+            shard[key] = value.detach().cpu().clone().contiguous()
+            return 'tensor', key
+        elif isinstance(value, DiagonalGaussianDistribution):
+            shard[key] = value.parameters.detach().cpu().clone().contiguous()
+            return 'distribution', key
+        else:
+            return 'object', value
+
+    def __refresh_variation(self, group_key: str, in_variation: int, old_index: dict | None) -> tuple[int, int]:
+        """
+        Writes a new index for the variation, reusing all items of old_index that are still valid.
+
+        Returns the number of reused and encoded items.
+        """
+        variation_dir = self.__get_variation_dir(group_key, in_variation)
+        os.makedirs(variation_dir, exist_ok=True)
+
+        old_items = {}
+        shard_names = []
+        if old_index is not None:
+            shard_names = list(old_index['shards'])
+            for item_key, item, aggregate in zip(old_index.get('keys', []), old_index['items'], old_index['aggregate']):
+                old_items[item_key] = (item, aggregate)
+
+        item_keys = self.__group_item_keys[group_key]
+        in_indices = self.__group_in_indices[group_key]
+        missing_group_indices = [i for i, item_key in enumerate(item_keys) if item_key not in old_items]
+
+        new_items = {}
+        shard = {}
+        shard_bytes = 0
+        next_shard_number = len(shard_names)
+
+        def write_shard():
+            nonlocal next_shard_number
+            shard_name = f"shard-{next_shard_number:05d}.safetensors"
+            while shard_name in shard_names:
+                next_shard_number += 1
+                shard_name = f"shard-{next_shard_number:05d}.safetensors"
+            save_file(shard, os.path.join(variation_dir, shard_name))
+            shard_names.append(shard_name)
+
+        for module in self.planned_request_modules:
+            module.set_planned_requests(in_variation, [in_indices[i] for i in missing_group_indices])
+
+        for group_index in tqdm(missing_group_indices, desc='caching', smoothing=0.1):
+            in_index = in_indices[group_index]
+            item_key = item_keys[group_index]
+
+            item = {}
+            for name in self.split_names:
+                value = self._get_previous_item(in_variation, name, in_index)
+                value_type, data = self.__encode_value(value, f"{item_key}.{name}", shard)
+                if value_type in ['tensor', 'distribution']:
+                    item[name] = (value_type, len(shard_names), data)
+                    shard_bytes += shard[data].numel() * shard[data].element_size()
+                else:
+                    item[name] = (value_type, data)
+
+            aggregate = {name: self._get_previous_item(in_variation, name, in_index) for name in self.aggregate_names}
+            new_items[item_key] = (item, aggregate)
+
+            if shard_bytes >= self.shard_size:
+                write_shard()
+                shard = {}
+                shard_bytes = 0
+
+        if shard:
+            write_shard()
+
+        for module in self.planned_request_modules:
+            module.set_planned_requests(in_variation, None)
+
+        # collect all items in their current order, and drop shards that are no longer referenced
+        items = []
+        aggregates = []
+        used_shard_names = []
+        for item_key in item_keys:
+            item, aggregate = new_items[item_key] if item_key in new_items else old_items[item_key]
+
+            remapped_item = {}
+            for name, encoded in item.items():
+                if encoded[0] in ['tensor', 'distribution']:
+                    shard_name = shard_names[encoded[1]]
+                    if shard_name not in used_shard_names:
+                        used_shard_names.append(shard_name)
+                    encoded = (encoded[0], used_shard_names.index(shard_name), encoded[2])
+                remapped_item[name] = encoded
+
+            items.append(remapped_item)
+            aggregates.append(aggregate)
+
+        # the index is written last, a variation without an index is treated as missing
+        index_path = os.path.join(variation_dir, self.INDEX_FILE_NAME)
+        torch.save({
+            'shards': used_shard_names,
+            'keys': item_keys,
+            'items': items,
+            'aggregate': aggregates,
+        }, index_path + ".tmp")
+        os.replace(index_path + ".tmp", index_path)
+
+        for shard_name in shard_names:
+            if shard_name not in used_shard_names:
+                shard_path = os.path.join(variation_dir, shard_name)
+                if os.path.exists(shard_path):
+                    os.remove(shard_path)
+
+        return len(item_keys) - len(missing_group_indices), len(missing_group_indices)
+
+    def start(self, variation: int):
+        self.__init_groups()
+        self.__close_shards()
+        if self.prune_stale_groups:
+            self.__prune_stale_groups()
+
+        hits = 0
+        misses = 0
+        before_cache_called = False
+        for group_key in self.__output_group_keys:
+            for in_variation in self.__get_in_variations(group_key, variation):
+                variation_dir = self.__get_variation_dir(group_key, in_variation)
+                index_path = os.path.join(variation_dir, self.INDEX_FILE_NAME)
+
+                index = torch.load(index_path) if os.path.exists(index_path) else None
+
+                if index is not None and index.get('keys') == self.__group_item_keys[group_key]:
+                    hits += len(index['keys'])
+                else:
+                    if not before_cache_called and self.before_cache_fun is not None:
+                        self.before_cache_fun()
+                        before_cache_called = True
+
+                    group_hits, group_misses = self.__refresh_variation(group_key, in_variation, index)
+                    hits += group_hits
+                    misses += group_misses
+
+                    index = torch.load(index_path)
+
+                index['shards'] = [os.path.join(variation_dir, shard_name) for shard_name in index['shards']]
+                self.__current_indices[(group_key, in_variation)] = index
+
+        print(f"Cache {self.cache_dir}: {hits} items reused, {misses} items encoded")
+
+    def __get_shard(self, path: str) -> MemoryMappedSafetensors:
+        if path not in self.__shards:
+            self.__shards[path] = MemoryMappedSafetensors(path)
+        return self.__shards[path]
+
+    def __decode_value(self, index: dict, encoded: tuple) -> Any:
+        value_type = encoded[0]
+        if value_type == 'object':
+            return encoded[1]
+
+        shard_index, key = encoded[1], encoded[2]
+        tensor = self.__get_shard(index['shards'][shard_index]).get_tensor(key)
+        tensor = tensor.to(self.pipeline.device)
+
+        if value_type == 'distribution':
+            return DiagonalGaussianDistribution(tensor)
+        return tensor
+
+    def get_item(self, variation: int, index: int, requested_name: str = None) -> dict:
+        group_key, in_variation, group_index = self.__get_input_index(variation, index)
+        cache_index = self.__current_indices[(group_key, in_variation)]
+
+        item = {}
+
+        if requested_name in self.aggregate_names:
+            item[requested_name] = cache_index['aggregate'][group_index][requested_name]
+        else:
+            for name, encoded in cache_index['items'][group_index].items():
+                item[name] = self.__decode_value(cache_index, encoded)
+            item.update(cache_index['aggregate'][group_index])
+
+        return item
@@ -0,0 +1,37 @@
+import torch
+
+from modules.dataLoader.pipelineModules.BaseBatchedEncoder import BaseBatchedEncoder
+from modules.model.WuerstchenModel import WuerstchenEfficientNetEncoder
+
+
+class BatchedEncodeWuerstchenEffnet(BaseBatchedEncoder):
+    def __init__(
+            self,
+            in_name: str,
+            out_name: str,
+            effnet_encoder: WuerstchenEfficientNetEncoder,
+            batch_size: int,
+            autocast_contexts: list[torch.autocast | None] = None,
+            dtype: torch.dtype | None = None,
+    ):
+        super(BatchedEncodeWuerstchenEffnet, self).__init__(
+            in_names=[in_name],
+            out_names=[out_name],
+            batch_size=batch_size,
+            autocast_contexts=autocast_contexts,
+            dtype=dtype,
+        )
+        self.in_name = in_name
+        self.out_name = out_name
+        self.effnet_encoder = effnet_encoder
+
+    def _encode_batch(self, inputs: list[dict]) -> list[dict]:
+        image = torch.stack([item[self.in_name] for item in inputs])
+
+        if self.dtype:
+            image = image.to(device=self.effnet_encoder.device, dtype=self.dtype)
+
+        with self._all_contexts(self.autocast_contexts):
+            image_embeddings = self.effnet_encoder(image)
+
+        return [{self.out_name: image_embedding} for image_embedding in image_embeddings]
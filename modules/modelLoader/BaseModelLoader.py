@@ -8,6 +8,9 @@ from modules.util.enum.ModelType import ModelType
 
 class BaseModelLoader(metaclass=ABCMeta):
 
+    def __init__(self, lazy_loading: bool = False):
+        self.lazy_loading = lazy_loading
+
     @abstractmethod
     def load(
             self,
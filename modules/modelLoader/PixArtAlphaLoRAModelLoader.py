@@ -18,8 +18,8 @@ from modules.util.enum.ModelType import ModelType
 
 
 class PixArtAlphaLoRAModelLoader(BaseModelLoader, ModelLoaderModelSpecMixin, ModelLoaderLoRAMixin):
-    def __init__(self):
-        super(PixArtAlphaLoRAModelLoader, self).__init__()
+    def __init__(self, lazy_loading: bool = False):
+        super(PixArtAlphaLoRAModelLoader, self).__init__(lazy_loading)
 
     def _default_model_spec_name(
             self,
@@ -129,7 +129,7 @@ class PixArtAlphaLoRAModelLoader(BaseModelLoader, ModelLoaderModelSpecMixin, Mod
     ) -> PixArtAlphaModel | None:
         stacktraces = []
 
-        base_model_loader = PixArtAlphaModelLoader()
+        base_model_loader = PixArtAlphaModelLoader(self.lazy_loading)
 
         if model_names.base_model is not None:
             model = base_model_loader.load(model_type, model_names, weight_dtypes)
@@ -8,6 +8,7 @@ from transformers import T5Tokenizer, T5EncoderModel
 
 from modules.model.PixArtAlphaModel import PixArtAlphaModel
 from modules.modelLoader.BaseModelLoader import BaseModelLoader
+from modules.modelLoader.mixin.ModelLoaderLazyMixin import ModelLoaderLazyMixin
 from modules.modelLoader.mixin.ModelLoaderModelSpecMixin import ModelLoaderModelSpecMixin
 from modules.util.ModelNames import ModelNames
 from modules.util.ModelWeightDtypes import ModelWeightDtypes
@@ -15,9 +16,9 @@ from modules.util.TrainProgress import TrainProgress
 from modules.util.enum.ModelType import ModelType
 
 
-class PixArtAlphaModelLoader(BaseModelLoader, ModelLoaderModelSpecMixin):
-    def __init__(self):
-        super(PixArtAlphaModelLoader, self).__init__()
+class PixArtAlphaModelLoader(BaseModelLoader, ModelLoaderLazyMixin, ModelLoaderModelSpecMixin):
+    def __init__(self, lazy_loading: bool = False):
+        super(PixArtAlphaModelLoader, self).__init__(lazy_loading)
 
     def _default_model_spec_name(
             self,
@@ -90,7 +91,8 @@ class PixArtAlphaModelLoader(BaseModelLoader, ModelLoaderModelSpecMixin):
             subfolder="scheduler",
         )
 
-        text_encoder = T5EncoderModel.from_pretrained(
+        text_encoder = self._load_pretrained(
+            T5EncoderModel,
             base_model_name,
             subfolder="text_encoder",
             torch_dtype=weight_dtypes.text_encoder.torch_dtype(),
@@ -98,18 +100,21 @@ class PixArtAlphaModelLoader(BaseModelLoader, ModelLoaderModelSpecMixin):
         text_encoder.encoder.embed_tokens.to(dtype=weight_dtypes.text_encoder.torch_dtype(supports_fp8=False))
 
         if vae_model_name:
-            vae = AutoencoderKL.from_pretrained(
+            vae = self._load_pretrained(
+                AutoencoderKL,
                 vae_model_name,
                 torch_dtype=weight_dtypes.vae.torch_dtype(),
             )
         else:
-            vae = AutoencoderKL.from_pretrained(
+            vae = self._load_pretrained(
+                AutoencoderKL,
                 base_model_name,
                 subfolder="vae",
                 torch_dtype=weight_dtypes.vae.torch_dtype(),
             )
 
-        transformer = Transformer2DModel.from_pretrained(
+        transformer = self._load_pretrained(
+            Transformer2DModel,
             base_model_name,
             subfolder="transformer",
             torch_dtype=weight_dtypes.prior.torch_dtype(),
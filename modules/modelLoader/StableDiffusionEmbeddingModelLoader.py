@@ -16,8 +16,8 @@ from modules.util.enum.ModelType import ModelType
 
 
 class StableDiffusionEmbeddingModelLoader(BaseModelLoader, ModelLoaderModelSpecMixin):
-    def __init__(self):
-        super(StableDiffusionEmbeddingModelLoader, self).__init__()
+    def __init__(self, lazy_loading: bool = False):
+        super(StableDiffusionEmbeddingModelLoader, self).__init__(lazy_loading)
 
     def _default_model_spec_name(
             self,
@@ -131,7 +131,7 @@ class StableDiffusionEmbeddingModelLoader(BaseModelLoader, ModelLoaderModelSpecM
     ) -> StableDiffusionModel | None:
         stacktraces = []
 
-        base_model_loader = StableDiffusionModelLoader()
+        base_model_loader = StableDiffusionModelLoader(self.lazy_loading)
 
         if model_names.base_model is not None:
             model = base_model_loader.load(model_type, model_names, weight_dtypes)
@@ -18,8 +18,8 @@ from modules.util.enum.ModelType import ModelType
 
 
 class StableDiffusionLoRAModelLoader(BaseModelLoader, ModelLoaderModelSpecMixin, ModelLoaderLoRAMixin):
-    def __init__(self):
-        super(StableDiffusionLoRAModelLoader, self).__init__()
+    def __init__(self, lazy_loading: bool = False):
+        super(StableDiffusionLoRAModelLoader, self).__init__(lazy_loading)
 
     def _default_model_spec_name(
             self,
@@ -143,7 +143,7 @@ class StableDiffusionLoRAModelLoader(BaseModelLoader, ModelLoaderModelSpecMixin,
     ) -> StableDiffusionModel | None:
         stacktraces = []
 
-        base_model_loader = StableDiffusionModelLoader()
+        base_model_loader = StableDiffusionModelLoader(self.lazy_loading)
 
         if model_names.base_model is not None:
             model = base_model_loader.load(model_type, model_names, weight_dtypes)
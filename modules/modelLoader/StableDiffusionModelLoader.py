@@ -9,9 +9,10 @@ from transformers import CLIPTokenizer, CLIPTextModel, DPTImageProcessor, DPTFor
 
 from modules.model.StableDiffusionModel import StableDiffusionModel
 from modules.modelLoader.BaseModelLoader import BaseModelLoader
+from modules.modelLoader.mixin.ModelLoaderLazyMixin import ModelLoaderLazyMixin
 from modules.modelLoader.mixin.ModelLoaderModelSpecMixin import ModelLoaderModelSpecMixin
 from modules.modelLoader.mixin.ModelLoaderSDConfigMixin import ModelLoaderSDConfigMixin
-from modules.util import create
+from modules.util import create, safetensors_util
 from modules.util.ModelNames import ModelNames
 from modules.util.ModelWeightDtypes import ModelWeightDtypes
 from modules.util.TrainProgress import TrainProgress
@@ -19,9 +20,9 @@ from modules.util.enum.ModelType import ModelType
 from modules.util.enum.NoiseScheduler import NoiseScheduler
 
 
-class StableDiffusionModelLoader(BaseModelLoader, ModelLoaderModelSpecMixin, ModelLoaderSDConfigMixin):
-    def __init__(self):
-        super(StableDiffusionModelLoader, self).__init__()
+class StableDiffusionModelLoader(BaseModelLoader, ModelLoaderLazyMixin, ModelLoaderModelSpecMixin, ModelLoaderSDConfigMixin):
+    def __init__(self, lazy_loading: bool = False):
+        super(StableDiffusionModelLoader, self).__init__(lazy_loading)
 
     def _default_sd_config_name(
             self,
@@ -133,7 +134,8 @@ class StableDiffusionModelLoader(BaseModelLoader, ModelLoaderModelSpecMixin, Mod
             original_noise_scheduler=noise_scheduler,
         )
 
-        text_encoder = CLIPTextModel.from_pretrained(
+        text_encoder = self._load_pretrained(
+            CLIPTextModel,
             base_model_name,
             subfolder="text_encoder",
             torch_dtype=weight_dtypes.text_encoder.torch_dtype(),
@@ -141,18 +143,21 @@ class StableDiffusionModelLoader(BaseModelLoader, ModelLoaderModelSpecMixin, Mod
         text_encoder.text_model.embeddings.to(dtype=weight_dtypes.text_encoder.torch_dtype(supports_fp8=False))
 
         if vae_model_name:
-            vae = AutoencoderKL.from_pretrained(
+            vae = self._load_pretrained(
+                AutoencoderKL,
                 vae_model_name,
                 torch_dtype=weight_dtypes.vae.torch_dtype(),
             )
         else:
-            vae = AutoencoderKL.from_pretrained(
+            vae = self._load_pretrained(
+                AutoencoderKL,
                 base_model_name,
                 subfolder="vae",
                 torch_dtype=weight_dtypes.vae.torch_dtype(),
             )
 
-        unet = UNet2DConditionModel.from_pretrained(
+        unet = self._load_pretrained(
+            UNet2DConditionModel,
             base_model_name,
             subfolder="unet",
             torch_dtype=weight_dtypes.unet.torch_dtype(),
@@ -163,7 +168,8 @@ class StableDiffusionModelLoader(BaseModelLoader, ModelLoaderModelSpecMixin, Mod
             subfolder="feature_extractor",
         ) if model_type.has_depth_input() else None
 
-        depth_estimator = DPTForDepthEstimation.from_pretrained(
+        depth_estimator = self._load_pretrained(
+            DPTForDepthEstimation,
             base_model_name,
             subfolder="depth_estimator",
             torch_dtype=weight_dtypes.unet.torch_dtype(),  # TODO: use depth estimator dtype
@@ -232,7 +238,8 @@ class StableDiffusionModelLoader(BaseModelLoader, ModelLoaderModelSpecMixin, Mod
         )
 
         if vae_model_name:
-            pipeline.vae = AutoencoderKL.from_pretrained(
+            pipeline.vae = self._load_pretrained(
+                AutoencoderKL,
                 vae_model_name,
                 torch_dtype=weight_dtypes.vae.torch_dtype(),
             )
@@ -274,12 +281,13 @@ class StableDiffusionModelLoader(BaseModelLoader, ModelLoaderModelSpecMixin, Mod
         if model_type.has_conditioning_image_input():
             num_in_channels += 4
 
+        state_dict = safetensors_util.load_file_parallel(base_model_name)
+
         pipeline = download_from_original_stable_diffusion_ckpt(
-            checkpoint_path_or_dict=base_model_name,
+            checkpoint_path_or_dict=state_dict,
             original_config_file=sd_config_name,
             num_in_channels=num_in_channels,
             load_safety_checker=False,
-            from_safetensors=True,
         )
 
         noise_scheduler = create.create_noise_scheduler(
@@ -288,7 +296,8 @@ class StableDiffusionModelLoader(BaseModelLoader, ModelLoaderModelSpecMixin, Mod
         )
 
         if vae_model_name:
-            pipeline.vae = AutoencoderKL.from_pretrained(
+            pipeline.vae = self._load_pretrained(
+                AutoencoderKL,
                 vae_model_name,
                 torch_dtype=weight_dtypes.vae.torch_dtype(),
             )
@@ -16,8 +16,8 @@ from modules.util.enum.ModelType import ModelType
 
 
 class StableDiffusionXLEmbeddingModelLoader(BaseModelLoader, ModelLoaderModelSpecMixin):
-    def __init__(self):
-        super(StableDiffusionXLEmbeddingModelLoader, self).__init__()
+    def __init__(self, lazy_loading: bool = False):
+        super(StableDiffusionXLEmbeddingModelLoader, self).__init__(lazy_loading)
 
     def _default_model_spec_name(
             self,
@@ -124,7 +124,7 @@ class StableDiffusionXLEmbeddingModelLoader(BaseModelLoader, ModelLoaderModelSpe
     ) -> StableDiffusionXLModel | None:
         stacktraces = []
 
-        base_model_loader = StableDiffusionXLModelLoader()
+        base_model_loader = StableDiffusionXLModelLoader(self.lazy_loading)
 
         if model_names.base_model is not None:
             model = base_model_loader.load(model_type, model_names, weight_dtypes)
@@ -18,8 +18,8 @@ from modules.util.enum.ModelType import ModelType
 
 
 class StableDiffusionXLLoRAModelLoader(BaseModelLoader, ModelLoaderModelSpecMixin, ModelLoaderLoRAMixin):
-    def __init__(self):
-        super(StableDiffusionXLLoRAModelLoader, self).__init__()
+    def __init__(self, lazy_loading: bool = False):
+        super(StableDiffusionXLLoRAModelLoader, self).__init__(lazy_loading)
 
     def __init_lora(
             self,
@@ -132,7 +132,7 @@ class StableDiffusionXLLoRAModelLoader(BaseModelLoader, ModelLoaderModelSpecMixi
     ) -> StableDiffusionXLModel | None:
         stacktraces = []
 
-        base_model_loader = StableDiffusionXLModelLoader()
+        base_model_loader = StableDiffusionXLModelLoader(self.lazy_loading)
 
         if model_names.base_model is not None:
             model = base_model_loader.load(model_type, model_names, weight_dtypes)
@@ -4,13 +4,15 @@ import traceback
 
 import torch
 from diffusers import AutoencoderKL, UNet2DConditionModel, DDIMScheduler, StableDiffusionXLPipeline
+from diffusers.pipelines.stable_diffusion.convert_from_ckpt import download_from_original_stable_diffusion_ckpt
 from transformers import CLIPTokenizer, CLIPTextModel, CLIPTextModelWithProjection
 
 from modules.model.StableDiffusionXLModel import StableDiffusionXLModel
 from modules.modelLoader.BaseModelLoader import BaseModelLoader
+from modules.modelLoader.mixin.ModelLoaderLazyMixin import ModelLoaderLazyMixin
 from modules.modelLoader.mixin.ModelLoaderModelSpecMixin import ModelLoaderModelSpecMixin
 from modules.modelLoader.mixin.ModelLoaderSDConfigMixin import ModelLoaderSDConfigMixin
-from modules.util import create
+from modules.util import create, safetensors_util
 from modules.util.ModelNames import ModelNames
 from modules.util.ModelWeightDtypes import ModelWeightDtypes
 from modules.util.TrainProgress import TrainProgress
@@ -18,9 +20,9 @@ from modules.util.enum.ModelType import ModelType
 from modules.util.enum.NoiseScheduler import NoiseScheduler
 
 
-class StableDiffusionXLModelLoader(BaseModelLoader, ModelLoaderModelSpecMixin, ModelLoaderSDConfigMixin):
-    def __init__(self):
-        super(StableDiffusionXLModelLoader, self).__init__()
+class StableDiffusionXLModelLoader(BaseModelLoader, ModelLoaderLazyMixin, ModelLoaderModelSpecMixin, ModelLoaderSDConfigMixin):
+    def __init__(self, lazy_loading: bool = False):
+        super(StableDiffusionXLModelLoader, self).__init__(lazy_loading)
 
     def _default_sd_config_name(
             self,
@@ -113,14 +115,16 @@ class StableDiffusionXLModelLoader(BaseModelLoader, ModelLoaderModelSpecMixin, M
             original_noise_scheduler=noise_scheduler,
         )
 
-        text_encoder_1 = CLIPTextModel.from_pretrained(
+        text_encoder_1 = self._load_pretrained(
+            CLIPTextModel,
             base_model_name,
             subfolder="text_encoder",
             torch_dtype=weight_dtypes.text_encoder.torch_dtype(),
         )
         text_encoder_1.text_model.embeddings.to(dtype=weight_dtypes.text_encoder.torch_dtype(supports_fp8=False))
 
-        text_encoder_2 = CLIPTextModelWithProjection.from_pretrained(
+        text_encoder_2 = self._load_pretrained(
+            CLIPTextModelWithProjection,
             base_model_name,
             subfolder="text_encoder_2",
             torch_dtype=weight_dtypes.text_encoder_2.torch_dtype(),
@@ -128,18 +132,21 @@ class StableDiffusionXLModelLoader(BaseModelLoader, ModelLoaderModelSpecMixin, M
         text_encoder_2.text_model.embeddings.to(dtype=weight_dtypes.text_encoder.torch_dtype(supports_fp8=False))
 
         if vae_model_name:
-            vae = AutoencoderKL.from_pretrained(
+            vae = self._load_pretrained(
+                AutoencoderKL,
                 vae_model_name,
                 torch_dtype=weight_dtypes.vae.torch_dtype(),
             )
         else:
-            vae = AutoencoderKL.from_pretrained(
+            vae = self._load_pretrained(
+                AutoencoderKL,
                 base_model_name,
                 subfolder="vae",
                 torch_dtype=weight_dtypes.vae.torch_dtype(),
             )
 
-        unet = UNet2DConditionModel.from_pretrained(
+        unet = self._load_pretrained(
+            UNet2DConditionModel,
             base_model_name,
             subfolder="unet",
             torch_dtype=weight_dtypes.unet.torch_dtype(),
@@ -183,7 +190,8 @@ class StableDiffusionXLModelLoader(BaseModelLoader, ModelLoaderModelSpecMixin, M
         )
 
         if vae_model_name:
-            pipeline.vae = AutoencoderKL.from_pretrained(
+            pipeline.vae = self._load_pretrained(
+                AutoencoderKL,
                 vae_model_name,
                 torch_dtype=weight_dtypes.vae.torch_dtype(),
             )
@@ -221,12 +229,21 @@ class StableDiffusionXLModelLoader(BaseModelLoader, ModelLoaderModelSpecMixin, M
     ) -> StableDiffusionXLModel | None:
         sd_config_name = self._get_sd_config_name(model_type, base_model_name)
 
-        pipeline = StableDiffusionXLPipeline.from_single_file(
-            pretrained_model_link_or_path=base_model_name,
+        state_dict = safetensors_util.load_file_parallel(base_model_name)
+
+        # StableDiffusionXLPipeline.from_single_file only accepts a path. It calls this function with the same
+        # arguments, its defaults are repeated here, so both create identical components. from_safetensors only
+        # selects how a path is read, and has no effect on a state dict.
+        pipeline = download_from_original_stable_diffusion_ckpt(
+            checkpoint_path_or_dict=state_dict,
             original_config_file=sd_config_name,
+            pipeline_class=StableDiffusionXLPipeline,
+            from_safetensors=True,
+            extract_ema=False,
+            scheduler_type="pndm",
             load_safety_checker=False,
-            use_safetensors=True,
         )
+        del state_dict
 
         noise_scheduler = create.create_noise_scheduler(
             noise_scheduler=NoiseScheduler.DDIM,
@@ -234,7 +251,8 @@ class StableDiffusionXLModelLoader(BaseModelLoader, ModelLoaderModelSpecMixin, M
         )
 
         if vae_model_name:
-            pipeline.vae = AutoencoderKL.from_pretrained(
+            pipeline.vae = self._load_pretrained(
+                AutoencoderKL,
                 vae_model_name,
                 torch_dtype=weight_dtypes.vae.torch_dtype(),
             )
@@ -16,8 +16,8 @@ from modules.util.enum.ModelType import ModelType
 
 
 class WuerstchenEmbeddingModelLoader(BaseModelLoader, ModelLoaderModelSpecMixin):
-    def __init__(self):
-        super(WuerstchenEmbeddingModelLoader, self).__init__()
+    def __init__(self, lazy_loading: bool = False):
+        super(WuerstchenEmbeddingModelLoader, self).__init__(lazy_loading)
 
     def _default_model_spec_name(
             self,
@@ -119,7 +119,7 @@ class WuerstchenEmbeddingModelLoader(BaseModelLoader, ModelLoaderModelSpecMixin)
     ) -> WuerstchenModel | None:
         stacktraces = []
 
-        base_model_loader = WuerstchenModelLoader()
+        base_model_loader = WuerstchenModelLoader(self.lazy_loading)
 
         if model_names.base_model is not None:
             model = base_model_loader.load(model_type, model_names, weight_dtypes)
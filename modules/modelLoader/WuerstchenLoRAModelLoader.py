@@ -21,8 +21,8 @@ from modules.util.modelSpec.ModelSpec import ModelSpec
 
 
 class WuerstchenLoRAModelLoader(BaseModelLoader, ModelLoaderModelSpecMixin, ModelLoaderLoRAMixin):
-    def __init__(self):
-        super(WuerstchenLoRAModelLoader, self).__init__()
+    def __init__(self, lazy_loading: bool = False):
+        super(WuerstchenLoRAModelLoader, self).__init__(lazy_loading)
 
     def __init_lora(
             self,
@@ -137,7 +137,7 @@ class WuerstchenLoRAModelLoader(BaseModelLoader, ModelLoaderModelSpecMixin, Mode
     ) -> WuerstchenModel | None:
         stacktraces = []
 
-        base_model_loader = WuerstchenModelLoader()
+        base_model_loader = WuerstchenModelLoader(self.lazy_loading)
 
         if model_names.base_model is not None:
             model = base_model_loader.load(model_type, model_names, weight_dtypes)
@@ -12,6 +12,7 @@ from transformers import CLIPTokenizer, CLIPTextModel, CLIPTextModelWithProjecti
 
 from modules.model.WuerstchenModel import WuerstchenModel, WuerstchenEfficientNetEncoder
 from modules.modelLoader.BaseModelLoader import BaseModelLoader
+from modules.modelLoader.mixin.ModelLoaderLazyMixin import ModelLoaderLazyMixin
 from modules.modelLoader.mixin.ModelLoaderModelSpecMixin import ModelLoaderModelSpecMixin
 from modules.util.ModelNames import ModelNames
 from modules.util.ModelWeightDtypes import ModelWeightDtypes
@@ -20,9 +21,9 @@ from modules.util.convert.convert_stable_cascade_ckpt_to_diffusers import conver
 from modules.util.enum.ModelType import ModelType
 
 
-class WuerstchenModelLoader(BaseModelLoader, ModelLoaderModelSpecMixin):
-    def __init__(self):
-        super(WuerstchenModelLoader, self).__init__()
+class WuerstchenModelLoader(BaseModelLoader, ModelLoaderLazyMixin, ModelLoaderModelSpecMixin):
+    def __init__(self, lazy_loading: bool = False):
+        super(WuerstchenModelLoader, self).__init__(lazy_loading)
 
     def _default_model_spec_name(
             self,
@@ -107,7 +108,8 @@ class WuerstchenModelLoader(BaseModelLoader, ModelLoaderModelSpecMixin):
         )
 
         if model_type.is_wuerstchen_v2():
-            decoder_text_encoder = CLIPTextModel.from_pretrained(
+            decoder_text_encoder = self._load_pretrained(
+                CLIPTextModel,
                 decoder_model_name,
                 subfolder="text_encoder",
                 torch_dtype=weight_dtypes.decoder_text_encoder.torch_dtype(),
@@ -118,26 +120,30 @@ class WuerstchenModelLoader(BaseModelLoader, ModelLoaderModelSpecMixin):
             decoder_text_encoder = None
 
         if model_type.is_wuerstchen_v2():
-            decoder_decoder = WuerstchenDiffNeXt.from_pretrained(
+            decoder_decoder = self._load_pretrained(
+                WuerstchenDiffNeXt,
                 decoder_model_name,
                 subfolder="decoder",
                 torch_dtype=weight_dtypes.decoder.torch_dtype(),
             )
         elif model_type.is_stable_cascade():
-            decoder_decoder = StableCascadeUnet.from_pretrained(
+            decoder_decoder = self._load_pretrained(
+                StableCascadeUnet,
                 decoder_model_name,
                 subfolder="decoder",
                 torch_dtype=weight_dtypes.decoder.torch_dtype(),
             )
 
-        decoder_vqgan = PaellaVQModel.from_pretrained(
+        decoder_vqgan = self._load_pretrained(
+            PaellaVQModel,
             decoder_model_name,
             subfolder="vqgan",
             torch_dtype=weight_dtypes.decoder_vqgan.torch_dtype(),
         )
 
         if model_type.is_wuerstchen_v2():
-            effnet_encoder = WuerstchenEfficientNetEncoder.from_pretrained(
+            effnet_encoder = self._load_pretrained(
+                WuerstchenEfficientNetEncoder,
                 effnet_encoder_model_name,
                 torch_dtype=weight_dtypes.effnet_encoder.torch_dtype(),
             )
@@ -148,7 +154,8 @@ class WuerstchenModelLoader(BaseModelLoader, ModelLoaderModelSpecMixin):
             effnet_encoder.to(dtype=weight_dtypes.effnet_encoder.torch_dtype())
 
         if model_type.is_wuerstchen_v2():
-            prior_prior = WuerstchenPrior.from_pretrained(
+            prior_prior = self._load_pretrained(
+                WuerstchenPrior,
                 prior_model_name,
                 subfolder="prior",
                 torch_dtype=weight_dtypes.prior.torch_dtype(),
@@ -166,7 +173,8 @@ class WuerstchenModelLoader(BaseModelLoader, ModelLoaderModelSpecMixin):
                 prior_prior.load_state_dict(convert_stable_cascade_ckpt_to_diffusers(load_file(prior_prior_model_name)))
                 prior_prior.to(dtype=weight_dtypes.prior.torch_dtype())
             else:
-                prior_prior = StableCascadeUnet.from_pretrained(
+                prior_prior = self._load_pretrained(
+                    StableCascadeUnet,
                     prior_model_name,
                     subfolder="prior",
                     torch_dtype=weight_dtypes.prior.torch_dtype(),
@@ -178,14 +186,16 @@ class WuerstchenModelLoader(BaseModelLoader, ModelLoaderModelSpecMixin):
         )
 
         if model_type.is_wuerstchen_v2():
-            prior_text_encoder = CLIPTextModel.from_pretrained(
+            prior_text_encoder = self._load_pretrained(
+                CLIPTextModel,
                 prior_model_name,
                 subfolder="text_encoder",
                 torch_dtype=weight_dtypes.text_encoder.torch_dtype(),
             )
             prior_text_encoder.text_model.embeddings.to(dtype=weight_dtypes.text_encoder.torch_dtype(False))
         elif model_type.is_stable_cascade():
-            prior_text_encoder = CLIPTextModelWithProjection.from_pretrained(
+            prior_text_encoder = self._load_pretrained(
+                CLIPTextModelWithProjection,
                 prior_model_name,
                 subfolder="text_encoder",
                 torch_dtype=weight_dtypes.text_encoder.torch_dtype(),
@@ -0,0 +1,94 @@
+import os
+from abc import ABCMeta
+
+import torch
+from accelerate import init_empty_weights
+from diffusers import ModelMixin
+from transformers import PreTrainedModel
+
+from modules.util.safetensors_util import MemoryMappedSafetensors
+
+
+class ModelLoaderLazyMixin(metaclass=ABCMeta):
+    __WEIGHTS_FILE_NAMES = [
+        "diffusion_pytorch_model.safetensors",
+        "model.safetensors",
+    ]
+
+    def __load_memory_mapped(
+            self,
+            module_class: type,
+            directory: str,
+            torch_dtype: torch.dtype | None,
+    ) -> torch.nn.Module | None:
+        weights_path = None
+        for file_name in self.__WEIGHTS_FILE_NAMES:
+            if os.path.isfile(os.path.join(directory, file_name)):
+                weights_path = os.path.join(directory, file_name)
+                break
+        if weights_path is None:
+            # sharded or non-safetensors weights
+            return None
+
+        if issubclass(module_class, PreTrainedModel):
+            if module_class._keep_in_fp32_modules:
+                # these need the dtype handling of from_pretrained
+                return None
+            config = module_class.config_class.from_pretrained(directory)
+            with init_empty_weights():
+                module = module_class(config)
+        elif issubclass(module_class, ModelMixin):
+            config = module_class.load_config(directory)
+            with init_empty_weights():
+                module = module_class.from_config(config)
+        else:
+            return None
+
+        # the mapping is kept open by the returned tensors, it is closed when the module is deleted
+        weights = MemoryMappedSafetensors(weights_path)
+        state_dict = {}
+        for key in weights.keys():
+            tensor = weights.get_tensor(key)
+            if torch_dtype is not None and tensor.is_floating_point() and tensor.dtype != torch_dtype:
+                tensor = tensor.to(dtype=torch_dtype)
+            state_dict[key] = tensor
+
+        module.load_state_dict(state_dict, strict=False, assign=True)
+
+        if any(tensor.is_meta for tensor in module.state_dict().values()):
+            # renamed or missing keys, only from_pretrained knows how to convert them
+            return None
+
+        if isinstance(module, PreTrainedModel):
+            module.tie_weights()
+        module.eval()
+
+        return module
+
+    def _load_pretrained(
+            self,
+            module_class: type,
+            model_name: str,
+            subfolder: str | None = None,
+            torch_dtype: torch.dtype | None = None,
+    ):
+        """
+        Loads a model component like from_pretrained.
+
+        With lazy loading enabled, local safetensors weights are memory mapped instead of read into memory. The
+        parameters are views into the file, data is only read when a tensor is used or moved to another device.
+        Moving a component to the train device copies its weights directly from the file to that device, and
+        components that are never used (like the vae in runs with cached latents) are never read. Weights stored in a
+        different dtype are converted while loading, this needs the same memory as a normal load.
+        """
+        if self.lazy_loading:
+            directory = os.path.join(model_name, subfolder) if subfolder else model_name
+            if os.path.isdir(directory):
+                module = self.__load_memory_mapped(module_class, directory, torch_dtype)
+                if module is not None:
+                    return module
+
+        if subfolder:
+            return module_class.from_pretrained(model_name, subfolder=subfolder, torch_dtype=torch_dtype)
+        else:
+            return module_class.from_pretrained(model_name, torch_dtype=torch_dtype)
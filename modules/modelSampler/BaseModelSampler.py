@@ -1,8 +1,11 @@
+import os
 from abc import ABCMeta, abstractmethod
+from pathlib import Path
 from typing import Callable
 
 import torch
 from PIL.Image import Image
+from torch import Tensor
 
 from modules.util.enum.ImageFormat import ImageFormat
 from modules.util.config.SampleConfig import SampleConfig
@@ -32,3 +35,114 @@ class BaseModelSampler(metaclass=ABCMeta):
             on_update_progress: Callable[[int, int], None] = lambda _, __: None,
     ):
         pass
+
+    def sample_batch(
+            self,
+            sample_params_list: list[SampleConfig],
+            destinations: list[str],
+            image_format: ImageFormat,
+            text_encoder_layer_skip: int,
+            force_last_timestep: bool = False,
+            batch_size: int = 1,
+            on_sample: Callable[[int, Image], None] = lambda _, __: None,
+            on_update_progress: Callable[[int, int], None] = lambda _, __: None,
+    ):
+        """
+        Samples a list of sample configs. on_sample receives the index of the sample config and the image.
+
+        The default implementation samples one config at a time. Samplers that support batching denoise up to
+        batch_size configs with the same resolution, step count and noise scheduler together.
+        """
+        for index, (sample_params, destination) in enumerate(zip(sample_params_list, destinations)):
+            self.sample(
+                sample_params=sample_params,
+                destination=destination,
+                image_format=image_format,
+                text_encoder_layer_skip=text_encoder_layer_skip,
+                force_last_timestep=force_last_timestep,
+                on_sample=lambda image, index=index: on_sample(index, image),
+                on_update_progress=on_update_progress,
+            )
+
+    @staticmethod
+    def _group_sample_params(
+            sample_params_list: list[SampleConfig],
+            batch_size: int,
+    ) -> list[list[int]]:
+        """
+        Groups the indices of all sample configs that can be denoised in the same batch.
+        Each group contains at most batch_size indices.
+        """
+        groups = {}
+        for index, sample_params in enumerate(sample_params_list):
+            key = (
+                sample_params.height,
+                sample_params.width,
+                sample_params.diffusion_steps,
+                sample_params.noise_scheduler,
+            )
+            groups.setdefault(key, []).append(index)
+
+        batch_size = max(1, batch_size)
+        batches = []
+        for indices in groups.values():
+            for start in range(0, len(indices), batch_size):
+                batches.append(indices[start:start + batch_size])
+        return batches
+
+    def _create_generator(self, sample_params: SampleConfig) -> torch.Generator:
+        generator = torch.Generator(device=self.train_device)
+        if sample_params.random_seed:
+            generator.seed()
+        else:
+            generator.manual_seed(sample_params.seed)
+        return generator
+
+    def _create_noise(
+            self,
+            size: tuple[int, ...],
+            generators: list[torch.Generator],
+            dtype: torch.dtype,
+    ) -> Tensor:
+        # every sample uses its own generator, so the result doesn't depend on the other samples of the batch
+        return torch.cat([
+            torch.randn(size=(1, *size), generator=generator, device=self.train_device, dtype=dtype)
+            for generator in generators
+        ])
+
+    def _cfg_scale_tensor(self, sample_params_list: list[SampleConfig], dtype: torch.dtype) -> Tensor:
+        return torch.tensor(
+            [sample_params.cfg_scale for sample_params in sample_params_list],
+            dtype=dtype,
+            device=self.train_device,
+        ).reshape(-1, 1, 1, 1)
+
+    @staticmethod
+    def _apply_cfg(
+            noise_pred: Tensor,
+            cfg_scale: Tensor,
+            cfg_rescale: float,
+    ) -> Tensor:
+        noise_pred_negative, noise_pred_positive = noise_pred.chunk(2)
+        noise_pred = noise_pred_negative + cfg_scale * (noise_pred_positive - noise_pred_negative)
+
+        if cfg_rescale > 0.0:
+            # From: Common Diffusion Noise Schedules and Sample Steps are Flawed (https://arxiv.org/abs/2305.08891)
+            std_positive = noise_pred_positive.std(dim=list(range(1, noise_pred_positive.ndim)), keepdim=True)
+            std_pred = noise_pred.std(dim=list(range(1, noise_pred.ndim)), keepdim=True)
+            noise_pred_rescaled = noise_pred * (std_positive / std_pred)
+            noise_pred = (
+                    cfg_rescale * noise_pred_rescaled + (1 - cfg_rescale) * noise_pred
+            )
+
+        return noise_pred
+
+    @staticmethod
+    def _step_generator(generators: list[torch.Generator]) -> torch.Generator | list[torch.Generator]:
+        # schedulers accept a list with one generator per sample
+        return generators[0] if len(generators) == 1 else generators
+
+    @staticmethod
+    def _save_image(image: Image, destination: str, image_format: ImageFormat):
+        os.makedirs(Path(destination).parent.absolute(), exist_ok=True)
+        image.save(destination, format=image_format.pil_format())
@@ -1,10 +1,9 @@
 import inspect
-import os
-from pathlib import Path
 from typing import Callable
 
 import torch
 from PIL.Image import Image
+from torch import Tensor
 from tqdm import tqdm
 
 from modules.model.StableDiffusionModel import StableDiffusionModel
@@ -12,7 +11,7 @@ from modules.modelSampler.BaseModelSampler import BaseModelSampler
 from modules.util import create
 from modules.util.enum.ImageFormat import ImageFormat
 from modules.util.enum.ModelType import ModelType
-from modules.util.enum.NoiseScheduler import NoiseScheduler
+from modules.util.PromptEmbeddingCache import PromptEmbeddingCache
 from modules.util.config.SampleConfig import SampleConfig
 from modules.util.torch_util import torch_gc
 
@@ -30,353 +29,247 @@ class StableDiffusionSampler(BaseModelSampler):
         self.model = model
         self.model_type = model_type
         self.pipeline = model.create_pipeline()
+        self.__prompt_cache = PromptEmbeddingCache(temp_device)
 
-    @torch.no_grad()
-    def __sample_base(
-            self,
-            prompt: str,
-            negative_prompt: str,
-            height: int,
-            width: int,
-            seed: int,
-            random_seed: bool,
-            diffusion_steps: int,
-            cfg_scale: float,
-            noise_scheduler: NoiseScheduler,
-            cfg_rescale: float = 0.7,
-            text_encoder_layer_skip: int = 0,
-            force_last_timestep: bool = False,
-            on_update_progress: Callable[[int, int], None] = lambda _, __: None,
-    ) -> Image:
-        with self.model.autocast_context:
-            generator = torch.Generator(device=self.train_device)
-            if random_seed:
-                generator.seed()
-            else:
-                generator.manual_seed(seed)
-
-            tokenizer = self.pipeline.tokenizer
-            text_encoder = self.pipeline.text_encoder
-            noise_scheduler = create.create_noise_scheduler(noise_scheduler, self.pipeline.scheduler, diffusion_steps)
-            image_processor = self.pipeline.image_processor
-            unet = self.pipeline.unet
-            vae = self.pipeline.vae
-            vae_scale_factor = self.pipeline.vae_scale_factor
-
-            # prepare prompt
-            self.model.text_encoder_to(self.train_device)
-            tokenizer_output = tokenizer(
-                prompt,
-                padding='max_length',
-                truncation=True,
-                max_length=tokenizer.model_max_length,
-                return_tensors="pt",
-            )
-            tokens = tokenizer_output.input_ids.to(self.train_device)
-            if hasattr(text_encoder.config, "use_attention_mask") and text_encoder.config.use_attention_mask:
-                tokens_attention_mask = tokenizer_output.attention_mask.to(self.train_device)
-            else:
-                tokens_attention_mask = None
-
-            negative_tokenizer_output = tokenizer(
-                negative_prompt,
-                padding='max_length',
-                truncation=True,
-                max_length=tokenizer.model_max_length,
-                return_tensors="pt",
-            )
-            negative_tokens = negative_tokenizer_output.input_ids.to(self.train_device)
-            if hasattr(text_encoder.config, "use_attention_mask") and text_encoder.config.use_attention_mask:
-                negative_tokens_attention_mask = negative_tokenizer_output.attention_mask.to(self.train_device)
-            else:
-                negative_tokens_attention_mask = None
-
-            text_encoder_output = text_encoder(
-                tokens,
-                attention_mask=tokens_attention_mask,
-                return_dict=True,
-                output_hidden_states=True,
-            )
-            final_layer_norm = text_encoder.text_model.final_layer_norm
-            prompt_embedding = final_layer_norm(
-                text_encoder_output.hidden_states[-(1 + text_encoder_layer_skip)]
-            )
-
-            text_encoder_output = text_encoder(
-                negative_tokens,
-                attention_mask=negative_tokens_attention_mask,
-                return_dict=True,
-                output_hidden_states=True,
-            )
-            final_layer_norm = text_encoder.text_model.final_layer_norm
-            negative_prompt_embedding = final_layer_norm(
-                text_encoder_output.hidden_states[-(1 + text_encoder_layer_skip)]
-            )
-
-            combined_prompt_embedding = torch.cat([negative_prompt_embedding, prompt_embedding])
-
-            self.model.text_encoder_to(self.temp_device)
-            torch_gc()
-
-            # prepare timesteps
-            noise_scheduler.set_timesteps(diffusion_steps, device=self.train_device)
-            timesteps = noise_scheduler.timesteps
-
-            if force_last_timestep:
-                last_timestep = torch.ones(1, device=self.train_device, dtype=torch.int64) \
-                                * (noise_scheduler.config.num_train_timesteps - 1)
-
-                # add the final timestep to force predicting with zero snr
-                timesteps = torch.cat([last_timestep, timesteps])
+    def __prepare_prompt(self, prompt: str) -> str:
+        if len(self.model.embeddings) > 0:
+            embedding_string = ''.join(self.model.embeddings[0].text_tokens)
+            prompt = prompt.replace("<embedding>", embedding_string)
+        return prompt
 
-            # prepare latent image
+    def __encode_prompts(
+            self,
+            prompts: list[str],
+            text_encoder_layer_skip: int,
+    ) -> Tensor:
+        tokenizer = self.pipeline.tokenizer
+        text_encoder = self.pipeline.text_encoder
+
+        tokenizer_output = tokenizer(
+            prompts,
+            padding='max_length',
+            truncation=True,
+            max_length=tokenizer.model_max_length,
+            return_tensors="pt",
+        )
+        tokens = tokenizer_output.input_ids.to(self.train_device)
+        if hasattr(text_encoder.config, "use_attention_mask") and text_encoder.config.use_attention_mask:
+            tokens_attention_mask = tokenizer_output.attention_mask.to(self.train_device)
+        else:
+            tokens_attention_mask = None
+
+        text_encoder_output = text_encoder(
+            tokens,
+            attention_mask=tokens_attention_mask,
+            return_dict=True,
+            output_hidden_states=True,
+        )
+        final_layer_norm = text_encoder.text_model.final_layer_norm
+        return final_layer_norm(
+            text_encoder_output.hidden_states[-(1 + text_encoder_layer_skip)]
+        )
+
+    def __encode_missing_prompts(
+            self,
+            prompts: list[str],
+            text_encoder_layer_skip: int,
+    ) -> tuple[Tensor]:
+        self.model.text_encoder_to(self.train_device)
+        prompt_embedding = self.__encode_prompts(prompts, text_encoder_layer_skip)
+        self.model.text_encoder_to(self.temp_device)
+        torch_gc()
+
+        return (prompt_embedding,)
+
+    def __encode_conditioning_image(self, height: int, width: int) -> tuple[Tensor, Tensor]:
+        vae = self.pipeline.vae
+
+        conditioning_image = torch.zeros(
+            (1, 3, height, width),
+            dtype=self.model.train_dtype.torch_dtype(),
+            device=self.train_device,
+        )
+        latent_conditioning_image = vae.encode(conditioning_image).latent_dist.mode() * vae.config.scaling_factor
+        latent_mask = torch.ones(
+            size=(1, 1, latent_conditioning_image.shape[2], latent_conditioning_image.shape[3]),
+            dtype=self.model.train_dtype.torch_dtype(),
+            device=self.train_device
+        )
+        return latent_conditioning_image, latent_mask
+
+    def __denoise(
+            self,
+            sample_params_list: list[SampleConfig],
+            generators: list[torch.Generator],
+            prompt_embedding: Tensor,
+            negative_prompt_embedding: Tensor,
+            conditioning: tuple[Tensor, Tensor] | None,
+            cfg_rescale: float,
+            force_last_timestep: bool,
+            on_update_progress: Callable[[int, int], None],
+    ) -> Tensor:
+        sample_params = sample_params_list[0]
+        height = sample_params.height
+        width = sample_params.width
+        diffusion_steps = sample_params.diffusion_steps
+
+        noise_scheduler = create.create_noise_scheduler(
+            sample_params.noise_scheduler, self.pipeline.scheduler, diffusion_steps
+        )
+        unet = self.pipeline.unet
+        vae_scale_factor = self.pipeline.vae_scale_factor
+
+        combined_prompt_embedding = torch.cat([negative_prompt_embedding, prompt_embedding])
+
+        # prepare timesteps
+        noise_scheduler.set_timesteps(diffusion_steps, device=self.train_device)
+        timesteps = noise_scheduler.timesteps
+
+        if force_last_timestep:
+            last_timestep = torch.ones(1, device=self.train_device, dtype=torch.int64) \
+                            * (noise_scheduler.config.num_train_timesteps - 1)
+
+            # add the final timestep to force predicting with zero snr
+            timesteps = torch.cat([last_timestep, timesteps])
+
+        # prepare latent image
+        if conditioning is not None:
+            latent_conditioning_image, latent_mask = conditioning
+            batch_size = len(sample_params_list)
+            latent_conditioning_image = latent_conditioning_image.expand(batch_size, -1, -1, -1)
+            latent_mask = latent_mask.expand(batch_size, -1, -1, -1)
+            num_channels_latents = latent_conditioning_image.shape[1]
+            latent_dtype = self.model.train_dtype.torch_dtype()
+        else:
             num_channels_latents = unet.config.in_channels
-            latent_image = torch.randn(
-                size=(1, num_channels_latents, height // vae_scale_factor, width // vae_scale_factor),
-                generator=generator,
-                device=self.train_device,
-                dtype=torch.float32
-            ) * noise_scheduler.init_noise_sigma
+            latent_dtype = torch.float32
 
-            # denoising loop
-            extra_step_kwargs = {}
-            if "generator" in set(inspect.signature(noise_scheduler.step).parameters.keys()):
-                extra_step_kwargs["generator"] = generator
+        latent_image = self._create_noise(
+            (num_channels_latents, height // vae_scale_factor, width // vae_scale_factor),
+            generators,
+            latent_dtype,
+        ) * noise_scheduler.init_noise_sigma
 
-            # denoising loop
-            self.model.unet_to(self.train_device)
-            for i, timestep in enumerate(tqdm(timesteps, desc="sampling")):
-                latent_model_input = torch.cat([latent_image] * 2)
-                latent_model_input = noise_scheduler.scale_model_input(latent_model_input, timestep)
-
-                # predict the noise residual
-                noise_pred = unet(
-                    latent_model_input,
-                    timestep,
-                    encoder_hidden_states=combined_prompt_embedding,
-                    cross_attention_kwargs=None,
-                    return_dict=False,
-                )[0]
-
-                # cfg
-                noise_pred_negative, noise_pred_positive = noise_pred.chunk(2)
-                noise_pred = noise_pred_negative + cfg_scale * (noise_pred_positive - noise_pred_negative)
-
-                if cfg_rescale > 0.0:
-                    # From: Common Diffusion Noise Schedules and Sample Steps are Flawed (https://arxiv.org/abs/2305.08891)
-                    std_positive = noise_pred_positive.std(dim=list(range(1, noise_pred_positive.ndim)), keepdim=True)
-                    std_pred = noise_pred.std(dim=list(range(1, noise_pred.ndim)), keepdim=True)
-                    noise_pred_rescaled = noise_pred * (std_positive / std_pred)
-                    noise_pred = (
-                            cfg_rescale * noise_pred_rescaled + (1 - cfg_rescale) * noise_pred
-                    )
-
-                # compute the previous noisy sample x_t -> x_t-1
-                latent_image = noise_scheduler.step(
-                    noise_pred, timestep, latent_image, return_dict=False, **extra_step_kwargs
-                )[0]
-
-                on_update_progress(i + 1, len(timesteps))
+        cfg_scale = self._cfg_scale_tensor(sample_params_list, latent_dtype)
 
-            self.model.unet_to(self.temp_device)
-            torch_gc()
+        extra_step_kwargs = {}
+        if "generator" in set(inspect.signature(noise_scheduler.step).parameters.keys()):
+            extra_step_kwargs["generator"] = self._step_generator(generators)
 
-            # decode
-            self.model.vae_to(self.train_device)
+        # denoising loop
+        for i, timestep in enumerate(tqdm(timesteps, desc="sampling")):
+            latent_model_input = noise_scheduler.scale_model_input(latent_image, timestep)
+            if conditioning is not None:
+                latent_model_input = torch.concat(
+                    [latent_model_input, latent_mask, latent_conditioning_image], 1
+                )
+            latent_model_input = torch.cat([latent_model_input] * 2)
 
-            latent_image = latent_image.to(dtype=vae.dtype)
-            image = vae.decode(latent_image / vae.config.scaling_factor, return_dict=False)[0]
+            # predict the noise residual
+            noise_pred = unet(
+                latent_model_input,
+                timestep,
+                encoder_hidden_states=combined_prompt_embedding,
+                cross_attention_kwargs=None,
+                return_dict=False,
+            )[0]
 
-            do_denormalize = [True] * image.shape[0]
-            image = image_processor.postprocess(image, output_type='pil', do_denormalize=do_denormalize)
+            noise_pred = self._apply_cfg(noise_pred, cfg_scale, cfg_rescale)
 
-            self.model.vae_to(self.temp_device)
+            # compute the previous noisy sample x_t -> x_t-1
+            latent_image = noise_scheduler.step(
+                noise_pred, timestep, latent_image, return_dict=False, **extra_step_kwargs
+            )[0]
+
+            on_update_progress(i + 1, len(timesteps))
 
-            return image[0]
+        return latent_image
 
     @torch.no_grad()
-    def __sample_inpainting(
+    def sample_batch(
             self,
-            prompt: str,
-            negative_prompt: str,
-            height: int,
-            width: int,
-            seed: int,
-            random_seed: bool,
-            diffusion_steps: int,
-            cfg_scale: float,
-            noise_scheduler: NoiseScheduler,
-            cfg_rescale: float = 0.7,
-            text_encoder_layer_skip: int = 0,
+            sample_params_list: list[SampleConfig],
+            destinations: list[str],
+            image_format: ImageFormat,
+            text_encoder_layer_skip: int,
             force_last_timestep: bool = False,
+            batch_size: int = 1,
+            on_sample: Callable[[int, Image], None] = lambda _, __: None,
             on_update_progress: Callable[[int, int], None] = lambda _, __: None,
-    ) -> Image:
-        with self.model.autocast_context:
-            generator = torch.Generator(device=self.train_device)
-            if random_seed:
-                generator.seed()
-            else:
-                generator.manual_seed(seed)
-
-            tokenizer = self.pipeline.tokenizer
-            text_encoder = self.pipeline.text_encoder
-            noise_scheduler = create.create_noise_scheduler(noise_scheduler, self.pipeline.scheduler, diffusion_steps)
-            image_processor = self.pipeline.image_processor
-            unet = self.pipeline.unet
-            vae = self.pipeline.vae
-            vae_scale_factor = self.pipeline.vae_scale_factor
-
-            # prepare conditioning image
-            self.model.vae_to(self.train_device)
-            conditioning_image = torch.zeros(
-                (1, 3, height, width),
-                dtype=self.model.train_dtype.torch_dtype(),
-                device=self.train_device,
-            )
-            conditioning_image = conditioning_image
-            latent_conditioning_image = vae.encode(conditioning_image).latent_dist.mode() * vae.config.scaling_factor
-            latent_mask = torch.ones(
-                size=(1, 1, latent_conditioning_image.shape[2], latent_conditioning_image.shape[3]),
-                dtype=self.model.train_dtype.torch_dtype(),
-                device=self.train_device
-            )
-            self.model.vae_to(self.temp_device)
-            torch_gc()
-
-            # prepare prompt
-            self.model.text_encoder_to(self.train_device)
-            tokenizer_output = tokenizer(
-                prompt,
-                padding='max_length',
-                truncation=True,
-                max_length=tokenizer.model_max_length,
-                return_tensors="pt",
-            )
-            tokens = tokenizer_output.input_ids.to(self.train_device)
-            if hasattr(text_encoder.config, "use_attention_mask") and text_encoder.config.use_attention_mask:
-                tokens_attention_mask = tokenizer_output.attention_mask.to(self.train_device)
-            else:
-                tokens_attention_mask = None
-
-            negative_tokenizer_output = tokenizer(
-                negative_prompt,
-                padding='max_length',
-                truncation=True,
-                max_length=tokenizer.model_max_length,
-                return_tensors="pt",
-            )
-            negative_tokens = negative_tokenizer_output.input_ids.to(self.train_device)
-            if hasattr(text_encoder.config, "use_attention_mask") and text_encoder.config.use_attention_mask:
-                negative_tokens_attention_mask = negative_tokenizer_output.attention_mask.to(self.train_device)
-            else:
-                negative_tokens_attention_mask = None
-
-            text_encoder_output = text_encoder(
-                tokens,
-                attention_mask=tokens_attention_mask,
-                return_dict=True,
-                output_hidden_states=True,
-            )
-            final_layer_norm = text_encoder.text_model.final_layer_norm
-            prompt_embedding = final_layer_norm(
-                text_encoder_output.hidden_states[-(1 + text_encoder_layer_skip)]
-            )
-
-            text_encoder_output = text_encoder(
-                negative_tokens,
-                attention_mask=negative_tokens_attention_mask,
-                return_dict=True,
-                output_hidden_states=True,
-            )
-            final_layer_norm = text_encoder.text_model.final_layer_norm
-            negative_prompt_embedding = final_layer_norm(
-                text_encoder_output.hidden_states[-(1 + text_encoder_layer_skip)]
-            )
-
-            combined_prompt_embedding = torch.cat([negative_prompt_embedding, prompt_embedding])
-
-            self.model.text_encoder_to(self.temp_device)
-            torch_gc()
-
-            # prepare timesteps
-            noise_scheduler.set_timesteps(diffusion_steps, device=self.train_device)
-            timesteps = noise_scheduler.timesteps
-
-            if force_last_timestep:
-                last_timestep = torch.ones(1, device=self.train_device, dtype=torch.int64) \
-                                * (noise_scheduler.config.num_train_timesteps - 1)
+    ):
+        image_processor = self.pipeline.image_processor
+        vae = self.pipeline.vae
+        cfg_rescale = 0.7 if force_last_timestep else 0.0
 
-                # add the final timestep to force predicting with zero snr
-                timesteps = torch.cat([last_timestep, timesteps])
+        batches = self._group_sample_params(sample_params_list, batch_size)
+        generators = [self._create_generator(sample_params) for sample_params in sample_params_list]
 
-            # prepare latent image
-            num_channels_latents = latent_conditioning_image.shape[1]
-            latent_image = torch.randn(
-                size=(1, num_channels_latents, height // vae_scale_factor, width // vae_scale_factor),
-                generator=generator,
+        with self.model.autocast_context:
+            # prepare conditioning images, one for each resolution
+            conditioning = {}
+            if self.model_type.has_conditioning_image_input():
+                self.model.vae_to(self.train_device)
+                for batch in batches:
+                    resolution = (sample_params_list[batch[0]].height, sample_params_list[batch[0]].width)
+                    if resolution not in conditioning:
+                        conditioning[resolution] = self.__encode_conditioning_image(*resolution)
+                self.model.vae_to(self.temp_device)
+                torch_gc()
+
+            # prepare all prompts in a single pass
+            prompts = [self.__prepare_prompt(sample_params.prompt) for sample_params in sample_params_list]
+            negative_prompts = [
+                self.__prepare_prompt(sample_params.negative_prompt) for sample_params in sample_params_list
+            ]
+
+            # the text encoder is only used for prompts that are not cached yet
+            prompt_embeddings, = self.__prompt_cache.encode(
+                prompts=prompts + negative_prompts,
+                text_encoder_layer_skip=text_encoder_layer_skip,
+                version=PromptEmbeddingCache.text_encoder_version(
+                    self.model.text_encoder, self.model.text_encoder_lora
+                ),
+                encode_fun=lambda missing_prompts: self.__encode_missing_prompts(
+                    missing_prompts, text_encoder_layer_skip
+                ),
                 device=self.train_device,
-                dtype=self.model.train_dtype.torch_dtype(),
-            ) * noise_scheduler.init_noise_sigma
+            )
 
-            # denoising loop
-            extra_step_kwargs = {}
-            if "generator" in set(inspect.signature(noise_scheduler.step).parameters.keys()):
-                extra_step_kwargs["generator"] = generator
+            negative_prompt_embeddings = prompt_embeddings[len(prompts):]
+            prompt_embeddings = prompt_embeddings[:len(prompts)]
 
-            # denoising loop
+            # denoise all batches
+            latent_images = []
             self.model.unet_to(self.train_device)
-            for i, timestep in enumerate(tqdm(timesteps, desc="sampling")):
-                latent_model_input = noise_scheduler.scale_model_input(latent_image, timestep)
-                latent_model_input = torch.concat(
-                    [latent_model_input, latent_mask, latent_conditioning_image], 1
-                )
-                latent_model_input = torch.cat([latent_model_input] * 2)
-
-                # predict the noise residual
-                noise_pred = unet(
-                    latent_model_input,
-                    timestep,
-                    encoder_hidden_states=combined_prompt_embedding,
-                    cross_attention_kwargs=None,
-                    return_dict=False,
-                )[0]
-
-                # cfg
-                noise_pred_negative, noise_pred_positive = noise_pred.chunk(2)
-                noise_pred = noise_pred_negative + cfg_scale * (noise_pred_positive - noise_pred_negative)
-
-                if cfg_rescale > 0.0:
-                    # From: Common Diffusion Noise Schedules and Sample Steps are Flawed (https://arxiv.org/abs/2305.08891)
-                    std_positive = noise_pred_positive.std(dim=list(range(1, noise_pred_positive.ndim)), keepdim=True)
-                    std_pred = noise_pred.std(dim=list(range(1, noise_pred.ndim)), keepdim=True)
-                    noise_pred_rescaled = noise_pred * (std_positive / std_pred)
-                    noise_pred = (
-                            cfg_rescale * noise_pred_rescaled + (1 - cfg_rescale) * noise_pred
-                    )
-
-                # compute the previous noisy sample x_t -> x_t-1
-                latent_image = noise_scheduler.step(
-                    noise_pred, timestep, latent_image, return_dict=False, **extra_step_kwargs
-                )[0]
-
-                on_update_progress(i + 1, len(timesteps))
-
+            for batch in batches:
+                first_params = sample_params_list[batch[0]]
+                latent_images.append(self.__denoise(
+                    sample_params_list=[sample_params_list[index] for index in batch],
+                    generators=[generators[index] for index in batch],
+                    prompt_embedding=prompt_embeddings[batch],
+                    negative_prompt_embedding=negative_prompt_embeddings[batch],
+                    conditioning=conditioning.get((first_params.height, first_params.width)),
+                    cfg_rescale=cfg_rescale,
+                    force_last_timestep=force_last_timestep,
+                    on_update_progress=on_update_progress,
+                ))
             self.model.unet_to(self.temp_device)
             torch_gc()
 
-            #decode
+            # decode
             self.model.vae_to(self.train_device)
+            for batch, latent_image in zip(batches, latent_images):
+                latent_image = latent_image.to(dtype=vae.dtype)
+                image = vae.decode(latent_image / vae.config.scaling_factor, return_dict=False)[0]
 
-            latent_image = latent_image.to(dtype=vae.dtype)
-            image = vae.decode(latent_image / vae.config.scaling_factor, return_dict=False)[0]
-
-            do_denormalize = [True] * image.shape[0]
-            image = image_processor.postprocess(image, output_type='pil', do_denormalize=do_denormalize)
+                do_denormalize = [True] * image.shape[0]
+                images = image_processor.postprocess(image, output_type='pil', do_denormalize=do_denormalize)
 
+                for index, image in zip(batch, images):
+                    self._save_image(image, destinations[index], image_format)
+                    on_sample(index, image)
             self.model.vae_to(self.temp_device)
 
-            return image[0]
-
     def sample(
             self,
             sample_params: SampleConfig,
@@ -387,48 +280,12 @@ class StableDiffusionSampler(BaseModelSampler):
             on_sample: Callable[[Image], None] = lambda _: None,
             on_update_progress: Callable[[int, int], None] = lambda _, __: None,
     ):
-        prompt = sample_params.prompt
-        negative_prompt = sample_params.negative_prompt
-
-        if len(self.model.embeddings) > 0:
-            embedding_string = ''.join(self.model.embeddings[0].text_tokens)
-            prompt = prompt.replace("<embedding>", embedding_string)
-            negative_prompt = negative_prompt.replace("<embedding>", embedding_string)
-
-        if self.model_type.has_conditioning_image_input():
-            image = self.__sample_inpainting(
-                prompt=prompt,
-                negative_prompt=negative_prompt,
-                height=sample_params.height,
-                width=sample_params.width,
-                seed=sample_params.seed,
-                random_seed=sample_params.random_seed,
-                diffusion_steps=sample_params.diffusion_steps,
-                cfg_scale=sample_params.cfg_scale,
-                noise_scheduler=sample_params.noise_scheduler,
-                cfg_rescale=0.7 if force_last_timestep else 0.0,
-                text_encoder_layer_skip=text_encoder_layer_skip,
-                force_last_timestep=force_last_timestep,
-                on_update_progress=on_update_progress,
-            )
-        else:
-            image = self.__sample_base(
-                prompt=prompt,
-                negative_prompt=negative_prompt,
-                height=sample_params.height,
-                width=sample_params.width,
-                seed=sample_params.seed,
-                random_seed=sample_params.random_seed,
-                diffusion_steps=sample_params.diffusion_steps,
-                cfg_scale=sample_params.cfg_scale,
-                noise_scheduler=sample_params.noise_scheduler,
-                cfg_rescale=0.7 if force_last_timestep else 0.0,
-                text_encoder_layer_skip=text_encoder_layer_skip,
-                force_last_timestep=force_last_timestep,
-                on_update_progress=on_update_progress,
-            )
-
-        os.makedirs(Path(destination).parent.absolute(), exist_ok=True)
-        image.save(destination)
-
-        on_sample(image)
+        self.sample_batch(
+            sample_params_list=[sample_params],
+            destinations=[destination],
+            image_format=image_format,
+            text_encoder_layer_skip=text_encoder_layer_skip,
+            force_last_timestep=force_last_timestep,
+            on_sample=lambda _, image: on_sample(image),
+            on_update_progress=on_update_progress,
+        )
@@ -1,10 +1,9 @@
 import inspect
-import os
-from pathlib import Path
 from typing import Callable
 
 import torch
 from PIL.Image import Image
+from torch import Tensor
 from tqdm import tqdm
 
 from modules.model.StableDiffusionXLModel import StableDiffusionXLModel
@@ -12,7 +11,7 @@ from modules.modelSampler.BaseModelSampler import BaseModelSampler
 from modules.util import create
 from modules.util.enum.ImageFormat import ImageFormat
 from modules.util.enum.ModelType import ModelType
-from modules.util.enum.NoiseScheduler import NoiseScheduler
+from modules.util.PromptEmbeddingCache import PromptEmbeddingCache
 from modules.util.config.SampleConfig import SampleConfig
 from modules.util.torch_util import torch_gc
 
@@ -30,93 +29,39 @@ class StableDiffusionXLSampler(BaseModelSampler):
         self.model = model
         self.model_type = model_type
         self.pipeline = model.create_pipeline()
+        self.__prompt_cache = PromptEmbeddingCache(temp_device)
 
-    @torch.no_grad()
-    def __sample_base(
-            self,
-            prompt: str,
-            negative_prompt: str,
-            height: int,
-            width: int,
-            seed: int,
-            random_seed: bool,
-            diffusion_steps: int,
-            cfg_scale: float,
-            noise_scheduler: NoiseScheduler,
-            cfg_rescale: float = 0.7,
-            text_encoder_layer_skip: int = 0,
-            force_last_timestep: bool = False,
-            on_update_progress: Callable[[int, int], None] = lambda _, __: None,
-    ) -> Image:
-        generator = torch.Generator(device=self.train_device)
-        if random_seed:
-            generator.seed()
-        else:
-            generator.manual_seed(seed)
-
-        tokenizer_1 = self.model.tokenizer_1
-        tokenizer_2 = self.model.tokenizer_2
-        text_encoder_1 = self.model.text_encoder_1
-        text_encoder_2 = self.model.text_encoder_2
-        noise_scheduler = create.create_noise_scheduler(noise_scheduler, self.model.noise_scheduler, diffusion_steps)
-        image_processor = self.pipeline.image_processor
-        unet = self.pipeline.unet
-        vae = self.pipeline.vae
-        vae_scale_factor = self.pipeline.vae_scale_factor
-
-        # prepare prompt
-        self.model.text_encoder_to(self.train_device)
-        tokenizer_1_output = tokenizer_1(
-            prompt,
-            padding='max_length',
-            truncation=True,
-            max_length=tokenizer_1.model_max_length,
-            return_tensors="pt",
-        )
-        tokens_1 = tokenizer_1_output.input_ids.to(self.train_device)
-        if hasattr(text_encoder_1.config, "use_attention_mask") and text_encoder_1.config.use_attention_mask:
-            tokens_1_attention_mask = tokenizer_1_output.attention_mask.to(self.train_device)
-        else:
-            tokens_1_attention_mask = None
+    def __prepare_prompt(self, prompt: str) -> str:
+        if len(self.model.embeddings) > 0:
+            embedding_string = ''.join(self.model.embeddings[0].text_tokens)
+            prompt = prompt.replace("<embedding>", embedding_string)
+        return prompt
 
-        tokenizer_2_output = tokenizer_2(
-            prompt,
+    def __tokenize(self, tokenizer, text_encoder, prompts: list[str]) -> tuple[Tensor, Tensor | None]:
+        tokenizer_output = tokenizer(
+            prompts,
             padding='max_length',
             truncation=True,
-            max_length=tokenizer_2.model_max_length,
+            max_length=tokenizer.model_max_length,
             return_tensors="pt",
         )
-        tokens_2 = tokenizer_2_output.input_ids.to(self.train_device)
-        if hasattr(text_encoder_2.config, "use_attention_mask") and text_encoder_2.config.use_attention_mask:
-            tokens_2_attention_mask = tokenizer_2_output.attention_mask.to(self.train_device)
+        tokens = tokenizer_output.input_ids.to(self.train_device)
+        if hasattr(text_encoder.config, "use_attention_mask") and text_encoder.config.use_attention_mask:
+            tokens_attention_mask = tokenizer_output.attention_mask.to(self.train_device)
         else:
-            tokens_2_attention_mask = None
+            tokens_attention_mask = None
+        return tokens, tokens_attention_mask
 
-        negative_tokenizer_1_output = tokenizer_1(
-            negative_prompt,
-            padding='max_length',
-            truncation=True,
-            max_length=tokenizer_1.model_max_length,
-            return_tensors="pt",
-        )
-        negative_tokens_1 = negative_tokenizer_1_output.input_ids.to(self.train_device)
-        if hasattr(text_encoder_1.config, "use_attention_mask") and text_encoder_1.config.use_attention_mask:
-            negative_tokens_1_attention_mask = negative_tokenizer_1_output.attention_mask.to(self.train_device)
-        else:
-            negative_tokens_1_attention_mask = None
+    def __encode_prompts(
+            self,
+            prompts: list[str],
+            text_encoder_layer_skip: int,
+    ) -> tuple[Tensor, Tensor]:
+        text_encoder_1 = self.model.text_encoder_1
+        text_encoder_2 = self.model.text_encoder_2
 
-        negative_tokenizer_2_output = tokenizer_2(
-            negative_prompt,
-            padding='max_length',
-            truncation=True,
-            max_length=tokenizer_2.model_max_length,
-            return_tensors="pt",
-        )
-        negative_tokens_2 = negative_tokenizer_2_output.input_ids.to(self.train_device)
-        if hasattr(text_encoder_2.config, "use_attention_mask") and text_encoder_2.config.use_attention_mask:
-            negative_tokens_2_attention_mask = negative_tokenizer_2_output.attention_mask.to(self.train_device)
-        else:
-            negative_tokens_2_attention_mask = None
+        tokens_1, tokens_1_attention_mask = self.__tokenize(self.model.tokenizer_1, text_encoder_1, prompts)
+        tokens_2, tokens_2_attention_mask = self.__tokenize(self.model.tokenizer_2, text_encoder_2, prompts)
 
         with torch.autocast(self.train_device.type):
             text_encoder_1_output = text_encoder_1(
@@ -140,285 +85,59 @@ class StableDiffusionXLSampler(BaseModelSampler):
                 [text_encoder_1_output, text_encoder_2_output], dim=-1
             )
 
-            negative_text_encoder_1_output = text_encoder_1(
-                negative_tokens_1,
-                attention_mask=negative_tokens_1_attention_mask,
-                output_hidden_states=True,
-                return_dict=True,
-            )
-            negative_text_encoder_1_output = \
-                negative_text_encoder_1_output.hidden_states[-(2 + text_encoder_layer_skip)]
-
-            negative_text_encoder_2_output = text_encoder_2(
-                negative_tokens_2,
-                attention_mask=negative_tokens_2_attention_mask,
-                output_hidden_states=True,
-                return_dict=True,
-            )
-            negative_pooled_text_encoder_2_output = negative_text_encoder_2_output.text_embeds
-            negative_text_encoder_2_output = \
-                negative_text_encoder_2_output.hidden_states[-(2 + text_encoder_layer_skip)]
-
-            negative_prompt_embedding = torch.concat(
-                [negative_text_encoder_1_output, negative_text_encoder_2_output], dim=-1
-            )
-
-        combined_prompt_embedding = torch.cat([negative_prompt_embedding, prompt_embedding])
+        return prompt_embedding, pooled_text_encoder_2_output
 
+    def __encode_missing_prompts(
+            self,
+            prompts: list[str],
+            text_encoder_layer_skip: int,
+    ) -> tuple[Tensor, Tensor]:
+        self.model.text_encoder_to(self.train_device)
+        prompt_embedding, pooled_prompt_embedding = self.__encode_prompts(prompts, text_encoder_layer_skip)
         self.model.text_encoder_to(self.temp_device)
         torch_gc()
 
-        # prepare timesteps
-        noise_scheduler.set_timesteps(diffusion_steps, device=self.train_device)
-        timesteps = noise_scheduler.timesteps
-
-        if force_last_timestep:
-            last_timestep = torch.ones(1, device=self.train_device, dtype=torch.int64) \
-                            * (noise_scheduler.config.num_train_timesteps - 1)
-
-            # add the final timestep to force predicting with zero snr
-            timesteps = torch.cat([last_timestep, timesteps])
-
-        original_height = height
-        original_width = width
-        crops_coords_top = 0
-        crops_coords_left = 0
-        target_height = height
-        target_width = width
-
-        add_time_ids = torch.tensor([
-            original_height,
-            original_width,
-            crops_coords_top,
-            crops_coords_left,
-            target_height,
-            target_width
-        ]).unsqueeze(dim=0)
-
-        add_time_ids = add_time_ids.to(
-            device=self.train_device,
-        )
-
-        # prepare latent image
-        num_channels_latents = unet.config.in_channels
-        latent_image = torch.randn(
-            size=(1, num_channels_latents, height // vae_scale_factor, width // vae_scale_factor),
-            generator=generator,
-            device=self.train_device,
-            dtype=torch.float32,
-        ) * noise_scheduler.init_noise_sigma
-
-        added_cond_kwargs = {
-            "text_embeds": torch.concat([pooled_text_encoder_2_output, negative_pooled_text_encoder_2_output], dim=0),
-            "time_ids": torch.concat([add_time_ids] * 2, dim=0),
-        }
-
-        # denoising loop
-        extra_step_kwargs = {}
-        if "generator" in set(inspect.signature(noise_scheduler.step).parameters.keys()):
-            extra_step_kwargs["generator"] = generator
-
-        # denoising loop
-        self.model.unet_to(self.train_device)
-        for i, timestep in enumerate(tqdm(timesteps, desc="sampling")):
-            latent_model_input = torch.cat([latent_image] * 2)
-            latent_model_input = noise_scheduler.scale_model_input(latent_model_input, timestep)
-
-            # predict the noise residual
-            with torch.autocast(self.train_device.type):
-                noise_pred = unet(
-                    sample=latent_model_input,
-                    timestep=timestep,
-                    encoder_hidden_states=combined_prompt_embedding,
-                    added_cond_kwargs=added_cond_kwargs,
-                )[0]
-
-            # cfg
-            noise_pred_negative, noise_pred_positive = noise_pred.chunk(2)
-            noise_pred = noise_pred_negative + cfg_scale * (noise_pred_positive - noise_pred_negative)
-
-            if cfg_rescale > 0.0:
-                # From: Common Diffusion Noise Schedules and Sample Steps are Flawed (https://arxiv.org/abs/2305.08891)
-                std_positive = noise_pred_positive.std(dim=list(range(1, noise_pred_positive.ndim)), keepdim=True)
-                std_pred = noise_pred.std(dim=list(range(1, noise_pred.ndim)), keepdim=True)
-                noise_pred_rescaled = noise_pred * (std_positive / std_pred)
-                noise_pred = (
-                        cfg_rescale * noise_pred_rescaled + (1 - cfg_rescale) * noise_pred
-                )
-
-            # compute the previous noisy sample x_t -> x_t-1
-            latent_image = noise_scheduler.step(
-                noise_pred, timestep, latent_image, return_dict=False, **extra_step_kwargs
-            )[0]
-
-            on_update_progress(i + 1, len(timesteps))
-
-        self.model.unet_to(self.temp_device)
-        torch_gc()
-
-        # decode
-        self.model.vae_to(self.train_device)
-
-        latent_image = latent_image.to(dtype=vae.dtype)
-        image = vae.decode(latent_image / vae.config.scaling_factor, return_dict=False)[0]
-
-        do_denormalize = [True] * image.shape[0]
-        image = image_processor.postprocess(image, output_type='pil', do_denormalize=do_denormalize)
-
-        self.model.vae_to(self.temp_device)
-
-        return image[0]
-
-    @torch.no_grad()
-    def __sample_inpainting(
-            self,
-            prompt: str,
-            negative_prompt: str,
-            height: int,
-            width: int,
-            seed: int,
-            random_seed: bool,
-            diffusion_steps: int,
-            cfg_scale: float,
-            noise_scheduler: NoiseScheduler,
-            cfg_rescale: float = 0.7,
-            text_encoder_layer_skip: int = 0,
-            force_last_timestep: bool = False,
-            on_update_progress: Callable[[int, int], None] = lambda _, __: None,
-    ) -> Image:
-        generator = torch.Generator(device=self.train_device)
-        if random_seed:
-            generator.seed()
-        else:
-            generator.manual_seed(seed)
+        return prompt_embedding, pooled_prompt_embedding
 
-        tokenizer_1 = self.model.tokenizer_1
-        tokenizer_2 = self.model.tokenizer_2
-        text_encoder_1 = self.model.text_encoder_1
-        text_encoder_2 = self.model.text_encoder_2
-        noise_scheduler = create.create_noise_scheduler(noise_scheduler, self.model.noise_scheduler, diffusion_steps)
-        image_processor = self.pipeline.image_processor
-        unet = self.pipeline.unet
+    def __encode_conditioning_image(self, height: int, width: int) -> tuple[Tensor, Tensor]:
         vae = self.pipeline.vae
-        vae_scale_factor = self.pipeline.vae_scale_factor
 
-        # prepare conditioning image
-        self.model.vae_to(self.train_device)
         conditioning_image = torch.zeros((1, 3, height, width), dtype=torch.float32, device=self.train_device)
-        conditioning_image = conditioning_image
         latent_conditioning_image = vae.encode(conditioning_image).latent_dist.mode() * vae.config.scaling_factor
         latent_mask = torch.ones(
             size=(1, 1, latent_conditioning_image.shape[2], latent_conditioning_image.shape[3]),
             dtype=torch.float32,
             device=self.train_device
         )
-        self.model.vae_to(self.temp_device)
-        torch_gc()
-
-        # prepare prompt
-        self.model.text_encoder_to(self.train_device)
-        tokenizer_1_output = tokenizer_1(
-            prompt,
-            padding='max_length',
-            truncation=True,
-            max_length=tokenizer_1.model_max_length,
-            return_tensors="pt",
-        )
-        tokens_1 = tokenizer_1_output.input_ids.to(self.train_device)
-        if hasattr(text_encoder_1.config, "use_attention_mask") and text_encoder_1.config.use_attention_mask:
-            tokens_1_attention_mask = tokenizer_1_output.attention_mask.to(self.train_device)
-        else:
-            tokens_1_attention_mask = None
-
-        tokenizer_2_output = tokenizer_2(
-            prompt,
-            padding='max_length',
-            truncation=True,
-            max_length=tokenizer_2.model_max_length,
-            return_tensors="pt",
-        )
-        tokens_2 = tokenizer_2_output.input_ids.to(self.train_device)
-        if hasattr(text_encoder_2.config, "use_attention_mask") and text_encoder_2.config.use_attention_mask:
-            tokens_2_attention_mask = tokenizer_2_output.attention_mask.to(self.train_device)
-        else:
-            tokens_2_attention_mask = None
-
-        negative_tokenizer_1_output = tokenizer_1(
-            negative_prompt,
-            padding='max_length',
-            truncation=True,
-            max_length=tokenizer_1.model_max_length,
-            return_tensors="pt",
-        )
-        negative_tokens_1 = negative_tokenizer_1_output.input_ids.to(self.train_device)
-        if hasattr(text_encoder_1.config, "use_attention_mask") and text_encoder_1.config.use_attention_mask:
-            negative_tokens_1_attention_mask = negative_tokenizer_1_output.attention_mask.to(self.train_device)
-        else:
-            negative_tokens_1_attention_mask = None
+        return latent_conditioning_image, latent_mask
 
-        negative_tokenizer_2_output = tokenizer_2(
-            negative_prompt,
-            padding='max_length',
-            truncation=True,
-            max_length=tokenizer_2.model_max_length,
-            return_tensors="pt",
+    def __denoise(
+            self,
+            sample_params_list: list[SampleConfig],
+            generators: list[torch.Generator],
+            prompt_embedding: Tensor,
+            pooled_prompt_embedding: Tensor,
+            negative_prompt_embedding: Tensor,
+            negative_pooled_prompt_embedding: Tensor,
+            conditioning: tuple[Tensor, Tensor] | None,
+            cfg_rescale: float,
+            force_last_timestep: bool,
+            on_update_progress: Callable[[int, int], None],
+    ) -> Tensor:
+        sample_params = sample_params_list[0]
+        height = sample_params.height
+        width = sample_params.width
+        diffusion_steps = sample_params.diffusion_steps
+        batch_size = len(sample_params_list)
+
+        noise_scheduler = create.create_noise_scheduler(
+            sample_params.noise_scheduler, self.model.noise_scheduler, diffusion_steps
         )
-        negative_tokens_2 = negative_tokenizer_2_output.input_ids.to(self.train_device)
-        if hasattr(text_encoder_2.config, "use_attention_mask") and text_encoder_2.config.use_attention_mask:
-            negative_tokens_2_attention_mask = negative_tokenizer_2_output.attention_mask.to(self.train_device)
-        else:
-            negative_tokens_2_attention_mask = None
-
-        with torch.autocast(self.train_device.type):
-            text_encoder_1_output = text_encoder_1(
-                tokens_1,
-                attention_mask=tokens_1_attention_mask,
-                output_hidden_states=True,
-                return_dict=True,
-            )
-            text_encoder_1_output = text_encoder_1_output.hidden_states[-(2 + text_encoder_layer_skip)]
-
-            text_encoder_2_output = text_encoder_2(
-                tokens_2,
-                attention_mask=tokens_2_attention_mask,
-                output_hidden_states=True,
-                return_dict=True,
-            )
-            pooled_text_encoder_2_output = text_encoder_2_output.text_embeds
-            text_encoder_2_output = text_encoder_2_output.hidden_states[-(2 + text_encoder_layer_skip)]
-
-            prompt_embedding = torch.concat(
-                [text_encoder_1_output, text_encoder_2_output], dim=-1
-            )
-
-            negative_text_encoder_1_output = text_encoder_1(
-                negative_tokens_1,
-                attention_mask=negative_tokens_1_attention_mask,
-                output_hidden_states=True,
-                return_dict=True,
-            )
-            negative_text_encoder_1_output = \
-                negative_text_encoder_1_output.hidden_states[-(2 + text_encoder_layer_skip)]
-
-            negative_text_encoder_2_output = text_encoder_2(
-                negative_tokens_2,
-                attention_mask=negative_tokens_2_attention_mask,
-                output_hidden_states=True,
-                return_dict=True,
-            )
-            negative_pooled_text_encoder_2_output = negative_text_encoder_2_output.text_embeds
-            negative_text_encoder_2_output = \
-                negative_text_encoder_2_output.hidden_states[-(2 + text_encoder_layer_skip)]
-
-            negative_prompt_embedding = torch.concat(
-                [negative_text_encoder_1_output, negative_text_encoder_2_output], dim=-1
-            )
+        unet = self.pipeline.unet
+        vae_scale_factor = self.pipeline.vae_scale_factor
 
         combined_prompt_embedding = torch.cat([negative_prompt_embedding, prompt_embedding])
 
-        self.model.text_encoder_to(self.temp_device)
-        torch_gc()
-
         # prepare timesteps
         noise_scheduler.set_timesteps(diffusion_steps, device=self.train_device)
         timesteps = noise_scheduler.timesteps
@@ -451,31 +170,39 @@ class StableDiffusionXLSampler(BaseModelSampler):
         )
 
         # prepare latent image
-        num_channels_latents = latent_conditioning_image.shape[1]
-        latent_image = torch.randn(
-            size=(1, num_channels_latents, height // vae_scale_factor, width // vae_scale_factor),
-            generator=generator,
-            device=self.train_device,
-            dtype=torch.float32,
+        if conditioning is not None:
+            latent_conditioning_image, latent_mask = conditioning
+            latent_conditioning_image = latent_conditioning_image.expand(batch_size, -1, -1, -1)
+            latent_mask = latent_mask.expand(batch_size, -1, -1, -1)
+            num_channels_latents = latent_conditioning_image.shape[1]
+        else:
+            num_channels_latents = unet.config.in_channels
+
+        latent_image = self._create_noise(
+            (num_channels_latents, height // vae_scale_factor, width // vae_scale_factor),
+            generators,
+            torch.float32,
         ) * noise_scheduler.init_noise_sigma
 
+        # same order as the prompt embedding
         added_cond_kwargs = {
-            "text_embeds": torch.concat([pooled_text_encoder_2_output, negative_pooled_text_encoder_2_output], dim=0),
-            "time_ids": torch.concat([add_time_ids] * 2, dim=0),
+            "text_embeds": torch.concat([negative_pooled_prompt_embedding, pooled_prompt_embedding], dim=0),
+            "time_ids": torch.concat([add_time_ids] * (2 * batch_size), dim=0),
         }
 
-        # denoising loop
+        cfg_scale = self._cfg_scale_tensor(sample_params_list, torch.float32)
+
         extra_step_kwargs = {}
         if "generator" in set(inspect.signature(noise_scheduler.step).parameters.keys()):
-            extra_step_kwargs["generator"] = generator
+            extra_step_kwargs["generator"] = self._step_generator(generators)
 
         # denoising loop
-        self.model.unet_to(self.train_device)
         for i, timestep in enumerate(tqdm(timesteps, desc="sampling")):
             latent_model_input = noise_scheduler.scale_model_input(latent_image, timestep)
-            latent_model_input = torch.concat(
-                [latent_model_input, latent_mask, latent_conditioning_image], 1
-            )
+            if conditioning is not None:
+                latent_model_input = torch.concat(
+                    [latent_model_input, latent_mask, latent_conditioning_image], 1
+                )
             latent_model_input = torch.cat([latent_model_input] * 2)
 
             # predict the noise residual
@@ -487,18 +214,7 @@ class StableDiffusionXLSampler(BaseModelSampler):
                     added_cond_kwargs=added_cond_kwargs,
                 )[0]
 
-            # cfg
-            noise_pred_negative, noise_pred_positive = noise_pred.chunk(2)
-            noise_pred = noise_pred_negative + cfg_scale * (noise_pred_positive - noise_pred_negative)
-
-            if cfg_rescale > 0.0:
-                # From: Common Diffusion Noise Schedules and Sample Steps are Flawed (https://arxiv.org/abs/2305.08891)
-                std_positive = noise_pred_positive.std(dim=list(range(1, noise_pred_positive.ndim)), keepdim=True)
-                std_pred = noise_pred.std(dim=list(range(1, noise_pred.ndim)), keepdim=True)
-                noise_pred_rescaled = noise_pred * (std_positive / std_pred)
-                noise_pred = (
-                        cfg_rescale * noise_pred_rescaled + (1 - cfg_rescale) * noise_pred
-                )
+            noise_pred = self._apply_cfg(noise_pred, cfg_scale, cfg_rescale)
 
             # compute the previous noisy sample x_t -> x_t-1
             latent_image = noise_scheduler.step(
@@ -507,22 +223,99 @@ class StableDiffusionXLSampler(BaseModelSampler):
 
             on_update_progress(i + 1, len(timesteps))
 
+        return latent_image
+
+    @torch.no_grad()
+    def sample_batch(
+            self,
+            sample_params_list: list[SampleConfig],
+            destinations: list[str],
+            image_format: ImageFormat,
+            text_encoder_layer_skip: int,
+            force_last_timestep: bool = False,
+            batch_size: int = 1,
+            on_sample: Callable[[int, Image], None] = lambda _, __: None,
+            on_update_progress: Callable[[int, int], None] = lambda _, __: None,
+    ):
+        image_processor = self.pipeline.image_processor
+        vae = self.pipeline.vae
+        cfg_rescale = 0.7 if force_last_timestep else 0.0
+
+        batches = self._group_sample_params(sample_params_list, batch_size)
+        generators = [self._create_generator(sample_params) for sample_params in sample_params_list]
+
+        # prepare conditioning images, one for each resolution
+        conditioning = {}
+        if self.model_type.has_conditioning_image_input():
+            self.model.vae_to(self.train_device)
+            for batch in batches:
+                resolution = (sample_params_list[batch[0]].height, sample_params_list[batch[0]].width)
+                if resolution not in conditioning:
+                    conditioning[resolution] = self.__encode_conditioning_image(*resolution)
+            self.model.vae_to(self.temp_device)
+            torch_gc()
+
+        # prepare all prompts in a single pass
+        prompts = [self.__prepare_prompt(sample_params.prompt) for sample_params in sample_params_list]
+        negative_prompts = [
+            self.__prepare_prompt(sample_params.negative_prompt) for sample_params in sample_params_list
+        ]
+
+        # the text encoders are only used for prompts that are not cached yet
+        prompt_embeddings, pooled_prompt_embeddings = self.__prompt_cache.encode(
+            prompts=prompts + negative_prompts,
+            text_encoder_layer_skip=text_encoder_layer_skip,
+            version=PromptEmbeddingCache.text_encoder_version(
+                self.model.text_encoder_1,
+                self.model.text_encoder_2,
+                self.model.text_encoder_1_lora,
+                self.model.text_encoder_2_lora,
+            ),
+            encode_fun=lambda missing_prompts: self.__encode_missing_prompts(
+                missing_prompts, text_encoder_layer_skip
+            ),
+            device=self.train_device,
+        )
+
+        negative_prompt_embeddings = prompt_embeddings[len(prompts):]
+        negative_pooled_prompt_embeddings = pooled_prompt_embeddings[len(prompts):]
+        prompt_embeddings = prompt_embeddings[:len(prompts)]
+        pooled_prompt_embeddings = pooled_prompt_embeddings[:len(prompts)]
+
+        # denoise all batches
+        latent_images = []
+        self.model.unet_to(self.train_device)
+        for batch in batches:
+            first_params = sample_params_list[batch[0]]
+            latent_images.append(self.__denoise(
+                sample_params_list=[sample_params_list[index] for index in batch],
+                generators=[generators[index] for index in batch],
+                prompt_embedding=prompt_embeddings[batch],
+                pooled_prompt_embedding=pooled_prompt_embeddings[batch],
+                negative_prompt_embedding=negative_prompt_embeddings[batch],
+                negative_pooled_prompt_embedding=negative_pooled_prompt_embeddings[batch],
+                conditioning=conditioning.get((first_params.height, first_params.width)),
+                cfg_rescale=cfg_rescale,
+                force_last_timestep=force_last_timestep,
+                on_update_progress=on_update_progress,
+            ))
         self.model.unet_to(self.temp_device)
         torch_gc()
 
         # decode
         self.model.vae_to(self.train_device)
+        for batch, latent_image in zip(batches, latent_images):
+            latent_image = latent_image.to(dtype=vae.dtype)
+            image = vae.decode(latent_image / vae.config.scaling_factor, return_dict=False)[0]
 
-        latent_image = latent_image.to(dtype=vae.dtype)
-        image = vae.decode(latent_image / vae.config.scaling_factor, return_dict=False)[0]
-
-        do_denormalize = [True] * image.shape[0]
-        image = image_processor.postprocess(image, output_type='pil', do_denormalize=do_denormalize)
+            do_denormalize = [True] * image.shape[0]
+            images = image_processor.postprocess(image, output_type='pil', do_denormalize=do_denormalize)
 
+            for index, image in zip(batch, images):
+                self._save_image(image, destinations[index], image_format)
+                on_sample(index, image)
         self.model.vae_to(self.temp_device)
 
-        return image[0]
-
     def sample(
             self,
             sample_params: SampleConfig,
@@ -533,48 +326,12 @@ class StableDiffusionXLSampler(BaseModelSampler):
             on_sample: Callable[[Image], None] = lambda _: None,
             on_update_progress: Callable[[int, int], None] = lambda _, __: None,
     ):
-        prompt = sample_params.prompt
-        negative_prompt = sample_params.negative_prompt
-
-        if len(self.model.embeddings) > 0:
-            embedding_string = ''.join(self.model.embeddings[0].text_tokens)
-            prompt = prompt.replace("<embedding>", embedding_string)
-            negative_prompt = negative_prompt.replace("<embedding>", embedding_string)
-
-        if self.model_type.has_conditioning_image_input():
-            image = self.__sample_inpainting(
-                prompt=prompt,
-                negative_prompt=negative_prompt,
-                height=sample_params.height,
-                width=sample_params.width,
-                seed=sample_params.seed,
-                random_seed=sample_params.random_seed,
-                diffusion_steps=sample_params.diffusion_steps,
-                cfg_scale=sample_params.cfg_scale,
-                noise_scheduler=sample_params.noise_scheduler,
-                cfg_rescale=0.7 if force_last_timestep else 0.0,
-                text_encoder_layer_skip=text_encoder_layer_skip,
-                force_last_timestep=force_last_timestep,
-                on_update_progress=on_update_progress,
-            )
-        else:
-            image = self.__sample_base(
-                prompt=prompt,
-                negative_prompt=negative_prompt,
-                height=sample_params.height,
-                width=sample_params.width,
-                seed=sample_params.seed,
-                random_seed=sample_params.random_seed,
-                diffusion_steps=sample_params.diffusion_steps,
-                cfg_scale=sample_params.cfg_scale,
-                noise_scheduler=sample_params.noise_scheduler,
-                cfg_rescale=0.7 if force_last_timestep else 0.0,
-                text_encoder_layer_skip=text_encoder_layer_skip,
-                force_last_timestep=force_last_timestep,
-                on_update_progress=on_update_progress,
-            )
-
-        os.makedirs(Path(destination).parent.absolute(), exist_ok=True)
-        image.save(destination, format=image_format.pil_format())
-
-        on_sample(image)
+        self.sample_batch(
+            sample_params_list=[sample_params],
+            destinations=[destination],
+            image_format=image_format,
+            text_encoder_layer_skip=text_encoder_layer_skip,
+            force_last_timestep=force_last_timestep,
+            on_sample=lambda _, image: on_sample(image),
+            on_update_progress=on_update_progress,
+        )
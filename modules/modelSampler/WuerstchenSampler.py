@@ -1,18 +1,17 @@
 import inspect
-import os
-from pathlib import Path
 from typing import Callable
 
 import torch
 from PIL import Image
+from torch import Tensor
 from tqdm import tqdm
 
 from modules.model.WuerstchenModel import WuerstchenModel
 from modules.modelSampler.BaseModelSampler import BaseModelSampler
+from modules.util.PromptEmbeddingCache import PromptEmbeddingCache
 from modules.util.config.SampleConfig import SampleConfig
 from modules.util.enum.ImageFormat import ImageFormat
 from modules.util.enum.ModelType import ModelType
-from modules.util.enum.NoiseScheduler import NoiseScheduler
 from modules.util.torch_util import torch_gc
 
 
@@ -29,28 +28,25 @@ class WuerstchenSampler(BaseModelSampler):
         self.model = model
         self.model_type = model_type
         self.pipeline = model.create_pipeline()
+        self.__prior_prompt_cache = PromptEmbeddingCache(temp_device)
+        self.__decoder_prompt_cache = PromptEmbeddingCache(temp_device)
 
-    def __sample_prior(
+    def __prepare_prompt(self, prompt: str) -> str:
+        if len(self.model.embeddings) > 0:
+            embedding_string = ''.join(self.model.embeddings[0].text_tokens)
+            prompt = prompt.replace("<embedding>", embedding_string)
+        return prompt
+
+    def __encode_prior_prompts(
             self,
-            prompt,
-            negative_prompt,
-            height,
-            width,
-            generator,
-            diffusion_steps,
-            cfg_scale,
-            cfg_rescale,
-            text_encoder_layer_skip,
-            prior_noise_scheduler,
-            prior_prior,
-            prior_text_encoder,
-            prior_tokenizer,
-            on_update_progress,
-    ):
-        # prepare prompt
-        self.model.prior_text_encoder_to(self.train_device)
+            prompts: list[str],
+            text_encoder_layer_skip: int,
+    ) -> tuple[Tensor, Tensor | None]:
+        prior_tokenizer = self.model.prior_tokenizer
+        prior_text_encoder = self.model.prior_text_encoder
+
         tokenizer_output = prior_tokenizer(
-            prompt,
+            prompts,
             padding='max_length',
             truncation=True,
             max_length=prior_tokenizer.model_max_length,
@@ -59,22 +55,13 @@ class WuerstchenSampler(BaseModelSampler):
         tokens = tokenizer_output.input_ids.to(self.train_device)
         tokens_attention_mask = tokenizer_output.attention_mask.to(self.train_device)
 
-        negative_tokenizer_output = prior_tokenizer(
-            negative_prompt,
-            padding='max_length',
-            truncation=True,
-            max_length=prior_tokenizer.model_max_length,
-            return_tensors="pt",
-        )
-        negative_tokens = negative_tokenizer_output.input_ids.to(self.train_device)
-        negative_tokens_attention_mask = negative_tokenizer_output.attention_mask.to(self.train_device)
-
         text_encoder_output = prior_text_encoder(
             tokens,
             attention_mask=tokens_attention_mask,
             return_dict=True,
             output_hidden_states=True,
         )
+        pooled_prompt_embedding = None
         if self.model_type.is_wuerstchen_v2():
             final_layer_norm = prior_text_encoder.text_model.final_layer_norm
             prompt_embedding = final_layer_norm(
@@ -84,20 +71,79 @@ class WuerstchenSampler(BaseModelSampler):
             prompt_embedding = text_encoder_output.hidden_states[-(1 + text_encoder_layer_skip)]
             pooled_prompt_embedding = text_encoder_output.text_embeds.unsqueeze(1)
 
-        negative_text_encoder_output = prior_text_encoder(
-            negative_tokens,
-            attention_mask=negative_tokens_attention_mask,
+        return prompt_embedding, pooled_prompt_embedding
+
+    def __encode_decoder_prompts(
+            self,
+            prompts: list[str],
+            text_encoder_layer_skip: int,
+    ) -> Tensor:
+        decoder_tokenizer = self.model.decoder_tokenizer
+        decoder_text_encoder = self.model.decoder_text_encoder
+
+        tokenizer_output = decoder_tokenizer(
+            prompts,
+            padding='max_length',
+            truncation=True,
+            max_length=decoder_tokenizer.model_max_length,
+            return_tensors="pt",
+        )
+        tokens = tokenizer_output.input_ids.to(self.train_device)
+        tokens_attention_mask = tokenizer_output.attention_mask.to(self.train_device)
+
+        text_encoder_output = decoder_text_encoder(
+            tokens,
+            attention_mask=tokens_attention_mask,
             return_dict=True,
             output_hidden_states=True,
         )
-        if self.model_type.is_wuerstchen_v2():
-            final_layer_norm = prior_text_encoder.text_model.final_layer_norm
-            negative_prompt_embedding = final_layer_norm(
-                negative_text_encoder_output.hidden_states[-(1 + text_encoder_layer_skip)]
-            )
-        if self.model_type.is_stable_cascade():
-            negative_prompt_embedding = negative_text_encoder_output.hidden_states[-(1 + text_encoder_layer_skip)]
-            pooled_negative_prompt_embedding = negative_text_encoder_output.text_embeds.unsqueeze(1)
+        final_layer_norm = decoder_text_encoder.text_model.final_layer_norm
+        return final_layer_norm(
+            text_encoder_output.hidden_states[-(1 + text_encoder_layer_skip)]
+        )
+
+    def __encode_missing_prior_prompts(
+            self,
+            prompts: list[str],
+            text_encoder_layer_skip: int,
+    ) -> tuple[Tensor, Tensor | None]:
+        self.model.prior_text_encoder_to(self.train_device)
+        prompt_embedding, pooled_prompt_embedding = self.__encode_prior_prompts(prompts, text_encoder_layer_skip)
+        self.model.prior_text_encoder_to(self.temp_device)
+        torch_gc()
+
+        return prompt_embedding, pooled_prompt_embedding
+
+    def __encode_missing_decoder_prompts(
+            self,
+            prompts: list[str],
+            text_encoder_layer_skip: int,
+    ) -> tuple[Tensor]:
+        self.model.decoder_text_encoder_to(self.train_device)
+        prompt_embedding = self.__encode_decoder_prompts(prompts, text_encoder_layer_skip)
+        self.model.decoder_text_encoder_to(self.temp_device)
+        torch_gc()
+
+        return (prompt_embedding,)
+
+    def __sample_prior(
+            self,
+            sample_params_list: list[SampleConfig],
+            generators: list[torch.Generator],
+            prompt_embedding: Tensor,
+            pooled_prompt_embedding: Tensor | None,
+            negative_prompt_embedding: Tensor,
+            pooled_negative_prompt_embedding: Tensor | None,
+            cfg_rescale: float,
+            on_update_progress: Callable[[int, int], None],
+    ) -> Tensor:
+        sample_params = sample_params_list[0]
+        height = (sample_params.height // 128) * 128
+        width = (sample_params.width // 128) * 128
+        batch_size = len(sample_params_list)
+
+        prior_noise_scheduler = self.model.prior_noise_scheduler
+        prior_prior = self.model.prior_prior
 
         combined_prompt_embedding = torch.cat([negative_prompt_embedding, prompt_embedding]) \
             .to(dtype=self.model.prior_train_dtype.torch_dtype())
@@ -105,32 +151,33 @@ class WuerstchenSampler(BaseModelSampler):
             pooled_combined_prompt_embedding = torch.cat([pooled_negative_prompt_embedding, pooled_prompt_embedding]) \
                 .to(dtype=self.model.prior_train_dtype.torch_dtype())
 
-        self.model.prior_text_encoder_to(self.temp_device)
-        torch_gc()
-
         # prepare timesteps
-        prior_noise_scheduler.set_timesteps(diffusion_steps, device=self.train_device)
+        prior_noise_scheduler.set_timesteps(sample_params.diffusion_steps, device=self.train_device)
         timesteps = prior_noise_scheduler.timesteps
 
         # prepare latent image
         num_channels_latents = 16
         latent_width = int((width * 0.75) / 32.0)
         latent_height = int((height * 0.75) / 32.0)
-        latent_image = torch.randn(
-            size=(1, num_channels_latents, latent_height, latent_width),
-            generator=generator,
-            device=self.train_device,
-            dtype=self.model.prior_train_dtype.torch_dtype(),
+        latent_image = self._create_noise(
+            (num_channels_latents, latent_height, latent_width),
+            generators,
+            self.model.prior_train_dtype.torch_dtype(),
         ) * prior_noise_scheduler.init_noise_sigma
 
+        cfg_scale = self._cfg_scale_tensor(sample_params_list, self.model.prior_train_dtype.torch_dtype())
+
         # denoising loop
         extra_step_kwargs = {}
         if "generator" in set(inspect.signature(prior_noise_scheduler.step).parameters.keys()):
-            extra_step_kwargs["generator"] = generator
+            extra_step_kwargs["generator"] = self._step_generator(generators)
 
-        clip_img = torch.zeros(size=(2, 1, 768), dtype=self.model.prior_train_dtype.torch_dtype(), device=combined_prompt_embedding.device)
+        clip_img = torch.zeros(
+            size=(2 * batch_size, 1, 768),
+            dtype=self.model.prior_train_dtype.torch_dtype(),
+            device=combined_prompt_embedding.device,
+        )
 
-        self.model.prior_prior_to(self.train_device)
         for i, timestep in enumerate(tqdm(timesteps[:-1], desc="sampling")):
             timestep = torch.stack([timestep]).to(dtype=self.model.prior_train_dtype.torch_dtype())
 
@@ -151,22 +198,11 @@ class WuerstchenSampler(BaseModelSampler):
 
                 noise_pred = prior_prior(
                     latent_model_input,
-                    torch.cat([timestep] * 2),
+                    torch.cat([timestep] * (2 * batch_size)),
                     **prior_kwargs,
                 )
 
-            # cfg
-            noise_pred_negative, noise_pred_positive = noise_pred.chunk(2)
-            noise_pred = noise_pred_negative + cfg_scale * (noise_pred_positive - noise_pred_negative)
-
-            if cfg_rescale > 0.0:
-                # From: Common Diffusion Noise Schedules and Sample Steps are Flawed (https://arxiv.org/abs/2305.08891)
-                std_positive = noise_pred_positive.std(dim=list(range(1, noise_pred_positive.ndim)), keepdim=True)
-                std_pred = noise_pred.std(dim=list(range(1, noise_pred.ndim)), keepdim=True)
-                noise_pred_rescaled = noise_pred * (std_positive / std_pred)
-                noise_pred = (
-                        cfg_rescale * noise_pred_rescaled + (1 - cfg_rescale) * noise_pred
-                )
+            noise_pred = self._apply_cfg(noise_pred, cfg_scale, cfg_rescale)
 
             # compute the previous noisy sample x_t -> x_t-1
             latent_image = prior_noise_scheduler.step(
@@ -175,9 +211,6 @@ class WuerstchenSampler(BaseModelSampler):
 
             on_update_progress(i + 1, len(timesteps))
 
-        self.model.prior_prior_to(self.temp_device)
-        torch_gc()
-
         if self.model_type.is_wuerstchen_v2():
             latent_image = latent_image * 42.0 - 1.0
 
@@ -187,53 +220,19 @@ class WuerstchenSampler(BaseModelSampler):
 
     def __sample_decoder(
             self,
-            prompt,
-            height,
-            width,
-            generator,
-            diffusion_steps,
-            text_encoder_layer_skip,
-            image_embedding,
-            decoder_tokenizer,
-            decoder_text_encoder,
-            decoder_noise_scheduler,
-            decoder_decoder,
-            on_update_progress,
-    ):
-        # prepare prompt
-        if self.model_type.is_wuerstchen_v2():
-            self.model.decoder_text_encoder_to(self.train_device)
-        elif self.model_type.is_stable_cascade():
-            self.model.prior_text_encoder_to(self.train_device)
-        tokenizer_output = decoder_tokenizer(
-            prompt,
-            padding='max_length',
-            truncation=True,
-            max_length=decoder_tokenizer.model_max_length,
-            return_tensors="pt",
-        )
-        tokens = tokenizer_output.input_ids.to(self.train_device)
-        tokens_attention_mask = tokenizer_output.attention_mask.to(self.train_device)
+            sample_params_list: list[SampleConfig],
+            generators: list[torch.Generator],
+            prompt_embedding: Tensor,
+            image_embedding: Tensor,
+            on_update_progress: Callable[[int, int], None],
+    ) -> Tensor:
+        sample_params = sample_params_list[0]
+        height = (sample_params.height // 128) * 128
+        width = (sample_params.width // 128) * 128
+        batch_size = len(sample_params_list)
 
-        text_encoder_output = decoder_text_encoder(
-            tokens,
-            attention_mask=tokens_attention_mask,
-            return_dict=True,
-            output_hidden_states=True,
-        )
-        final_layer_norm = decoder_text_encoder.text_model.final_layer_norm
-        prompt_embedding = final_layer_norm(
-            text_encoder_output.hidden_states[-(1 + text_encoder_layer_skip)]
-        )
-
-        if self.model_type.is_stable_cascade():
-            prompt_embedding = text_encoder_output.text_embeds.unsqueeze(1)
-
-        if self.model_type.is_wuerstchen_v2():
-            self.model.decoder_text_encoder_to(self.temp_device)
-        elif self.model_type.is_stable_cascade():
-            self.model.prior_text_encoder_to(self.temp_device)
-        torch_gc()
+        decoder_noise_scheduler = self.model.decoder_noise_scheduler
+        decoder_decoder = self.model.decoder_decoder
 
         # prepare timesteps
         decoder_noise_scheduler.set_timesteps(10, device=self.train_device)
@@ -243,19 +242,17 @@ class WuerstchenSampler(BaseModelSampler):
         num_channels_latents = 4
         latent_width = width // 4
         latent_height = height // 4
-        latent_image = torch.randn(
-            size=(1, num_channels_latents, latent_height, latent_width),
-            generator=generator,
-            device=self.train_device,
-            dtype=self.model.prior_train_dtype.torch_dtype(),
+        latent_image = self._create_noise(
+            (num_channels_latents, latent_height, latent_width),
+            generators,
+            self.model.prior_train_dtype.torch_dtype(),
         ) * decoder_noise_scheduler.init_noise_sigma
 
         # denoising loop
         extra_step_kwargs = {}
         if "generator" in set(inspect.signature(decoder_noise_scheduler.step).parameters.keys()):
-            extra_step_kwargs["generator"] = generator
+            extra_step_kwargs["generator"] = self._step_generator(generators)
 
-        self.model.decoder_decoder_to(self.train_device)
         for i, timestep in enumerate(tqdm(timesteps[:-1], desc="sampling")):
             timestep = torch.stack([timestep]).to(dtype=self.model.prior_train_dtype.torch_dtype())
 
@@ -275,7 +272,7 @@ class WuerstchenSampler(BaseModelSampler):
 
             noise_pred = decoder_decoder(
                 latent_model_input,
-                timestep,
+                torch.cat([timestep] * batch_size),
                 **decoder_kwargs,
             )
 
@@ -286,99 +283,116 @@ class WuerstchenSampler(BaseModelSampler):
 
             on_update_progress(i + 1, len(timesteps))
 
-        self.model.decoder_decoder_to(self.temp_device)
-        torch_gc()
-
         return latent_image
 
     @torch.no_grad()
-    def __sample_base(
+    def sample_batch(
             self,
-            prompt: str,
-            negative_prompt: str,
-            height: int,
-            width: int,
-            seed: int,
-            random_seed: bool,
-            diffusion_steps: int,
-            cfg_scale: float,
-            noise_scheduler: NoiseScheduler,
-            cfg_rescale: float = 0.7,
-            text_encoder_layer_skip: int = 0,
+            sample_params_list: list[SampleConfig],
+            destinations: list[str],
+            image_format: ImageFormat,
+            text_encoder_layer_skip: int,
             force_last_timestep: bool = False,
+            batch_size: int = 1,
+            on_sample: Callable[[int, Image.Image], None] = lambda _, __: None,
             on_update_progress: Callable[[int, int], None] = lambda _, __: None,
-    ) -> Image.Image:
-        generator = torch.Generator(device=self.train_device)
-        if random_seed:
-            generator.seed()
-        else:
-            generator.manual_seed(seed)
-
-        height = (height // 128) * 128
-        width = (width // 128) * 128
-
-        prior_tokenizer = self.model.prior_tokenizer
-        prior_text_encoder = self.model.prior_text_encoder
-        prior_noise_scheduler = self.model.prior_noise_scheduler
-        prior_prior = self.model.prior_prior
-
-        if self.model_type.is_wuerstchen_v2():
-            decoder_tokenizer = self.model.decoder_tokenizer
-            decoder_text_encoder = self.model.decoder_text_encoder
-        elif self.model_type.is_stable_cascade():
-            decoder_tokenizer = self.model.prior_tokenizer
-            decoder_text_encoder = self.model.prior_text_encoder
-
-        decoder_noise_scheduler = self.model.decoder_noise_scheduler
-        decoder_decoder = self.model.decoder_decoder
+    ):
         decoder_vqgan = self.model.decoder_vqgan
+        cfg_rescale = 0.7 if force_last_timestep else 0.0
+
+        batches = self._group_sample_params(sample_params_list, batch_size)
+        generators = [self._create_generator(sample_params) for sample_params in sample_params_list]
 
         with self.model.autocast_context:
-            image_embedding = self.__sample_prior(
-                prompt,
-                negative_prompt,
-                height,
-                width,
-                generator,
-                diffusion_steps,
-                cfg_scale,
-                cfg_rescale,
-                text_encoder_layer_skip,
-                prior_noise_scheduler,
-                prior_prior,
-                prior_text_encoder,
-                prior_tokenizer,
-                on_update_progress
+            # prepare all prompts in a single pass
+            prompts = [self.__prepare_prompt(sample_params.prompt) for sample_params in sample_params_list]
+            negative_prompts = [
+                self.__prepare_prompt(sample_params.negative_prompt) for sample_params in sample_params_list
+            ]
+
+            # the text encoders are only used for prompts that are not cached yet
+            prompt_embeddings, pooled_prompt_embeddings = self.__prior_prompt_cache.encode(
+                prompts=prompts + negative_prompts,
+                text_encoder_layer_skip=text_encoder_layer_skip,
+                version=PromptEmbeddingCache.text_encoder_version(
+                    self.model.prior_text_encoder, self.model.prior_text_encoder_lora
+                ),
+                encode_fun=lambda missing_prompts: self.__encode_missing_prior_prompts(
+                    missing_prompts, text_encoder_layer_skip
+                ),
+                device=self.train_device,
             )
 
-            latent_image = self.__sample_decoder(
-                prompt,
-                height,
-                width,
-                generator,
-                diffusion_steps,
-                text_encoder_layer_skip,
-                image_embedding,
-                decoder_tokenizer,
-                decoder_text_encoder,
-                decoder_noise_scheduler,
-                decoder_decoder,
-                on_update_progress,
-            )
+            negative_prompt_embeddings = prompt_embeddings[len(prompts):]
+            prompt_embeddings = prompt_embeddings[:len(prompts)]
+            if self.model_type.is_stable_cascade():
+                pooled_negative_prompt_embeddings = pooled_prompt_embeddings[len(prompts):]
+                pooled_prompt_embeddings = pooled_prompt_embeddings[:len(prompts)]
+            else:
+                pooled_negative_prompt_embeddings = None
 
-            # decode vqgan
-            self.model.decoder_vqgan_to(self.train_device)
+            if self.model_type.is_wuerstchen_v2():
+                decoder_prompt_embeddings, = self.__decoder_prompt_cache.encode(
+                    prompts=prompts,
+                    text_encoder_layer_skip=text_encoder_layer_skip,
+                    version=PromptEmbeddingCache.text_encoder_version(self.model.decoder_text_encoder),
+                    encode_fun=lambda missing_prompts: self.__encode_missing_decoder_prompts(
+                        missing_prompts, text_encoder_layer_skip
+                    ),
+                    device=self.train_device,
+                )
+            elif self.model_type.is_stable_cascade():
+                # the decoder is conditioned on the pooled output of the prior text encoder
+                decoder_prompt_embeddings = pooled_prompt_embeddings
+
+            # prior
+            image_embeddings = []
+            self.model.prior_prior_to(self.train_device)
+            for batch in batches:
+                image_embeddings.append(self.__sample_prior(
+                    sample_params_list=[sample_params_list[index] for index in batch],
+                    generators=[generators[index] for index in batch],
+                    prompt_embedding=prompt_embeddings[batch],
+                    pooled_prompt_embedding=
+                    pooled_prompt_embeddings[batch] if pooled_prompt_embeddings is not None else None,
+                    negative_prompt_embedding=negative_prompt_embeddings[batch],
+                    pooled_negative_prompt_embedding=
+                    pooled_negative_prompt_embeddings[batch] if pooled_negative_prompt_embeddings is not None else None,
+                    cfg_rescale=cfg_rescale,
+                    on_update_progress=on_update_progress,
+                ))
+            self.model.prior_prior_to(self.temp_device)
+            torch_gc()
 
-            latents = decoder_vqgan.config.scale_factor * latent_image
-            image_tensor = decoder_vqgan.decode(latents).sample.clamp(0, 1)
-            image_array = image_tensor.permute(0, 2, 3, 1).cpu().squeeze().float().numpy()
-            image_array = (image_array * 255).round().astype("uint8")
+            # decoder
+            latent_images = []
+            self.model.decoder_decoder_to(self.train_device)
+            for batch, image_embedding in zip(batches, image_embeddings):
+                latent_images.append(self.__sample_decoder(
+                    sample_params_list=[sample_params_list[index] for index in batch],
+                    generators=[generators[index] for index in batch],
+                    prompt_embedding=decoder_prompt_embeddings[batch],
+                    image_embedding=image_embedding,
+                    on_update_progress=on_update_progress,
+                ))
+            self.model.decoder_decoder_to(self.temp_device)
+            torch_gc()
 
+            # decode vqgan
+            self.model.decoder_vqgan_to(self.train_device)
+            for batch, latent_image in zip(batches, latent_images):
+                latents = decoder_vqgan.config.scale_factor * latent_image
+                image_tensor = decoder_vqgan.decode(latents).sample.clamp(0, 1)
+                image_array = image_tensor.permute(0, 2, 3, 1).cpu().float().numpy()
+                image_array = (image_array * 255).round().astype("uint8")
+
+                for index, array in zip(batch, image_array):
+                    image = Image.fromarray(array)
+                    self._save_image(image, destinations[index], image_format)
+                    on_sample(index, image)
             self.model.decoder_vqgan_to(self.temp_device)
             torch_gc()
 
-        return Image.fromarray(image_array)
-
     def sample(
             self,
             sample_params: SampleConfig,
@@ -386,34 +400,15 @@ class WuerstchenSampler(BaseModelSampler):
             image_format: ImageFormat,
             text_encoder_layer_skip: int,
             force_last_timestep: bool = False,
-            on_sample: Callable[[Image], None] = lambda _: None,
+            on_sample: Callable[[Image.Image], None] = lambda _: None,
             on_update_progress: Callable[[int, int], None] = lambda _, __: None,
     ):
-        prompt = sample_params.prompt
-        negative_prompt = sample_params.negative_prompt
-
-        if len(self.model.embeddings) > 0:
-            embedding_string = ''.join(self.model.embeddings[0].text_tokens)
-            prompt = prompt.replace("<embedding>", embedding_string)
-            negative_prompt = negative_prompt.replace("<embedding>", embedding_string)
-
-        image = self.__sample_base(
-            prompt=prompt,
-            negative_prompt=negative_prompt,
-            height=sample_params.height,
-            width=sample_params.width,
-            seed=sample_params.seed,
-            random_seed=sample_params.random_seed,
-            diffusion_steps=sample_params.diffusion_steps,
-            cfg_scale=sample_params.cfg_scale,
-            noise_scheduler=sample_params.noise_scheduler,
-            cfg_rescale=0.7 if force_last_timestep else 0.0,
+        self.sample_batch(
+            sample_params_list=[sample_params],
+            destinations=[destination],
+            image_format=image_format,
             text_encoder_layer_skip=text_encoder_layer_skip,
             force_last_timestep=force_last_timestep,
+            on_sample=lambda _, image: on_sample(image),
             on_update_progress=on_update_progress,
         )
-
-        os.makedirs(Path(destination).parent.absolute(), exist_ok=True)
-        image.save(destination, format=image_format.pil_format())
-
-        on_sample(image)
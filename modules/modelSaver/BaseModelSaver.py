@@ -1,16 +1,15 @@
 import copy
-import hashlib
 import json
+import os
 from abc import ABCMeta, abstractmethod
-from collections import OrderedDict
 from datetime import datetime
 
 import torch
-import safetensors.torch as safetensors
 from torch import Tensor
 
 from modules.model.BaseModel import BaseModel
-from modules.util import git_util
+from modules.util import git_util, safetensors_util
+from modules.util.IncrementalBackupStore import IncrementalBackupStore
 from modules.util.enum.ConfigPart import ConfigPart
 from modules.util.enum.ModelFormat import ModelFormat
 from modules.util.enum.ModelType import ModelType
@@ -44,26 +43,9 @@ class BaseModelSaver(metaclass=ABCMeta):
             else:
                 state_dict[key] = value.contiguous()
 
-    def __calculate_safetensors_hash(
-            self,
-            state_dict: dict[str, Tensor] | None = None,
-    ) -> str | None:
-        if state_dict is None:
-            return None
-
-        sha256_hash = hashlib.sha256()
-
-        ordered_state_dict = OrderedDict(sorted(state_dict.items()))
-        for key, tensor in ordered_state_dict.items():
-            data = safetensors._tobytes(tensor, key)
-            sha256_hash.update(data)
-
-        return f"0x{sha256_hash.hexdigest()}"
-
     def _create_safetensors_header(
             self,
             model: BaseModel,
-            state_dict: dict[str, Tensor] | None = None,
     ) -> dict[str, str]:
         if model.model_spec is not None:
             model_spec = copy.deepcopy(model.model_spec)
@@ -79,7 +61,8 @@ class BaseModelSaver(metaclass=ABCMeta):
 
         # update calculated fields
         model_spec.date = datetime.now().strftime("%Y-%m-%d")
-        model_spec.hash_sha256 = self.__calculate_safetensors_hash(state_dict)
+        # the hash is calculated while the file is written
+        model_spec.hash_sha256 = None
 
         # assemble the header
         model_spec_dict = model_spec.to_dict()
@@ -97,6 +80,60 @@ class BaseModelSaver(metaclass=ABCMeta):
             kohya_header["ss_v2"] = "True"
         return model_spec_dict | one_trainer_header | kohya_header
 
+    def _save_safetensors(
+            self,
+            model: BaseModel,
+            state_dict: dict[str, Tensor],
+            destination: str,
+            dtype: torch.dtype,
+    ):
+        """
+        Saves a flat state dict as a safetensors file. The tensors are converted to dtype one at a time while writing,
+        so no converted copy of the full state dict is created. The model spec hash is calculated from the written
+        bytes, without a separate serialization pass.
+        """
+        self._save_tensors(
+            state_dict,
+            destination,
+            self._create_safetensors_header(model),
+            dtype,
+            hash_key="modelspec.hash_sha256",
+        )
+
+    def _save_tensors(
+            self,
+            state_dict: dict[str, Tensor],
+            destination: str,
+            metadata: dict[str, str] | None = None,
+            dtype: torch.dtype | None = None,
+            hash_key: str | None = None,
+    ):
+        """
+        Saves a flat state dict as a safetensors file. If the file is part of an incremental backup, only the tensors
+        that are not yet stored are written.
+        """
+        backup = IncrementalBackupStore.active_backup(destination)
+        if backup is not None:
+            backup.save_safetensors(state_dict, destination, metadata, dtype, hash_key)
+        else:
+            safetensors_util.save_file(state_dict, destination, metadata, dtype, hash_key)
+
+    def _save_state(
+            self,
+            state: dict,
+            destination: str,
+    ):
+        """
+        Saves a state dict with torch.save(), like the optimizer or ema state. If the file is part of an incremental
+        backup, only the tensors that are not yet stored are written.
+        """
+        backup = IncrementalBackupStore.active_backup(destination)
+        if backup is not None:
+            backup.save_state(state, destination)
+        else:
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            torch.save(state, destination)
+
     @abstractmethod
     def save(
             self,
@@ -3,7 +3,6 @@ import os.path
 from pathlib import Path
 
 import torch
-from safetensors.torch import save_file
 from torch import Tensor
 
 from modules.model.BaseModel import BaseModel
@@ -46,10 +45,9 @@ class PixArtAlphaLoRAModelSaver(BaseModelSaver):
             dtype: torch.dtype,
     ):
         state_dict = self.__get_state_dict(model)
-        save_state_dict = self._convert_state_dict_dtype(state_dict, dtype)
 
         os.makedirs(Path(destination).parent.absolute(), exist_ok=True)
-        save_file(save_state_dict, destination, self._create_safetensors_header(model, save_state_dict))
+        self._save_safetensors(model, state_dict, destination, dtype)
 
     def __save_internal(
             self,
@@ -66,13 +64,11 @@ class PixArtAlphaLoRAModelSaver(BaseModelSaver):
         )
 
         # optimizer
-        os.makedirs(os.path.join(destination, "optimizer"), exist_ok=True)
-        torch.save(model.optimizer.state_dict(), os.path.join(destination, "optimizer", "optimizer.pt"))
+        self._save_state(model.optimizer.state_dict(), os.path.join(destination, "optimizer", "optimizer.pt"))
 
         # ema
         if model.ema:
-            os.makedirs(os.path.join(destination, "ema"), exist_ok=True)
-            torch.save(model.ema.state_dict(), os.path.join(destination, "ema", "ema.pt"))
+            self._save_state(model.ema.state_dict(), os.path.join(destination, "ema", "ema.pt"))
 
         # meta
         with open(os.path.join(destination, "meta.json"), "w") as meta_file:
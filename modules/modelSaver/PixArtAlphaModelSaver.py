@@ -4,7 +4,6 @@ import os.path
 from pathlib import Path
 
 import torch
-from safetensors.torch import save_file
 
 from modules.model.BaseModel import BaseModel
 from modules.model.PixArtAlphaModel import PixArtAlphaModel
@@ -69,12 +68,10 @@ class PixArtAlphaModelSaver(BaseModelSaver):
         state_dict = convert_pixart_diffusers_to_ckpt(
             model.transformer.state_dict(),
         )
-        save_state_dict = self._convert_state_dict_dtype(state_dict, dtype)
-        self._convert_state_dict_to_contiguous(save_state_dict)
 
         os.makedirs(Path(destination).parent.absolute(), exist_ok=True)
 
-        save_file(save_state_dict, destination, self._create_safetensors_header(model, save_state_dict))
+        self._save_safetensors(model, state_dict, destination, dtype)
 
     def __save_internal(
             self,
@@ -3,7 +3,6 @@ import os.path
 from pathlib import Path
 
 import torch
-from safetensors.torch import save_file
 
 from modules.model.BaseModel import BaseModel
 from modules.model.StableDiffusionModel import StableDiffusionModel
@@ -58,7 +57,7 @@ class StableDiffusionEmbeddingModelSaver(
             model.embeddings[0].text_tokens,
         ).to("cpu", dtype)
 
-        save_file(
+        self._save_tensors(
             {"emp_params": vector_cpu},
             destination
         )
@@ -78,13 +77,11 @@ class StableDiffusionEmbeddingModelSaver(
         )
 
         # optimizer
-        os.makedirs(os.path.join(destination, "optimizer"), exist_ok=True)
-        torch.save(model.optimizer.state_dict(), os.path.join(destination, "optimizer", "optimizer.pt"))
+        self._save_state(model.optimizer.state_dict(), os.path.join(destination, "optimizer", "optimizer.pt"))
 
         # ema
         if model.ema:
-            os.makedirs(os.path.join(destination, "ema"), exist_ok=True)
-            torch.save(model.ema.state_dict(), os.path.join(destination, "ema", "ema.pt"))
+            self._save_state(model.ema.state_dict(), os.path.join(destination, "ema", "ema.pt"))
 
         # meta
         with open(os.path.join(destination, "meta.json"), "w") as meta_file:
@@ -3,7 +3,6 @@ import os.path
 from pathlib import Path
 
 import torch
-from safetensors.torch import save_file
 
 from modules.model.BaseModel import BaseModel
 from modules.model.StableDiffusionXLModel import StableDiffusionXLModel
@@ -66,7 +65,7 @@ class StableDiffusionXLEmbeddingModelSaver(
             model.embeddings[0].text_tokens,
         ).to("cpu", dtype)
 
-        save_file(
+        self._save_tensors(
             {
                 "clip_l": text_encoder_1_vector_cpu,
                 "clip_g": text_encoder_2_vector_cpu,
@@ -89,13 +88,11 @@ class StableDiffusionXLEmbeddingModelSaver(
         )
 
         # optimizer
-        os.makedirs(os.path.join(destination, "optimizer"), exist_ok=True)
-        torch.save(model.optimizer.state_dict(), os.path.join(destination, "optimizer", "optimizer.pt"))
+        self._save_state(model.optimizer.state_dict(), os.path.join(destination, "optimizer", "optimizer.pt"))
 
         # ema
         if model.ema:
-            os.makedirs(os.path.join(destination, "ema"), exist_ok=True)
-            torch.save(model.ema.state_dict(), os.path.join(destination, "ema", "ema.pt"))
+            self._save_state(model.ema.state_dict(), os.path.join(destination, "ema", "ema.pt"))
 
         # meta
         with open(os.path.join(destination, "meta.json"), "w") as meta_file:
@@ -4,7 +4,6 @@ import os.path
 from pathlib import Path
 
 import torch
-from safetensors.torch import save_file
 
 from modules.model.BaseModel import BaseModel
 from modules.model.WuerstchenModel import WuerstchenModel
@@ -80,21 +79,19 @@ class WuerstchenModelSaver(BaseModelSaver):
             unet_state_dict = convert_stable_cascade_diffusers_to_ckpt(
                 model.prior_prior.state_dict(),
             )
-            unet_save_state_dict = self._convert_state_dict_dtype(unet_state_dict, dtype)
-            self._convert_state_dict_to_contiguous(unet_save_state_dict)
-            save_file(
-                unet_save_state_dict,
+            self._save_safetensors(
+                model,
+                unet_state_dict,
                 os.path.join(destination, "stage_c.safetensors"),
-                self._create_safetensors_header(model, unet_save_state_dict)
+                dtype,
             )
 
             te_state_dict = model.prior_text_encoder.state_dict()
-            te_save_state_dict = self._convert_state_dict_dtype(te_state_dict, dtype)
-            self._convert_state_dict_to_contiguous(te_save_state_dict)
-            save_file(
-                te_save_state_dict,
+            self._save_safetensors(
+                model,
+                te_state_dict,
                 os.path.join(destination, "text_encoder.safetensors"),
-                self._create_safetensors_header(model, te_save_state_dict)
+                dtype,
             )
         else:
             raise NotImplementedError
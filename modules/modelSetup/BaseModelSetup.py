@@ -6,6 +6,7 @@ from torch import Tensor
 from torch.nn import Parameter
 
 from modules.model.BaseModel import BaseModel
+from modules.util import create
 from modules.util.TimedActionMixin import TimedActionMixin
 from modules.util.TrainProgress import TrainProgress
 from modules.util.config.TrainConfig import TrainConfig
@@ -28,6 +29,9 @@ class BaseModelSetup(
         self.temp_device = temp_device
         self.debug_mode = debug_mode
 
+        # if False, setup_model() does not create an optimizer. used for models that are only sampled
+        self.optimizer_enabled = True
+
     @abstractmethod
     def create_parameters(
             self,
@@ -43,6 +47,19 @@ class BaseModelSetup(
     ) -> Iterable[Parameter] | list[dict]:
         return self.create_parameters(model, config)
 
+    def _create_optimizer(
+            self,
+            model: BaseModel,
+            config: TrainConfig,
+    ):
+        if self.optimizer_enabled:
+            model.optimizer = create.create_optimizer(
+                self.create_parameters_for_optimizer(model, config), model.optimizer_state_dict, config
+            )
+        else:
+            model.optimizer = None
+        del model.optimizer_state_dict
+
     @abstractmethod
     def setup_model(
             self,
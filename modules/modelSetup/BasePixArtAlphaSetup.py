@@ -13,6 +13,7 @@ from modules.modelSetup.mixin.ModelSetupDebugMixin import ModelSetupDebugMixin
 from modules.modelSetup.mixin.ModelSetupDiffusionLossMixin import ModelSetupDiffusionLossMixin
 from modules.modelSetup.mixin.ModelSetupDiffusionNoiseMixin import ModelSetupDiffusionNoiseMixin
 from modules.modelSetup.stableDiffusion.checkpointing_util import create_checkpointed_forward
+from modules.util import distributed_util
 from modules.util.TrainProgress import TrainProgress
 from modules.util.config.TrainConfig import TrainConfig
 from modules.util.dtype_util import create_autocast_context, disable_fp16_autocast_context
@@ -139,7 +140,7 @@ class BasePixArtAlphaSetup(
     ) -> dict:
         with model.autocast_context:
             generator = torch.Generator(device=config.train_device)
-            generator.manual_seed(train_progress.global_step)
+            generator.manual_seed(distributed_util.rank_seed(train_progress.step_seed()))
             rand = Random(train_progress.global_step)
 
             is_align_prop_step = config.align_prop and (rand.random() < config.align_prop_probability)
@@ -15,6 +15,7 @@ from modules.modelSetup.mixin.ModelSetupDiffusionNoiseMixin import ModelSetupDif
 from modules.modelSetup.stableDiffusion.checkpointing_util import \
     enable_checkpointing_for_transformer_blocks, enable_checkpointing_for_clip_encoder_layers, \
     create_checkpointed_forward
+from modules.util import distributed_util
 from modules.util.TrainProgress import TrainProgress
 from modules.util.config.TrainConfig import TrainConfig
 from modules.util.dtype_util import create_autocast_context, disable_fp16_autocast_context
@@ -142,7 +143,7 @@ class BaseStableDiffusionXLSetup(
     ) -> dict:
         with model.autocast_context:
             generator = torch.Generator(device=config.train_device)
-            generator.manual_seed(train_progress.global_step)
+            generator.manual_seed(distributed_util.rank_seed(train_progress.step_seed()))
             rand = Random(train_progress.global_step)
 
             is_align_prop_step = config.align_prop and (rand.random() < config.align_prop_probability)
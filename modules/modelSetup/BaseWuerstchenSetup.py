@@ -12,6 +12,7 @@ from modules.modelSetup.mixin.ModelSetupDiffusionLossMixin import ModelSetupDiff
 from modules.modelSetup.mixin.ModelSetupDiffusionNoiseMixin import ModelSetupDiffusionNoiseMixin
 from modules.modelSetup.stableDiffusion.checkpointing_util import enable_checkpointing_for_clip_encoder_layers, \
     enable_checkpointing_for_stable_cascade_blocks
+from modules.util import distributed_util
 from modules.util.TrainProgress import TrainProgress
 from modules.util.config.TrainConfig import TrainConfig
 from modules.util.dtype_util import create_autocast_context, disable_fp16_autocast_context, \
@@ -124,7 +125,7 @@ class BaseWuerstchenSetup(
                 scaled_latent_image = latent_image
 
             generator = torch.Generator(device=config.train_device)
-            generator.manual_seed(train_progress.global_step)
+            generator.manual_seed(distributed_util.rank_seed(train_progress.step_seed()))
 
             latent_noise = self._create_noise(scaled_latent_image, config, generator)
 
@@ -108,10 +108,7 @@ class PixArtAlphaLoRASetup(BasePixArtAlphaSetup):
             model.transformer_lora.hook_to_module()
             model.transformer_lora.to(dtype=config.lora_weight_dtype.torch_dtype())
 
-        model.optimizer = create.create_optimizer(
-            self.create_parameters_for_optimizer(model, config), model.optimizer_state_dict, config
-        )
-        del model.optimizer_state_dict
+        self._create_optimizer(model, config)
 
         model.ema = create.create_ema(
             self.create_parameters(model, config), model.ema_state_dict, config
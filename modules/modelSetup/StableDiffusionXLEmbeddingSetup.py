@@ -114,10 +114,7 @@ class StableDiffusionXLEmbeddingSetup(
         model.all_text_encoder_2_original_token_embeds = original_token_embeds_2
         model.text_encoder_2_untrainable_token_embeds_mask = untrainable_token_ids_2
 
-        model.optimizer = create.create_optimizer(
-            self.create_parameters_for_optimizer(model, config), model.optimizer_state_dict, config
-        )
-        del model.optimizer_state_dict
+        self._create_optimizer(model, config)
 
         model.ema = create.create_ema(
             self.create_parameters(model, config), model.ema_state_dict, config
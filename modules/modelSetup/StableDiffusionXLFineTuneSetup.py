@@ -85,10 +85,7 @@ class StableDiffusionXLFineTuneSetup(BaseStableDiffusionXLSetup):
 
         model.vae.requires_grad_(False)
 
-        model.optimizer = create.create_optimizer(
-            self.create_parameters_for_optimizer(model, config), model.optimizer_state_dict, config
-        )
-        del model.optimizer_state_dict
+        self._create_optimizer(model, config)
 
         model.ema = create.create_ema(
             self.create_parameters(model, config), model.ema_state_dict, config
@@ -85,10 +85,7 @@ class WuerstchenEmbeddingSetup(
         model.all_prior_text_encoder_original_token_embeds = original_token_embeds
         model.prior_text_encoder_untrainable_token_embeds_mask = untrainable_token_ids
 
-        model.optimizer = create.create_optimizer(
-            self.create_parameters_for_optimizer(model, config), model.optimizer_state_dict, config
-        )
-        del model.optimizer_state_dict
+        self._create_optimizer(model, config)
 
         model.ema = create.create_ema(
             self.create_parameters(model, config), model.ema_state_dict, config
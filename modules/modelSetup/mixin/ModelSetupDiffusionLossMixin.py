@@ -182,9 +182,10 @@ class ModelSetupDiffusionLossMixin(metaclass=ABCMeta):
             alphas_cumprod_fun: Callable[[Tensor, int], Tensor] | None = None,
     ) -> Tensor:
         loss_weight = batch['loss_weight']
+        # batches can have different sizes, and micro-batches still scale by the size of their whole batch
         batch_size_scale = \
             1 if config.loss_scaler in [LossScaler.NONE, LossScaler.GRADIENT_ACCUMULATION] \
-                else config.batch_size
+                else batch.get('batch_length', loss_weight.shape[0])
         gradient_accumulation_steps_scale = \
             1 if config.loss_scaler in [LossScaler.NONE, LossScaler.BATCH] \
                 else config.gradient_accumulation_steps
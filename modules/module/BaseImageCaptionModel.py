@@ -1,5 +1,7 @@
 import os
 from abc import ABCMeta, abstractmethod
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
 from typing import Callable
 
 from PIL import Image
@@ -89,6 +91,69 @@ class BaseImageCaptionModel(metaclass=ABCMeta):
         """
         pass
 
+    def generate_captions(
+            self,
+            caption_samples: list[CaptionSample],
+            initial_caption: str = "",
+    ) -> list[str]:
+        """
+        Generates captions for a batch of CaptionSamples. Models that support batched inference override this.
+
+        Args:
+            caption_samples (`list[CaptionSample]`): the samples to caption
+            initial_caption (`str`): the initial caption
+
+        Returns: the generated captions, in the order of caption_samples
+        """
+        return [self.generate_caption(caption_sample, initial_caption) for caption_sample in caption_samples]
+
+    def _prepare_image(self, image: Image) -> Image:
+        """
+        Converts a loaded image into the input format of the model. Runs on the loader threads.
+        """
+        return image
+
+    def __load_sample(self, filename: str, mode: str) -> CaptionSample | None:
+        caption_sample = CaptionSample(filename)
+
+        existing_caption = caption_sample.get_caption()
+        if mode == 'fill' and existing_caption is not None and existing_caption != "":
+            return None
+
+        caption_sample.image = self._prepare_image(caption_sample.get_image())
+        return caption_sample
+
+    @staticmethod
+    def __apply_caption(caption_sample: CaptionSample, predicted_caption: str, mode: str):
+        if mode == 'replace' or mode == 'fill':
+            caption_sample.set_caption(predicted_caption)
+
+        if mode == 'add':
+            caption_sample.add_caption(predicted_caption)
+
+        caption_sample.save_caption()
+
+    def __caption_batch(
+            self,
+            caption_samples: list[CaptionSample],
+            initial_caption: str,
+            mode: str,
+            save_executor: ThreadPoolExecutor,
+            error_callback: Callable[[str], None] | None,
+    ):
+        try:
+            predicted_captions = self.generate_captions(caption_samples, initial_caption)
+        except Exception:
+            if error_callback is not None:
+                for caption_sample in caption_samples:
+                    error_callback(caption_sample.image_filename)
+            return
+
+        for caption_sample, predicted_caption in zip(caption_samples, predicted_captions):
+            # the image is not needed anymore, only the caption is written
+            caption_sample.image = None
+            save_executor.submit(self.__apply_caption, caption_sample, predicted_caption, mode)
+
     def caption_image(
             self,
             filename: str,
@@ -129,10 +194,15 @@ class BaseImageCaptionModel(metaclass=ABCMeta):
             mode: str = 'fill',
             progress_callback: Callable[[int, int], None] = None,
             error_callback: Callable[[str], None] = None,
+            batch_size: int = 1,
+            num_workers: int = 4,
     ):
         """
         Captions all samples in a list
 
+        Images are loaded and resized on a pool of num_workers threads while the model captions the previous batch.
+        Caption files are written on a separate thread.
+
         Parameters:
             filenames (`[str]`): a list of sample filenames
             initial_caption (`str`): an initial caption. the generated caption will start with this string
@@ -142,18 +212,59 @@ class BaseImageCaptionModel(metaclass=ABCMeta):
                 - add: creates a new caption for all samples, appending if a caption already exists
             progress_callback (`Callable[[int, int], None]`): called after every processed image
             error_callback (`Callable[[str], None]`): called for every exception
+            batch_size (`int`): number of images captioned in a single model call
+            num_workers (`int`): number of threads used to load images
         """
 
+        batch_size = max(1, batch_size)
+        lookahead = max(batch_size, num_workers) * 2
+
         if progress_callback is not None:
             progress_callback(0, len(filenames))
-        for i, filename in enumerate(tqdm(filenames)):
-            try:
-                self.caption_image(filename, initial_caption, mode)
-            except Exception as e:
-                if error_callback is not None:
-                    error_callback(filename)
-            if progress_callback is not None:
-                progress_callback(i + 1, len(filenames))
+
+        with ThreadPoolExecutor(max_workers=max(1, num_workers), thread_name_prefix='CaptionLoad') as load_executor, \
+                ThreadPoolExecutor(max_workers=1, thread_name_prefix='CaptionSave') as save_executor:
+            pending: deque[tuple[str, Future]] = deque()
+            remaining_filenames = iter(filenames)
+            batch = []
+            processed = 0
+
+            with tqdm(total=len(filenames)) as progress_bar:
+                def on_processed(count: int):
+                    nonlocal processed
+                    processed += count
+                    progress_bar.update(count)
+                    if progress_callback is not None:
+                        progress_callback(processed, len(filenames))
+
+                while True:
+                    # keeps a bounded number of images loading ahead of the model
+                    while len(pending) < lookahead:
+                        filename = next(remaining_filenames, None)
+                        if filename is None:
+                            break
+                        pending.append((filename, load_executor.submit(self.__load_sample, filename, mode)))
+
+                    if not pending:
+                        break
+
+                    filename, future = pending.popleft()
+                    try:
+                        caption_sample = future.result()
+                    except Exception:
+                        caption_sample = None
+                        if error_callback is not None:
+                            error_callback(filename)
+
+                    if caption_sample is None:
+                        on_processed(1)
+                    else:
+                        batch.append(caption_sample)
+
+                    if len(batch) >= batch_size or (not pending and batch):
+                        self.__caption_batch(batch, initial_caption, mode, save_executor, error_callback)
+                        on_processed(len(batch))
+                        batch = []
 
     def caption_folder(
             self,
@@ -163,6 +274,8 @@ class BaseImageCaptionModel(metaclass=ABCMeta):
             progress_callback: Callable[[int, int], None] = None,
             error_callback: Callable[[str], None] = None,
             include_subdirectories: bool = False,
+            batch_size: int = 1,
+            num_workers: int = 4,
     ):
         """
         Captions all samples in a folder
@@ -177,6 +290,8 @@ class BaseImageCaptionModel(metaclass=ABCMeta):
             progress_callback (`Callable[[int, int], None]`): called after every processed image
             error_callback (`Callable[[str], None]`): called for every exception
             include_subdirectories (`bool`): whether to include subfolders when processing samples
+            batch_size (`int`): number of images captioned in a single model call
+            num_workers (`int`): number of threads used to load images
         """
 
         filenames = self.__get_sample_filenames(sample_dir, include_subdirectories)
@@ -186,4 +301,6 @@ class BaseImageCaptionModel(metaclass=ABCMeta):
             mode=mode,
             progress_callback=progress_callback,
             error_callback=error_callback,
+            batch_size=batch_size,
+            num_workers=num_workers,
         )
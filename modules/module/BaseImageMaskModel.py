@@ -1,6 +1,9 @@
 import os
 from abc import ABCMeta, abstractmethod
-from typing import Callable
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from queue import Queue, Empty
+from typing import Callable, Any
 
 import torch
 from PIL import Image
@@ -133,6 +136,110 @@ class BaseImageMaskModel(metaclass=ABCMeta):
         return filenames
 
     @abstractmethod
+    def predict_masks(
+            self,
+            mask_samples: list[MaskSample],
+            model_inputs: list[Any],
+            prompts: list[str],
+            threshold: float = 0.3,
+            smooth_pixels: int = 5,
+            expand_pixels: int = 10,
+    ) -> list[Tensor]:
+        """
+        Predicts the masks of a batch of samples
+
+        Parameters:
+            mask_samples (`[MaskSample]`): the samples to mask
+            model_inputs (`[Any]`): the inputs returned by _prepare_input for each sample
+            prompts (`[str]`): a list of prompts used to create a mask
+            threshold (`float`): threshold for including pixels in the mask
+            smooth_pixels (`int`): radius of a smoothing operation applied to the generated mask
+            expand_pixels (`int`): amount of expansion of the generated mask in all directions
+
+        Returns: a mask of shape (1, 1, height, width) for each sample, in the order of mask_samples
+        """
+        pass
+
+    def _prepare_input(self, mask_sample: MaskSample) -> Any:
+        """
+        Converts the image of a sample into the input format of the model. Runs on the loader threads.
+        """
+        return None
+
+    def _inverted_masks(self) -> bool:
+        """
+        Whether the predicted masks are inverted before they are added to or subtracted from existing masks.
+        """
+        return False
+
+    @staticmethod
+    def _group_by_size(mask_samples: list[MaskSample]) -> list[list[int]]:
+        """
+        Groups the indices of samples with the same image size, to process their masks in a single batch.
+        """
+        groups = {}
+        for i, mask_sample in enumerate(mask_samples):
+            groups.setdefault((mask_sample.height, mask_sample.width), []).append(i)
+        return list(groups.values())
+
+    def __load_sample(self, filename: str, mode: str) -> tuple[MaskSample, Any] | None:
+        mask_sample = MaskSample(filename, self.device)
+
+        if mode == 'fill' and mask_sample.get_mask_tensor() is not None:
+            return None
+
+        if mode in {'add', 'subtract', 'blend'}:
+            # these modes combine the new mask with the existing one
+            mask_sample.get_mask_tensor()
+
+        mask_sample.get_image()
+        return mask_sample, self._prepare_input(mask_sample)
+
+    def __mask_batch(
+            self,
+            loaded_samples: list[tuple[MaskSample, Any]],
+            prompts: list[str],
+            mode: str,
+            alpha: float,
+            threshold: float,
+            smooth_pixels: int,
+            expand_pixels: int,
+            save_executor: ThreadPoolExecutor,
+            saved_masks: Queue,
+            error_callback: Callable[[str], None] | None,
+    ) -> int:
+        """
+        Masks a batch of samples and submits their masks to save_executor. Once a mask is written, or writing it
+        failed, its filename and exception are put into saved_masks. Returns the number of submitted masks.
+        """
+        mask_samples = [mask_sample for mask_sample, _ in loaded_samples]
+        try:
+            with torch.no_grad():
+                predicted_masks = self.predict_masks(
+                    mask_samples,
+                    [model_input for _, model_input in loaded_samples],
+                    prompts,
+                    threshold,
+                    smooth_pixels,
+                    expand_pixels,
+                )
+            for mask_sample, predicted_mask in zip(mask_samples, predicted_masks):
+                mask_sample.apply_mask(mode, predicted_mask, alpha, self._inverted_masks())
+                # the image is not needed anymore, only the mask is written
+                mask_sample.image = None
+        except Exception:
+            if error_callback is not None:
+                for mask_sample in mask_samples:
+                    error_callback(mask_sample.image_filename)
+            return 0
+
+        for mask_sample in mask_samples:
+            future = save_executor.submit(mask_sample.save_mask)
+            future.add_done_callback(
+                lambda f, filename=mask_sample.image_filename: saved_masks.put((filename, f.exception()))
+            )
+        return len(mask_samples)
+
     def mask_image(
             self,
             filename: str,
@@ -160,7 +267,18 @@ class BaseImageMaskModel(metaclass=ABCMeta):
             smooth_pixels (`int`): radius of a smoothing operation applied to the generated mask
             expand_pixels (`int`): amount of expansion of the generated mask in all directions
         """
-        pass
+        loaded_sample = self.__load_sample(filename, mode)
+        if loaded_sample is None:
+            return
+
+        mask_sample, model_input = loaded_sample
+        with torch.no_grad():
+            predicted_mask = self.predict_masks(
+                [mask_sample], [model_input], prompts, threshold, smooth_pixels, expand_pixels
+            )[0]
+        mask_sample.apply_mask(mode, predicted_mask, alpha, self._inverted_masks())
+
+        mask_sample.save_mask()
 
     def mask_images(
             self,
@@ -173,10 +291,16 @@ class BaseImageMaskModel(metaclass=ABCMeta):
             expand_pixels: int = 10,
             progress_callback: Callable[[int, int], None] = None,
             error_callback: Callable[[str], None] = None,
+            batch_size: int = 1,
+            num_workers: int = 4,
     ):
         """
         Masks all samples in a list
 
+        Images are loaded and preprocessed on a pool of num_workers threads while the model masks the previous batch.
+        Mask files are written on a second pool of num_workers threads. An image counts as processed once its mask is
+        written. The callbacks are always called on the calling thread.
+
         Parameters:
             filenames (`[str]`): a list of sample filenames
             prompts (`[str]`): a list of prompts used to create a mask
@@ -192,18 +316,84 @@ class BaseImageMaskModel(metaclass=ABCMeta):
             expand_pixels (`int`): amount of expansion of the generated mask in all directions
             progress_callback (`Callable[[int, int], None]`): called after every processed image
             error_callback (`Callable[[str], None]`): called for every exception
+            batch_size (`int`): number of images masked in a single model call
+            num_workers (`int`): number of threads used to load images and to write masks
         """
 
+        batch_size = max(1, batch_size)
+        num_workers = max(1, num_workers)
+        lookahead = max(batch_size, num_workers) * 2
+
         if progress_callback is not None:
             progress_callback(0, len(filenames))
-        for i, filename in enumerate(tqdm(filenames)):
-            try:
-                self.mask_image(filename, prompts, mode, alpha, threshold, smooth_pixels, expand_pixels)
-            except Exception as e:
-                if error_callback is not None:
-                    error_callback(filename)
-            if progress_callback is not None:
-                progress_callback(i + 1, len(filenames))
+
+        with ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix='MaskLoad') as load_executor, \
+                ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix='MaskSave') as save_executor:
+            pending: deque[tuple[str, Future]] = deque()
+            remaining_filenames = iter(filenames)
+            batch = []
+            processed = 0
+            # (filename, exception) of every finished mask write
+            saved_masks = Queue()
+            pending_saves = 0
+
+            with tqdm(total=len(filenames)) as progress_bar:
+                def on_processed(count: int):
+                    nonlocal processed
+                    processed += count
+                    progress_bar.update(count)
+                    if progress_callback is not None:
+                        progress_callback(processed, len(filenames))
+
+                def on_saved(block: bool):
+                    nonlocal pending_saves
+                    while pending_saves > 0:
+                        try:
+                            filename, exception = saved_masks.get(block=block)
+                        except Empty:
+                            return
+                        pending_saves -= 1
+                        if exception is not None and error_callback is not None:
+                            error_callback(filename)
+                        on_processed(1)
+
+                while True:
+                    on_saved(block=False)
+
+                    # keeps a bounded number of images loading ahead of the model
+                    while len(pending) < lookahead:
+                        filename = next(remaining_filenames, None)
+                        if filename is None:
+                            break
+                        pending.append((filename, load_executor.submit(self.__load_sample, filename, mode)))
+
+                    if not pending:
+                        break
+
+                    filename, future = pending.popleft()
+                    try:
+                        loaded_sample = future.result()
+                    except Exception:
+                        loaded_sample = None
+                        if error_callback is not None:
+                            error_callback(filename)
+
+                    if loaded_sample is None:
+                        on_processed(1)
+                    else:
+                        batch.append(loaded_sample)
+
+                    if len(batch) >= batch_size or (not pending and batch):
+                        saving = self.__mask_batch(
+                            batch, prompts, mode, alpha, threshold, smooth_pixels, expand_pixels,
+                            save_executor, saved_masks, error_callback,
+                        )
+                        pending_saves += saving
+                        # samples that could not be masked are done, the others once their mask is written
+                        on_processed(len(batch) - saving)
+                        batch = []
+
+                on_saved(block=True)
 
     def mask_folder(
             self,
@@ -217,6 +407,8 @@ class BaseImageMaskModel(metaclass=ABCMeta):
             progress_callback: Callable[[int, int], None] = None,
             error_callback: Callable[[str], None] = None,
             include_subdirectories: bool = False,
+            batch_size: int = 1,
+            num_workers: int = 4,
     ):
         """
         Masks all samples in a folder
@@ -237,6 +429,8 @@ class BaseImageMaskModel(metaclass=ABCMeta):
             progress_callback (`Callable[[int, int], None]`): called after every processed image
             error_callback (`Callable[[str], None]`): called for every exception
             include_subdirectories (`bool`): whether to include subdirectories when processing samples
+            batch_size (`int`): number of images masked in a single model call
+            num_workers (`int`): number of threads used to load images and to write masks
         """
 
         filenames = self.__get_sample_filenames(sample_dir, include_subdirectories)
@@ -250,4 +444,6 @@ class BaseImageMaskModel(metaclass=ABCMeta):
             expand_pixels=expand_pixels,
             progress_callback=progress_callback,
             error_callback=error_callback,
+            batch_size=batch_size,
+            num_workers=num_workers,
         )
@@ -1,8 +1,7 @@
 import os
-from typing import Optional, Tuple
+from typing import Optional, Tuple, Any
 
 import numpy as np
-import onnxruntime
 import pooch
 import torch
 from PIL import Image
@@ -11,6 +10,7 @@ from torch import Tensor, nn
 from torchvision.transforms import functional, transforms
 
 from modules.module.BaseImageMaskModel import BaseImageMaskModel, MaskSample
+from modules.util.OnnxSessionPool import OnnxSessionPool, OnnxSession
 
 
 class BaseRembgModel(BaseImageMaskModel):
@@ -21,6 +21,7 @@ class BaseRembgModel(BaseImageMaskModel):
             model_md5: str,
             device: torch.device,
             dtype: torch.dtype,
+            session_pool: OnnxSessionPool | None = None,
     ):
         self.model_filename = model_filename
         self.model_path = model_path
@@ -28,7 +29,7 @@ class BaseRembgModel(BaseImageMaskModel):
         self.device = device
         self.dtype = dtype
 
-        self.model = self.__load_model()
+        self.model = self.__load_model(OnnxSessionPool.default() if session_pool is None else session_pool)
 
         self.smoothing_kernel_radius = None
         self.smoothing_kernel = self.__create_average_kernel(self.smoothing_kernel_radius)
@@ -40,7 +41,7 @@ class BaseRembgModel(BaseImageMaskModel):
             transforms.ToTensor(),
         ])
 
-    def __load_model(self) -> onnxruntime.InferenceSession:
+    def __load_model(self, session_pool: OnnxSessionPool) -> OnnxSession:
         path = os.path.join("external", "models", "rembg")
 
         pooch.retrieve(
@@ -51,11 +52,7 @@ class BaseRembgModel(BaseImageMaskModel):
             progressbar=True,
         )
 
-        if self.device.type == 'cpu':
-            provider = "CPUExecutionProvider"
-        else:
-            provider = "CUDAExecutionProvider" if "CUDAExecutionProvider" in onnxruntime.get_available_providers() else "CPUExecutionProvider"
-        return onnxruntime.InferenceSession(os.path.join(path, self.model_filename), providers=[provider])
+        return session_pool.get_session(os.path.join(path, self.model_filename), self.device)
 
     def __create_average_kernel(self, kernel_radius: Optional[int]):
         if kernel_radius is None:
@@ -108,21 +105,7 @@ class BaseRembgModel(BaseImageMaskModel):
 
         return np.expand_dims(tmpImg, 0).astype(np.float32)
 
-    def mask_image(
-            self,
-            filename: str,
-            prompts: [str],
-            mode: str = 'fill',
-            alpha: float = 1.0,
-            threshold: float = 0.3,
-            smooth_pixels: int = 5,
-            expand_pixels: int = 10
-    ):
-        mask_sample = MaskSample(filename, self.device)
-
-        if mode == 'fill' and mask_sample.get_mask_tensor() is not None:
-            return
-
+    def __update_kernels(self, smooth_pixels: int, expand_pixels: int):
         if self.smoothing_kernel_radius != smooth_pixels:
             self.smoothing_kernel = self.__create_average_kernel(smooth_pixels)
             self.smoothing_kernel_radius = smooth_pixels
@@ -131,29 +114,43 @@ class BaseRembgModel(BaseImageMaskModel):
             self.expand_kernel = self.__create_average_kernel(expand_pixels)
             self.expand_kernel_radius = expand_pixels
 
-        image = mask_sample.get_image()
-
-        normalized_image = self.__normalize(
-            image,
+    def _prepare_input(self, mask_sample: MaskSample) -> ndarray:
+        return self.__normalize(
+            mask_sample.get_image(),
             (0.485, 0.456, 0.406),
             (0.229, 0.224, 0.225),
             (320, 320)
         )
 
+    def predict_masks(
+            self,
+            mask_samples: list[MaskSample],
+            model_inputs: list[Any],
+            prompts: list[str],
+            threshold: float = 0.3,
+            smooth_pixels: int = 5,
+            expand_pixels: int = 10,
+    ) -> list[Tensor]:
+        self.__update_kernels(smooth_pixels, expand_pixels)
+
         input_name = self.model.get_inputs()[0].name
-        mask = self.model.run(None, {input_name: normalized_image})
+        mask = self.model.run(None, {input_name: np.concatenate(model_inputs)})[0]
 
-        mask = mask[0][:, 0, :, :]
+        mask = mask[:, 0, :, :]
 
-        ma = np.max(mask)
-        mi = np.min(mask)
+        # normalizes each mask separately
+        ma = np.max(mask, axis=(1, 2), keepdims=True)
+        mi = np.min(mask, axis=(1, 2), keepdims=True)
 
         mask = (mask - mi) / (ma - mi)
-        mask = np.squeeze(mask)
 
-        output = torch.from_numpy(mask).to(self.device)
+        output = torch.from_numpy(mask).to(self.device).unsqueeze(1)
 
-        predicted_mask = self.__process_mask(output, mask_sample.height, mask_sample.width, threshold)
-        mask_sample.apply_mask(mode, predicted_mask, alpha, False)
+        predicted_masks = [None] * len(mask_samples)
+        for indices in self._group_by_size(mask_samples):
+            mask_sample = mask_samples[indices[0]]
+            masks = self.__process_mask(output[indices], mask_sample.height, mask_sample.width, threshold)
+            for i, predicted_mask in zip(indices, masks):
+                predicted_masks[i] = predicted_mask.unsqueeze(0)
 
-        mask_sample.save_mask()
+        return predicted_masks
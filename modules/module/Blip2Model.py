@@ -1,4 +1,5 @@
 import torch
+from PIL import Image
 from transformers import AutoProcessor, Blip2ForConditionalGeneration
 
 from modules.module.BaseImageCaptionModel import CaptionSample, BaseImageCaptionModel
@@ -18,16 +19,29 @@ class Blip2Model(BaseImageCaptionModel):
         self.model.eval()
         self.model.to(self.device)
 
-    def generate_caption(
+    def _prepare_image(self, image: Image) -> Image:
+        # resizing on the loader threads, the processor only normalizes the resized images
+        size = self.processor.image_processor.size
+        return image.resize((size['width'], size['height']), Image.BICUBIC)
+
+    def generate_captions(
             self,
-            caption_sample: CaptionSample,
+            caption_samples: list[CaptionSample],
             initial_caption: str = "",
-    ) -> str:
-        inputs = self.processor(caption_sample.get_image(), initial_caption, return_tensors="pt")
+    ) -> list[str]:
+        images = [caption_sample.get_image() for caption_sample in caption_samples]
+        inputs = self.processor(images, [initial_caption] * len(images), return_tensors="pt")
         inputs = inputs.to(self.device, self.dtype)
         with torch.no_grad():
             outputs = self.model.generate(**inputs)
-        predicted_caption = self.processor.decode(outputs[0], skip_special_tokens=True)
-        predicted_caption = (initial_caption + predicted_caption).strip()
+        predicted_captions = self.processor.batch_decode(outputs, skip_special_tokens=True)
+        predicted_captions = [(initial_caption + predicted_caption).strip() for predicted_caption in predicted_captions]
+
+        return predicted_captions
 
-        return predicted_caption
+    def generate_caption(
+            self,
+            caption_sample: CaptionSample,
+            initial_caption: str = "",
+    ) -> str:
+        return self.generate_captions([caption_sample], initial_caption)[0]
@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Optional, Any
 
 import torch
 from torch import Tensor, nn
@@ -56,21 +56,7 @@ class ClipSegModel(BaseImageMaskModel):
 
         return mask
 
-    def mask_image(
-            self,
-            filename: str,
-            prompts: [str],
-            mode: str = 'fill',
-            alpha: float = 1.0,
-            threshold: float = 0.3,
-            smooth_pixels: int = 5,
-            expand_pixels: int = 10
-    ):
-        mask_sample = MaskSample(filename, self.device)
-
-        if mode == 'fill' and mask_sample.get_mask_tensor() is not None:
-            return
-
+    def __update_kernels(self, smooth_pixels: int, expand_pixels: int):
         if self.smoothing_kernel_radius != smooth_pixels:
             self.smoothing_kernel = self.__create_average_kernel(smooth_pixels)
             self.smoothing_kernel_radius = smooth_pixels
@@ -79,12 +65,36 @@ class ClipSegModel(BaseImageMaskModel):
             self.expand_kernel = self.__create_average_kernel(expand_pixels)
             self.expand_kernel_radius = expand_pixels
 
-        inputs = self.processor(text=prompts, images=[mask_sample.get_image()] * len(prompts), padding="max_length",
-                                return_tensors="pt")
-        inputs = inputs.to(self.device)
-        with torch.no_grad():
-            outputs = self.model(**inputs)
-        predicted_mask = self.__process_mask(outputs.logits, mask_sample.height, mask_sample.width, threshold)
-        mask_sample.apply_mask(mode, predicted_mask, alpha, False)
+    def _prepare_input(self, mask_sample: MaskSample) -> Tensor:
+        return self.processor.image_processor(images=mask_sample.get_image(), return_tensors="pt").pixel_values
+
+    def predict_masks(
+            self,
+            mask_samples: list[MaskSample],
+            model_inputs: list[Any],
+            prompts: list[str],
+            threshold: float = 0.3,
+            smooth_pixels: int = 5,
+            expand_pixels: int = 10,
+    ) -> list[Tensor]:
+        self.__update_kernels(smooth_pixels, expand_pixels)
+
+        # every image is paired with every prompt, without preprocessing the image more than once
+        text_inputs = self.processor.tokenizer(prompts, padding="max_length", return_tensors="pt")
+        text_inputs = text_inputs.to(self.device)
+        pixel_values = torch.cat(model_inputs).to(self.device)
+        outputs = self.model(
+            input_ids=text_inputs.input_ids.repeat(len(mask_samples), 1),
+            attention_mask=text_inputs.attention_mask.repeat(len(mask_samples), 1),
+            pixel_values=pixel_values.repeat_interleave(len(prompts), dim=0),
+        )
+        logits = outputs.logits.view(len(mask_samples), len(prompts), *outputs.logits.shape[-2:])
+
+        predicted_masks = [None] * len(mask_samples)
+        for indices in self._group_by_size(mask_samples):
+            mask_sample = mask_samples[indices[0]]
+            masks = self.__process_mask(logits[indices], mask_sample.height, mask_sample.width, threshold)
+            for i, predicted_mask in zip(indices, masks):
+                predicted_masks[i] = predicted_mask.unsqueeze(0)
 
-        mask_sample.save_mask()
+        return predicted_masks
@@ -10,6 +10,8 @@ class EMAModuleWrapper:
             decay: float = 0.9999,
             update_step_interval: int = 1,
             device: torch.device | None = None,
+            fused: bool = True,
+            transfer_chunk_size: int = 64 * 1024 * 1024,
     ):
         parameters = list(parameters)
         self.ema_parameters = [p.clone().detach().to(device) for p in parameters]
@@ -19,6 +21,11 @@ class EMAModuleWrapper:
         self.decay = decay
         self.update_step_interval = update_step_interval
         self.device = device
+        self.fused = fused
+        self.transfer_chunk_size = transfer_chunk_size
+
+        self.__transfer_buffers = {}  # dtype -> two pinned staging buffers
+        self.__transfer_streams = {}  # device -> stream used for copies to the staging buffers
 
         # TODO: add an automatic decay calculation based on this formula:
         # The impact of the last n steps can be calculated as:
@@ -41,17 +48,134 @@ class EMAModuleWrapper:
         one_minus_decay = 1 - self.get_current_decay(optimization_step)
 
         if (optimization_step + 1) % self.update_step_interval == 0:
+            if not self.fused:
+                self.__step_per_tensor(parameters, one_minus_decay)
+                return
+
+            same_device_groups = {}  # (device, dtype) -> (ema parameters, parameters)
+            transfer_groups = {}  # (device, dtype) -> (ema parameters, parameters)
             for ema_parameter, parameter in zip(self.ema_parameters, parameters):
                 if parameter.requires_grad:
                     if ema_parameter.device == parameter.device:
-                        ema_parameter.add_(one_minus_decay * (parameter - ema_parameter))
+                        groups = same_device_groups
+                    elif parameter.device.type == 'cuda' and ema_parameter.device.type == 'cpu':
+                        groups = transfer_groups
                     else:
-                        # in place calculations to save memory
-                        parameter_copy = parameter.detach().to(ema_parameter.device)
-                        parameter_copy.sub_(ema_parameter)
-                        parameter_copy.mul_(one_minus_decay)
-                        ema_parameter.add_(parameter_copy)
-                        del parameter_copy
+                        self.__step_per_tensor([parameter], one_minus_decay, [ema_parameter])
+                        continue
+
+                    ema_group, group = groups.setdefault((parameter.device, ema_parameter.dtype), ([], []))
+                    ema_group.append(ema_parameter)
+                    group.append(parameter)
+
+            for ema_group, group in same_device_groups.values():
+                self.__lerp(ema_group, group, one_minus_decay)
+
+            for ema_group, group in transfer_groups.values():
+                self.__step_transfer(ema_group, group, one_minus_decay)
+
+    @staticmethod
+    def __lerp(ema_parameters: list[torch.Tensor], parameters: list[torch.Tensor], weight: float):
+        # ema = ema + weight * (parameter - ema), for all tensors in a few kernel launches
+        parameters = [
+            parameter if parameter.dtype == ema_parameter.dtype else parameter.to(ema_parameter.dtype)
+            for ema_parameter, parameter in zip(ema_parameters, parameters)
+        ]
+        torch._foreach_lerp_(ema_parameters, parameters, weight)
+
+    def __step_per_tensor(
+            self,
+            parameters: list[torch.nn.Parameter],
+            one_minus_decay: float,
+            ema_parameters: list[torch.Tensor] | None = None,
+    ):
+        if ema_parameters is None:
+            ema_parameters = self.ema_parameters
+
+        for ema_parameter, parameter in zip(ema_parameters, parameters):
+            if parameter.requires_grad:
+                if ema_parameter.device == parameter.device:
+                    ema_parameter.add_(one_minus_decay * (parameter - ema_parameter))
+                else:
+                    # in place calculations to save memory
+                    parameter_copy = parameter.detach().to(ema_parameter.device)
+                    parameter_copy.sub_(ema_parameter)
+                    parameter_copy.mul_(one_minus_decay)
+                    ema_parameter.add_(parameter_copy)
+                    del parameter_copy
+
+    def __get_transfer_buffers(self, dtype: torch.dtype, numel: int) -> list[torch.Tensor]:
+        buffers = self.__transfer_buffers.get(dtype)
+        if buffers is None or buffers[0].numel() < numel:
+            buffers = [torch.empty(numel, dtype=dtype, pin_memory=True) for _ in range(2)]
+            self.__transfer_buffers[dtype] = buffers
+        return buffers
+
+    def __step_transfer(
+            self,
+            ema_parameters: list[torch.Tensor],
+            parameters: list[torch.nn.Parameter],
+            one_minus_decay: float,
+    ):
+        """
+        Updates ema parameters on the cpu from parameters on a cuda device.
+
+        The parameters are copied in chunks into two pinned staging buffers. The copy of the next chunk runs on a
+        separate stream while the cpu updates the ema parameters of the current chunk.
+        """
+        dtype = ema_parameters[0].dtype
+        element_size = ema_parameters[0].element_size()
+        chunk_numel = max(1, self.transfer_chunk_size // element_size)
+
+        chunks = []  # list of list of indices
+        chunk_sizes = []
+        for i, parameter in enumerate(parameters):
+            if not chunks or chunk_sizes[-1] + parameter.numel() > chunk_numel:
+                chunks.append([])
+                chunk_sizes.append(0)
+            chunks[-1].append(i)
+            chunk_sizes[-1] += parameter.numel()
+
+        buffers = self.__get_transfer_buffers(dtype, max(chunk_sizes))
+
+        device = parameters[0].device
+        if device not in self.__transfer_streams:
+            self.__transfer_streams[device] = torch.cuda.Stream(device)
+        stream = self.__transfer_streams[device]
+        stream.wait_stream(torch.cuda.current_stream(device))
+
+        def copy_chunk(chunk_index: int) -> torch.cuda.Event:
+            buffer = buffers[chunk_index % 2]
+            offset = 0
+            with torch.cuda.stream(stream):
+                for i in chunks[chunk_index]:
+                    parameter = parameters[i]
+                    numel = parameter.numel()
+                    buffer[offset:offset + numel].copy_(parameter.detach().reshape(-1), non_blocking=True)
+                    offset += numel
+                event = torch.cuda.Event()
+                event.record(stream)
+            return event
+
+        event = copy_chunk(0)
+        for chunk_index in range(len(chunks)):
+            next_event = copy_chunk(chunk_index + 1) if chunk_index + 1 < len(chunks) else None
+
+            event.synchronize()
+
+            buffer = buffers[chunk_index % 2]
+            chunk_ema_parameters = []
+            chunk_parameters = []
+            offset = 0
+            for i in chunks[chunk_index]:
+                numel = parameters[i].numel()
+                chunk_ema_parameters.append(ema_parameters[i])
+                chunk_parameters.append(buffer[offset:offset + numel].view(ema_parameters[i].shape))
+                offset += numel
+
+            self.__lerp(chunk_ema_parameters, chunk_parameters, one_minus_decay)
+
+            event = next_event
 
     def to(self, device: torch.device = None, dtype: torch.dtype = None) -> None:
         self.device = device
@@ -60,17 +184,66 @@ class EMAModuleWrapper:
             for p in self.ema_parameters
         ]
 
+    @staticmethod
+    def __free_device_memory(device: torch.device) -> int:
+        if device.type != 'cuda':
+            return 0
+        free_memory, _ = torch.cuda.mem_get_info(device)
+        return free_memory
+
+    def __can_swap_on_device(self, parameters: list[torch.nn.Parameter]) -> bool:
+        # swapping keeps the storage of the trained parameters alive on the device while the ema parameters are in
+        # use. only do this if at least the same amount of memory is left for sampling
+        needed_bytes = {}
+        for parameter in parameters:
+            if parameter.device.type != 'cpu':
+                needed_bytes[parameter.device] = \
+                    needed_bytes.get(parameter.device, 0) + parameter.numel() * parameter.element_size()
+
+        return all(
+            device.type == 'cuda' and self.__free_device_memory(device) >= 2 * device_bytes
+            for device, device_bytes in needed_bytes.items()
+        )
+
+    @torch.no_grad()
     def copy_ema_to(self, parameters: Iterable[torch.nn.Parameter], store_temp: bool = True) -> None:
-        if store_temp:
-            self.temp_stored_parameters = [parameter.detach().cpu() for parameter in parameters]
+        """
+        Replaces the values of the parameters with the ema parameters.
 
+        If store_temp is True, the current values are stored, so they can be restored by copy_temp_to. Where possible,
+        the parameter storage is swapped instead of copied, keeping the original storage on its device. This is only
+        done if enough device memory is available. Then, if an ema parameter has the same device and dtype, the
+        parameter uses the ema storage directly, otherwise the ema parameter is moved to a new buffer on the device.
+        If not enough memory is available, the parameters are backed up to the cpu.
+        """
         parameters = list(parameters)
+
+        if not store_temp:
+            for ema_parameter, parameter in zip(self.ema_parameters, parameters):
+                parameter.data.copy_(ema_parameter.to(parameter.device).data)
+            return
+
+        swap_on_device = self.__can_swap_on_device(parameters)
+
+        self.temp_stored_parameters = []
         for ema_parameter, parameter in zip(self.ema_parameters, parameters):
-            parameter.data.copy_(ema_parameter.to(parameter.device).data)
+            if swap_on_device:
+                self.temp_stored_parameters.append((True, parameter.data))
+                if ema_parameter.device == parameter.device and ema_parameter.dtype == parameter.dtype:
+                    parameter.data = ema_parameter
+                else:
+                    parameter.data = ema_parameter.to(device=parameter.device, dtype=parameter.dtype, copy=True)
+            else:
+                self.temp_stored_parameters.append((False, parameter.detach().cpu()))
+                parameter.data.copy_(ema_parameter.to(parameter.device).data)
 
+    @torch.no_grad()
     def copy_temp_to(self, parameters: Iterable[torch.nn.Parameter]) -> None:
-        for temp_parameter, parameter in zip(self.temp_stored_parameters, parameters):
-            parameter.data.copy_(temp_parameter.data)
+        for (swapped, temp_parameter), parameter in zip(self.temp_stored_parameters, parameters):
+            if swapped:
+                parameter.data = temp_parameter
+            else:
+                parameter.data.copy_(temp_parameter.data)
 
         self.temp_stored_parameters = None
 
@@ -5,6 +5,7 @@ import torch
 from tqdm import tqdm
 
 from modules.dataLoader import StableDiffusionFineTuneDataLoader
+from modules.dataLoader.DistributedDataLoader import DistributedDataLoader
 from modules.model.BaseModel import BaseModel
 from modules.modelLoader.BaseModelLoader import BaseModelLoader
 from modules.modelSetup.BaseModelSetup import BaseModelSetup
@@ -75,7 +76,10 @@ class GenerateLossesModel:
         )
 
         self.data_loader.get_data_set().start_next_epoch()
-        step_tqdm = tqdm(self.data_loader.get_data_loader(), desc="step")
+        step_tqdm = tqdm(
+            DistributedDataLoader(self.data_loader.get_data_loader(), self.data_loader.get_batch_ranges()),
+            desc="step",
+        )
 
         self.model_setup.setup_train_device(self.model, self.config)
 
@@ -1,4 +1,4 @@
-from typing import Optional, Tuple
+from typing import Optional, Tuple, Any
 
 import torch
 from torch import Tensor, nn
@@ -79,23 +79,7 @@ class MaskByColor(BaseImageMaskModel):
 
         return (0.0, 0.0, 0.0)
 
-    def mask_image(
-            self,
-            filename: str,
-            prompts: [str],
-            mode: str = 'fill',
-            alpha: float = 1.0,
-            threshold: float = 0.3,
-            smooth_pixels: int = 5,
-            expand_pixels: int = 10
-    ):
-        color = self.__parse_color(prompts[0] if prompts else "")
-
-        mask_sample = MaskSample(filename, self.device)
-
-        if mode == 'fill' and mask_sample.get_mask_tensor() is not None:
-            return
-
+    def __update_kernels(self, smooth_pixels: int, expand_pixels: int):
         if self.smoothing_kernel_radius != smooth_pixels:
             self.smoothing_kernel = self.__create_average_kernel(smooth_pixels)
             self.smoothing_kernel_radius = smooth_pixels
@@ -104,19 +88,41 @@ class MaskByColor(BaseImageMaskModel):
             self.expand_kernel = self.__create_average_kernel(expand_pixels)
             self.expand_kernel_radius = expand_pixels
 
-        image = mask_sample.get_image()
-        image_tensor = self.image2Tensor(image) \
-            .to(device=self.device, dtype=self.dtype) \
-            .unsqueeze(0)
+    def _prepare_input(self, mask_sample: MaskSample) -> Tensor:
+        return self.image2Tensor(mask_sample.get_image())
+
+    def _inverted_masks(self) -> bool:
+        return True
+
+    def predict_masks(
+            self,
+            mask_samples: list[MaskSample],
+            model_inputs: list[Any],
+            prompts: list[str],
+            threshold: float = 0.3,
+            smooth_pixels: int = 5,
+            expand_pixels: int = 10,
+    ) -> list[Tensor]:
+        color = self.__parse_color(prompts[0] if prompts else "")
+
+        self.__update_kernels(smooth_pixels, expand_pixels)
 
         color_tensor = torch.tensor(color, dtype=self.dtype, device=self.device).view(1, 3, 1, 1)
-        similarity = image_tensor - color_tensor
-        similarity = similarity * similarity
-        similarity = self.dot_kernel(similarity)
-        similarity = torch.sqrt(similarity)
-        output = similarity.to(dtype=torch.float32)
 
-        predicted_mask = self.__process_mask(output, mask_sample.height, mask_sample.width, threshold)
-        mask_sample.apply_mask(mode, predicted_mask, alpha, True)
+        predicted_masks = [None] * len(mask_samples)
+        for indices in self._group_by_size(mask_samples):
+            mask_sample = mask_samples[indices[0]]
+            image_tensor = torch.stack([model_inputs[i] for i in indices]) \
+                .to(device=self.device, dtype=self.dtype)
+
+            similarity = image_tensor - color_tensor
+            similarity = similarity * similarity
+            similarity = self.dot_kernel(similarity)
+            similarity = torch.sqrt(similarity)
+            output = similarity.to(dtype=torch.float32)
+
+            masks = self.__process_mask(output, mask_sample.height, mask_sample.width, threshold)
+            for i, predicted_mask in zip(indices, masks):
+                predicted_masks[i] = predicted_mask.unsqueeze(0)
 
-        mask_sample.save_mask()
+        return predicted_masks
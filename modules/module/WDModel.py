@@ -2,25 +2,35 @@ import csv
 
 import huggingface_hub
 import numpy as np
-import onnxruntime
 import torch
+from PIL import Image
 
 from modules.module.BaseImageCaptionModel import CaptionSample, BaseImageCaptionModel
+from modules.util.OnnxSessionPool import OnnxSessionPool
 
 
 class WDModel(BaseImageCaptionModel):
-    def __init__(self, device: torch.device, dtype: torch.dtype):
+    def __init__(
+            self,
+            device: torch.device,
+            dtype: torch.dtype,
+            general_threshold: float = 0.35,
+            character_threshold: float = 0.8,
+            include_character_tags: bool = False,
+            session_pool: OnnxSessionPool | None = None,
+    ):
         self.device = device
         self.dtype = dtype
+        self.general_threshold = general_threshold
+        self.character_threshold = character_threshold
+        self.include_character_tags = include_character_tags
 
         model_path = huggingface_hub.hf_hub_download(
             "SmilingWolf/wd-v1-4-vit-tagger-v2", "model.onnx"
         )
-        if device.type == 'cpu':
-            provider = "CPUExecutionProvider"
-        else:
-            provider = "CUDAExecutionProvider" if "CUDAExecutionProvider" in onnxruntime.get_available_providers() else "CPUExecutionProvider"
-        self.model = onnxruntime.InferenceSession(model_path, providers=[provider])
+        if session_pool is None:
+            session_pool = OnnxSessionPool.default()
+        self.model = session_pool.get_session(model_path, device)
 
         label_path = huggingface_hub.hf_hub_download(
             "SmilingWolf/wd-v1-4-vit-tagger-v2", "selected_tags.csv"
@@ -41,33 +51,62 @@ class WDModel(BaseImageCaptionModel):
 
                 self.tag_names.append(row["name"])
 
-    def generate_caption(
-            self,
-            caption_sample: CaptionSample,
-            initial_caption: str = "",
-    ):
+        # index arrays to select the tags of a whole batch at once
+        self.rating_indexes = np.array(self.rating_indexes, dtype=np.int64)
+        self.general_indexes = np.array(self.general_indexes, dtype=np.int64)
+        self.character_indexes = np.array(self.character_indexes, dtype=np.int64)
+        self.caption_tags = np.array([name.replace("_", " ") for name in self.tag_names], dtype=object)
+
+    def _prepare_image(self, image: Image) -> Image:
         _, height, width, _ = self.model.get_inputs()[0].shape
+        if image.size == (width, height):
+            return image
+        return image.resize((width, height))
+
+    def __select_tags(self, probs: np.ndarray, indexes: np.ndarray, threshold: float) -> list[np.ndarray]:
+        # sorts the tags of every sample by descending probability, then cuts off all tags below the threshold
+        category_probs = probs[:, indexes]
+        order = np.argsort(-category_probs, axis=1, kind='stable')
+        selected_counts = (category_probs > threshold).sum(axis=1)
+        sorted_tags = self.caption_tags[indexes[order]]
+        return [tags[:count] for tags, count in zip(sorted_tags, selected_counts)]
+
+    def __label_captions(self, probs: np.ndarray) -> list[str]:
+        general_tags = self.__select_tags(probs, self.general_indexes, self.general_threshold)
 
-        image = caption_sample.get_image()
-        image = image.resize((width, height))
-        image = np.asarray(image)
-        image = image[:, :, ::-1]  # RGB to BGR
-        image = image.astype(np.float32)
-        image = np.expand_dims(image, 0)
+        if not self.include_character_tags:
+            return [", ".join(sample_general_tags) for sample_general_tags in general_tags]
+
+        character_tags = self.__select_tags(probs, self.character_indexes, self.character_threshold)
+        return [
+            ", ".join([*sample_character_tags, *sample_general_tags])
+            for sample_character_tags, sample_general_tags
+            in zip(character_tags, general_tags)
+        ]
+
+    def generate_captions(
+            self,
+            caption_samples: list[CaptionSample],
+            initial_caption: str = "",
+    ) -> list[str]:
+        images = []
+        for caption_sample in caption_samples:
+            image = self._prepare_image(caption_sample.get_image())
+            image = np.asarray(image)
+            image = image[:, :, ::-1]  # RGB to BGR
+            images.append(image.astype(np.float32))
+        images = np.stack(images)
 
         input_name = self.model.get_inputs()[0].name
         label_name = self.model.get_outputs()[0].name
-        probs = self.model.run([label_name], {input_name: image})[0]
-        probs = probs[0].astype(float)
-
-        general_labels = [(self.tag_names[i], probs[i]) for i in self.general_indexes if probs[i] > 0.35]
-        character_labels = [(self.tag_names[i], probs[i]) for i in self.character_indexes if probs[i] > 0.8]
+        probs = self.model.run([label_name], {input_name: images})[0]
+        probs = probs.astype(float)
 
-        sorted_general_labels = sorted(general_labels, key=lambda label: label[1], reverse=True)
-        predicted_caption = ", ".join([
-            label[0].replace("_", " ")
-            for label
-            in sorted_general_labels
-        ])
+        return self.__label_captions(probs)
 
-        return predicted_caption
+    def generate_caption(
+            self,
+            caption_sample: CaptionSample,
+            initial_caption: str = "",
+    ):
+        return self.generate_captions([caption_sample], initial_caption)[0]
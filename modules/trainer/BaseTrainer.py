@@ -8,7 +8,7 @@ from modules.modelLoader.BaseModelLoader import BaseModelLoader
 from modules.modelSampler.BaseModelSampler import BaseModelSampler
 from modules.modelSaver.BaseModelSaver import BaseModelSaver
 from modules.modelSetup.BaseModelSetup import BaseModelSetup
-from modules.util import create
+from modules.util import create, distributed_util
 from modules.util.TimedActionMixin import TimedActionMixin
 from modules.util.TrainProgress import TrainProgress
 from modules.util.config.TrainConfig import TrainConfig
@@ -25,6 +25,9 @@ class BaseTrainer(
         self.config = config
         self.callbacks = callbacks
         self.commands = commands
+
+        distributed_util.init_distributed(self.config)
+
         self.train_device = torch.device(self.config.train_device)
         self.temp_device = torch.device(self.config.temp_device)
 
@@ -45,7 +48,9 @@ class BaseTrainer(
         pass
 
     def create_model_loader(self) -> BaseModelLoader:
-        return create.create_model_loader(self.config.model_type, self.config.training_method)
+        return create.create_model_loader(
+            self.config.model_type, self.config.training_method, self.config.lazy_model_loading
+        )
 
     def create_model_setup(self) -> BaseModelSetup:
         return create.create_model_setup(
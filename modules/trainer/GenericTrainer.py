@@ -4,6 +4,7 @@ import shutil
 import subprocess
 import sys
 import traceback
+from contextlib import nullcontext
 from pathlib import Path
 from typing import Callable
 
@@ -17,6 +18,8 @@ from torch.utils.tensorboard import SummaryWriter
 from torchvision.transforms.functional import pil_to_tensor
 from tqdm import tqdm
 
+from modules.dataLoader.DistributedDataLoader import DistributedDataLoader
+from modules.dataLoader.PrefetchDataLoader import PrefetchDataLoader
 from modules.dataLoader.StableDiffusionFineTuneDataLoader import StableDiffusionFineTuneDataLoader
 from modules.model.BaseModel import BaseModel
 from modules.modelLoader.BaseModelLoader import BaseModelLoader
@@ -24,16 +27,23 @@ from modules.modelSampler.BaseModelSampler import BaseModelSampler
 from modules.modelSaver.BaseModelSaver import BaseModelSaver
 from modules.modelSetup.BaseModelSetup import BaseModelSetup
 from modules.trainer.BaseTrainer import BaseTrainer
-from modules.util import path_util, create
+from modules.util import path_util, create, distributed_util
+from modules.util.BackgroundCheckpointWriter import BackgroundCheckpointWriter
+from modules.util.BackgroundSampler import BackgroundSampler, BackgroundSampleTask
+from modules.util.IncrementalBackupStore import IncrementalBackupStore
+from modules.util.MicroBatchSizer import MicroBatchSizer
+from modules.util.TrainProfiler import TrainProfiler
 from modules.util.TrainProgress import TrainProgress
 from modules.util.config.TrainConfig import TrainConfig
 from modules.util.callbacks.TrainCallbacks import TrainCallbacks
 from modules.util.commands.TrainCommands import TrainCommands
 from modules.util.dtype_util import enable_grad_scaling
+from modules.util.enum.CacheFormat import CacheFormat
 from modules.util.enum.ImageFormat import ImageFormat
 from modules.util.enum.ModelFormat import ModelFormat
 from modules.util.enum.TimeUnit import TimeUnit
 from modules.util.enum.TrainingMethod import TrainingMethod
+from modules.util.snapshot_util import create_model_snapshot
 from modules.util.config.SampleConfig import SampleConfig
 from modules.util.time_util import get_string_timestamp
 from modules.util.torch_util import torch_gc
@@ -55,14 +65,22 @@ class GenericTrainer(BaseTrainer):
 
     tensorboard_subprocess: subprocess.Popen
     tensorboard: SummaryWriter
+    profiler: TrainProfiler
+    checkpoint_writer: BackgroundCheckpointWriter | None
+    backup_store: IncrementalBackupStore | None
+    background_sampler: BackgroundSampler | None
+    micro_batch_sizer: MicroBatchSizer | None
 
     def __init__(self, config: TrainConfig, callbacks: TrainCallbacks, commands: TrainCommands):
         super(GenericTrainer, self).__init__(config, callbacks, commands)
 
         tensorboard_log_dir = os.path.join(config.workspace_dir, "tensorboard")
         os.makedirs(Path(tensorboard_log_dir).absolute(), exist_ok=True)
-        self.tensorboard = SummaryWriter(os.path.join(tensorboard_log_dir, get_string_timestamp()))
-        if config.tensorboard:
+        tensorboard_run_name = get_string_timestamp()
+        if not distributed_util.is_main_process():
+            tensorboard_run_name += f"-rank{distributed_util.rank()}"
+        self.tensorboard = SummaryWriter(os.path.join(tensorboard_log_dir, tensorboard_run_name))
+        if config.tensorboard and distributed_util.is_main_process():
             tensorboard_executable = os.path.join(os.path.dirname(sys.executable), "tensorboard")
 
             tensorboard_args = [
@@ -79,11 +97,27 @@ class GenericTrainer(BaseTrainer):
 
             self.tensorboard_subprocess = subprocess.Popen(tensorboard_args)
 
+        self.profiler = TrainProfiler(config.profiling, self.train_device, self.tensorboard)
+
+        if config.background_checkpoints > 0:
+            self.checkpoint_writer = BackgroundCheckpointWriter(config.background_checkpoints)
+        else:
+            self.checkpoint_writer = None
+
+        if config.incremental_backups and config.training_method in [TrainingMethod.LORA, TrainingMethod.EMBEDDING]:
+            self.backup_store = IncrementalBackupStore(os.path.join(config.workspace_dir, "backup", ".blobs"))
+        else:
+            self.backup_store = None
+
+        self.background_sampler = None
+
         self.one_step_trained = False
 
     def start(self):
-        if self.config.clear_cache_before_training and self.config.latent_caching:
+        if self.config.clear_cache_before_training and self.config.latent_caching \
+                and distributed_util.is_main_process():
             self.__clear_cache()
+        distributed_util.barrier()
 
         if self.config.train_dtype.enable_tf():
             torch.backends.cuda.matmul.allow_tf32 = True
@@ -100,6 +134,9 @@ class GenericTrainer(BaseTrainer):
             self.callbacks.on_update_status("searching for previous backups")
             last_backup_path = self.__get_last_backup_dirpath()
 
+            if last_backup_path and IncrementalBackupStore.is_incremental(last_backup_path):
+                last_backup_path = self.__restore_incremental_backup(last_backup_path)
+
             if last_backup_path:
                 if self.config.training_method == TrainingMethod.LORA:
                     model_names.lora = last_backup_path
@@ -139,8 +176,39 @@ class GenericTrainer(BaseTrainer):
         self.previous_sample_time = -1
         self.sample_queue = []
 
+        if self.config.background_sampling and distributed_util.is_main_process():
+            self.callbacks.on_update_status("starting the background sampler")
+            self.background_sampler = BackgroundSampler(
+                self.config, model_names, self.__background_sampling_device()
+            )
+
         self.parameters = list(self.model_setup.create_parameters(self.model, self.config))
 
+        if self.config.auto_micro_batch_size:
+            self.micro_batch_sizer = MicroBatchSizer(self.parameters)
+        else:
+            self.micro_batch_sizer = None
+
+        if distributed_util.is_enabled():
+            # newly initialized weights (LoRA, embeddings) are random, all ranks need to start from the same state
+            distributed_util.broadcast_tensors([parameter.data for parameter in self.parameters])
+            if self.model.ema:
+                distributed_util.broadcast_tensors(self.model.ema.ema_parameters)
+
+    def __background_sampling_device(self) -> str:
+        # the worker loads a second copy of the model, it only shares the train device if that is explicitly configured
+        device = self.config.background_sampling_device or "cpu"
+
+        sampling_device = torch.device(device)
+        if sampling_device.type != 'cpu' and sampling_device.type == self.train_device.type \
+                and (sampling_device.index or 0) == (self.train_device.index or 0):
+            print(
+                f"Background sampling uses the train device {device}. This loads a second copy of the model onto it, "
+                f"which needs additional memory and slows down training while sampling"
+            )
+
+        return device
+
     def __clear_cache(self):
         print(
             f'Clearing cache directory {self.config.cache_dir}! '
@@ -149,17 +217,26 @@ class GenericTrainer(BaseTrainer):
         if os.path.isdir(self.config.cache_dir):
             for filename in os.listdir(self.config.cache_dir):
                 path = os.path.join(self.config.cache_dir, filename)
-                if os.path.isdir(path) and (filename.startswith('epoch-') or filename in ['image', 'text']):
+                if not os.path.isdir(path):
+                    continue
+                if filename.startswith('epoch-'):
+                    shutil.rmtree(path)
+                elif filename in ['image', 'text'] and self.config.cache_format != CacheFormat.SHARDED:
+                    # the sharded cache reuses valid items, stale groups are pruned when the cache is started
                     shutil.rmtree(path)
 
+    def __get_backup_directories(self, backup_dirpath: str) -> list[str]:
+        # hidden directories contain unfinished backups or the blobs of incremental backups
+        return sorted(
+            [dirpath for dirpath in os.listdir(backup_dirpath) if
+             os.path.isdir(os.path.join(backup_dirpath, dirpath)) and not dirpath.startswith('.')],
+            reverse=True,
+        )
+
     def __get_last_backup_dirpath(self):
         backup_dirpath = os.path.join(self.config.workspace_dir, "backup")
         if os.path.exists(backup_dirpath):
-            backup_directories = sorted(
-                [dirpath for dirpath in os.listdir(backup_dirpath) if
-                 os.path.isdir(os.path.join(backup_dirpath, dirpath))],
-                reverse=True,
-            )
+            backup_directories = self.__get_backup_directories(backup_dirpath)
 
             if backup_directories:
                 last_backup_dirpath = backup_directories[0]
@@ -167,14 +244,21 @@ class GenericTrainer(BaseTrainer):
 
         return None
 
+    def __restore_incremental_backup(self, backup_path: str) -> str:
+        restore_path = os.path.join(self.config.workspace_dir, "restore", os.path.basename(backup_path))
+
+        if distributed_util.is_main_process():
+            self.callbacks.on_update_status("restoring incremental backup")
+            print(f"Restoring incremental backup '{backup_path}' to '{restore_path}'...")
+            IncrementalBackupStore.for_backup(backup_path).restore(backup_path, restore_path)
+        distributed_util.barrier()
+
+        return restore_path
+
     def __prune_backups(self, backups_to_keep: int):
         backup_dirpath = os.path.join(self.config.workspace_dir, "backup")
         if os.path.exists(backup_dirpath):
-            backup_directories = sorted(
-                [dirpath for dirpath in os.listdir(backup_dirpath) if
-                 os.path.isdir(os.path.join(backup_dirpath, dirpath))],
-                reverse=True,
-            )
+            backup_directories = self.__get_backup_directories(backup_dirpath)
 
             for dirpath in backup_directories[backups_to_keep:]:
                 dirpath = os.path.join(backup_dirpath, dirpath)
@@ -183,6 +267,9 @@ class GenericTrainer(BaseTrainer):
                 except Exception as e:
                     print(f"Could not delete old rolling backup {dirpath}")
 
+            if self.backup_store is not None:
+                self.backup_store.collect_garbage(backup_dirpath)
+
         return None
 
     def __enqueue_sample_during_training(self, fun: Callable):
@@ -193,6 +280,48 @@ class GenericTrainer(BaseTrainer):
             fun()
         self.sample_queue = []
 
+    def __prepare_samples(
+            self,
+            train_progress: TrainProgress,
+            sample_params_list: list[SampleConfig],
+            folder_postfix: str,
+            image_format: ImageFormat,
+            is_custom_sample: bool,
+    ) -> tuple[list[int], list[SampleConfig], list[str]]:
+        """
+        Returns the indices, configs and destination paths of all enabled samples.
+        """
+        indices = []
+        enabled_params_list = []
+        sample_paths = []
+        for i, sample_params in enumerate(sample_params_list):
+            if sample_params.enabled:
+                safe_prompt = path_util.safe_filename(sample_params.prompt)
+
+                if is_custom_sample:
+                    sample_dir = os.path.join(
+                        self.config.workspace_dir,
+                        "samples",
+                        "custom",
+                    )
+                else:
+                    sample_dir = os.path.join(
+                        self.config.workspace_dir,
+                        "samples",
+                        f"{str(i)} - {safe_prompt}{folder_postfix}",
+                    )
+
+                sample_path = os.path.join(
+                    sample_dir,
+                    f"{get_string_timestamp()}-training-sample-{train_progress.filename_string()}{image_format.extension()}"
+                )
+
+                indices.append(i)
+                enabled_params_list.append(sample_params)
+                sample_paths.append(sample_path)
+
+        return indices, enabled_params_list, sample_paths
+
     def __sample_loop(
             self,
             train_progress: TrainProgress,
@@ -202,58 +331,116 @@ class GenericTrainer(BaseTrainer):
             image_format: ImageFormat = ImageFormat.JPG,
             is_custom_sample: bool = False,
     ):
-        for i, sample_params in enumerate(sample_params_list):
-            if sample_params.enabled:
-                try:
-                    safe_prompt = path_util.safe_filename(sample_params.prompt)
+        indices, enabled_params_list, sample_paths = self.__prepare_samples(
+            train_progress, sample_params_list, folder_postfix, image_format, is_custom_sample
+        )
 
-                    if is_custom_sample:
-                        sample_dir = os.path.join(
-                            self.config.workspace_dir,
-                            "samples",
-                            "custom",
-                        )
-                    else:
-                        sample_dir = os.path.join(
-                            self.config.workspace_dir,
-                            "samples",
-                            f"{str(i)} - {safe_prompt}{folder_postfix}",
-                        )
+        if not enabled_params_list:
+            return
 
-                    sample_path = os.path.join(
-                        sample_dir,
-                        f"{get_string_timestamp()}-training-sample-{train_progress.filename_string()}{image_format.extension()}"
-                    )
+        def on_sample_default(index: int, image: Image):
+            if self.config.samples_to_tensorboard:
+                i = indices[index]
+                safe_prompt = path_util.safe_filename(enabled_params_list[index].prompt)
+                self.tensorboard.add_image(f"sample{str(i)} - {safe_prompt}", pil_to_tensor(image),
+                                           train_progress.global_step)
+            self.callbacks.on_sample_default(image)
 
-                    def on_sample_default(image: Image):
-                        if self.config.samples_to_tensorboard:
-                            self.tensorboard.add_image(f"sample{str(i)} - {safe_prompt}", pil_to_tensor(image),
-                                                       train_progress.global_step)
-                        self.callbacks.on_sample_default(image)
-
-                    def on_sample_custom(image: Image):
-                        self.callbacks.on_sample_custom(image)
-
-                    on_sample = on_sample_custom if is_custom_sample else on_sample_default
-                    on_update_progress = self.callbacks.on_update_sample_custom_progress if is_custom_sample else self.callbacks.on_update_sample_default_progress
-
-                    self.model.to(self.temp_device)
-                    self.model.eval()
-
-                    self.model_sampler.sample(
-                        sample_params=sample_params,
-                        destination=sample_path,
-                        image_format=self.config.sample_image_format,
-                        text_encoder_layer_skip=self.config.text_encoder_layer_skip,
-                        force_last_timestep=self.config.rescale_noise_scheduler_to_zero_terminal_snr,
-                        on_sample=on_sample,
-                        on_update_progress=on_update_progress,
-                    )
-                except:
-                    traceback.print_exc()
-                    print("Error during sampling, proceeding without sampling")
+        def on_sample_custom(index: int, image: Image):
+            self.callbacks.on_sample_custom(image)
+
+        on_sample = on_sample_custom if is_custom_sample else on_sample_default
+        on_update_progress = self.callbacks.on_update_sample_custom_progress if is_custom_sample else self.callbacks.on_update_sample_default_progress
+
+        try:
+            self.model.to(self.temp_device)
+            self.model.eval()
+
+            # samples with the same resolution, step count and noise scheduler are denoised together
+            self.model_sampler.sample_batch(
+                sample_params_list=enabled_params_list,
+                destinations=sample_paths,
+                image_format=self.config.sample_image_format,
+                text_encoder_layer_skip=self.config.text_encoder_layer_skip,
+                force_last_timestep=self.config.rescale_noise_scheduler_to_zero_terminal_snr,
+                batch_size=self.config.sample_batch_size,
+                on_sample=on_sample,
+                on_update_progress=on_update_progress,
+            )
+        except:
+            traceback.print_exc()
+            print("Error during sampling, proceeding without sampling")
+
+        torch_gc()
+
+    def __submit_background_sample_task(
+            self,
+            train_progress: TrainProgress,
+            sample_params_list: list[SampleConfig],
+            folder_postfix: str = "",
+            is_custom_sample: bool = False,
+    ):
+        indices, enabled_params_list, sample_paths = self.__prepare_samples(
+            train_progress, sample_params_list, folder_postfix, self.config.sample_image_format, is_custom_sample
+        )
+
+        if not enabled_params_list:
+            return
+
+        tags = []
+        for i, sample_params in zip(indices, enabled_params_list):
+            safe_prompt = path_util.safe_filename(sample_params.prompt)
+            tags.append((f"sample{str(i)} - {safe_prompt}", train_progress.global_step, is_custom_sample))
+
+        self.background_sampler.submit(self.parameters, BackgroundSampleTask(
+            sample_params_list=enabled_params_list,
+            destinations=sample_paths,
+            tags=tags,
+            image_format=self.config.sample_image_format,
+            text_encoder_layer_skip=self.config.text_encoder_layer_skip,
+            force_last_timestep=self.config.rescale_noise_scheduler_to_zero_terminal_snr,
+            batch_size=self.config.sample_batch_size,
+        ))
+
+    def __sample_in_background(
+            self,
+            train_progress: TrainProgress,
+            sample_params_list: list[SampleConfig],
+            is_custom_sample: bool,
+    ):
+        if self.background_sampler.is_busy():
+            print("The background sampler is still busy, skipping this sample")
+            return
+
+        if self.model.ema:
+            self.model.ema.copy_ema_to(self.parameters, store_temp=True)
+
+        self.__submit_background_sample_task(
+            train_progress=train_progress,
+            sample_params_list=sample_params_list,
+            is_custom_sample=is_custom_sample,
+        )
+
+        if self.model.ema:
+            self.background_sampler.before_parameter_update()
+            self.model.ema.copy_temp_to(self.parameters)
 
-                torch_gc()
+        # ema-less sampling, if an ema model exists
+        if self.model.ema and not is_custom_sample and self.config.non_ema_sampling:
+            self.__submit_background_sample_task(
+                train_progress=train_progress,
+                sample_params_list=sample_params_list,
+                folder_postfix=" - no-ema",
+            )
+
+    def __process_background_samples(self, results: list[tuple[tuple[str, int, bool], Image]]):
+        for (tensorboard_name, global_step, is_custom_sample), image in results:
+            if is_custom_sample:
+                self.callbacks.on_sample_custom(image)
+            else:
+                if self.config.samples_to_tensorboard:
+                    self.tensorboard.add_image(tensorboard_name, pil_to_tensor(image), global_step)
+                self.callbacks.on_sample_default(image)
 
     def __sample_during_training(
             self,
@@ -278,6 +465,13 @@ class GenericTrainer(BaseTrainer):
         else:
             is_custom_sample = True
 
+        if self.background_sampler is not None:
+            if self.background_sampler.is_alive():
+                self.__sample_in_background(train_progress, sample_params_list, is_custom_sample)
+                return
+            print("The background sampler is not running, sampling in the training process")
+            self.background_sampler.before_parameter_update()
+
         if self.model.ema:
             self.model.ema.copy_ema_to(self.parameters, store_temp=True)
 
@@ -319,6 +513,19 @@ class GenericTrainer(BaseTrainer):
         shutil.copy2(self.config.concept_file_name, concepts_path)
         shutil.copy2(self.config.sample_definition_file_name, samples_path)
 
+    def __write_backup(self, model: BaseModel, backup_path: str):
+        # incremental backups hash the tensors in memory, only new tensors and the manifest are written
+        with self.backup_store.write_backup(backup_path) if self.backup_store is not None else nullcontext():
+            self.model_saver.save(
+                model,
+                self.config.model_type,
+                ModelFormat.INTERNAL,
+                backup_path,
+                torch.float32
+            )
+
+        self.__save_backup_config(backup_path)
+
     def backup(self, train_progress: TrainProgress):
         torch_gc()
 
@@ -327,18 +534,16 @@ class GenericTrainer(BaseTrainer):
         backup_name = f"{get_string_timestamp()}-backup-{train_progress.filename_string()}"
         backup_path = os.path.join(self.config.workspace_dir, "backup", backup_name)
 
+        if self.checkpoint_writer is not None:
+            self.__backup_in_background(backup_path)
+            self.model_setup.setup_train_device(self.model, self.config)
+            torch_gc()
+            return
+
         try:
             print("Creating Backup " + backup_path)
 
-            self.model_saver.save(
-                self.model,
-                self.config.model_type,
-                ModelFormat.INTERNAL,
-                backup_path,
-                torch.float32
-            )
-
-            self.__save_backup_config(backup_path)
+            self.__write_backup(self.model, backup_path)
         except:
             traceback.print_exc()
             print("Could not save backup. Check your disk space!")
@@ -357,6 +562,45 @@ class GenericTrainer(BaseTrainer):
 
         torch_gc()
 
+    def __snapshot_frozen_parameters(self) -> bool:
+        # LoRA and embedding savers only write the trained parameters
+        return self.config.training_method in [TrainingMethod.FINE_TUNE, TrainingMethod.FINE_TUNE_VAE]
+
+    def __backup_in_background(self, backup_path: str):
+        print("Creating Backup " + backup_path)
+
+        model_snapshot = create_model_snapshot(self.model, self.__snapshot_frozen_parameters())
+
+        def write_backup(destination: str):
+            self.__write_backup(model_snapshot, destination)
+
+        def on_backup_done(success: bool):
+            if self.config.rolling_backup:
+                self.__prune_backups(self.config.rolling_backup_count)
+
+        self.checkpoint_writer.write(backup_path, write_backup, on_backup_done)
+
+    def __save_in_background(self, save_path: str):
+        if self.model.ema:
+            self.model.ema.copy_ema_to(self.parameters, store_temp=True)
+
+        try:
+            model_snapshot = create_model_snapshot(self.model, self.__snapshot_frozen_parameters())
+        finally:
+            if self.model.ema:
+                self.model.ema.copy_temp_to(self.parameters)
+
+        def write_save(destination: str):
+            self.model_saver.save(
+                model=model_snapshot,
+                model_type=self.config.model_type,
+                output_model_format=self.config.output_model_format,
+                output_model_destination=destination,
+                dtype=self.config.output_dtype.torch_dtype()
+            )
+
+        self.checkpoint_writer.write(save_path, write_save)
+
     def save(self, train_progress: TrainProgress):
         torch_gc()
 
@@ -369,6 +613,11 @@ class GenericTrainer(BaseTrainer):
         )
         print("Saving " + save_path)
 
+        if self.checkpoint_writer is not None:
+            self.__save_in_background(save_path)
+            torch_gc()
+            return
+
         try:
             if self.model.ema:
                 self.model.ema.copy_ema_to(self.parameters, store_temp=True)
@@ -417,15 +666,25 @@ class GenericTrainer(BaseTrainer):
             "update_step", self.config.gradient_accumulation_steps, TimeUnit.STEP, train_progress, start_at_zero=False
         )
 
+    def __start_next_epoch(self):
+        # the main process fills the cache first, the other ranks only read it
+        if distributed_util.is_main_process():
+            self.data_loader.get_data_set().start_next_epoch()
+        distributed_util.barrier()
+        if not distributed_util.is_main_process():
+            self.data_loader.get_data_set().start_next_epoch()
+
     def train(self):
         train_device = torch.device(self.config.train_device)
+        world_size = distributed_util.world_size()
+        is_main_process = distributed_util.is_main_process()
 
         train_progress = self.model.train_progress
 
         if self.config.only_cache:
             self.callbacks.on_update_status("caching")
             for epoch in tqdm(range(train_progress.epoch, self.config.epochs, 1), desc="epoch"):
-                self.data_loader.get_data_set().start_next_epoch()
+                self.__start_next_epoch()
             return
 
         if enable_grad_scaling(self.config.train_dtype, self.parameters):
@@ -443,10 +702,19 @@ class GenericTrainer(BaseTrainer):
         for epoch in tqdm(range(train_progress.epoch, self.config.epochs, 1), desc="epoch"):
             self.callbacks.on_update_status("starting epoch/caching")
 
-            self.data_loader.get_data_set().start_next_epoch()
+            self.__start_next_epoch()
             self.model_setup.setup_train_device(self.model, self.config)
             torch_gc()
 
+            # with dynamic batch sizes, the epoch length is counted in batches instead of samples
+            batch_ranges = self.data_loader.get_batch_ranges()
+            if batch_ranges is None:
+                approximate_epoch_length = self.data_loader.get_data_set().approximate_length()
+                scheduler_batch_size = self.config.batch_size * world_size
+            else:
+                approximate_epoch_length = len(batch_ranges)
+                scheduler_batch_size = world_size
+
             if lr_scheduler is None:
                 lr_scheduler = create.create_lr_scheduler(
                     optimizer=self.model.optimizer,
@@ -454,22 +722,36 @@ class GenericTrainer(BaseTrainer):
                     warmup_steps=self.config.learning_rate_warmup_steps,
                     num_cycles=self.config.learning_rate_cycles,
                     num_epochs=self.config.epochs,
-                    approximate_epoch_length=self.data_loader.get_data_set().approximate_length(),
-                    batch_size=self.config.batch_size,
+                    approximate_epoch_length=approximate_epoch_length,
+                    batch_size=scheduler_batch_size,
                     gradient_accumulation_steps=self.config.gradient_accumulation_steps,
                     global_step=train_progress.global_step
                 )
 
-            current_epoch_length = len(self.data_loader.get_data_loader()) + train_progress.epoch_step
-            step_tqdm = tqdm(self.data_loader.get_data_loader(), desc="step")
-            for epoch_step, batch in enumerate(step_tqdm):
-                if self.__needs_sample(train_progress) or self.commands.get_and_reset_sample_default_command():
+            if batch_ranges is not None and (train_progress.epoch_step > 0 or train_progress.epoch_sample > 0):
+                # the batches are only known for whole epochs, a resumed epoch is restarted from its beginning
+                print(f"Restarting epoch {train_progress.epoch} from its first batch")
+                train_progress.epoch_step = 0
+                train_progress.epoch_sample = 0
+
+            distributed_data_loader = DistributedDataLoader(self.data_loader.get_data_loader(), batch_ranges)
+            current_epoch_length = len(distributed_data_loader) + train_progress.epoch_step
+            prefetch_data_loader = PrefetchDataLoader(
+                distributed_data_loader, train_device, self.config.prefetch_batches
+            )
+            step_tqdm = tqdm(prefetch_data_loader, desc="step")
+            for epoch_step, batch in enumerate(self.profiler.batches(step_tqdm)):
+                self.profiler.start_step()
+
+                if is_main_process and (
+                        self.__needs_sample(train_progress) or self.commands.get_and_reset_sample_default_command()
+                ):
                     self.__enqueue_sample_during_training(
                         lambda: self.__sample_during_training(train_progress, train_device)
                     )
 
                 sample_commands = self.commands.get_and_reset_sample_custom_commands()
-                if sample_commands:
+                if is_main_process and sample_commands:
                     def create_sample_commands_fun(sample_commands):
                         def sample_commands_fun():
                             self.__sample_during_training(train_progress, train_device, sample_commands)
@@ -481,85 +763,134 @@ class GenericTrainer(BaseTrainer):
                 if self.__needs_gc(train_progress):
                     torch_gc()
 
-                if not has_gradient:
-                    self.__execute_sample_during_training()
+                if self.background_sampler is not None:
+                    self.__process_background_samples(self.background_sampler.poll())
 
-                if self.__needs_backup(train_progress) or self.commands.get_and_reset_backup_command():
-                    self.backup(train_progress)
+                if not has_gradient and self.sample_queue:
+                    with self.profiler.phase("sample"), prefetch_data_loader.pause():
+                        self.__execute_sample_during_training()
 
-                if self.__needs_save(train_progress):
-                    self.save(train_progress)
+                if is_main_process and (
+                        self.__needs_backup(train_progress) or self.commands.get_and_reset_backup_command()
+                ):
+                    with self.profiler.phase("backup"), prefetch_data_loader.pause():
+                        self.backup(train_progress)
 
-                self.callbacks.on_update_status("training")
+                if is_main_process and self.__needs_save(train_progress):
+                    with self.profiler.phase("save"), prefetch_data_loader.pause():
+                        self.save(train_progress)
 
-                model_output_data = self.model_setup.predict(self.model, batch, self.config, train_progress)
+                self.callbacks.on_update_status("training")
 
-                loss = self.model_setup.calculate_loss(self.model, batch, model_output_data, self.config)
+                def train_micro_batch(micro_batch: dict, loss_weight: float = 1.0) -> float:
+                    with self.profiler.phase("predict"):
+                        model_output_data = self.model_setup.predict(
+                            self.model, micro_batch, self.config, train_progress
+                        )
 
-                loss = loss / self.config.gradient_accumulation_steps
-                if scaler:
-                    scaler.scale(loss).backward()
+                    with self.profiler.phase("calculate_loss"):
+                        loss = self.model_setup.calculate_loss(self.model, micro_batch, model_output_data, self.config)
+
+                    with self.profiler.phase("backward"):
+                        loss = loss * loss_weight / self.config.gradient_accumulation_steps
+                        if scaler:
+                            scaler.scale(loss).backward()
+                        else:
+                            loss.backward()
+                        return loss.item()
+
+                batch_length = MicroBatchSizer.batch_length(batch)
+                if self.micro_batch_sizer is not None:
+                    micro_batches = self.micro_batch_sizer.micro_batches(batch, train_micro_batch)
+                    for micro_batch_index, micro_batch in enumerate(micro_batches):
+                        train_progress.micro_batch = micro_batch_index
+                        # each micro-batch loss is weighted by its share of the batch
+                        accumulated_loss += train_micro_batch(
+                            micro_batch, MicroBatchSizer.batch_length(micro_batch) / batch_length
+                        )
+                    train_progress.micro_batch = 0
                 else:
-                    loss.backward()
+                    accumulated_loss += train_micro_batch(batch)
                 has_gradient = True
-                accumulated_loss += loss.item()
 
                 if self.__is_update_step(train_progress):
-                    if scaler:
-                        scaler.unscale_(self.model.optimizer)
-                        nn.utils.clip_grad_norm_(self.parameters, 1)
-                        scaler.step(self.model.optimizer)
-                        scaler.update()
-                    else:
+                    if distributed_util.is_enabled():
+                        with self.profiler.phase("all_reduce_gradients"):
+                            distributed_util.all_reduce_gradients(self.parameters)
+
+                    with self.profiler.phase("clip_grad_norm"):
+                        if scaler:
+                            scaler.unscale_(self.model.optimizer)
                         nn.utils.clip_grad_norm_(self.parameters, 1)
-                        self.model.optimizer.step()
 
-                    lr_scheduler.step()  # done before zero_grad, because some lr schedulers need gradients
-                    self.model.optimizer.zero_grad(set_to_none=True)
-                    has_gradient = False
+                    with self.profiler.phase("optimizer_step"):
+                        if self.background_sampler is not None:
+                            # the parameters of a submitted sample task can still be copied
+                            self.background_sampler.before_parameter_update()
 
-                    self.tensorboard.add_scalar(
-                        "learning_rate", lr_scheduler.get_last_lr()[0], train_progress.global_step
-                    )
-                    self.tensorboard.add_scalar("loss", accumulated_loss, train_progress.global_step)
-                    ema_loss = ema_loss or accumulated_loss
-                    ema_loss = (ema_loss * 0.99) + (accumulated_loss * 0.01)
-                    step_tqdm.set_postfix({
-                        'loss': accumulated_loss,
-                        'smooth loss': ema_loss,
-                    })
-                    self.tensorboard.add_scalar("smooth loss", ema_loss, train_progress.global_step)
-                    accumulated_loss = 0.0
+                        if scaler:
+                            scaler.step(self.model.optimizer)
+                            scaler.update()
+                        else:
+                            self.model.optimizer.step()
 
-                    self.model_setup.after_optimizer_step(self.model, self.config, train_progress)
-                    if self.model.ema:
-                        update_step = train_progress.global_step // self.config.gradient_accumulation_steps
+                        lr_scheduler.step()  # done before zero_grad, because some lr schedulers need gradients
+                        self.model.optimizer.zero_grad(set_to_none=True)
+                        has_gradient = False
+
+                    with self.profiler.phase("tensorboard"):
                         self.tensorboard.add_scalar(
-                            "ema_decay",
-                            self.model.ema.get_current_decay(update_step),
-                            train_progress.global_step
-                        )
-                        self.model.ema.step(
-                            self.parameters,
-                            update_step
+                            "learning_rate", lr_scheduler.get_last_lr()[0], train_progress.global_step
                         )
+                        self.tensorboard.add_scalar("loss", accumulated_loss, train_progress.global_step)
+                        ema_loss = ema_loss or accumulated_loss
+                        ema_loss = (ema_loss * 0.99) + (accumulated_loss * 0.01)
+                        step_tqdm.set_postfix({
+                            'loss': accumulated_loss,
+                            'smooth loss': ema_loss,
+                        })
+                        self.tensorboard.add_scalar("smooth loss", ema_loss, train_progress.global_step)
+                        accumulated_loss = 0.0
+
+                    self.model_setup.after_optimizer_step(self.model, self.config, train_progress)
+                    if self.model.ema:
+                        with self.profiler.phase("ema_step"):
+                            update_step = train_progress.global_step // self.config.gradient_accumulation_steps
+                            self.tensorboard.add_scalar(
+                                "ema_decay",
+                                self.model.ema.get_current_decay(update_step),
+                                train_progress.global_step
+                            )
+                            self.model.ema.step(
+                                self.parameters,
+                                update_step
+                            )
 
                     self.one_step_trained = True
 
-                train_progress.next_step(self.config.batch_size)
-                self.callbacks.on_update_train_progress(train_progress, current_epoch_length, self.config.epochs)
+                global_step = train_progress.global_step
+                with self.profiler.phase("update_progress"):
+                    # each step trains one batch on every rank
+                    train_progress.next_step(batch_length * world_size)
+                    self.callbacks.on_update_train_progress(train_progress, current_epoch_length, self.config.epochs)
+
+                with self.profiler.phase("stop_command"):
+                    # also waits for all other ranks to finish the step
+                    stop = distributed_util.any_rank(self.commands.get_stop_command())
+
+                self.profiler.end_step(global_step, batch_length * world_size)
 
-                if self.commands.get_stop_command():
+                if stop:
                     return
 
             train_progress.next_epoch()
             self.callbacks.on_update_train_progress(train_progress, current_epoch_length, self.config.epochs)
 
-            if self.commands.get_stop_command():
+            if distributed_util.any_rank(self.commands.get_stop_command()):
                 return
 
     def end(self):
-        if self.one_step_trained:
+        if self.one_step_trained and distributed_util.is_main_process():
             if self.config.backup_before_save:
                 self.backup(self.model.train_progress)
 
@@ -576,7 +907,22 @@ class GenericTrainer(BaseTrainer):
                 dtype=self.config.output_dtype.torch_dtype()
             )
 
+        if self.checkpoint_writer is not None:
+            self.callbacks.on_update_status("waiting for background checkpoints")
+            self.checkpoint_writer.wait()
+
+        if self.background_sampler is not None:
+            self.callbacks.on_update_status("waiting for background samples")
+            self.__process_background_samples(self.background_sampler.close())
+
+        if distributed_util.is_main_process():
+            self.profiler.save_summary(
+                os.path.join(self.config.workspace_dir, "profiling", f"{get_string_timestamp()}-profile.json")
+            )
+
         self.tensorboard.close()
 
-        if self.config.tensorboard:
+        if self.config.tensorboard and distributed_util.is_main_process():
             self.tensorboard_subprocess.kill()
+
+        distributed_util.destroy_distributed()
@@ -21,6 +21,7 @@ from modules.module.WDModel import WDModel
 from modules.ui.GenerateCaptionsWindow import GenerateCaptionsWindow
 from modules.ui.GenerateMasksWindow import GenerateMasksWindow
 from modules.util import path_util
+from modules.util.OnnxSessionPool import OnnxSessionPool
 from modules.util.ui import components
 from modules.util.ui.UIState import UIState
 
@@ -65,6 +66,8 @@ Mouse wheel: increase or decrease brush size"""
 
         self.masking_model = None
         self.captioning_model = None
+        # owned by this window, so sessions are released when models are switched or the window is closed
+        self.onnx_session_pool = OnnxSessionPool()
 
         self.grid_rowconfigure(0, weight=0)
         self.grid_rowconfigure(1, weight=1)
@@ -519,6 +522,8 @@ Mouse wheel: increase or decrease brush size"""
 
     def load_masking_model(self, model):
         self.captioning_model = None
+        # the current model keeps its own session alive, sessions of all other models are released
+        self.onnx_session_pool.clear()
 
         if model == "ClipSeg":
             if self.masking_model is None or not isinstance(self.masking_model, ClipSegModel):
@@ -527,17 +532,19 @@ Mouse wheel: increase or decrease brush size"""
         elif model == "Rembg":
             if self.masking_model is None or not isinstance(self.masking_model, RembgModel):
                 print("loading Rembg model, this may take a while")
-                self.masking_model = RembgModel(torch.device("cuda"), torch.float32)
+                self.masking_model = RembgModel(torch.device("cuda"), torch.float32, self.onnx_session_pool)
         elif model == "Rembg-Human":
             if self.masking_model is None or not isinstance(self.masking_model, RembgHumanModel):
                 print("loading Rembg-Human model, this may take a while")
-                self.masking_model = RembgHumanModel(torch.device("cuda"), torch.float32)
+                self.masking_model = RembgHumanModel(torch.device("cuda"), torch.float32, self.onnx_session_pool)
         elif model == "Hex Color":
             if self.masking_model is None or not isinstance(self.masking_model, MaskByColor):
                 self.masking_model = MaskByColor(torch.device("cuda"), torch.float32)
 
     def load_captioning_model(self, model):
         self.masking_model = None
+        # the current model keeps its own session alive, sessions of all other models are released
+        self.onnx_session_pool.clear()
 
         if model == "Blip":
             if self.captioning_model is None or not isinstance(self.captioning_model, BlipModel):
@@ -550,7 +557,7 @@ Mouse wheel: increase or decrease brush size"""
         elif model == "WD14 VIT v2":
             if self.captioning_model is None or not isinstance(self.captioning_model, WDModel):
                 print("loading WD14_VIT_v2 model, this may take a while")
-                self.captioning_model = WDModel(torch.device("cuda"), torch.float16)
+                self.captioning_model = WDModel(torch.device("cuda"), torch.float16, session_pool=self.onnx_session_pool)
 
     def print_help(self):
         print(self.help_text)
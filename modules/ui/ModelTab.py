@@ -141,6 +141,14 @@ class ModelTab:
 
         row += 1
 
+        # lazy loading
+        components.label(self.scroll_frame, row, 0, "Lazy Loading",
+                         tooltip="Memory maps the weights of the base model instead of reading them into memory. Weights are only read when they are used, directly to the device they are moved to. "
+                                 "Only works for local diffusers models stored as safetensors. Don't overwrite the base model while training")
+        components.switch(self.scroll_frame, row, 1, self.ui_state, "lazy_model_loading")
+
+        row += 1
+
         return row
 
     def __create_base_components(
@@ -21,7 +21,9 @@ from modules.util.TrainProgress import TrainProgress
 from modules.util.callbacks.TrainCallbacks import TrainCallbacks
 from modules.util.commands.TrainCommands import TrainCommands
 from modules.util.config.TrainConfig import TrainConfig
+from modules.util.enum.CacheFormat import CacheFormat
 from modules.util.enum.DataType import DataType
+from modules.util.enum.DistributedBackend import DistributedBackend
 from modules.util.enum.ImageFormat import ImageFormat
 from modules.util.enum.ModelType import ModelType
 from modules.util.enum.TrainingMethod import TrainingMethod
@@ -169,14 +171,27 @@ class TrainUI(ctk.CTk):
                          tooltip="Exposes Tensorboard Web UI to all network interfaces (makes it accessible from the network)")
         components.switch(master, 7, 1, self.ui_state, "tensorboard_expose")
 
+        # profiling
+        components.label(master, 8, 0, "Profiling",
+                         tooltip="Records the time spent in each phase of a training step. The results are written to Tensorboard and to <workspace>/profiling")
+        components.switch(master, 8, 1, self.ui_state, "profiling")
+
         # device
-        components.label(master, 8, 0, "Train Device",
+        components.label(master, 9, 0, "Train Device",
                          tooltip="The device used for training. Can be \"cuda\", \"cuda:0\", \"cuda:1\" etc. Default:\"cuda\"")
-        components.entry(master, 8, 1, self.ui_state, "train_device")
+        components.entry(master, 9, 1, self.ui_state, "train_device")
 
-        components.label(master, 9, 0, "Temp Device",
+        components.label(master, 10, 0, "Temp Device",
                          tooltip="The device used to temporarily offload models while they are not used. Default:\"cpu\"")
-        components.entry(master, 9, 1, self.ui_state, "temp_device")
+        components.entry(master, 10, 1, self.ui_state, "temp_device")
+
+        # distributed backend
+        components.label(master, 11, 0, "Distributed Backend",
+                         tooltip="The communication backend used when training is launched with torchrun on several GPUs or nodes. NCCL is the fastest option for cuda devices, GLOO also works on the cpu")
+        components.options_kv(master, 11, 1, [
+            ("NCCL", DistributedBackend.NCCL),
+            ("GLOO", DistributedBackend.GLOO),
+        ], self.ui_state, "distributed_backend")
 
     def create_model_tab(self, master):
         return ModelTab(master, self.train_config, self.ui_state)
@@ -213,6 +228,29 @@ class TrainUI(ctk.CTk):
                          tooltip="Clears the cache directory before starting to train. Only disable this if you want to continue using the same cached data. Disabling this can lead to errors, if other settings are changed during a restart")
         components.switch(master, 4, 1, self.ui_state, "clear_cache_before_training")
 
+        # cache format
+        components.label(master, 4, 3, "Cache Format",
+                         tooltip="The format used for the latent cache. \"File per item\" writes one file for each cached item. \"Sharded\" packs all items into a few large memory mapped files, which is faster for big datasets. The sharded cache only re-encodes images and captions that changed, so it does not need to be cleared before training")
+        components.options_kv(master, 4, 4, [
+            ("File per item", CacheFormat.FILE_PER_ITEM),
+            ("Sharded", CacheFormat.SHARDED),
+        ], self.ui_state, "cache_format")
+
+        # cache batch size
+        components.label(master, 5, 3, "Cache Batch Size",
+                         tooltip="The number of images or captions that are encoded together while building the latent cache. Images are only batched with other images of the same resolution")
+        components.entry(master, 5, 4, self.ui_state, "cache_batch_size")
+
+        # prefetch batches
+        components.label(master, 5, 0, "Prefetch Batches",
+                         tooltip="The number of batches that are loaded and moved to the train device in the background while the current step is trained. 0 disables prefetching")
+        components.entry(master, 5, 1, self.ui_state, "prefetch_batches")
+
+        # dataloader threads
+        components.label(master, 6, 0, "Data Loader Threads",
+                         tooltip="The number of threads used to load, crop and augment images in parallel. Random augmentations stay the same, independent of this setting. 1 disables parallel loading")
+        components.entry(master, 6, 1, self.ui_state, "dataloader_threads")
+
     def create_concepts_tab(self, master):
         ConceptTab(master, self.train_config, self.ui_state)
 
@@ -252,6 +290,18 @@ class TrainUI(ctk.CTk):
                          tooltip="Whether to include sample images in the Tensorboard output.")
         components.switch(sub_frame, 0, 3, self.ui_state, "samples_to_tensorboard")
 
+        components.label(sub_frame, 0, 4, "Sample Batch Size",
+                         tooltip="The number of samples that are generated at the same time. Only samples with the same resolution, step count and noise scheduler are combined. Higher values are faster, but need more VRAM.")
+        components.entry(sub_frame, 0, 5, self.ui_state, "sample_batch_size")
+
+        components.label(sub_frame, 1, 0, "Background Sampling",
+                         tooltip="Generates samples in a separate process, so training doesn't pause while sampling. The process loads its own copy of the model on the background sampling device.")
+        components.switch(sub_frame, 1, 1, self.ui_state, "background_sampling")
+
+        components.label(sub_frame, 1, 2, "Background Sampling Device",
+                         tooltip="The device used by the background sampling process. For example \"cuda:1\" for a second GPU, or \"cpu\" (the default). On the cpu, the model is loaded in float32. Setting this to the train device loads a second full copy of the model onto it, which needs as much additional VRAM as the model itself and competes with training for the GPU")
+        components.entry(sub_frame, 1, 3, self.ui_state, "background_sampling_device")
+
         # table
         frame = ctk.CTkFrame(master=master, corner_radius=0)
         frame.grid(row=1, column=0, sticky="nsew")
@@ -288,11 +338,21 @@ class TrainUI(ctk.CTk):
                          tooltip="Create a full backup before saving the final model")
         components.switch(master, 2, 1, self.ui_state, "backup_before_save")
 
+        # incremental backups
+        components.label(master, 2, 3, "Incremental Backups",
+                         tooltip="Only for LoRA and embedding training. Stores the tensors of all backups in a shared directory, and only writes tensors that changed since the last backup. Unchanged parts of the model don't need any additional space")
+        components.switch(master, 2, 4, self.ui_state, "incremental_backups")
+
         # save after
         components.label(master, 3, 0, "Save After",
                          tooltip="The interval used when automatically saving the model during training")
         components.time_entry(master, 3, 1, self.ui_state, "save_after", "save_after_unit")
 
+        # background checkpoints
+        components.label(master, 4, 0, "Background Checkpoints",
+                         tooltip="The number of backups and saves that can be written to disk in the background while training continues. The model is copied to cpu memory first, so each pending checkpoint needs additional RAM. 0 writes checkpoints before training continues")
+        components.entry(master, 4, 1, self.ui_state, "background_checkpoints")
+
     def lora_tab(self, master):
         master.grid_columnconfigure(0, weight=0)
         master.grid_columnconfigure(1, weight=1)
@@ -164,6 +164,16 @@ class TrainingTab:
         components.options(frame, 8, 1, [str(x) for x in list(LearningRateScaler)], self.ui_state,
                            "learning_rate_scaler")
 
+        # auto micro-batch size
+        components.label(frame, 9, 0, "Auto Micro-Batching",
+                         tooltip="Splits each batch into the largest micro-batches that fit into memory. The size is searched once for every aspect ratio bucket. The effective batch size doesn't change")
+        components.switch(frame, 9, 1, self.ui_state, "auto_micro_batch_size")
+
+        # batch pixel budget
+        components.label(frame, 10, 0, "Batch Pixel Budget",
+                         tooltip="If set, replaces the fixed batch size. Each batch is filled with images of one aspect ratio bucket up to this number of pixels, so buckets of smaller images get larger batches. For example, 1048576 is 4 images of 512x512. 0 disables this")
+        components.entry(frame, 10, 1, self.ui_state, "batch_pixel_budget")
+
     def __create_base2_frame(self, master, row):
         frame = ctk.CTkFrame(master=master, corner_radius=5)
         frame.grid(row=row, column=0, padx=5, pady=5, sticky="nsew")
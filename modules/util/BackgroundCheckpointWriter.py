@@ -0,0 +1,100 @@
+import os
+import shutil
+import threading
+import traceback
+from typing import Callable
+
+
+class BackgroundCheckpointWriter:
+    """
+    Writes checkpoints on background threads.
+
+    Every checkpoint is first written to a temporary directory next to its destination, and moved to the destination
+    once it is complete. Incomplete checkpoints are never visible under their final name. At most max_in_flight
+    checkpoints are written at the same time, write() blocks until a slot is free.
+    """
+
+    def __init__(self, max_in_flight: int):
+        self.max_in_flight = max(1, max_in_flight)
+
+        self.__slots = threading.Semaphore(self.max_in_flight)
+        self.__threads = []
+
+    @staticmethod
+    def temp_dir_path(destination: str) -> str:
+        parent, name = os.path.split(os.path.abspath(destination))
+        return os.path.join(parent, f".{name}.tmp")
+
+    def __write(
+            self,
+            destination: str,
+            write_fun: Callable[[str], None],
+            on_done: Callable[[bool], None] | None,
+    ):
+        temp_dir = self.temp_dir_path(destination)
+        parent = os.path.dirname(temp_dir)
+        success = False
+
+        try:
+            if os.path.exists(temp_dir):
+                shutil.rmtree(temp_dir)
+            os.makedirs(temp_dir)
+
+            # the checkpoint is written with its final name, so side files (like .yaml configs) are named correctly
+            write_fun(os.path.join(temp_dir, os.path.basename(destination)))
+
+            for name in os.listdir(temp_dir):
+                target = os.path.join(parent, name)
+                if os.path.isdir(target):
+                    shutil.rmtree(target)
+                os.replace(os.path.join(temp_dir, name), target)
+            os.rmdir(temp_dir)
+
+            success = True
+            print(f"Finished writing {destination}")
+        except:
+            traceback.print_exc()
+            print(f"Could not write {destination}. Check your disk space!")
+            try:
+                if os.path.isdir(temp_dir):
+                    shutil.rmtree(temp_dir)
+            except:
+                traceback.print_exc()
+                print(f"Could not delete partial checkpoint {temp_dir}")
+        finally:
+            try:
+                if on_done is not None:
+                    on_done(success)
+            finally:
+                self.__slots.release()
+
+    def write(
+            self,
+            destination: str,
+            write_fun: Callable[[str], None],
+            on_done: Callable[[bool], None] | None = None,
+    ):
+        """
+        Calls write_fun on a background thread. write_fun receives the path it should write the checkpoint to.
+        on_done is called on the same thread after the checkpoint is moved to its destination, or after it failed.
+        """
+        self.__slots.acquire()
+
+        self.__threads = [thread for thread in self.__threads if thread.is_alive()]
+
+        # not a daemon thread, the interpreter waits for pending checkpoints before it exits
+        thread = threading.Thread(
+            target=self.__write,
+            args=(destination, write_fun, on_done),
+            name=f"checkpoint writer {os.path.basename(destination)}",
+        )
+        self.__threads.append(thread)
+        thread.start()
+
+    def wait(self):
+        """
+        Blocks until all pending checkpoints are written.
+        """
+        for thread in self.__threads:
+            thread.join()
+        self.__threads = []
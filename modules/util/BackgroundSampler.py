@@ -0,0 +1,307 @@
+import os
+import queue
+import traceback
+from collections import deque
+from typing import Any
+
+import torch
+import torch.multiprocessing as mp
+from PIL.Image import Image
+from torch import Tensor
+
+from modules.util import create
+from modules.util.ModelNames import ModelNames
+from modules.util.config.SampleConfig import SampleConfig
+from modules.util.config.TrainConfig import TrainConfig
+from modules.util.enum.DataType import DataType
+from modules.util.enum.EMAMode import EMAMode
+from modules.util.enum.ImageFormat import ImageFormat
+
+
+class BackgroundSampleTask:
+    def __init__(
+            self,
+            sample_params_list: list[SampleConfig],
+            destinations: list[str],
+            tags: list[Any],
+            image_format: ImageFormat,
+            text_encoder_layer_skip: int,
+            force_last_timestep: bool,
+            batch_size: int,
+    ):
+        self.parameters = []
+        self.sample_params_list = sample_params_list
+        self.destinations = destinations
+        self.tags = tags
+        self.image_format = image_format
+        self.text_encoder_layer_skip = text_encoder_layer_skip
+        self.force_last_timestep = force_last_timestep
+        self.batch_size = batch_size
+
+
+def _lower_priority():
+    try:
+        os.nice(10)
+    except (AttributeError, OSError):
+        # not supported on this platform
+        pass
+
+
+def _force_float32(config: TrainConfig):
+    # half precision weights and autocast are slow or unsupported on the cpu
+    config.weight_dtype = DataType.FLOAT_32
+    for model_part in [
+        config.unet, config.prior, config.text_encoder, config.text_encoder_2, config.vae, config.effnet_encoder,
+        config.decoder, config.decoder_text_encoder, config.decoder_vqgan,
+    ]:
+        model_part.weight_dtype = DataType.FLOAT_32
+    config.lora_weight_dtype = DataType.FLOAT_32
+    config.embedding_weight_dtype = DataType.FLOAT_32
+    config.train_dtype = DataType.FLOAT_32
+    config.fallback_train_dtype = DataType.FLOAT_32
+
+
+@torch.no_grad()
+def _run_worker(
+        config_dict: dict,
+        model_names: ModelNames,
+        device_name: str,
+        task_queue: mp.Queue,
+        result_queue: mp.Queue,
+):
+    _lower_priority()
+
+    config = TrainConfig.default_values().from_dict(config_dict)
+    config.train_device = device_name
+    config.temp_device = device_name
+    # the worker only receives the current weights, an ema copy would never be used
+    config.ema = EMAMode.OFF
+    device = torch.device(device_name)
+    if device.type == 'cpu':
+        _force_float32(config)
+
+    model_loader = create.create_model_loader(config.model_type, config.training_method, config.lazy_model_loading)
+    model_setup = create.create_model_setup(config.model_type, device, device, config.training_method)
+    # the worker never trains, an optimizer would only take up memory
+    model_setup.optimizer_enabled = False
+
+    model = model_loader.load(
+        model_type=config.model_type,
+        model_names=model_names,
+        weight_dtypes=config.weight_dtypes(),
+    )
+    model.train_config = config
+    model_setup.setup_model(model, config)
+    model.to(device)
+    model.eval()
+
+    # the same order as the parameters of the trainer
+    parameters = list(model_setup.create_parameters(model, config))
+    model_sampler = create.create_model_sampler(device, device, model, config.model_type, config.training_method)
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+
+        try:
+            for parameter, value in zip(parameters, task.parameters):
+                parameter.copy_(value)
+            del task.parameters
+
+            def on_sample(index: int, image: Image):
+                result_queue.put((task.tags[index], image))
+
+            model_sampler.sample_batch(
+                sample_params_list=task.sample_params_list,
+                destinations=task.destinations,
+                image_format=task.image_format,
+                text_encoder_layer_skip=task.text_encoder_layer_skip,
+                force_last_timestep=task.force_last_timestep,
+                batch_size=task.batch_size,
+                on_sample=on_sample,
+            )
+        except:
+            traceback.print_exc()
+            print("Error during background sampling, proceeding without sampling")
+
+        # marks the task as done
+        result_queue.put(None)
+
+
+class BackgroundSampler:
+    """
+    Generates samples in a separate process, so training continues while samples are generated.
+
+    The worker process loads its own copy of the model on the given device and runs with a lower priority. On the cpu,
+    the model is loaded in float32. For every task, it only receives the current values of the trainable parameters
+    (LoRA weights, embeddings or the fine-tuned model parts) through shared memory. Finished images are sent back, and
+    are returned by poll().
+
+    The parameters are copied into reused, pinned shared memory buffers on a separate cuda stream, so the training
+    thread doesn't wait for the copy. A task is sent to the worker once its copy is finished.
+    """
+
+    def __init__(
+            self,
+            config: TrainConfig,
+            model_names: ModelNames,
+            device: str,
+    ):
+        context = mp.get_context('spawn')
+        self.__task_queue = context.Queue()
+        self.__result_queue = context.Queue()
+        self.__pending_tasks = 0
+
+        self.__copy_stream = None
+        self.__copy_event = None
+        self.__free_buffers = []  # sets of shared buffers that can receive the parameters of a new task
+        self.__task_buffers = deque()  # the buffers of all pending tasks, in submission order
+        self.__unsent_tasks = deque()  # (task, event) of tasks whose parameters are still copied
+
+        self.__process = context.Process(
+            target=_run_worker,
+            args=(config.to_dict(), model_names, device, self.__task_queue, self.__result_queue),
+            name="background sampler",
+            daemon=True,
+        )
+        self.__process.start()
+
+    def is_alive(self) -> bool:
+        return self.__process.is_alive()
+
+    def is_busy(self) -> bool:
+        return self.__pending_tasks > 0
+
+    @staticmethod
+    def __create_buffers(parameters: list[Tensor]) -> list[Tensor]:
+        buffers = []
+        for parameter in parameters:
+            buffer = torch.empty(parameter.shape, dtype=parameter.dtype).share_memory_()
+            if torch.cuda.is_available() and buffer.numel() > 0:
+                # page-locks the shared memory, so copies from the gpu can run asynchronously
+                torch.cuda.cudart().cudaHostRegister(buffer.data_ptr(), buffer.numel() * buffer.element_size(), 0)
+            buffers.append(buffer)
+        return buffers
+
+    @staticmethod
+    def __release_buffers(buffers: list[Tensor]):
+        if torch.cuda.is_available():
+            for buffer in buffers:
+                if buffer.numel() > 0:
+                    torch.cuda.cudart().cudaHostUnregister(buffer.data_ptr())
+
+    def __send_copied_tasks(self, wait: bool = False):
+        while self.__unsent_tasks:
+            task, event = self.__unsent_tasks[0]
+            if event is not None:
+                if wait:
+                    event.synchronize()
+                elif not event.query():
+                    break
+            self.__unsent_tasks.popleft()
+            self.__task_queue.put(task)
+
+    def submit(self, parameters: list[Tensor], task: BackgroundSampleTask):
+        """
+        Queues a task. parameters are copied asynchronously, before_parameter_update() needs to be called before they
+        are changed.
+        """
+        buffers = self.__free_buffers.pop() if self.__free_buffers else self.__create_buffers(parameters)
+
+        event = None
+        cuda_device = next((parameter.device for parameter in parameters if parameter.device.type == 'cuda'), None)
+        if cuda_device is not None:
+            if self.__copy_stream is None:
+                self.__copy_stream = torch.cuda.Stream(cuda_device)
+
+            # the copy starts after all queued work that changes the parameters
+            self.__copy_stream.wait_stream(torch.cuda.current_stream(cuda_device))
+            with torch.cuda.stream(self.__copy_stream):
+                for buffer, parameter in zip(buffers, parameters):
+                    buffer.copy_(parameter.detach(), non_blocking=True)
+                event = torch.cuda.Event()
+                event.record(self.__copy_stream)
+            self.__copy_event = (cuda_device, event)
+        else:
+            for buffer, parameter in zip(buffers, parameters):
+                buffer.copy_(parameter.detach())
+
+        task.parameters = buffers
+        self.__pending_tasks += 1
+        self.__task_buffers.append(buffers)
+        self.__unsent_tasks.append((task, event))
+        self.__send_copied_tasks()
+
+    def before_parameter_update(self):
+        """
+        Makes the current cuda stream wait for the parameter copies of submitted tasks. Needs to be called before the
+        parameters are changed. Only the gpu waits, the calling thread doesn't block.
+        """
+        if self.__copy_event is not None:
+            device, event = self.__copy_event
+            torch.cuda.current_stream(device).wait_event(event)
+            self.__copy_event = None
+
+    def poll(self) -> list[tuple[Any, Image]]:
+        """
+        Returns the tags and images of all samples that were finished since the last call. Never blocks.
+        """
+        self.__send_copied_tasks()
+
+        results = []
+        while True:
+            try:
+                result = self.__result_queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if result is None:
+                self.__task_done()
+            else:
+                results.append(result)
+
+        if self.__pending_tasks > 0 and not self.__process.is_alive():
+            print("The background sampler stopped unexpectedly")
+            self.__pending_tasks = 0
+            self.__free_buffers.extend(self.__task_buffers)
+            self.__task_buffers.clear()
+
+        return results
+
+    def __task_done(self):
+        # tasks are processed in order, the buffers of the oldest task can be reused
+        self.__pending_tasks -= 1
+        if self.__task_buffers:
+            self.__free_buffers.append(self.__task_buffers.popleft())
+
+    def close(self) -> list[tuple[Any, Image]]:
+        """
+        Waits for all queued tasks, stops the worker process, and returns the remaining samples.
+        """
+        results = []
+        if self.__process.is_alive():
+            self.__send_copied_tasks(wait=True)
+            self.__task_queue.put(None)
+            while self.__pending_tasks > 0 and self.__process.is_alive():
+                try:
+                    result = self.__result_queue.get(timeout=1)
+                except queue.Empty:
+                    continue
+
+                if result is None:
+                    self.__task_done()
+                else:
+                    results.append(result)
+            self.__process.join()
+
+        results += self.poll()
+
+        if self.__copy_stream is not None:
+            self.__copy_stream.synchronize()
+        for buffers in [*self.__free_buffers, *self.__task_buffers]:
+            self.__release_buffers(buffers)
+        self.__free_buffers = []
+        self.__task_buffers.clear()
+
+        return results
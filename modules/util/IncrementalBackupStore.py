@@ -0,0 +1,276 @@
+import hashlib
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from typing import Any
+
+import torch
+from safetensors import safe_open
+from safetensors.torch import save_file
+from torch import Tensor
+
+from modules.util import safetensors_util
+
+
+class BlobReference:
+    def __init__(self, blob_hash: str):
+        self.blob_hash = blob_hash
+
+
+class IncrementalBackup:
+    """
+    Collects the manifest of a backup that is currently written to an IncrementalBackupStore.
+
+    The savers pass their in-memory state dicts to save_safetensors() and save_state() instead of writing files. Every
+    tensor is hashed and only written as a blob if no blob with the same content exists yet.
+    """
+
+    def __init__(self, store: 'IncrementalBackupStore', backup_dir: str):
+        self.store = store
+        self.backup_dir = backup_dir
+
+        self.manifest = {
+            'safetensors': {},
+            'torch': {},
+        }
+        self.hashes = set()
+        self.written_bytes = 0
+        self.total_bytes = 0
+
+    def __relative_path(self, path: str) -> str:
+        return os.path.relpath(os.path.abspath(path), self.backup_dir).replace(os.sep, '/')
+
+    def __store_tensor(self, tensor: Tensor, dtype: torch.dtype | None = None) -> BlobReference:
+        tensor = tensor.detach().to(device='cpu', dtype=dtype).contiguous()
+        blob_hash, written_bytes = self.store.store_tensor(tensor, self.hashes)
+
+        self.written_bytes += written_bytes
+        self.total_bytes += tensor.numel() * tensor.element_size()
+        return BlobReference(blob_hash)
+
+    def __replace_tensors(self, state: Any) -> Any:
+        if isinstance(state, Tensor):
+            return self.__store_tensor(state)
+        elif isinstance(state, dict):
+            return {key: self.__replace_tensors(value) for key, value in state.items()}
+        elif isinstance(state, list):
+            return [self.__replace_tensors(value) for value in state]
+        elif isinstance(state, tuple):
+            return tuple(self.__replace_tensors(value) for value in state)
+        return state
+
+    def save_safetensors(
+            self,
+            tensors: dict[str, Tensor],
+            path: str,
+            metadata: dict[str, str] | None = None,
+            dtype: torch.dtype | None = None,
+            hash_key: str | None = None,
+    ):
+        """
+        Adds a safetensors file to the backup. Takes the same arguments as safetensors_util.save_file().
+        """
+        self.manifest['safetensors'][self.__relative_path(path)] = {
+            'metadata': metadata,
+            'hash_key': hash_key,
+            'tensors': {key: self.__store_tensor(tensor, dtype) for key, tensor in tensors.items()},
+        }
+
+    def save_state(self, state: Any, path: str):
+        """
+        Adds a file written by torch.save() to the backup.
+        """
+        self.manifest['torch'][self.__relative_path(path)] = self.__replace_tensors(state)
+
+
+class IncrementalBackupStore:
+    """
+    Deduplicates the tensors of backups in a content addressed blob directory.
+
+    While a backup is written with write_backup(), the savers hand their tensors to the store instead of writing
+    .safetensors and .pt files. Every tensor is hashed in memory and written to the blob directory, unless a blob with
+    the same content already exists. The backup only contains a manifest that describes how to rebuild the files.
+    Tensors that didn't change since the last backup (frozen or stopped parts of the model, and their optimizer state)
+    are neither written nor need any additional space.
+
+    Deduplicated backups can't be loaded directly, they need to be restored to a new directory first.
+    """
+
+    MANIFEST_FILE_NAME = "incremental_manifest.pt"
+
+    __lock = threading.Lock()
+    __active_backups: dict[str, IncrementalBackup] = {}
+
+    def __init__(self, blob_dir: str):
+        self.blob_dir = blob_dir
+
+    @staticmethod
+    def for_backup(backup_dir: str) -> 'IncrementalBackupStore':
+        return IncrementalBackupStore(os.path.join(os.path.dirname(os.path.abspath(backup_dir)), ".blobs"))
+
+    @staticmethod
+    def is_incremental(backup_dir: str) -> bool:
+        return os.path.isfile(os.path.join(backup_dir, IncrementalBackupStore.MANIFEST_FILE_NAME))
+
+    @staticmethod
+    def active_backup(path: str) -> IncrementalBackup | None:
+        """
+        Returns the incremental backup that is currently written to a directory containing path, if there is one.
+        """
+        path = os.path.abspath(path)
+        with IncrementalBackupStore.__lock:
+            for backup_dir, backup in IncrementalBackupStore.__active_backups.items():
+                if os.path.commonpath([path, backup_dir]) == backup_dir:
+                    return backup
+        return None
+
+    @staticmethod
+    def __hash_tensor(tensor: Tensor) -> str:
+        sha256_hash = hashlib.sha256()
+        sha256_hash.update(f"{tensor.dtype}{list(tensor.shape)}".encode('utf-8'))
+        if tensor.numel() > 0:
+            sha256_hash.update(tensor.reshape(-1).view(torch.uint8).numpy())
+
+        return sha256_hash.hexdigest()
+
+    def __blob_path(self, blob_hash: str) -> str:
+        return os.path.join(self.blob_dir, f"{blob_hash}.safetensors")
+
+    def store_tensor(self, tensor: Tensor, referenced_hashes: set[str]) -> tuple[str, int]:
+        """
+        Stores a contiguous cpu tensor as a blob, unless it already exists. The hash is added to referenced_hashes
+        before the blob is checked, so it is not collected while the backup is written. Returns the blob hash and the
+        number of newly written bytes.
+        """
+        blob_hash = self.__hash_tensor(tensor)
+        blob_path = self.__blob_path(blob_hash)
+
+        with self.__lock:
+            referenced_hashes.add(blob_hash)
+            if os.path.exists(blob_path):
+                return blob_hash, 0
+
+        # the temporary name is unique, the same blob can be written by several backups at once
+        temp_path = f"{blob_path}.{threading.get_ident()}.tmp"
+        save_file({"tensor": tensor}, temp_path)
+        os.replace(temp_path, blob_path)
+        return blob_hash, tensor.numel() * tensor.element_size()
+
+    def __load_tensor(self, blob_hash: str) -> Tensor:
+        with safe_open(self.__blob_path(blob_hash), framework="pt") as f:
+            return f.get_tensor("tensor")
+
+    def __restore_tensors(self, state: Any) -> Any:
+        if isinstance(state, BlobReference):
+            return self.__load_tensor(state.blob_hash)
+        elif isinstance(state, dict):
+            return {key: self.__restore_tensors(value) for key, value in state.items()}
+        elif isinstance(state, list):
+            return [self.__restore_tensors(value) for value in state]
+        elif isinstance(state, tuple):
+            return tuple(self.__restore_tensors(value) for value in state)
+        return state
+
+    @staticmethod
+    def __referenced_hashes(state: Any, hashes: set[str]):
+        if isinstance(state, BlobReference):
+            hashes.add(state.blob_hash)
+        elif isinstance(state, dict):
+            for value in state.values():
+                IncrementalBackupStore.__referenced_hashes(value, hashes)
+        elif isinstance(state, list | tuple):
+            for value in state:
+                IncrementalBackupStore.__referenced_hashes(value, hashes)
+
+    @contextmanager
+    def write_backup(self, backup_dir: str):
+        """
+        Makes all tensor files that the savers write to backup_dir part of an incremental backup. The manifest is
+        written when the context exits without an exception.
+        """
+        backup_dir = os.path.abspath(backup_dir)
+        backup = IncrementalBackup(self, backup_dir)
+
+        os.makedirs(self.blob_dir, exist_ok=True)
+        with self.__lock:
+            self.__active_backups[backup_dir] = backup
+
+        try:
+            yield backup
+
+            os.makedirs(backup_dir, exist_ok=True)
+            manifest_path = os.path.join(backup_dir, self.MANIFEST_FILE_NAME)
+            torch.save(backup.manifest, manifest_path + ".tmp")
+            os.replace(manifest_path + ".tmp", manifest_path)
+        finally:
+            with self.__lock:
+                self.__active_backups.pop(backup_dir, None)
+
+        print(f"Incremental backup: wrote {backup.written_bytes / (1024 ** 2):.1f} MiB "
+              f"of {backup.total_bytes / (1024 ** 2):.1f} MiB")
+
+    def restore(self, backup_dir: str, destination: str):
+        """
+        Rebuilds the original files of a deduplicated backup in destination.
+        """
+        if os.path.exists(destination):
+            shutil.rmtree(destination)
+        shutil.copytree(
+            backup_dir, destination, ignore=shutil.ignore_patterns(self.MANIFEST_FILE_NAME)
+        )
+
+        manifest = torch.load(os.path.join(backup_dir, self.MANIFEST_FILE_NAME))
+
+        for relative_path, entry in manifest['safetensors'].items():
+            path = os.path.join(destination, relative_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            safetensors_util.save_file(
+                self.__restore_tensors(entry['tensors']),
+                path,
+                entry['metadata'],
+                hash_key=entry.get('hash_key'),
+            )
+
+        for relative_path, state in manifest['torch'].items():
+            path = os.path.join(destination, relative_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            torch.save(self.__restore_tensors(state), path)
+
+    def collect_garbage(self, backup_root: str):
+        """
+        Deletes all blobs that are not referenced by any backup in backup_root, or by a backup that is being written.
+        """
+        with self.__lock:
+            if not os.path.isdir(self.blob_dir):
+                return
+
+            blob_dir = os.path.abspath(self.blob_dir)
+
+            while True:
+                hashes = set()
+                complete = True
+
+                def on_error(e: OSError):
+                    # a backup was moved or deleted while scanning, it could be missing from the list
+                    nonlocal complete
+                    complete = False
+
+                # finished background backups are moved out of hidden temporary directories, those are scanned as well
+                for root, dir_names, file_names in os.walk(backup_root, onerror=on_error):
+                    dir_names[:] = [name for name in dir_names if os.path.abspath(os.path.join(root, name)) != blob_dir]
+                    if self.MANIFEST_FILE_NAME in file_names:
+                        try:
+                            self.__referenced_hashes(torch.load(os.path.join(root, self.MANIFEST_FILE_NAME)), hashes)
+                        except FileNotFoundError as e:
+                            on_error(e)
+
+                if complete:
+                    break
+
+            for backup in self.__active_backups.values():
+                hashes |= backup.hashes
+
+            for file_name in os.listdir(self.blob_dir):
+                if file_name.endswith(".safetensors") and file_name[:-len(".safetensors")] not in hashes:
+                    os.remove(os.path.join(self.blob_dir, file_name))
@@ -0,0 +1,115 @@
+from typing import Callable
+
+import torch
+from torch import Tensor
+from torch.nn import Parameter
+
+from modules.util.torch_util import torch_gc
+
+
+class MicroBatchSizer:
+    """
+    Splits batches into micro-batches that fit into memory.
+
+    The micro-batch size is searched once for every batch shape, which means once for every aspect ratio bucket. The
+    search runs a forward and backward pass of a single micro-batch, and reduces the size with a binary search until
+    it fits. The gradients of the search are discarded. Batches of small buckets can use larger micro-batches than
+    batches of large buckets.
+
+    The effective batch size doesn't change: the loss of each micro-batch is weighted by its share of the batch, and
+    the gradients of all micro-batches are accumulated before the optimizer step.
+    """
+
+    def __init__(self, parameters: list[Parameter]):
+        self.parameters = parameters
+
+        self.__sizes = {}
+
+    @staticmethod
+    def batch_length(batch: dict) -> int:
+        for value in batch.values():
+            if isinstance(value, Tensor) and value.ndim > 0:
+                return value.shape[0]
+            if isinstance(value, list):
+                return len(value)
+        return 1
+
+    @staticmethod
+    def __shape_key(batch: dict) -> tuple:
+        return tuple(
+            (name, tuple(value.shape)) for name, value in sorted(batch.items())
+            if isinstance(value, Tensor)
+        )
+
+    @staticmethod
+    def split(batch: dict, size: int) -> list[dict]:
+        length = MicroBatchSizer.batch_length(batch)
+        micro_batches = []
+        for start in range(0, length, size):
+            micro_batch = {}
+            for name, value in batch.items():
+                if isinstance(value, Tensor) and value.ndim > 0 and value.shape[0] == length:
+                    micro_batch[name] = value[start:start + size]
+                elif isinstance(value, list) and len(value) == length:
+                    micro_batch[name] = value[start:start + size]
+                else:
+                    micro_batch[name] = value
+            micro_batch['batch_length'] = length
+            micro_batches.append(micro_batch)
+        return micro_batches
+
+    def __fits(self, micro_batch: dict, train_fun: Callable[[dict], float]) -> bool:
+        try:
+            train_fun(micro_batch)
+            return True
+        except torch.cuda.OutOfMemoryError:
+            return False
+        finally:
+            for parameter in self.parameters:
+                parameter.grad = None
+            torch_gc()
+
+    def __search(self, batch: dict, train_fun: Callable[[dict], float]) -> int:
+        length = self.batch_length(batch)
+
+        # the gradients of the current accumulation steps are kept aside during the search
+        gradients = [parameter.grad for parameter in self.parameters]
+        for parameter in self.parameters:
+            parameter.grad = None
+
+        try:
+            # fitting_size always fits, failing_size never fits
+            fitting_size, failing_size = 0, length + 1
+            size = length
+            while failing_size - fitting_size > 1:
+                if self.__fits(self.split(batch, size)[0], train_fun):
+                    fitting_size = size
+                else:
+                    failing_size = size
+                size = (fitting_size + failing_size) // 2
+        finally:
+            for parameter, gradient in zip(self.parameters, gradients):
+                parameter.grad = gradient
+
+        if fitting_size == 0:
+            raise torch.cuda.OutOfMemoryError("A single sample doesn't fit into memory")
+
+        print(f"Using a micro-batch size of {fitting_size} for batches of shape {self.__describe(batch)}")
+        return fitting_size
+
+    @staticmethod
+    def __describe(batch: dict) -> str:
+        for name, value in sorted(batch.items()):
+            if isinstance(value, Tensor) and value.ndim == 4:
+                return f"{name} {list(value.shape)}"
+        return "unknown"
+
+    def micro_batches(self, batch: dict, train_fun: Callable[[dict], float]) -> list[dict]:
+        """
+        Splits the batch into micro-batches. If this batch shape was not seen before, the largest micro-batch size is
+        searched first by calling train_fun with micro-batches of different sizes.
+        """
+        key = self.__shape_key(batch)
+        if key not in self.__sizes:
+            self.__sizes[key] = self.__search(batch, train_fun)
+        return self.split(batch, self.__sizes[key])
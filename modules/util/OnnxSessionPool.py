@@ -0,0 +1,148 @@
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import onnxruntime
+import torch
+
+from modules.util.enum.OnnxGraphOptimization import OnnxGraphOptimization
+
+
+class OnnxSession:
+    """
+    One or more inference sessions of the same model file.
+
+    run() has the same interface as onnxruntime.InferenceSession.run(). Batched inputs are split into chunks that are
+    run concurrently on all sessions. Models with a fixed batch size are run in chunks of that size.
+    """
+
+    def __init__(self, sessions: list[onnxruntime.InferenceSession]):
+        self.sessions = sessions
+
+        self.__executor = None
+        if len(sessions) > 1:
+            self.__executor = ThreadPoolExecutor(max_workers=len(sessions), thread_name_prefix='OnnxSession')
+
+    def get_inputs(self):
+        return self.sessions[0].get_inputs()
+
+    def get_outputs(self):
+        return self.sessions[0].get_outputs()
+
+    def __max_batch_size(self) -> int | None:
+        batch_dim = self.get_inputs()[0].shape[0]
+        return batch_dim if isinstance(batch_dim, int) else None
+
+    def run(self, output_names: list[str] | None, input_feed: dict[str, np.ndarray]) -> list[np.ndarray]:
+        batch_size = next(iter(input_feed.values())).shape[0]
+        max_batch_size = self.__max_batch_size()
+
+        chunk_size = math.ceil(batch_size / len(self.sessions))
+        if max_batch_size is not None:
+            chunk_size = min(chunk_size, max_batch_size)
+
+        if chunk_size >= batch_size:
+            return self.sessions[0].run(output_names, input_feed)
+
+        chunks = [
+            {name: value[start:start + chunk_size] for name, value in input_feed.items()}
+            for start in range(0, batch_size, chunk_size)
+        ]
+
+        if self.__executor is None:
+            results = [self.sessions[0].run(output_names, chunk) for chunk in chunks]
+        else:
+            futures = [
+                self.__executor.submit(self.sessions[i % len(self.sessions)].run, output_names, chunk)
+                for i, chunk in enumerate(chunks)
+            ]
+            results = [future.result() for future in futures]
+
+        return [np.concatenate([result[i] for result in results]) for i in range(len(results[0]))]
+
+
+class OnnxSessionPool:
+    """
+    Caches onnxruntime inference sessions per model file and device, so every model is only loaded once.
+
+    All sessions are created with the same thread, graph optimization and memory arena settings. On cpu-only hosts,
+    sessions_per_model sessions are created for each model. Each of them gets an equal share of the cpu cores, and
+    batches are split between them. This often uses the cores better than a single session with many threads.
+    """
+
+    def __init__(
+            self,
+            intra_op_threads: int = 0,
+            inter_op_threads: int = 0,
+            graph_optimization: OnnxGraphOptimization = OnnxGraphOptimization.ALL,
+            enable_memory_arena: bool = True,
+            sessions_per_model: int = 1,
+    ):
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.graph_optimization = graph_optimization
+        self.enable_memory_arena = enable_memory_arena
+        self.sessions_per_model = max(1, sessions_per_model)
+
+        self.__sessions = {}
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def default() -> 'OnnxSessionPool':
+        """
+        Returns a pool with default settings that is shared by all models of this process.
+        """
+        return _default_pool
+
+    @staticmethod
+    def __providers(device: torch.device) -> list[str]:
+        if device.type == 'cpu':
+            return ["CPUExecutionProvider"]
+        elif "CUDAExecutionProvider" in onnxruntime.get_available_providers():
+            return ["CUDAExecutionProvider"]
+        else:
+            return ["CPUExecutionProvider"]
+
+    def __session_options(self, session_count: int) -> onnxruntime.SessionOptions:
+        options = onnxruntime.SessionOptions()
+
+        intra_op_threads = self.intra_op_threads
+        if intra_op_threads == 0 and session_count > 1:
+            # the sessions share the cpu cores instead of each using all of them
+            intra_op_threads = max(1, (os.cpu_count() or 1) // session_count)
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = self.inter_op_threads
+        if self.inter_op_threads > 1:
+            options.execution_mode = onnxruntime.ExecutionMode.ORT_PARALLEL
+
+        options.graph_optimization_level = self.graph_optimization.onnx_level()
+        options.enable_cpu_mem_arena = self.enable_memory_arena
+
+        return options
+
+    def get_session(self, model_path: str, device: torch.device) -> OnnxSession:
+        providers = self.__providers(device)
+        key = (os.path.abspath(model_path), tuple(providers))
+
+        with self.__lock:
+            if key not in self.__sessions:
+                session_count = self.sessions_per_model if providers == ["CPUExecutionProvider"] else 1
+                options = self.__session_options(session_count)
+                self.__sessions[key] = OnnxSession([
+                    onnxruntime.InferenceSession(model_path, sess_options=options, providers=providers)
+                    for _ in range(session_count)
+                ])
+
+            return self.__sessions[key]
+
+    def clear(self):
+        """
+        Releases all cached sessions.
+        """
+        with self.__lock:
+            self.__sessions = {}
+
+
+_default_pool = OnnxSessionPool()
@@ -0,0 +1,72 @@
+from typing import Callable
+
+import torch
+from torch import Tensor
+
+from modules.module.LoRAModule import LoRAModuleWrapper
+
+
+class PromptEmbeddingCache:
+    """
+    Caches the text encoder outputs of sample prompts.
+
+    Entries are keyed on the prompt and the text encoder layer skip. All entries are dropped when the text encoder
+    version changes. The version is built from the data pointers and in-place version counters of the trainable text
+    encoder parameters, so a frozen text encoder never invalidates the cache. An optimizer step of a trained text
+    encoder increments the version counters. An ema weight swap replaces parameter.data, which keeps the version
+    counter, but changes the data pointer.
+    """
+
+    def __init__(self, storage_device: torch.device):
+        self.storage_device = storage_device
+
+        self.__version = None
+        self.__entries = {}
+
+    @staticmethod
+    def text_encoder_version(*modules: torch.nn.Module | LoRAModuleWrapper | None) -> tuple:
+        version = []
+        for module in modules:
+            if module is None:
+                continue
+            for parameter in module.parameters():
+                if parameter.requires_grad:
+                    version.append((id(parameter), parameter.data_ptr(), parameter._version))
+        return tuple(version)
+
+    def clear(self):
+        self.__version = None
+        self.__entries = {}
+
+    def encode(
+            self,
+            prompts: list[str],
+            text_encoder_layer_skip: int,
+            version: tuple,
+            encode_fun: Callable[[list[str]], tuple[Tensor | None, ...]],
+            device: torch.device,
+    ) -> tuple[Tensor | None, ...]:
+        """
+        Returns the stacked outputs of encode_fun for all prompts. encode_fun is only called for prompts that are not
+        cached, and not at all if every prompt is cached.
+        """
+        if version != self.__version:
+            self.__entries = {}
+            self.__version = version
+
+        missing_prompts = list(dict.fromkeys(
+            prompt for prompt in prompts if (prompt, text_encoder_layer_skip) not in self.__entries
+        ))
+
+        if missing_prompts:
+            outputs = encode_fun(missing_prompts)
+            for i, prompt in enumerate(missing_prompts):
+                self.__entries[(prompt, text_encoder_layer_skip)] = tuple(
+                    None if output is None else output[i].to(device=self.storage_device) for output in outputs
+                )
+
+        entries = [self.__entries[(prompt, text_encoder_layer_skip)] for prompt in prompts]
+        return tuple(
+            None if values[0] is None else torch.stack(values).to(device=device)
+            for values in zip(*entries)
+        )
@@ -0,0 +1,159 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterable, Iterator
+
+import torch
+from torch.utils.tensorboard import SummaryWriter
+
+
+class TrainProfiler:
+    """
+    Records the wall time of each phase of a training step.
+
+    When the train device is a cuda device, phases are timed with cuda events, so the measured time includes the
+    asynchronous GPU work that was queued during the phase. Otherwise, time.perf_counter() is used. Data loader stall
+    time is always measured on the host, as the time spent waiting for the next batch in batches().
+    """
+
+    def __init__(
+            self,
+            enabled: bool,
+            train_device: torch.device,
+            tensorboard: SummaryWriter,
+    ):
+        self.enabled = enabled
+        self.tensorboard = tensorboard
+        self.use_cuda_events = enabled and train_device.type == 'cuda' and torch.cuda.is_available()
+
+        self.__step_phases = []
+        self.__step_start_time = None
+        self.__step_data_stall = 0.0
+
+        self.__phase_total_times = {}
+        self.__phase_counts = {}
+        self.__data_stall_total_time = 0.0
+        self.__total_time = 0.0
+        self.__step_count = 0
+        self.__sample_count = 0
+
+    def batches(self, data_loader: Iterable) -> Iterator:
+        """
+        Yields the batches of data_loader, and measures the time spent waiting for each of them.
+        """
+        iterator = iter(data_loader)
+        while True:
+            start_time = time.perf_counter()
+            try:
+                batch = next(iterator)
+            except StopIteration:
+                return
+            self.__step_data_stall = time.perf_counter() - start_time
+
+            yield batch
+
+    def start_step(self):
+        """
+        Called directly after a new batch was received from batches().
+        """
+        if not self.enabled:
+            return
+
+        self.__step_start_time = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name: str):
+        if not self.enabled:
+            yield
+            return
+
+        if self.use_cuda_events:
+            start_event = torch.cuda.Event(enable_timing=True)
+            end_event = torch.cuda.Event(enable_timing=True)
+            start_event.record()
+            try:
+                yield
+            finally:
+                end_event.record()
+                self.__step_phases.append((name, start_event, end_event))
+        else:
+            start_time = time.perf_counter()
+            try:
+                yield
+            finally:
+                self.__step_phases.append((name, start_time, time.perf_counter()))
+
+    def __resolve_phase_times(self) -> dict[str, float]:
+        # returns the time of each phase in seconds
+        phase_times = {}
+
+        if self.use_cuda_events and self.__step_phases:
+            self.__step_phases[-1][2].synchronize()
+
+        for name, start, end in self.__step_phases:
+            if self.use_cuda_events:
+                duration = start.elapsed_time(end) / 1000.0
+            else:
+                duration = end - start
+            phase_times[name] = phase_times.get(name, 0.0) + duration
+
+        self.__step_phases = []
+        return phase_times
+
+    def end_step(self, global_step: int, batch_size: int):
+        if not self.enabled:
+            return
+
+        phase_times = self.__resolve_phase_times()
+
+        step_time = time.perf_counter() - self.__step_start_time + self.__step_data_stall
+
+        for name, duration in phase_times.items():
+            self.__phase_total_times[name] = self.__phase_total_times.get(name, 0.0) + duration
+            self.__phase_counts[name] = self.__phase_counts.get(name, 0) + 1
+            self.tensorboard.add_scalar(f"profiling/{name}_ms", duration * 1000.0, global_step)
+
+        self.__data_stall_total_time += self.__step_data_stall
+        self.__total_time += step_time
+        self.__step_count += 1
+        self.__sample_count += batch_size
+
+        self.tensorboard.add_scalar("profiling/data_loader_stall_ms", self.__step_data_stall * 1000.0, global_step)
+        self.tensorboard.add_scalar("profiling/step_ms", step_time * 1000.0, global_step)
+        if step_time > 0:
+            self.tensorboard.add_scalar("profiling/samples_per_second", batch_size / step_time, global_step)
+
+    def summary(self) -> dict:
+        phases = {}
+        for name, total_time in self.__phase_total_times.items():
+            count = self.__phase_counts[name]
+            phases[name] = {
+                "total_seconds": total_time,
+                "mean_ms": total_time * 1000.0 / count,
+                "count": count,
+                "fraction": total_time / self.__total_time if self.__total_time > 0 else 0.0,
+            }
+
+        return {
+            "timer": "cuda_event" if self.use_cuda_events else "perf_counter",
+            "steps": self.__step_count,
+            "samples": self.__sample_count,
+            "total_seconds": self.__total_time,
+            "samples_per_second": self.__sample_count / self.__total_time if self.__total_time > 0 else 0.0,
+            "data_loader_stall": {
+                "total_seconds": self.__data_stall_total_time,
+                "mean_ms": self.__data_stall_total_time * 1000.0 / self.__step_count if self.__step_count > 0 else 0.0,
+                "fraction": self.__data_stall_total_time / self.__total_time if self.__total_time > 0 else 0.0,
+            },
+            "phases": phases,
+        }
+
+    def save_summary(self, path: str):
+        if not self.enabled or self.__step_count == 0:
+            return
+
+        os.makedirs(Path(path).parent.absolute(), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=4)
@@ -11,11 +11,18 @@ class TrainProgress:
         self.epoch_sample = epoch_sample
         self.global_step = global_step
 
+        # the index of the current micro-batch, if a step is split into several micro-batches
+        self.micro_batch = 0
+
     def next_step(self, batch_size: int):
         self.epoch_step += 1
         self.epoch_sample += batch_size
         self.global_step += 1
 
+    def step_seed(self) -> int:
+        # each micro-batch of a step needs its own random values, the first one uses the seed of the whole step
+        return self.global_step + (self.micro_batch << 32)
+
     def next_epoch(self):
         self.epoch_step = 0
         self.epoch_sample = 0
@@ -0,0 +1,50 @@
+import argparse
+from typing import Any
+
+from modules.util.args.BaseArgs import BaseArgs
+from modules.util.enum.DataType import DataType
+
+
+class BenchmarkEmaArgs(BaseArgs):
+    parameter_count: int
+    parameter_size: int
+    steps: int
+    device: str
+    ema_device: str
+    dtype: DataType
+
+    def __init__(self, data: list[(str, Any, type, bool)]):
+        super(BenchmarkEmaArgs, self).__init__(data)
+
+    @staticmethod
+    def parse_args() -> 'BenchmarkEmaArgs':
+        parser = argparse.ArgumentParser(description="One Trainer EMA Benchmark Script.")
+
+        # @formatter:off
+
+        parser.add_argument("--parameter-count", type=int, required=False, default=2000, dest="parameter_count", help="The number of parameter tensors")
+        parser.add_argument("--parameter-size", type=int, required=False, default=1024 * 1024, dest="parameter_size", help="The number of elements in each parameter tensor")
+        parser.add_argument("--steps", type=int, required=False, default=20, dest="steps", help="The number of measured ema steps")
+        parser.add_argument("--device", type=str, required=False, default="cuda", dest="device", help="The device of the trained parameters")
+        parser.add_argument("--ema-device", type=str, required=False, default="cpu", dest="ema_device", help="The device of the ema parameters")
+        parser.add_argument("--dtype", type=DataType, required=False, default=DataType.FLOAT_32, dest="dtype", help="The data type of the parameters", choices=list(DataType))
+
+        # @formatter:on
+
+        args = BenchmarkEmaArgs.default_values()
+        args.from_dict(vars(parser.parse_args()))
+        return args
+
+    @staticmethod
+    def default_values() -> 'BenchmarkEmaArgs':
+        data = []
+
+        # name, default value, data type, nullable
+        data.append(("parameter_count", 2000, int, False))
+        data.append(("parameter_size", 1024 * 1024, int, False))
+        data.append(("steps", 20, int, False))
+        data.append(("device", "cuda", str, False))
+        data.append(("ema_device", "cpu", str, False))
+        data.append(("dtype", DataType.FLOAT_32, DataType, False))
+
+        return BenchmarkEmaArgs(data)
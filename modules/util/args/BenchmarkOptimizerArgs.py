@@ -0,0 +1,47 @@
+import argparse
+from typing import Any
+
+from modules.util.args.BaseArgs import BaseArgs
+from modules.util.enum.Optimizer import Optimizer
+
+
+class BenchmarkOptimizerArgs(BaseArgs):
+    optimizer: Optimizer
+    parameter_count: int
+    parameter_size: int
+    steps: int
+    device: str
+
+    def __init__(self, data: list[(str, Any, type, bool)]):
+        super(BenchmarkOptimizerArgs, self).__init__(data)
+
+    @staticmethod
+    def parse_args() -> 'BenchmarkOptimizerArgs':
+        parser = argparse.ArgumentParser(description="One Trainer Stochastic Rounding Optimizer Benchmark Script.")
+
+        # @formatter:off
+
+        parser.add_argument("--optimizer", type=Optimizer, required=False, default=Optimizer.ADAMW, dest="optimizer", help="The optimizer to benchmark", choices=[Optimizer.ADAM, Optimizer.ADAMW, Optimizer.ADAFACTOR])
+        parser.add_argument("--parameter-count", type=int, required=False, default=500, dest="parameter_count", help="The number of parameter tensors")
+        parser.add_argument("--parameter-size", type=int, required=False, default=1024 * 1024, dest="parameter_size", help="The number of elements in each parameter tensor")
+        parser.add_argument("--steps", type=int, required=False, default=20, dest="steps", help="The number of measured optimizer steps")
+        parser.add_argument("--device", type=str, required=False, default="cuda", dest="device", help="The device of the trained parameters")
+
+        # @formatter:on
+
+        args = BenchmarkOptimizerArgs.default_values()
+        args.from_dict(vars(parser.parse_args()))
+        return args
+
+    @staticmethod
+    def default_values() -> 'BenchmarkOptimizerArgs':
+        data = []
+
+        # name, default value, data type, nullable
+        data.append(("optimizer", Optimizer.ADAMW, Optimizer, False))
+        data.append(("parameter_count", 500, int, False))
+        data.append(("parameter_size", 1024 * 1024, int, False))
+        data.append(("steps", 20, int, False))
+        data.append(("device", "cuda", str, False))
+
+        return BenchmarkOptimizerArgs(data)
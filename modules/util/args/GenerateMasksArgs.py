@@ -4,6 +4,7 @@ from typing import Any
 from modules.util.args.BaseArgs import BaseArgs
 from modules.util.enum.DataType import DataType
 from modules.util.enum.GenerateMasksModel import GenerateMasksModel
+from modules.util.enum.OnnxGraphOptimization import OnnxGraphOptimization
 
 
 class GenerateMasksArgs(BaseArgs):
@@ -18,6 +19,13 @@ class GenerateMasksArgs(BaseArgs):
     dtype: DataType
     alpha: float
     include_subdirectories: bool
+    batch_size: int
+    num_workers: int
+    onnx_intra_op_threads: int
+    onnx_inter_op_threads: int
+    onnx_graph_optimization: OnnxGraphOptimization
+    onnx_memory_arena: bool
+    onnx_sessions: int
 
     def __init__(self, data: list[(str, Any, type, bool)]):
         super(GenerateMasksArgs, self).__init__(data)
@@ -39,6 +47,13 @@ class GenerateMasksArgs(BaseArgs):
         parser.add_argument("--dtype", type=DataType, required=False, default=DataType.FLOAT_32, dest="dtype", help="The data type to use for weights during calculations", choices=list(DataType))
         parser.add_argument("--alpha", type=float, required=False, default=1.0, dest="alpha", help="The factor to weight the mask by. Default is 1.")
         parser.add_argument("--include-subdirectories", action="store_true", required=False, default=False, dest="include_subdirectories", help="Whether to include subdirectories when processing samples")
+        parser.add_argument("--batch-size", type=int, required=False, default=1, dest="batch_size", help="The number of images masked in a single model call")
+        parser.add_argument("--num-workers", type=int, required=False, default=4, dest="num_workers", help="The number of threads used to load images and to write masks")
+        parser.add_argument("--onnx-intra-op-threads", type=int, required=False, default=0, dest="onnx_intra_op_threads", help="The number of threads used within an operation of ONNX models. 0 uses the onnxruntime default")
+        parser.add_argument("--onnx-inter-op-threads", type=int, required=False, default=0, dest="onnx_inter_op_threads", help="The number of threads used to run independent operations of ONNX models in parallel. 0 uses the onnxruntime default")
+        parser.add_argument("--onnx-graph-optimization", type=OnnxGraphOptimization, required=False, default=OnnxGraphOptimization.ALL, dest="onnx_graph_optimization", help="The graph optimization level of ONNX models", choices=list(OnnxGraphOptimization))
+        parser.add_argument("--onnx-disable-memory-arena", action="store_false", required=False, default=True, dest="onnx_memory_arena", help="Disables the cpu memory arena of ONNX models")
+        parser.add_argument("--onnx-sessions", type=int, required=False, default=1, dest="onnx_sessions", help="The number of concurrent sessions for each ONNX model on cpu-only hosts")
 
         # @formatter:on
 
@@ -61,5 +76,12 @@ class GenerateMasksArgs(BaseArgs):
         data.append(("dtype", DataType.FLOAT_16, DataType, False))
         data.append(("alpha", 1.0, float, False))
         data.append(("include_subdirectories", False, bool, False))
+        data.append(("batch_size", 1, int, False))
+        data.append(("num_workers", 4, int, False))
+        data.append(("onnx_intra_op_threads", 0, int, False))
+        data.append(("onnx_inter_op_threads", 0, int, False))
+        data.append(("onnx_graph_optimization", OnnxGraphOptimization.ALL, OnnxGraphOptimization, False))
+        data.append(("onnx_memory_arena", True, bool, False))
+        data.append(("onnx_sessions", 1, int, False))
 
         return GenerateMasksArgs(data)
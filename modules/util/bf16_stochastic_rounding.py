@@ -1,6 +1,32 @@
 import torch
 from torch import Tensor
 
+# the list functions convert at most this many elements to float32 at once, and at most this many random bits are
+# generated at once
+_LIST_CHUNK_NUMEL = 1 << 26
+
+# reused int32 buffers for the random bits, one per device. each buffer holds at most _LIST_CHUNK_NUMEL elements
+_random_bit_buffers: dict[torch.device, Tensor] = {}
+
+
+def _random_bits(numel: int, device: torch.device) -> Tensor:
+    """
+    returns a flat int32 tensor of numel random 16 bit integers, numel can be at most _LIST_CHUNK_NUMEL. The memory
+    is reused between calls, the result is only valid until the next call.
+    """
+    if numel > _LIST_CHUNK_NUMEL:
+        raise ValueError(f"at most {_LIST_CHUNK_NUMEL} random bits can be generated at once, got {numel}")
+
+    buffer = _random_bit_buffers.get(device)
+    if buffer is None or buffer.numel() < numel:
+        # grows in powers of two up to the limit, so slightly larger requests don't allocate again
+        buffer = torch.empty(min(_LIST_CHUNK_NUMEL, 1 << (numel - 1).bit_length()), dtype=torch.int32, device=device)
+        _random_bit_buffers[device] = buffer
+
+    bits = buffer[:numel]
+    bits.random_(0, 1 << 16)
+    return bits
+
 
 def copy_stochastic_(target: Tensor, source: Tensor):
     """
@@ -10,13 +36,19 @@ def copy_stochastic_(target: Tensor, source: Tensor):
         target: the target tensor with dtype=bfloat16
         source: the target tensor with dtype=float32
     """
+    if source.numel() > _LIST_CHUNK_NUMEL:
+        # large tensors are rounded in slices, so the random bit buffer stays small
+        source = source.contiguous().view(-1)
+        flat_target = target.view(-1) if target.is_contiguous() else torch.empty_like(source, dtype=target.dtype)
+        for start in range(0, source.numel(), _LIST_CHUNK_NUMEL):
+            end = start + _LIST_CHUNK_NUMEL
+            copy_stochastic_(flat_target[start:end], source[start:end])
+        if not target.is_contiguous():
+            target.copy_(flat_target.view(target.shape))
+        return
+
     # create a random 16 bit integer
-    result = torch.randint_like(
-        source,
-        dtype=torch.int32,
-        low=0,
-        high=(1 << 16),
-    )
+    result = _random_bits(source.numel(), source.device).view(source.shape)
 
     # add the random number to the lower 16 bit of the mantissa
     result.add_(source.view(dtype=torch.int32))
@@ -27,7 +59,65 @@ def copy_stochastic_(target: Tensor, source: Tensor):
     # copy the higher 16 bit into the target tensor
     target.copy_(result.view(dtype=torch.float32))
 
-    del result
+
+def _foreach_copy_(targets: list[Tensor], sources: list[Tensor]):
+    if hasattr(torch, '_foreach_copy_'):
+        torch._foreach_copy_(targets, sources)
+    else:
+        for target, source in zip(targets, sources):
+            target.copy_(source)
+
+
+def copy_stochastic_list_(targets: list[Tensor], sources: list[Tensor]):
+    """
+    copies each source into its target using stochastic rounding. The random bits of the tensors on a device are
+    generated together in chunks of at most _LIST_CHUNK_NUMEL elements, and the rounding uses multi-tensor operations.
+
+    Args:
+        targets: the target tensors with dtype=bfloat16
+        sources: the source tensors with dtype=float32
+    """
+    device_indices = {}
+    for i, source in enumerate(sources):
+        device_indices.setdefault(source.device, []).append(i)
+
+    for device, device_indices_list in device_indices.items():
+        for chunk in _list_chunks([sources[i] for i in device_indices_list]):
+            indices = [device_indices_list[i] for i in chunk]
+            device_sources = [sources[i] for i in indices]
+
+            if len(indices) == 1:
+                # a single tensor can be larger than the random bit buffer
+                copy_stochastic_(targets[indices[0]], device_sources[0])
+                continue
+
+            bits = _random_bits(sum(source.numel() for source in device_sources), device)
+            results = []
+            offset = 0
+            for source in device_sources:
+                results.append(bits[offset:offset + source.numel()].view(source.shape))
+                offset += source.numel()
+
+            torch._foreach_add_(results, [source.view(dtype=torch.int32) for source in device_sources])
+            bits.bitwise_and_(-65536)  # -65536 = FFFF0000 as a signed int32
+
+            _foreach_copy_([targets[i] for i in indices], [result.view(dtype=torch.float32) for result in results])
+
+
+def _list_chunks(tensors: list[Tensor]) -> list[list[int]]:
+    chunks = []
+    chunk = []
+    chunk_numel = 0
+    for i, tensor in enumerate(tensors):
+        if chunk and chunk_numel + tensor.numel() > _LIST_CHUNK_NUMEL:
+            chunks.append(chunk)
+            chunk = []
+            chunk_numel = 0
+        chunk.append(i)
+        chunk_numel += tensor.numel()
+    if chunk:
+        chunks.append(chunk)
+    return chunks
 
 
 def add_stochastic_(input: Tensor, other: Tensor, alpha: float = 1.0):
@@ -65,3 +155,32 @@ def addcdiv_stochastic_(input: Tensor, tensor1: Tensor, tensor2: Tensor, value:
 
     result.addcdiv_(tensor1, tensor2, value=value)
     copy_stochastic_(input, result)
+
+
+def addcdiv_stochastic_list_(
+        inputs: list[Tensor],
+        tensor1s: list[Tensor],
+        tensor2s: list[Tensor],
+        values: list[float],
+):
+    """
+    adds (tensor1 / tensor2 * value) to each input using stochastic rounding and multi-tensor operations. The float32
+    copies of the inputs are created in chunks to limit the memory usage.
+
+    Args:
+        inputs: the input tensors with dtype=bfloat16
+        tensor1s: the numerator tensors
+        tensor2s: the denominator tensors
+        values: a multiplier for each tensor1/tensor2
+    """
+    for chunk in _list_chunks(inputs):
+        chunk_inputs = [inputs[i] for i in chunk]
+        results = [input.to(dtype=torch.float32) for input in chunk_inputs]
+
+        torch._foreach_addcdiv_(
+            results,
+            [tensor1s[i] for i in chunk],
+            [tensor2s[i] for i in chunk],
+            [values[i] for i in chunk],
+        )
+        copy_stochastic_list_(chunk_inputs, results)
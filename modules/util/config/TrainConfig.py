@@ -9,8 +9,10 @@ from modules.util.config.ConceptConfig import ConceptConfig
 from modules.util.config.SampleConfig import SampleConfig
 from modules.util.enum.AlignPropLoss import AlignPropLoss
 from modules.util.enum.AttentionMechanism import AttentionMechanism
+from modules.util.enum.CacheFormat import CacheFormat
 from modules.util.enum.ConfigPart import ConfigPart
 from modules.util.enum.DataType import DataType
+from modules.util.enum.DistributedBackend import DistributedBackend
 from modules.util.enum.EMAMode import EMAMode
 from modules.util.enum.ImageFormat import ImageFormat
 from modules.util.enum.LearningRateScaler import LearningRateScaler
@@ -188,6 +190,7 @@ class TrainConfig(BaseConfig):
     cache_dir: str
     tensorboard: bool
     tensorboard_expose: bool
+    profiling: bool
     continue_last_backup: bool
     include_train_config: ConfigPart
 
@@ -198,6 +201,7 @@ class TrainConfig(BaseConfig):
     output_model_format: ModelFormat
     output_model_destination: str
     gradient_checkpointing: bool
+    lazy_model_loading: bool
 
     # data settings
     concept_file_name: str
@@ -207,6 +211,10 @@ class TrainConfig(BaseConfig):
     aspect_ratio_bucketing: bool
     latent_caching: bool
     clear_cache_before_training: bool
+    cache_format: CacheFormat
+    cache_batch_size: int
+    prefetch_batches: int
+    dataloader_threads: int
 
     # training settings
     learning_rate_scheduler: LearningRateScheduler
@@ -215,12 +223,15 @@ class TrainConfig(BaseConfig):
     learning_rate_cycles: float
     epochs: int
     batch_size: int
+    batch_pixel_budget: int
     gradient_accumulation_steps: int
+    auto_micro_batch_size: bool
     ema: EMAMode
     ema_decay: float
     ema_update_step_interval: int
     train_device: str
     temp_device: str
+    distributed_backend: DistributedBackend
     train_dtype: DataType
     fallback_train_dtype: DataType
     only_cache: bool
@@ -308,6 +319,9 @@ class TrainConfig(BaseConfig):
     sample_after_unit: TimeUnit
     sample_image_format: ImageFormat
     samples_to_tensorboard: bool
+    sample_batch_size: int
+    background_sampling: bool
+    background_sampling_device: str
     non_ema_sampling: bool
 
     # backup settings
@@ -316,8 +330,10 @@ class TrainConfig(BaseConfig):
     rolling_backup: bool
     rolling_backup_count: int
     backup_before_save: bool
+    incremental_backups: bool
     save_after: float
     save_after_unit: TimeUnit
+    background_checkpoints: int
 
     def __init__(self, data: list[(str, Any, type, bool)]):
         super(TrainConfig, self).__init__(
@@ -511,6 +527,7 @@ class TrainConfig(BaseConfig):
         data.append(("cache_dir", "workspace-cache/run", str, False))
         data.append(("tensorboard", True, bool, False))
         data.append(("tensorboard_expose", False, bool, False))
+        data.append(("profiling", False, bool, False))
         data.append(("continue_last_backup", False, bool, False))
         data.append(("include_train_config", ConfigPart.NONE, ConfigPart, False))
 
@@ -521,6 +538,7 @@ class TrainConfig(BaseConfig):
         data.append(("output_model_format", ModelFormat.SAFETENSORS, ModelFormat, False))
         data.append(("output_model_destination", "models/model.safetensors", str, False))
         data.append(("gradient_checkpointing", True, bool, False))
+        data.append(("lazy_model_loading", False, bool, False))
 
         # data settings
         data.append(("concept_file_name", "training_concepts/concepts.json", str, False))
@@ -530,6 +548,10 @@ class TrainConfig(BaseConfig):
         data.append(("aspect_ratio_bucketing", True, bool, False))
         data.append(("latent_caching", True, bool, False))
         data.append(("clear_cache_before_training", True, bool, False))
+        data.append(("cache_format", CacheFormat.FILE_PER_ITEM, CacheFormat, False))
+        data.append(("cache_batch_size", 1, int, False))
+        data.append(("prefetch_batches", 0, int, False))
+        data.append(("dataloader_threads", 1, int, False))
 
         # training settings
         data.append(("learning_rate_scheduler", LearningRateScheduler.CONSTANT, LearningRateScheduler, False))
@@ -538,12 +560,15 @@ class TrainConfig(BaseConfig):
         data.append(("learning_rate_cycles", 1, int, False))
         data.append(("epochs", 100, int, False))
         data.append(("batch_size", 1, int, False))
+        data.append(("batch_pixel_budget", 0, int, False))
         data.append(("gradient_accumulation_steps", 1, int, False))
+        data.append(("auto_micro_batch_size", False, bool, False))
         data.append(("ema", EMAMode.OFF, EMAMode, False))
         data.append(("ema_decay", 0.999, float, False))
         data.append(("ema_update_step_interval", 5, int, False))
         data.append(("train_device", "cuda", str, False))
         data.append(("temp_device", "cpu", str, False))
+        data.append(("distributed_backend", DistributedBackend.NCCL, DistributedBackend, False))
         data.append(("train_dtype", DataType.FLOAT_16, DataType, False))
         data.append(("fallback_train_dtype", DataType.BFLOAT_16, DataType, False))
         data.append(("only_cache", False, bool, False))
@@ -667,6 +692,9 @@ class TrainConfig(BaseConfig):
         data.append(("sample_after_unit", TimeUnit.MINUTE, TimeUnit, False))
         data.append(("sample_image_format", ImageFormat.JPG, ImageFormat, False))
         data.append(("samples_to_tensorboard", True, bool, False))
+        data.append(("sample_batch_size", 1, int, False))
+        data.append(("background_sampling", False, bool, False))
+        data.append(("background_sampling_device", "cpu", str, False))
         data.append(("non_ema_sampling", True, bool, False))
 
         # backup settings
@@ -675,7 +703,9 @@ class TrainConfig(BaseConfig):
         data.append(("rolling_backup", False, bool, False))
         data.append(("rolling_backup_count", 3, int, False))
         data.append(("backup_before_save", True, bool, False))
+        data.append(("incremental_backups", False, bool, False))
         data.append(("save_after", 0, int, False))
         data.append(("save_after_unit", TimeUnit.NEVER, TimeUnit, False))
+        data.append(("background_checkpoints", 0, int, False))
 
         return TrainConfig(data)
@@ -76,36 +76,37 @@ from modules.util.optimizer.adamw_extensions import step_adamw
 def create_model_loader(
         model_type: ModelType,
         training_method: TrainingMethod = TrainingMethod.FINE_TUNE,
+        lazy_loading: bool = False,
 ) -> BaseModelLoader:
     match training_method:
         case TrainingMethod.FINE_TUNE:
             if model_type.is_stable_diffusion():
-                return StableDiffusionModelLoader()
+                return StableDiffusionModelLoader(lazy_loading)
             if model_type.is_stable_diffusion_xl():
-                return StableDiffusionXLModelLoader()
+                return StableDiffusionXLModelLoader(lazy_loading)
             if model_type.is_wuerstchen():
-                return WuerstchenModelLoader()
+                return WuerstchenModelLoader(lazy_loading)
             if model_type.is_pixart_alpha():
-                return PixArtAlphaModelLoader()
+                return PixArtAlphaModelLoader(lazy_loading)
         case TrainingMethod.FINE_TUNE_VAE:
             if model_type.is_stable_diffusion():
-                return StableDiffusionModelLoader()
+                return StableDiffusionModelLoader(lazy_loading)
         case TrainingMethod.LORA:
             if model_type.is_stable_diffusion():
-                return StableDiffusionLoRAModelLoader()
+                return StableDiffusionLoRAModelLoader(lazy_loading)
             if model_type.is_stable_diffusion_xl():
-                return StableDiffusionXLLoRAModelLoader()
+                return StableDiffusionXLLoRAModelLoader(lazy_loading)
             if model_type.is_wuerstchen():
-                return WuerstchenLoRAModelLoader()
+                return WuerstchenLoRAModelLoader(lazy_loading)
             if model_type.is_pixart_alpha():
-                return PixArtAlphaLoRAModelLoader()
+                return PixArtAlphaLoRAModelLoader(lazy_loading)
         case TrainingMethod.EMBEDDING:
             if model_type.is_stable_diffusion():
-                return StableDiffusionEmbeddingModelLoader()
+                return StableDiffusionEmbeddingModelLoader(lazy_loading)
             if model_type.is_stable_diffusion_xl():
-                return StableDiffusionXLEmbeddingModelLoader()
+                return StableDiffusionXLEmbeddingModelLoader(lazy_loading)
             if model_type.is_wuerstchen():
-                return WuerstchenEmbeddingModelLoader()
+                return WuerstchenEmbeddingModelLoader(lazy_loading)
 
 
 def create_model_saver(
@@ -312,10 +313,10 @@ def create_optimizer(
                 fused=optimizer_config.fused if optimizer_config.fused is not None else False,
             )
 
-            if optimizer_config.stochastic_rounding and not optimizer_config.fused and not optimizer_config.foreach:
+            if optimizer_config.stochastic_rounding and not optimizer_config.fused:
                 optimizer.step = step_adam.__get__(optimizer, torch.optim.Adam)
-            elif optimizer_config.stochastic_rounding and (optimizer_config.fused or optimizer_config.foreach):
-                raise RuntimeError('"stochastic_rounding" is only allowed when "fused" and "foreach" are disabled')
+            elif optimizer_config.stochastic_rounding and optimizer_config.fused:
+                raise RuntimeError('"stochastic_rounding" is only allowed when "fused" is disabled')
 
         # ADAMW Optimizer
         case Optimizer.ADAMW:
@@ -334,10 +335,10 @@ def create_optimizer(
                 fused=optimizer_config.fused if optimizer_config.fused is not None else False,
             )
 
-            if optimizer_config.stochastic_rounding and not optimizer_config.fused and not optimizer_config.foreach:
+            if optimizer_config.stochastic_rounding and not optimizer_config.fused:
                 optimizer.step = step_adamw.__get__(optimizer, torch.optim.AdamW)
-            elif optimizer_config.stochastic_rounding and (optimizer_config.fused or optimizer_config.foreach):
-                raise RuntimeError('"stochastic_rounding" is only allowed when "fused" and "foreach" are disabled')
+            elif optimizer_config.stochastic_rounding and optimizer_config.fused:
+                raise RuntimeError('"stochastic_rounding" is only allowed when "fused" is disabled')
 
         # ADAM_8BIT Optimizer
         case Optimizer.ADAM_8BIT:
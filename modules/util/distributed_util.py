@@ -0,0 +1,154 @@
+import os
+
+import torch
+import torch.distributed as dist
+from torch import Tensor
+from torch.nn import Parameter
+
+from modules.util.config.TrainConfig import TrainConfig
+
+
+def is_launched_distributed() -> bool:
+    """
+    Returns True if the process was started by torchrun (or a compatible launcher) with more than one process.
+    """
+    return int(os.environ.get("WORLD_SIZE", "1")) > 1
+
+
+def init_distributed(config: TrainConfig):
+    """
+    Joins the process group of a distributed run. Each process trains on its own local cuda device, which replaces
+    the configured train device. Does nothing if the process was not started by a distributed launcher.
+    """
+    if not is_launched_distributed() or is_enabled():
+        return
+
+    local_rank = int(os.environ.get("LOCAL_RANK", "0"))
+    train_device = torch.device(config.train_device)
+    if train_device.type == 'cuda':
+        config.train_device = f"cuda:{local_rank}"
+        torch.cuda.set_device(local_rank)
+
+    dist.init_process_group(backend=config.distributed_backend.torch_backend())
+
+    print(f"Joined distributed training as rank {rank()} of {world_size()}, using device {config.train_device}")
+
+
+def destroy_distributed():
+    if is_enabled():
+        dist.destroy_process_group()
+
+
+def is_enabled() -> bool:
+    return dist.is_available() and dist.is_initialized()
+
+
+def rank() -> int:
+    return dist.get_rank() if is_enabled() else 0
+
+
+def world_size() -> int:
+    return dist.get_world_size() if is_enabled() else 1
+
+
+def is_main_process() -> bool:
+    return rank() == 0
+
+
+def barrier():
+    if is_enabled():
+        dist.barrier()
+
+
+def rank_seed(seed: int) -> int:
+    """
+    Derives a different seed for each rank. Returns the seed unchanged if training is not distributed.
+    """
+    return seed * world_size() + rank()
+
+
+def _communication_device(tensor: Tensor) -> torch.device:
+    # nccl can only communicate cuda tensors
+    if dist.get_backend() == 'nccl' and tensor.device.type != 'cuda':
+        return torch.device('cuda', torch.cuda.current_device())
+    return tensor.device
+
+
+@torch.no_grad()
+def broadcast_tensors(tensors: list[Tensor], src: int = 0):
+    """
+    Overwrites the tensors of all ranks with the tensors of the src rank.
+    """
+    if not is_enabled():
+        return
+
+    for tensor in tensors:
+        device = _communication_device(tensor)
+        if device == tensor.device:
+            dist.broadcast(tensor, src=src)
+        else:
+            communication_tensor = tensor.to(device)
+            dist.broadcast(communication_tensor, src=src)
+            tensor.copy_(communication_tensor)
+
+
+def any_rank(value: bool) -> bool:
+    """
+    Returns True on all ranks if value is True on any rank.
+    """
+    if not is_enabled():
+        return value
+
+    device = torch.device('cuda', torch.cuda.current_device()) if dist.get_backend() == 'nccl' else torch.device('cpu')
+    tensor = torch.tensor([1 if value else 0], dtype=torch.int32, device=device)
+    dist.all_reduce(tensor, op=dist.ReduceOp.MAX)
+    return tensor.item() > 0
+
+
+@torch.no_grad()
+def all_reduce_gradients(parameters: list[Parameter], bucket_size: int = 25 * 1024 * 1024):
+    """
+    Averages the gradients of all trainable parameters across all ranks.
+
+    Gradients are flattened into buckets of up to bucket_size bytes, so only a few collective calls are needed.
+    Parameters without a gradient are treated as having a zero gradient, because every rank has to take part in the
+    same collective calls.
+    """
+    if not is_enabled():
+        return
+
+    buckets = {}  # (device, dtype) -> list of list of gradients
+    bucket_bytes = {}
+    for parameter in parameters:
+        if not parameter.requires_grad:
+            continue
+
+        if parameter.grad is None:
+            parameter.grad = torch.zeros_like(parameter)
+
+        grad = parameter.grad
+        key = (grad.device, grad.dtype)
+        grad_bytes = grad.numel() * grad.element_size()
+
+        if key not in buckets or bucket_bytes[key] + grad_bytes > bucket_size:
+            buckets.setdefault(key, []).append([])
+            bucket_bytes[key] = 0
+
+        buckets[key][-1].append(grad)
+        bucket_bytes[key] += grad_bytes
+
+    scale = 1.0 / world_size()
+    for key_buckets in buckets.values():
+        for bucket in key_buckets:
+            flat = torch.cat([grad.reshape(-1) for grad in bucket])
+            device = _communication_device(flat)
+            communication_flat = flat.to(device)
+
+            dist.all_reduce(communication_flat)
+            communication_flat.mul_(scale)
+
+            offset = 0
+            for grad in bucket:
+                numel = grad.numel()
+                grad.copy_(communication_flat[offset:offset + numel].view_as(grad))
+                offset += numel
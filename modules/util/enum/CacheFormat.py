@@ -0,0 +1,9 @@
+from enum import Enum
+
+
+class CacheFormat(Enum):
+    FILE_PER_ITEM = 'FILE_PER_ITEM'
+    SHARDED = 'SHARDED'
+
+    def __str__(self):
+        return self.value
@@ -0,0 +1,24 @@
+from enum import Enum
+
+import onnxruntime
+
+
+class OnnxGraphOptimization(Enum):
+    DISABLE = 'DISABLE'
+    BASIC = 'BASIC'
+    EXTENDED = 'EXTENDED'
+    ALL = 'ALL'
+
+    def __str__(self):
+        return self.value
+
+    def onnx_level(self) -> onnxruntime.GraphOptimizationLevel:
+        match self:
+            case OnnxGraphOptimization.DISABLE:
+                return onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL
+            case OnnxGraphOptimization.BASIC:
+                return onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC
+            case OnnxGraphOptimization.EXTENDED:
+                return onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+            case _:
+                return onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
@@ -8,7 +8,53 @@ import math
 
 import torch
 
-from modules.util.bf16_stochastic_rounding import copy_stochastic_
+from modules.util.bf16_stochastic_rounding import copy_stochastic_list_
+
+# the float32 copies of at most this many bfloat16 parameter elements are kept for a batched stochastic rounding
+_ROUNDING_CHUNK_NUMEL = 1 << 26
+
+
+def _step_unfactored_foreach(
+        group: dict,
+        beta2t: float,
+        params_fp32: list[torch.Tensor],
+        grads: list[torch.Tensor],
+        exp_avg_sqs: list[torch.Tensor],
+        exp_avgs: list[torch.Tensor] | None,
+        lrs: list,
+):
+    """
+    The update of all parameters without factored second moments, using multi-tensor operations. All tensors are on
+    the same device, and all parameters have the same beta2t.
+    """
+    device = grads[0].device
+
+    updates = torch._foreach_mul(grads, grads)
+    torch._foreach_add_(updates, group["eps"][0])
+
+    torch._foreach_mul_(exp_avg_sqs, beta2t)
+    torch._foreach_add_(exp_avg_sqs, updates, alpha=(1.0 - beta2t))
+
+    # update = grad / sqrt(exp_avg_sq)
+    updates = torch._foreach_sqrt(exp_avg_sqs)
+    torch._foreach_reciprocal_(updates)
+    torch._foreach_mul_(updates, grads)
+
+    # the clipping and learning rate of each parameter are combined into one scale, without synchronizing the device
+    numels = torch.tensor([update.numel() for update in updates], dtype=torch.float32, device=device)
+    rms = torch.stack(torch._foreach_norm(updates)) / numels.sqrt()
+    lr = torch.stack([torch.as_tensor(lr, dtype=torch.float32, device=device) for lr in lrs])
+    torch._foreach_mul_(updates, (lr / (rms / group["clip_threshold"]).clamp_(min=1.0)).unbind(0))
+
+    if exp_avgs is not None:
+        torch._foreach_mul_(exp_avgs, group["beta1"])
+        torch._foreach_add_(exp_avgs, updates, alpha=(1 - group["beta1"]))
+        updates = exp_avgs
+
+    if group["weight_decay"] != 0:
+        torch._foreach_mul_(params_fp32, (1.0 - group["weight_decay"] * lr).unbind(0))
+
+    torch._foreach_sub_(params_fp32, updates)
 
 
 @torch.no_grad()
@@ -16,6 +62,9 @@ def step_adafactor(self, closure=None):
     """
     Performs a single optimization step
 
+    Parameters with factored second moments are updated one by one. All other parameters (biases, norms and other 1-D
+    parameters) are updated together with multi-tensor operations.
+
     Arguments:
         closure (callable, optional): A closure that reevaluates the model
             and returns the loss.
@@ -25,6 +74,28 @@ def step_adafactor(self, closure=None):
         loss = closure()
 
     for group in self.param_groups:
+        rounding_targets = []
+        rounding_sources = []
+        rounding_numel = 0
+
+        def finish_parameter(p, p_data_fp32):
+            nonlocal rounding_targets, rounding_sources, rounding_numel
+
+            if p.dtype == torch.bfloat16:
+                rounding_targets.append(p)
+                rounding_sources.append(p_data_fp32)
+                rounding_numel += p.numel()
+                if rounding_numel >= _ROUNDING_CHUNK_NUMEL:
+                    copy_stochastic_list_(rounding_targets, rounding_sources)
+                    rounding_targets = []
+                    rounding_sources = []
+                    rounding_numel = 0
+            elif p.dtype == torch.float16:
+                p.copy_(p_data_fp32)
+
+        # (device, beta2t) -> parameters without factored second moments
+        unfactored = {}
+
         for p in group["params"]:
             if p.grad is None:
                 continue
@@ -70,22 +141,30 @@ def step_adafactor(self, closure=None):
             lr = self._get_lr(group, state)
 
             beta2t = 1.0 - math.pow(state["step"], group["decay_rate"])
-            update = (grad ** 2) + group["eps"][0]
-            if factored:
-                exp_avg_sq_row = state["exp_avg_sq_row"]
-                exp_avg_sq_col = state["exp_avg_sq_col"]
 
-                exp_avg_sq_row.mul_(beta2t).add_(update.mean(dim=-1), alpha=(1.0 - beta2t))
-                exp_avg_sq_col.mul_(beta2t).add_(update.mean(dim=-2), alpha=(1.0 - beta2t))
+            if not factored:
+                lists = unfactored.setdefault((p.device, beta2t), {
+                    "params": [], "params_fp32": [], "grads": [], "exp_avg_sqs": [], "exp_avgs": [], "lrs": [],
+                })
+                lists["params"].append(p)
+                lists["params_fp32"].append(p_data_fp32)
+                lists["grads"].append(grad)
+                lists["exp_avg_sqs"].append(state["exp_avg_sq"])
+                if use_first_moment:
+                    lists["exp_avgs"].append(state["exp_avg"])
+                lists["lrs"].append(lr)
+                continue
 
-                # Approximation of exponential moving average of square of gradient
-                update = self._approx_sq_grad(exp_avg_sq_row, exp_avg_sq_col)
-                update.mul_(grad)
-            else:
-                exp_avg_sq = state["exp_avg_sq"]
+            update = (grad ** 2) + group["eps"][0]
+            exp_avg_sq_row = state["exp_avg_sq_row"]
+            exp_avg_sq_col = state["exp_avg_sq_col"]
+
+            exp_avg_sq_row.mul_(beta2t).add_(update.mean(dim=-1), alpha=(1.0 - beta2t))
+            exp_avg_sq_col.mul_(beta2t).add_(update.mean(dim=-2), alpha=(1.0 - beta2t))
 
-                exp_avg_sq.mul_(beta2t).add_(update, alpha=(1.0 - beta2t))
-                update = exp_avg_sq.rsqrt().mul_(grad)
+            # Approximation of exponential moving average of square of gradient
+            update = self._approx_sq_grad(exp_avg_sq_row, exp_avg_sq_col)
+            update.mul_(grad)
 
             update.div_((self._rms(update) / group["clip_threshold"]).clamp_(min=1.0))
             update.mul_(lr)
@@ -100,9 +179,23 @@ def step_adafactor(self, closure=None):
 
             p_data_fp32.add_(-update)
 
-            if p.dtype == torch.bfloat16:
-                copy_stochastic_(p, p_data_fp32)
-            elif p.dtype == torch.float16:
-                p.copy_(p_data_fp32)
+            finish_parameter(p, p_data_fp32)
+
+        for (_, beta2t), lists in unfactored.items():
+            _step_unfactored_foreach(
+                group,
+                beta2t,
+                lists["params_fp32"],
+                lists["grads"],
+                lists["exp_avg_sqs"],
+                lists["exp_avgs"] if group["beta1"] is not None else None,
+                lists["lrs"],
+            )
+
+            for p, p_data_fp32 in zip(lists["params"], lists["params_fp32"]):
+                finish_parameter(p, p_data_fp32)
+
+        if rounding_targets:
+            copy_stochastic_list_(rounding_targets, rounding_sources)
 
     return loss
@@ -11,7 +11,7 @@ import torch
 from torch import Tensor
 from torch.optim.optimizer import _use_grad_for_differentiable
 
-from modules.util.bf16_stochastic_rounding import addcdiv_stochastic_
+from modules.util.bf16_stochastic_rounding import addcdiv_stochastic_, addcdiv_stochastic_list_
 
 
 def _single_tensor_adam(
@@ -137,6 +137,102 @@ def _single_tensor_adam(
             max_exp_avg_sqs[i] = torch.view_as_complex(max_exp_avg_sqs[i])
 
 
+def _multi_tensor_adam(
+        params: List[Tensor],
+        grads: List[Tensor],
+        exp_avgs: List[Tensor],
+        exp_avg_sqs: List[Tensor],
+        max_exp_avg_sqs: List[Tensor],
+        state_steps: List[Tensor],
+        grad_scale: Optional[Tensor],
+        found_inf: Optional[Tensor],
+        *,
+        amsgrad: bool,
+        beta1: float,
+        beta2: float,
+        lr: Union[float, Tensor],
+        weight_decay: float,
+        eps: float,
+        maximize: bool,
+        capturable: bool,
+        differentiable: bool,
+):
+    assert grad_scale is None and found_inf is None
+
+    if len(params) == 0:
+        return
+
+    if capturable or differentiable:
+        # these modes don't use stochastic rounding, the single tensor implementation handles them
+        _single_tensor_adam(
+            params, grads, exp_avgs, exp_avg_sqs, max_exp_avg_sqs, state_steps, grad_scale, found_inf,
+            amsgrad=amsgrad, beta1=beta1, beta2=beta2, lr=lr, weight_decay=weight_decay, eps=eps,
+            maximize=maximize, capturable=capturable, differentiable=differentiable,
+        )
+        return
+
+    if isinstance(lr, Tensor):
+        lr = lr.item()
+
+    # multi-tensor operations need all tensors of a list on the same device with the same dtype
+    groups = {}
+    for i, param in enumerate(params):
+        groups.setdefault((param.device, param.dtype), []).append(i)
+
+    def view_as_real(tensors: List[Tensor], indices: List[int]) -> List[Tensor]:
+        return [torch.view_as_real(tensors[i]) if torch.is_complex(tensors[i]) else tensors[i] for i in indices]
+
+    for (_, dtype), indices in groups.items():
+        device_params = view_as_real(params, indices)
+        device_grads = view_as_real(grads, indices)
+        device_exp_avgs = view_as_real(exp_avgs, indices)
+        device_exp_avg_sqs = view_as_real(exp_avg_sqs, indices)
+        device_max_exp_avg_sqs = view_as_real(max_exp_avg_sqs, indices) if amsgrad else []
+        device_state_steps = [state_steps[i] for i in indices]
+
+        if maximize:
+            device_grads = torch._foreach_neg(device_grads)
+
+        # update steps
+        torch._foreach_add_(device_state_steps, 1)
+
+        if weight_decay != 0:
+            # Re-use the intermediate memory (device_grads) already allocated for maximize
+            if maximize:
+                torch._foreach_add_(device_grads, device_params, alpha=weight_decay)
+            else:
+                device_grads = torch._foreach_add(device_grads, device_params, alpha=weight_decay)
+
+        # Decay the first and second moment running average coefficient
+        torch._foreach_lerp_(device_exp_avgs, device_grads, 1 - beta1)
+        torch._foreach_mul_(device_exp_avg_sqs, beta2)
+        torch._foreach_addcmul_(device_exp_avg_sqs, device_grads, device_grads, 1 - beta2)
+
+        # Delete the local intermediate since it won't be used anymore to save on peak memory
+        del device_grads
+
+        steps = [step.item() for step in device_state_steps]
+        step_sizes_neg = [-lr / (1 - beta1 ** step) for step in steps]
+        bias_corrections2_sqrt = [math.sqrt(1 - beta2 ** step) for step in steps]
+
+        if amsgrad:
+            # Maintains the maximum of all 2nd moment running avg. till now
+            torch._foreach_maximum_(device_max_exp_avg_sqs, device_exp_avg_sqs)
+
+            # Use the max. for normalizing running avg. of gradient
+            denoms = torch._foreach_sqrt(device_max_exp_avg_sqs)
+        else:
+            denoms = torch._foreach_sqrt(device_exp_avg_sqs)
+
+        torch._foreach_div_(denoms, bias_corrections2_sqrt)
+        torch._foreach_add_(denoms, eps)
+
+        if dtype == torch.bfloat16:
+            addcdiv_stochastic_list_(device_params, device_exp_avgs, denoms, step_sizes_neg)
+        else:
+            torch._foreach_addcdiv_(device_params, device_exp_avgs, denoms, step_sizes_neg)
+
+
 @_use_grad_for_differentiable
 def step_adam(self, closure=None):
     """Performs a single optimization step.
@@ -170,7 +266,12 @@ def step_adam(self, closure=None):
             max_exp_avg_sqs,
             state_steps)
 
-        _single_tensor_adam(
+        if group['foreach']:
+            func = _multi_tensor_adam
+        else:
+            func = _single_tensor_adam
+
+        func(
             params=params_with_grad,
             grads=grads,
             exp_avgs=exp_avgs,
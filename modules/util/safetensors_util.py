@@ -0,0 +1,248 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+from torch import Tensor
+
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+SAFETENSORS_DTYPE_NAMES = {dtype: name for name, dtype in SAFETENSORS_DTYPES.items()}
+
+_INTEGER_VIEW_DTYPES = {
+    2: torch.int16,
+    4: torch.int32,
+    8: torch.int64,
+}
+
+
+def read_header(path: str) -> tuple[dict, int]:
+    """
+    Reads the json header of a safetensors file.
+
+    Returns the header and the offset of the first data byte in the file.
+    """
+    with open(path, "rb") as f:
+        header_size = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_size))
+
+    return header, 8 + header_size
+
+
+def load_file_parallel(
+        path: str,
+        threads: int | None = None,
+        chunk_size: int = 64 * 1024 * 1024,
+) -> dict[str, Tensor]:
+    """
+    Reads all tensors of a safetensors file into cpu memory, using several threads.
+
+    The tensors are allocated from the header, then the data section is split into chunks of at most chunk_size bytes
+    that are read directly into the tensor memory. File reads release the GIL, so the threads read in parallel.
+    """
+    if threads is None:
+        threads = min(8, os.cpu_count() or 1)
+
+    start_time = time.perf_counter()
+
+    header, data_offset = read_header(path)
+    header.pop("__metadata__", None)
+
+    tensors = {}
+    chunks = []
+    total_size = 0
+    for key, info in header.items():
+        tensor = torch.empty(info["shape"], dtype=SAFETENSORS_DTYPES[info["dtype"]])
+        tensors[key] = tensor
+
+        start, end = info["data_offsets"]
+        total_size += end - start
+        if end == start:
+            continue
+
+        buffer = tensor.reshape(-1).view(torch.uint8).numpy()
+        for chunk_start in range(0, end - start, chunk_size):
+            chunk_end = min(chunk_start + chunk_size, end - start)
+            chunks.append((data_offset + start + chunk_start, buffer[chunk_start:chunk_end]))
+
+    files = threading.local()
+    opened_files = []
+    opened_files_lock = threading.Lock()
+
+    def read_chunk(chunk: tuple):
+        file_offset, buffer = chunk
+
+        if not hasattr(files, "file"):
+            files.file = open(path, "rb", buffering=0)
+            with opened_files_lock:
+                opened_files.append(files.file)
+
+        view = memoryview(buffer)
+        files.file.seek(file_offset)
+        while len(view) > 0:
+            read_bytes = files.file.readinto(view)
+            if not read_bytes:
+                raise EOFError(f"unexpected end of file while reading {path}")
+            view = view[read_bytes:]
+
+    try:
+        with ThreadPoolExecutor(max_workers=threads, thread_name_prefix="safetensors_load") as executor:
+            # consume the iterator to raise exceptions from the threads
+            list(executor.map(read_chunk, chunks))
+    finally:
+        for file in opened_files:
+            file.close()
+
+    duration = time.perf_counter() - start_time
+    print(f"Loaded {total_size / 1e9:.2f} GB from {path} in {duration:.2f}s "
+          f"({total_size / 1e9 / max(duration, 1e-6):.2f} GB/s, {threads} threads)")
+
+    return tensors
+
+
+class MemoryMappedSafetensors:
+    """
+    Maps a safetensors file into memory. Tensors returned by get_tensor() are views into the mapped file, no data is
+    copied until the tensor is modified or moved to another device.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.header, self.data_offset = read_header(path)
+        self.metadata = self.header.pop("__metadata__", None)
+
+        self.__file = open(path, "rb")
+        # ACCESS_COPY creates a writable copy-on-write mapping, which is needed by torch.frombuffer
+        self.__mmap = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    def keys(self) -> list[str]:
+        return list(self.header.keys())
+
+    def get_tensor(self, key: str) -> Tensor:
+        info = self.header[key]
+        dtype = SAFETENSORS_DTYPES[info["dtype"]]
+        shape = info["shape"]
+        start, end = info["data_offsets"]
+
+        if end == start:
+            return torch.empty(shape, dtype=dtype)
+
+        tensor = torch.frombuffer(
+            self.__mmap,
+            dtype=dtype,
+            count=(end - start) // dtype.itemsize,
+            offset=self.data_offset + start,
+        )
+        return tensor.reshape(shape)
+
+    def close(self):
+        try:
+            self.__mmap.close()
+        except BufferError:
+            # tensors returned by get_tensor() are still alive, the mapping is released when they are collected
+            pass
+        self.__file.close()
+
+
+def tensor_to_bytes(tensor: Tensor):
+    """
+    Returns the little endian bytes of a contiguous cpu tensor as a numpy array, without copying it if possible.
+    """
+    tensor = tensor.reshape(-1)
+
+    if sys.byteorder == "big" and tensor.element_size() > 1:
+        tensor = tensor.view(_INTEGER_VIEW_DTYPES[tensor.element_size()])
+        return tensor.numpy().byteswap().view("uint8")
+
+    return tensor.view(torch.uint8).numpy()
+
+
+def _encode_header(header: dict) -> bytes:
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    # the data section is aligned to 8 bytes, safetensors pads the header with spaces
+    return header_bytes + b" " * (-len(header_bytes) % 8)
+
+
+def save_file(
+        tensors: dict[str, Tensor],
+        path: str,
+        metadata: dict[str, str] | None = None,
+        dtype: torch.dtype | None = None,
+        hash_key: str | None = None,
+) -> str | None:
+    """
+    Writes a safetensors file, converting one tensor at a time.
+
+    The header is computed from the shapes and the target dtype before any data is written. Each tensor is then moved
+    to the cpu, converted to dtype, made contiguous and written, so the additional memory needed is roughly the size of
+    the largest tensor, instead of a full converted copy of the state dict. Tensors are written in sorted key order.
+
+    If hash_key is set, the sha256 hash of the written tensor data is calculated while writing and stored in the
+    metadata under that key. The header is first written with a placeholder of the same length, and overwritten once
+    all data is written. The hash is returned.
+    """
+    keys = sorted(tensors.keys())
+
+    metadata = {} if metadata is None else dict(metadata)
+    sha256_hash = None
+    if hash_key is not None:
+        sha256_hash = hashlib.sha256()
+        metadata[hash_key] = "0x" + "0" * (sha256_hash.digest_size * 2)
+
+    header = {}
+    if metadata:
+        header["__metadata__"] = metadata
+
+    offset = 0
+    for key in keys:
+        tensor = tensors[key]
+        target_dtype = tensor.dtype if dtype is None else dtype
+        size = tensor.numel() * target_dtype.itemsize
+        header[key] = {
+            "dtype": SAFETENSORS_DTYPE_NAMES[target_dtype],
+            "shape": list(tensor.shape),
+            "data_offsets": [offset, offset + size],
+        }
+        offset += size
+
+    header_bytes = _encode_header(header)
+
+    with open(path, "wb") as f:
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+
+        for key in keys:
+            tensor = tensors[key].detach().to(device="cpu", dtype=dtype).contiguous()
+            if tensor.numel() > 0:
+                data = tensor_to_bytes(tensor)
+                if sha256_hash is not None:
+                    sha256_hash.update(data)
+                f.write(data)
+            del tensor
+
+        if sha256_hash is None:
+            return None
+
+        # the hex digest has a fixed length, the final header has the same size as the placeholder
+        metadata[hash_key] = f"0x{sha256_hash.hexdigest()}"
+        f.seek(8)
+        f.write(_encode_header(header))
+
+    return metadata[hash_key]
@@ -0,0 +1,109 @@
+import copy
+from typing import Any
+
+import torch
+from torch import Tensor
+from torch.nn import Parameter
+from torch.optim import Optimizer
+from transformers import PreTrainedTokenizerBase
+
+from modules.model.BaseModel import BaseModel
+from modules.module.EMAModule import EMAModuleWrapper
+from modules.util.config.TrainConfig import TrainConfig
+
+
+class StateDictSnapshot:
+    """
+    Stands in for an optimizer or ema module in a model snapshot. Only state_dict() is supported.
+    """
+
+    def __init__(self, state_dict: dict):
+        self.__state_dict = state_dict
+
+    def state_dict(self) -> dict:
+        return self.__state_dict
+
+
+def _snapshot_tensor(tensor: Tensor) -> Tensor:
+    # pinned memory is cached by torch, repeated snapshots of the same size don't allocate new memory
+    snapshot = torch.empty_like(tensor, device='cpu', pin_memory=torch.cuda.is_available())
+    snapshot.copy_(tensor.detach(), non_blocking=True)
+    return snapshot
+
+
+def _snapshot_state(state: Any) -> Any:
+    if isinstance(state, Tensor):
+        return _snapshot_tensor(state)
+    elif isinstance(state, dict):
+        return {key: _snapshot_state(value) for key, value in state.items()}
+    elif isinstance(state, list):
+        return [_snapshot_state(value) for value in state]
+    elif isinstance(state, tuple):
+        return tuple(_snapshot_state(value) for value in state)
+    return state
+
+
+def _iter_parameters(value: Any):
+    if isinstance(value, torch.nn.Module):
+        yield from value.parameters()
+    elif hasattr(value, 'parameters') and callable(value.parameters):
+        # LoRA wrappers
+        yield from value.parameters()
+    elif isinstance(value, list):
+        for item in value:
+            yield from _iter_parameters(item)
+
+
+def _iter_buffers(value: Any):
+    if isinstance(value, torch.nn.Module):
+        yield from value.buffers()
+    elif isinstance(value, list):
+        for item in value:
+            yield from _iter_buffers(item)
+
+
+@torch.no_grad()
+def create_model_snapshot(model: BaseModel, include_frozen_parameters: bool = True) -> BaseModel:
+    """
+    Creates a copy of the model on the cpu that can be saved while training continues.
+
+    Trainable parameters, buffers, and the optimizer and ema state are copied to pinned cpu memory. Frozen parameters
+    don't change during training. Those on the cpu share their storage with the model, all others are copied to the
+    cpu before this function returns, so the saver never reads from the train device. If include_frozen_parameters is
+    False, frozen parameters are replaced by meta tensors instead. This is enough for savers that only write the
+    trained parameters, like the LoRA and embedding savers. Tokenizers and the train config are shared.
+    """
+    memo = {}
+
+    for value in vars(model).values():
+        if isinstance(value, PreTrainedTokenizerBase | TrainConfig):
+            memo[id(value)] = value
+        elif isinstance(value, Optimizer | EMAModuleWrapper):
+            memo[id(value)] = StateDictSnapshot(_snapshot_state(value.state_dict()))
+        else:
+            for parameter in _iter_parameters(value):
+                if id(parameter) in memo:
+                    continue
+
+                if parameter.requires_grad:
+                    memo[id(parameter)] = Parameter(_snapshot_tensor(parameter), requires_grad=True)
+                elif not include_frozen_parameters:
+                    memo[id(parameter)] = Parameter(torch.empty_like(parameter, device='meta'), requires_grad=False)
+                elif parameter.device.type == 'cpu':
+                    # a new parameter object, so changes to the snapshot don't affect the model
+                    memo[id(parameter)] = Parameter(parameter.data, requires_grad=False)
+                else:
+                    memo[id(parameter)] = Parameter(_snapshot_tensor(parameter), requires_grad=False)
+
+            for buffer in _iter_buffers(value):
+                if id(buffer) not in memo:
+                    memo[id(buffer)] = _snapshot_tensor(buffer)
+
+    snapshot = copy.copy(model)
+    snapshot.__dict__ = copy.deepcopy(vars(model), memo)
+
+    if torch.cuda.is_available():
+        # waits for all non-blocking copies to pinned memory
+        torch.cuda.synchronize()
+
+    return snapshot
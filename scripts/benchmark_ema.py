@@ -0,0 +1,67 @@
+import os
+import sys
+
+sys.path.append(os.getcwd())
+
+import time
+
+import torch
+
+from modules.module.EMAModule import EMAModuleWrapper
+from modules.util.args.BenchmarkEmaArgs import BenchmarkEmaArgs
+
+
+def synchronize(device: torch.device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+
+
+def benchmark(args: BenchmarkEmaArgs, parameters: list[torch.nn.Parameter], fused: bool) -> tuple[float, list]:
+    device = torch.device(args.device)
+    ema = EMAModuleWrapper(
+        parameters=parameters,
+        decay=0.999,
+        update_step_interval=1,
+        device=torch.device(args.ema_device),
+        fused=fused,
+    )
+
+    # warmup, allocates the staging buffers
+    ema.step(parameters, 100)
+    synchronize(device)
+
+    start_time = time.perf_counter()
+    for step in range(args.steps):
+        ema.step(parameters, 100 + step)
+    synchronize(device)
+    seconds_per_step = (time.perf_counter() - start_time) / args.steps
+
+    return seconds_per_step, ema.ema_parameters
+
+
+def main():
+    args = BenchmarkEmaArgs.parse_args()
+
+    device = torch.device(args.device)
+    dtype = args.dtype.torch_dtype()
+
+    parameters = [
+        torch.nn.Parameter(torch.randn(args.parameter_size, device=device, dtype=dtype))
+        for _ in range(args.parameter_count)
+    ]
+    parameter_bytes = sum(p.numel() * p.element_size() for p in parameters)
+    print(f"{len(parameters)} parameters, {parameter_bytes / (1024 ** 3):.2f} GiB, "
+          f"{args.device} -> ema on {args.ema_device}")
+
+    loop_time, loop_ema = benchmark(args, parameters, fused=False)
+    print(f"per tensor loop: {loop_time * 1000:.1f} ms/step")
+
+    fused_time, fused_ema = benchmark(args, parameters, fused=True)
+    print(f"fused:           {fused_time * 1000:.1f} ms/step ({loop_time / fused_time:.2f}x)")
+
+    max_difference = max((a - b).abs().max().item() for a, b in zip(loop_ema, fused_ema))
+    print(f"max difference:  {max_difference}")
+
+
+if __name__ == '__main__':
+    main()
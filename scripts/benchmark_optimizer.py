@@ -0,0 +1,267 @@
+import os
+import sys
+
+sys.path.append(os.getcwd())
+
+import math
+import time
+from contextlib import contextmanager, nullcontext
+
+import torch
+from torch import Tensor
+from transformers.optimization import Adafactor
+
+from modules.util.args.BenchmarkOptimizerArgs import BenchmarkOptimizerArgs
+from modules.util.bf16_stochastic_rounding import copy_stochastic_, copy_stochastic_list_
+from modules.util.enum.Optimizer import Optimizer
+from modules.util.optimizer import adam_extensions, adamw_extensions
+from modules.util.optimizer.adafactor_extensions import step_adafactor
+from modules.util.optimizer.adam_extensions import step_adam
+from modules.util.optimizer.adamw_extensions import step_adamw
+
+
+def synchronize(device: torch.device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+
+
+def copy_stochastic_reference_(target: Tensor, source: Tensor):
+    # the rounding this benchmark compares against, it allocates new random bits for every tensor and step
+    result = torch.randint_like(
+        source,
+        dtype=torch.int32,
+        low=0,
+        high=(1 << 16),
+    )
+    result.add_(source.view(dtype=torch.int32))
+    result.bitwise_and_(-65536)  # -65536 = FFFF0000 as a signed int32
+    target.copy_(result.view(dtype=torch.float32))
+
+    del result
+
+
+def addcdiv_stochastic_reference_(input: Tensor, tensor1: Tensor, tensor2: Tensor, value: float = 1.0):
+    if input.dtype == torch.float32:
+        result = input.clone()
+    else:
+        result = input.to(dtype=torch.float32)
+
+    result.addcdiv_(tensor1, tensor2, value=value)
+    copy_stochastic_reference_(input, result)
+
+
+@contextmanager
+def reference_rounding():
+    """
+    Makes the per tensor Adam and AdamW implementations use the reference rounding.
+    """
+    original_functions = adam_extensions.addcdiv_stochastic_, adamw_extensions.addcdiv_stochastic_
+    adam_extensions.addcdiv_stochastic_ = addcdiv_stochastic_reference_
+    adamw_extensions.addcdiv_stochastic_ = addcdiv_stochastic_reference_
+    try:
+        yield
+    finally:
+        adam_extensions.addcdiv_stochastic_, adamw_extensions.addcdiv_stochastic_ = original_functions
+
+
+@torch.no_grad()
+def step_adafactor_reference(self, closure=None):
+    """
+    The Adafactor step this benchmark compares against. Every parameter is updated and rounded on its own.
+    """
+    for group in self.param_groups:
+        for p in group["params"]:
+            if p.grad is None:
+                continue
+            grad = p.grad
+            if grad.dtype in {torch.float16, torch.bfloat16}:
+                grad = grad.float()
+
+            state = self.state[p]
+            grad_shape = grad.shape
+
+            factored, use_first_moment = self._get_options(group, grad_shape)
+            if len(state) == 0:
+                state["step"] = 0
+
+                if use_first_moment:
+                    state["exp_avg"] = torch.zeros_like(grad)
+                if factored:
+                    state["exp_avg_sq_row"] = torch.zeros(grad_shape[:-1]).to(grad)
+                    state["exp_avg_sq_col"] = torch.zeros(grad_shape[:-2] + grad_shape[-1:]).to(grad)
+                else:
+                    state["exp_avg_sq"] = torch.zeros_like(grad)
+
+                state["RMS"] = 0
+
+            p_data_fp32 = p
+            if p.dtype in {torch.float16, torch.bfloat16}:
+                p_data_fp32 = p_data_fp32.float()
+
+            state["step"] += 1
+            state["RMS"] = self._rms(p_data_fp32)
+            lr = self._get_lr(group, state)
+
+            beta2t = 1.0 - math.pow(state["step"], group["decay_rate"])
+            update = (grad ** 2) + group["eps"][0]
+            if factored:
+                exp_avg_sq_row = state["exp_avg_sq_row"]
+                exp_avg_sq_col = state["exp_avg_sq_col"]
+
+                exp_avg_sq_row.mul_(beta2t).add_(update.mean(dim=-1), alpha=(1.0 - beta2t))
+                exp_avg_sq_col.mul_(beta2t).add_(update.mean(dim=-2), alpha=(1.0 - beta2t))
+
+                update = self._approx_sq_grad(exp_avg_sq_row, exp_avg_sq_col)
+                update.mul_(grad)
+            else:
+                exp_avg_sq = state["exp_avg_sq"]
+
+                exp_avg_sq.mul_(beta2t).add_(update, alpha=(1.0 - beta2t))
+                update = exp_avg_sq.rsqrt().mul_(grad)
+
+            update.div_((self._rms(update) / group["clip_threshold"]).clamp_(min=1.0))
+            update.mul_(lr)
+
+            if use_first_moment:
+                exp_avg = state["exp_avg"]
+                exp_avg.mul_(group["beta1"]).add_(update, alpha=(1 - group["beta1"]))
+                update = exp_avg
+
+            if group["weight_decay"] != 0:
+                p_data_fp32.add_(p_data_fp32, alpha=(-group["weight_decay"] * lr))
+
+            p_data_fp32.add_(-update)
+
+            if p.dtype == torch.bfloat16:
+                copy_stochastic_reference_(p, p_data_fp32)
+            elif p.dtype == torch.float16:
+                p.copy_(p_data_fp32)
+
+
+def create_optimizer(args: BenchmarkOptimizerArgs, parameters: list[torch.nn.Parameter], implementation: str):
+    """
+    implementation is "reference" for the code before the multi-tensor implementations, "loop" for the per tensor
+    implementation, or "foreach" for the multi-tensor implementation
+    """
+    foreach = implementation == "foreach"
+
+    match args.optimizer:
+        case Optimizer.ADAM:
+            optimizer = torch.optim.Adam(params=parameters, lr=1e-4, weight_decay=1e-2, foreach=foreach)
+            optimizer.step = step_adam.__get__(optimizer, torch.optim.Adam)
+        case Optimizer.ADAFACTOR:
+            optimizer = Adafactor(
+                params=parameters, lr=1e-4, weight_decay=1e-2, scale_parameter=False, relative_step=False,
+            )
+            if implementation == "reference":
+                optimizer.step = step_adafactor_reference.__get__(optimizer, Adafactor)
+            else:
+                optimizer.step = step_adafactor.__get__(optimizer, Adafactor)
+        case _:
+            optimizer = torch.optim.AdamW(params=parameters, lr=1e-4, weight_decay=1e-2, foreach=foreach)
+            optimizer.step = step_adamw.__get__(optimizer, torch.optim.AdamW)
+    return optimizer
+
+
+def benchmark_optimizer(
+        args: BenchmarkOptimizerArgs,
+        initial_parameters: list[torch.Tensor],
+        gradients: list[torch.Tensor],
+        implementation: str,
+) -> tuple[float, list[torch.Tensor]]:
+    device = torch.device(args.device)
+    parameters = [torch.nn.Parameter(parameter.clone()) for parameter in initial_parameters]
+    for parameter, gradient in zip(parameters, gradients):
+        parameter.grad = gradient
+
+    optimizer = create_optimizer(args, parameters, implementation)
+
+    with reference_rounding() if implementation == "reference" else nullcontext():
+        # warmup, initializes the optimizer state and the random bit buffers
+        optimizer.step()
+        synchronize(device)
+
+        start_time = time.perf_counter()
+        for _ in range(args.steps):
+            optimizer.step()
+        synchronize(device)
+        seconds_per_step = (time.perf_counter() - start_time) / args.steps
+
+    return seconds_per_step, [parameter.detach() for parameter in parameters]
+
+
+def benchmark_rounding(
+        args: BenchmarkOptimizerArgs,
+        targets: list[torch.Tensor],
+        sources: list[torch.Tensor],
+        implementation: str,
+) -> float:
+    device = torch.device(args.device)
+
+    def round_all():
+        if implementation == "foreach":
+            copy_stochastic_list_(targets, sources)
+        elif implementation == "reference":
+            for target, source in zip(targets, sources):
+                copy_stochastic_reference_(target, source)
+        else:
+            for target, source in zip(targets, sources):
+                copy_stochastic_(target, source)
+
+    round_all()
+    synchronize(device)
+
+    start_time = time.perf_counter()
+    for _ in range(args.steps):
+        round_all()
+    synchronize(device)
+    return (time.perf_counter() - start_time) / args.steps
+
+
+def main():
+    args = BenchmarkOptimizerArgs.parse_args()
+
+    device = torch.device(args.device)
+
+    parameters = [
+        torch.randn(args.parameter_size, device=device, dtype=torch.bfloat16)
+        for _ in range(args.parameter_count)
+    ]
+    gradients = [torch.randn_like(parameter) * 1e-3 for parameter in parameters]
+    parameter_bytes = sum(p.numel() * p.element_size() for p in parameters)
+    print(f"{len(parameters)} bfloat16 parameters, {parameter_bytes / (1024 ** 3):.2f} GiB on {args.device}, "
+          f"{args.optimizer} with stochastic rounding")
+
+    reference_time, reference_parameters = benchmark_optimizer(args, parameters, gradients, "reference")
+    print(f"reference:          {reference_time * 1000:.1f} ms/step")
+
+    if args.optimizer != Optimizer.ADAFACTOR:
+        # Adafactor has no per tensor mode, all 1-D parameters are updated with multi-tensor operations
+        loop_time, _ = benchmark_optimizer(args, parameters, gradients, "loop")
+        print(f"per tensor loop:    {loop_time * 1000:.1f} ms/step ({reference_time / loop_time:.2f}x)")
+
+    foreach_time, foreach_parameters = benchmark_optimizer(args, parameters, gradients, "foreach")
+    print(f"multi-tensor:       {foreach_time * 1000:.1f} ms/step ({reference_time / foreach_time:.2f}x)")
+
+    # both runs round randomly, the results only match up to the rounding noise
+    max_difference = max(
+        (a.float() - b.float()).abs().max().item() for a, b in zip(reference_parameters, foreach_parameters)
+    )
+    print(f"max difference:     {max_difference}")
+
+    sources = [parameter.float() for parameter in parameters]
+    targets = [parameter.clone() for parameter in parameters]
+    reference_rounding_time = benchmark_rounding(args, targets, sources, "reference")
+    print(f"rounding reference: {reference_rounding_time * 1000:.1f} ms/step")
+
+    loop_rounding_time = benchmark_rounding(args, targets, sources, "loop")
+    print(f"rounding loop:      {loop_rounding_time * 1000:.1f} ms/step "
+          f"({reference_rounding_time / loop_rounding_time:.2f}x)")
+
+    foreach_rounding_time = benchmark_rounding(args, targets, sources, "foreach")
+    print(f"rounding batched:   {foreach_rounding_time * 1000:.1f} ms/step "
+          f"({reference_rounding_time / foreach_rounding_time:.2f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -9,25 +9,43 @@ from modules.util.args.GenerateCaptionsArgs import GenerateCaptionsArgs
 from modules.module.Blip2Model import Blip2Model
 from modules.module.BlipModel import BlipModel
 from modules.module.WDModel import WDModel
+from modules.util.OnnxSessionPool import OnnxSessionPool
 
 
 def main():
     args = GenerateCaptionsArgs.parse_args()
 
+    session_pool = OnnxSessionPool(
+        intra_op_threads=args.onnx_intra_op_threads,
+        inter_op_threads=args.onnx_inter_op_threads,
+        graph_optimization=args.onnx_graph_optimization,
+        enable_memory_arena=args.onnx_memory_arena,
+        sessions_per_model=args.onnx_sessions,
+    )
+
     model = None
     if args.model == GenerateCaptionsModel.BLIP:
         model = BlipModel(torch.device(args.device), args.dtype.torch_dtype())
     elif args.model == GenerateCaptionsModel.BLIP2:
         model = Blip2Model(torch.device(args.device), args.dtype.torch_dtype())
     elif args.model == GenerateCaptionsModel.WD14_VIT_2:
-        model = WDModel(torch.device(args.device), args.dtype.torch_dtype())
+        model = WDModel(
+            torch.device(args.device),
+            args.dtype.torch_dtype(),
+            general_threshold=args.general_threshold,
+            character_threshold=args.character_threshold,
+            include_character_tags=args.include_character_tags,
+            session_pool=session_pool,
+        )
 
     model.caption_folder(
         sample_dir=args.sample_dir,
         initial_caption=args.initial_caption,
         mode=args.mode,
         error_callback=lambda filename: print("Error while processing image " + filename),
-        include_subdirectories=args.include_subdirectories
+        include_subdirectories=args.include_subdirectories,
+        batch_size=args.batch_size,
+        num_workers=args.num_workers,
     )
 
 
@@ -11,18 +11,27 @@ from modules.util.args.GenerateMasksArgs import GenerateMasksArgs
 from modules.module.RembgModel import RembgModel
 from modules.module.ClipSegModel import ClipSegModel
 from modules.module.MaskByColor import MaskByColor
+from modules.util.OnnxSessionPool import OnnxSessionPool
 
 
 def main():
     args = GenerateMasksArgs.parse_args()
 
+    session_pool = OnnxSessionPool(
+        intra_op_threads=args.onnx_intra_op_threads,
+        inter_op_threads=args.onnx_inter_op_threads,
+        graph_optimization=args.onnx_graph_optimization,
+        enable_memory_arena=args.onnx_memory_arena,
+        sessions_per_model=args.onnx_sessions,
+    )
+
     model = None
     if args.model == GenerateMasksModel.CLIPSEG:
         model = ClipSegModel(torch.device(args.device), args.dtype.torch_dtype())
     elif args.model == GenerateMasksModel.REMBG:
-        model = RembgModel(torch.device(args.device), args.dtype.torch_dtype())
+        model = RembgModel(torch.device(args.device), args.dtype.torch_dtype(), session_pool)
     elif args.model == GenerateMasksModel.REMBG_HUMAN:
-        model = RembgHumanModel(torch.device(args.device), args.dtype.torch_dtype())
+        model = RembgHumanModel(torch.device(args.device), args.dtype.torch_dtype(), session_pool)
     elif args.model == GenerateMasksModel.COLOR:
         model = MaskByColor(torch.device(args.device), args.dtype.torch_dtype())
 
@@ -35,7 +44,9 @@ def main():
         expand_pixels=args.expand_pixels,
         alpha=args.alpha,
         error_callback=lambda filename: print("Error while processing image " + filename),
-        include_subdirectories=args.include_subdirectories
+        include_subdirectories=args.include_subdirectories,
+        batch_size=args.batch_size,
+        num_workers=args.num_workers,
     )
 
 